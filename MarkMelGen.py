@@ -16,41 +16,63 @@
 
 import argparse
 import ast
+import concurrent.futures
 import configparser
 import contextlib
 import copy
 import datetime
+import functools
+import glob
 import json
 import logging
-import subprocess
-import MarkMelGen_utilities
-import markmelgen_style
 import math
-import music21
-import pickle
-import pyparsing
+import multiprocessing
 import os
+import pickle
 import random
 import re
+import subprocess
 import sys
+import threading
+import time
+import types
 import warnings  # Import the warnings module
 
+# answer -v and -lS before the slow imports of music21 and numpy, see markmelgen_cli.fast_path
+if __name__ == "__main__":
+    import markmelgen_cli
+
+    markmelgen_cli.fast_path(sys.argv[1:])
+
+import MarkMelGen_utilities
+import markmelgen_style
+import music21
+import numpy
+
 from datetime import datetime
 from enum import Enum, auto
 from fractions import Fraction
 
-from logging_config import logger
+from logging_config import (
+    logger,
+    note_logger,
+    CompressedRotatingFileHandler,
+    quiet_stdout,
+    start_log_listener,
+    stop_log_listener,
+)
+from markmelgen_cli import MARKMELGEN_VERSION, list_styles
 
 from MarkMelGen_utilities import *
 from markmelgen_style import *
 from music21 import *
 from music21 import environment
 from music21.musicxml.archiveTools import compressXML
+from music21.musicxml.m21ToXml import GeneralObjectExporter
 from music21.stream.makeNotation import consolidateCompletedTuplets
 from music21.stream.makeNotation import splitElementsToCompleteTuplets
 from music21.musicxml.xmlObjects import MusicXMLWarning
 from numpy.random import choice
-from showscore import show
 
 # Define log_filename as a global variable
 log_filename = None
@@ -58,14 +80,25 @@ log_filename = None
 logger = logging.getLogger("MMG")
 
 
-def setup_logger(loglevel):
+def setup_logger(loglevel, quiet=False):
+    """
+    log to the console at loglevel and to log/MarkMelGen_log_<date>.log, a compressed rotating file,
+    at DEBUG for the default loglevel INFO, else at loglevel.
+    The per-note DEBUG messages of note_logger are only made for the loglevel DEBUG.
+    The log file is written by a QueueListener thread, see start_log_listener.
+    quiet logs only warnings and errors to the console and INFO to the file.
+    """
     global log_filename  # Declare log_filename as global to modify it
 
     iso_datetime_str = get_iso_datetime_str()
     log_path = "log" + os.sep
     log_filename = f"{log_path}MarkMelGen_log_{iso_datetime_str}.log"
 
-    logger.setLevel(logging.DEBUG)
+    # replace the handlers of an earlier run in this process e.g. generate_song_buffers
+    stop_log_listener()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
 
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.INFO)
@@ -74,7 +107,7 @@ def setup_logger(loglevel):
     console_formatter = logging.Formatter("%(message)s")
     console_handler.setFormatter(console_formatter)
 
-    file_handler = logging.FileHandler(log_filename)
+    file_handler = CompressedRotatingFileHandler(log_filename)
     file_handler.setLevel(logging.DEBUG)
     if loglevel != "INFO":
         file_handler.setLevel(level=getattr(logging, loglevel))
@@ -83,8 +116,17 @@ def setup_logger(loglevel):
     )
     file_handler.setFormatter(file_formatter)
 
+    if quiet:
+        console_handler.setLevel(max(console_handler.level, logging.WARNING))
+        file_handler.setLevel(max(file_handler.level, logging.INFO))
+
+    # the logger drops a message below both handler levels before it is made, see logger.isEnabledFor
+    logger.setLevel(min(console_handler.level, file_handler.level))
+    note_logger.setLevel(logging.NOTSET if loglevel == "DEBUG" else logging.INFO)
+
+    # the console is written in turn with the print output, the log file by the listener thread
     logger.addHandler(console_handler)
-    logger.addHandler(file_handler)
+    start_log_listener([file_handler])
 
     logger.info(f"Logging to {log_filename}")
 
@@ -205,6 +247,75 @@ MAX_PHRASE_REST = 8.0
 
 OUTPUT_PATH = here
 
+# the outputs written for each song, see OUTPUT_TYPES, and the number of worker processes writing them concurrently.
+# None is one worker per output where processes can be forked, 0 writes them one after another
+OUTPUTS = OUTPUT_TYPES
+OUTPUT_WORKERS = None
+
+# write each song to OUTPUT_PATH, False when generate_song_buffers returns the songs in memory
+WRITE_OUTPUT_FILES = True
+
+# True to keep parsed input music in memory, for processes that run many configurations e.g. runconfs.py --jobs
+CACHE_MUSIC = False
+
+# input music file -> (modification time, parsed music21 stream)
+_music_cache = {}
+
+# a directory or glob of lyrics files to make a song for each, with the transitions built or loaded once,
+# and the number of worker processes making the songs. 0 makes them one after another
+LYRICS_BATCH = ""
+LYRICS_WORKERS = 0
+
+# the arguments of process_lyrics_batch, read by forked lyrics workers
+_lyrics_batch_context = None
+
+# the number of worker processes generating the independent lines of a song, see generate_song_lines.
+# 0 or 1 generates the lines in turn, each line from its own seed and TONE_ASCENT / TONE_DESCENT state
+SECTION_WORKERS = 0
+
+# the arguments of generate_song_lines and the song seed, read by forked section workers
+_song_lines_context = None
+
+# the wall time in seconds of each stage of generation (config, parse, transitions, generation, output),
+# added to by stage_timer e.g. for markmelgen_bench.py
+STAGE_TIMES = {}
+_stage_timer_local = threading.local()
+
+# the functions whose calls --profile counts
+PROFILE_COUNTED_FUNCTIONS = ["get_next_note", "valid_pitch", "valid_duration", "get_random_draw"]
+
+# --quiet: discard the print output of generation, see quiet_stdout
+QUIET = False
+
+# the format of the histograms rendered headless to files in a background process, instead of shown (None, "png" or "svg"),
+# see save_histograms
+SAVE_GRAPHS = None
+
+# --max-memory: the peak memory (RSS) budget of a run in MB, 0 for none. The input music is then read one file at a time
+# into count tables rather than appended to one song stream, see stream_input_music, and going over it is logged
+MAX_MEMORY = 0
+_max_memory_warned = False
+
+# the format of the note telemetry written at the end of a run (None, "json" or "prometheus"), see write_note_telemetry
+TELEMETRY = None
+TELEMETRY_EXTENSIONS = {"json": ".json", "prometheus": ".prom"}
+
+# the number of melodies made for each lyrics file and the number of the best scoring kept, see score_song_variant
+VARIANTS = 1
+KEEP_VARIANTS = 1
+
+# the weight of each score_song_variant metric in the variant score, higher scores are better
+VARIANT_SCORE_WEIGHTS = {
+    "log_likelihood": 1.0,  # mean log2 probability per transition of the pitches and durations, see VARIANT_BACKOFF_WEIGHT
+    "rejections": -0.1,  # pitch and duration draws rejected per note by valid_pitch and valid_duration
+    "range_usage": 1.0,  # fraction of TONE_RANGE_BOTTOM to TONE_RANGE_TOP used
+    "cadence": 1.0,  # fraction of phrase end notes the cadence transitions could have drawn
+}
+
+# the weight of the style's unigram probability of the next pitch or duration in each score_song_variant transition
+# probability, which alone is the probability of a transition missing from the style tables (see get_unigram_probabilities)
+VARIANT_BACKOFF_WEIGHT = 0.1
+
 DISPLAY_GRAPHS = True
 DISPLAY_HTML = True
 DISPLAY_MXL = True
@@ -237,7 +348,6 @@ TIME_SIG_WANTED = None
 
 # Tone filters
 TONE_ASCENT = False  # Turn off TONE_ASCENT
-TONE_ASCENT_COUNT = 0  # not a configuration paramenter, just a global variable
 # TONE_ASCENT_MIN_INTERVAL = 1 # gives infinite loop on valid_note
 TONE_ASCENT_MIN_INTERVAL = 2  # gives runs down scale
 # TONE_ASCENT_MIN_INTERVAL = 3 # gives descent leaps
@@ -245,12 +355,9 @@ TONE_ASCENT_MIN_INTERVAL = 2  # gives runs down scale
 
 # TONE_ASCENT_TRIGGER = None
 TONE_ASCENT_TRIGGER = "C3"
-TONE_ASCENT_TRIGGERED = False  # not a configuration paramenter, just a global variable
-TONE_ASCENT_TRIGGER_COUNT = 0  # not a configuration paramenter, just a global variable
 TONE_ASCENT_TRIGGER_EVERY_N_TIMES = 1
 
 TONE_DESCENT = False  # Turn off TONE_DESCENT
-TONE_DESCENT_COUNT = 0  # not a configuration paramenter, just a global variable
 # TONE_DESCENT_MAX_INTERVAL = 1 # gives infinite loop on valid_note
 TONE_DESCENT_MAX_INTERVAL = 2  # gives runs down scale
 # TONE_DESCENT_MAX_INTERVAL = 3 # gives descent leaps
@@ -258,12 +365,12 @@ TONE_DESCENT_MAX_INTERVAL = 2  # gives runs down scale
 
 # TONE_DESCENT_TRIGGER = None
 TONE_DESCENT_TRIGGER = "C5"
-TONE_DESCENT_TRIGGERED = False  # not a configuration paramenter, just a global variable
-TONE_DESCENT_TRIGGER_COUNT = 0  # not a configuration paramenter, just a global variable
 TONE_DESCENT_TRIGGER_EVERY_N_TIMES = 4
 
 TONE_EQ = ""
 
+TONE_INTERVAL = "smallest"  # [smallest | largest | random]
+
 TONES_ON_KEY = False
 # TONES_ON_KEY = True
 TONES_OFF_KEY = False
@@ -308,47 +415,405 @@ TONE_SCALE_SET = ["A", "C", "D", "D#", "E", "G"]
 TONE_SCALE_ON_ANHEMITONIC = False
 TONE_SCALE_ON_HEMITONIC = False
 
+# the styles to load from INPUT_STYLE_PATH rather than make the transitions from the input music, see is_style_blend
+USE_STYLES = []
 
-# ------------ FUNCTIONS -------------------------------------------
 
+# the section values, set for each section (Intro ... Outro) from the PER_SECTION_* lists, see SectionConstraints
+SECTION_VALUE_NAMES = (
+    "DURATION_SET",
+    "DUR_LEAST",
+    "DUR_LONGEST",
+    "DUR_PREV_DIFF",
+    "DUR_RATIONAL",
+    "DUR_TUPLET",
+    "REST_NOTE_LINE_OFFSET",
+    "TONES_ON_KEY",
+    "TONE_PREV_INTERVAL",
+    "TONE_RANGE_BOTTOM",
+    "TONE_RANGE_TOP",
+    "TONE_SCALE_SET",
+)
 
-def add_new_lyrics_to_old_phrase(
-    sect, section_name_text, section_line_num, lyric_line, stream_line
-):
+
+# the grid of the durations and beat placements tabled by SectionConstraints, in quarter lengths:
+# the multiples of 1/SECTION_TABLE_GRID up to SECTION_TABLE_DUR_LONGEST (and the beat placements within a beat)
+SECTION_TABLE_GRID = 96
+SECTION_TABLE_DUR_LONGEST = 16
+
+
+def is_tuplet_on_section_table_grid(dur):
     """
-    function that takes a stream of notes, wipes any old lyrics, adds new lyrics
-    and returns the new stream
+    given a duration (a Fraction) on the SECTION_TABLE_GRID
+    return True if it is a tuplet, i.e. its denominator is not a power of 2,
+    the same as is_tuplet(dur) for the durations of the grid, without the cost of a music21 Duration for each
     """
-    # print('add_new_lyrics_to_old_phrase')
-    # print('lyric_line', lyric_line)
-    # stream_line.show('text')
+    return dur.denominator & (dur.denominator - 1) != 0
 
-    new_stream = music21.stream.Stream()
-    new_stream.append(stream_line)
-    # new_stream.show('text')
 
-    # split and count new lyric syllables
-    syllable_line = split_hyphens(lyric_line)
-    # print('syllable_line', syllable_line)
+class SectionConstraints:
+    """
+    The constraints of a song section, compiled once when the configuration is loaded:
+    the section values (SECTION_VALUE_NAMES) e.g. section.TONE_RANGE_BOTTOM,
+    the tone range as MIDI numbers, the TONE_SCALE_SET as a bitmask of the pitch space numbers of its tone names,
+    the DURATION_SET as Fractions, and read only tables (MappingProxyType) of the checks of the durations
+    and beat placements of the SECTION_TABLE_GRID that do not depend on the previous note.
+    A song selects the constraints of a section by reference, see get_section_values.
+    Nothing is changed after __init__, so the section workers of concurrent songs can share them without a lock:
+    a duration or beat placement that is not on the grid is checked each time it is seen.
+    """
+
+    def __init__(self, generation_config, section_values):
+        for name in SECTION_VALUE_NAMES:
+            setattr(self, name, section_values[name])
+
+        self.tone_range_bottom_ps = pitch.Pitch(self.TONE_RANGE_BOTTOM).ps
+        self.tone_range_top_ps = pitch.Pitch(self.TONE_RANGE_TOP).ps
+        # bit n is set if a tone name of the TONE_SCALE_SET has pitch space number n in octave 4 e.g. D# 63, B# 72
+        self.tone_scale_set_mask = 0
+        for tone in self.TONE_SCALE_SET or []:
+            self.tone_scale_set_mask |= 1 << int(get_tone_name_ps(tone))
+        self.duration_set = frozenset(Fraction(dur) for dur in (self.DURATION_SET or []))
+
+        self.beat_placements_denied_set = generation_config.BEAT_PLACEMENTS_DENIED_SET
+        self.beat_placements_denominator_denied_set = generation_config.BEAT_PLACEMENTS_DENOMINATOR_DENIED_SET
+        self.beat_placement_denominator_maximum_allowed = generation_config.BEAT_PLACEMENT_DENOMINATOR_MAXIMUM_ALLOWED
+
+        # duration -> (valid, reason, is tuplet, rejections), beat placement -> reason it is bad, "" if it is allowed
+        self.duration_checks = types.MappingProxyType({
+            dur: self.get_duration_check(dur, is_tuplet_on_section_table_grid(dur))
+            for dur in (
+                Fraction(step, SECTION_TABLE_GRID)
+                for step in range(SECTION_TABLE_DUR_LONGEST * SECTION_TABLE_GRID + 1)
+            )
+        })
+        self.beat_placement_checks = types.MappingProxyType({
+            beat_placement: self.get_beat_placement_check(beat_placement)
+            for beat_placement in (Fraction(step, SECTION_TABLE_GRID) for step in range(SECTION_TABLE_GRID))
+        })
+
+    def in_tone_scale_set(self, n):
+        """
+        given a note
+        return True if its tone name is in the TONE_SCALE_SET, compared by pitch space number e.g. B# is not C
+        """
+        # the pitch space number of the tone name in octave 4, as get_tone_name_ps(n.name)
+        name_ps = n.pitch.ps - 12 * (n.pitch.implicitOctave - 4)
+        return name_ps.is_integer() and name_ps >= 0 and bool(self.tone_scale_set_mask >> int(name_ps) & 1)
+
+    def check_duration(self, dur):
+        """
+        given a duration
+        return (valid, reason, is_tuplet, rejections) of the checks of the duration alone in valid_duration:
+        DUR_RATIONAL, DUR_LEAST, DUR_LONGEST, DURATION_MIN_MUSIC21 and DURATION_SET,
+        rejections the note telemetry reasons of the checks failed e.g. ("least", "duration_set")
+        """
+        checked = self.duration_checks.get(dur)
+        if checked is not None:
+            return checked
+        return self.get_duration_check(dur, is_tuplet(Fraction(dur)))
+
+    def get_duration_check(self, dur, dur_is_tuplet):
+        """
+        given a duration and whether it is a tuplet
+        return (valid, reason, is_tuplet, rejections) as check_duration
+        """
+        result = True
+        reason = ""
+        rejections = []
+        if self.DUR_RATIONAL == True:
+            if dur_is_tuplet:
+                result = False
+                reason = "DUR_RATIONAL == True: is_tuplet(dur)"
+                rejections.append("rational")
+
+        if self.DUR_LEAST != 0:  # any duration < DUR_LEAST is invalid
+            if dur < self.DUR_LEAST:
+                result = False
+                reason = "DUR_LEAST= " + str(self.DUR_LEAST) + " DUR_LEAST != 0: dur < DUR_LEAST"
+                rejections.append("least")
+        if self.DUR_LONGEST != 0:  # any duration > DUR_LONGEST is invalid
+            if dur > self.DUR_LONGEST:
+                result = False
+                reason = "DUR_LONGEST= " + str(self.DUR_LONGEST) + " DUR_LONGEST != 0, dur > DUR_LONGEST"
+                rejections.append("longest")
+
+        # zero or very small durations not allowed
+        if dur < DURATION_MIN_MUSIC21:
+            result = False
+            reason = "DURATION_MIN_MUSIC21= " + str(DURATION_MIN_MUSIC21) + " dur < DURATION_MIN_MUSIC21"
+            rejections.append("min_music21")
+
+        if self.duration_set:  # if duration is NOT in duration set then the tone is invalid
+            if Fraction(dur) not in self.duration_set:
+                result = False
+                reason = "DURATION_SET " + str(self.DURATION_SET) + " if DURATION_SET: not duration_found"
+                rejections.append("duration_set")
+
+        return (result, reason, dur_is_tuplet, tuple(rejections))
+
+    def check_beat_placement(self, beat_placement):
+        """
+        given a beat placement within a beat (a Fraction)
+        return the reason it is a bad beat placement, or "" if it is allowed
+        """
+        reason = self.beat_placement_checks.get(beat_placement)
+        if reason is not None:
+            return reason
+        return self.get_beat_placement_check(beat_placement)
+
+    def get_beat_placement_check(self, beat_placement):
+        """
+        given a beat placement within a beat (a Fraction)
+        return the reason it is a bad beat placement, or "" if it is allowed, as check_beat_placement
+        """
+        reason = ""
+        if beat_placement in self.beat_placements_denied_set:
+            reason = "in BEAT_PLACEMENTS_DENIED_SET"
+        elif beat_placement.denominator in self.beat_placements_denominator_denied_set:
+            reason = "in BEAT_PLACEMENTS_DENOMINATOR_DENIED_SET"
+        elif (
+            self.beat_placement_denominator_maximum_allowed > 0
+            and beat_placement.denominator > self.beat_placement_denominator_maximum_allowed
+        ):
+            reason = f"denominator > BEAT_PLACEMENT_DENOMINATOR_MAXIMUM_ALLOWED {self.beat_placement_denominator_maximum_allowed}"
+        return reason
+
+
+# the configuration settings read by read_config (and WRITE_OUTPUT_FILES), the settings of a GenerationConfig
+GENERATION_SETTINGS = (
+    "CONF_FILENAME", "INPUT_LYRICS_PATH", "INPUT_LYRICS_FULLY_QUALIFIED", "INPUT_MUSIC_PATH",
+    "INPUT_MUSIC_FULLY_QUALIFIED", "INPUT_STYLE_PATH", "OUTPUT_PATH", "INPUT_LYRICS_FILENAME",
+    "INPUT_MUSIC_FILENAME", "BEAT_PLACEMENT_DENOMINATOR_MAXIMUM_ALLOWED", "BEAT_PLACEMENTS_DENIED_SET",
+    "BEAT_PLACEMENTS_DENOMINATOR_DENIED_SET", "CADENCE_ALTERNATE_PHRASE_END", "CADENCE_DUR_MIN",
+    "CADENCE_SECTION_END", "CADENCE_TONE_FREQUENCY", "CADENCE_TONE_PROBABILITY", "CADENCE_TONE_SAMPLES",
+    "DISPLAY_GRAPHS", "SAVE_GRAPHS", "DISPLAY_HTML", "DISPLAY_MXL", "DISPLAY_KAR", "OUTPUTS", "OUTPUT_WORKERS",
+    "LYRICS_BATCH", "LYRICS_WORKERS", "SECTION_WORKERS", "VARIANTS", "KEEP_VARIANTS", "DURATION_EQ", "DURATION_SET",
+    "DUR_RATIONAL", "DUR_TUPLET", "DUR_LEAST", "DUR_LONGEST", "DUR_PREV_DIFF", "INSTRUMENT", "MAX_PHRASE_REST",
+    "PER_SECTION_LIST_LENGTH", "PER_SECTION_DURATION_SET", "PER_SECTION_DUR_LEAST", "PER_SECTION_DUR_LONGEST",
+    "PER_SECTION_DUR_PREV_DIFF", "PER_SECTION_DUR_RATIONAL", "PER_SECTION_DUR_TUPLET",
+    "PER_SECTION_REST_NOTE_LINE_OFFSET", "PER_SECTION_TONES_ON_KEY", "PER_SECTION_TONE_PREV_INTERVAL",
+    "PER_SECTION_TONE_RANGE_BOTTOM", "PER_SECTION_TONE_RANGE_TOP", "PER_SECTION_TONE_SCALE_SET",
+    "REST_NOTE_LINE_OFFSET", "TEMPO_BPM", "TIME_SIG_WANTED", "TONE_ASCENT", "TONE_ASCENT_MIN_INTERVAL",
+    "TONE_ASCENT_TRIGGER", "TONE_ASCENT_TRIGGER_EVERY_N_TIMES", "TONE_DESCENT", "TONE_DESCENT_MAX_INTERVAL",
+    "TONE_DESCENT_TRIGGER", "TONE_DESCENT_TRIGGER_EVERY_N_TIMES", "TONE_EQ", "TONE_INTERVAL", "TONES_ON_KEY",
+    "TONES_OFF_KEY", "TONE_PREV_INTERVAL", "TONE_RANGE_MID", "TONE_RANGE_BOTTOM", "TONE_RANGE_TOP",
+    "TONE_SCALE_SET", "TONE_SCALE_ON_ANHEMITONIC", "TONE_SCALE_ON_HEMITONIC", "USE_STYLES",
+    "WRITE_OUTPUT_FILES", "MAX_MEMORY", "QUIET", "TELEMETRY",
+)
+
+# the module defaults of the GENERATION_SETTINGS, that read_config starts each configuration from
+DEFAULT_GENERATION_SETTINGS = {name: globals()[name] for name in GENERATION_SETTINGS}
+
+
+class GenerationConfig:
+    """
+    The configuration settings of a generation, as read from a .conf file by read_config,
+    with the names of the settings e.g. generation_config.TONE_RANGE_BOTTOM
+    A GenerationConfig is not changed by generation, so one can be shared by concurrent generations.
+    The SectionConstraints of the song (song_constraints, before its first section)
+    and of each PER_SECTION_* slot (section_constraints) are compiled when it is made.
+    """
+
+    def __init__(self, **settings):
+        for name, value in settings.items():
+            setattr(self, name, value)
+
+        self.song_constraints = SectionConstraints(self, {name: settings[name] for name in SECTION_VALUE_NAMES})
+        self.section_constraints = [
+            SectionConstraints(
+                self,
+                {name: settings["PER_SECTION_" + name][section_num] for name in SECTION_VALUE_NAMES},
+            )
+            for section_num in range(settings["PER_SECTION_LIST_LENGTH"])
+        ]
+
+    @classmethod
+    def from_conf(cls, config="MarkMelGen.conf", overrides=()):
+        """
+        returns a GenerationConfig read from a .conf file, with optional overrides as for -o e.g. ["markmelgen.TEMPO_BPM=90.0"]
+        The module globals are not set, so several configurations can be loaded and used in one process
+        """
+        argv = ["-c", config]
+        for override in overrides:
+            argv += ["-o", override]
+        return read_config(argv)
+
+
+class GenerationContext:
+    """
+    The state of one generation (one song): its GenerationConfig settings, the SectionConstraints of the current
+    section (ctx.section and ctx.section_name, selected for each section by get_section_values),
+    the TONE_ASCENT / TONE_DESCENT state, the NOTE_REJECTIONS counts and the NOTE_TELEMETRY of each section.
+    process_lyrics and the functions it calls read the settings from their ctx argument rather than module globals,
+    so concurrent generations each need their own GenerationContext.
+    """
+
+    def __init__(self, generation_config):
+        self.config = generation_config
+        for name, value in vars(generation_config).items():
+            setattr(self, name, value)
+        self.section = generation_config.song_constraints
+        self.section_name = "SONG"
+
+        self.TONE_ASCENT_COUNT = 0
+        self.TONE_ASCENT_TRIGGERED = False
+        self.TONE_ASCENT_TRIGGER_COUNT = 0
+        self.TONE_DESCENT_COUNT = 0
+        self.TONE_DESCENT_TRIGGERED = False
+        self.TONE_DESCENT_TRIGGER_COUNT = 0
+
+        # draws rejected by valid_pitch and valid_duration, and fallback pitches and durations used, by get_next_note
+        self.NOTE_REJECTIONS = {"pitch": 0, "duration": 0, "pitch_fallback": 0, "duration_fallback": 0}
+        # section name -> the draws, rejections by reason, tiers reached and fallbacks of get_next_note, see get_note_telemetry
+        self.NOTE_TELEMETRY = {}
+
+
+class Phrase:
+    """
+    A melody line of the phrase store of a song, not changed once made:
+    a tuple of (tone, quarter length, lyric) events, tone the nameWithOctave of a note e.g. 'C#4' or None for a rest.
+    A line derived from another line, e.g. a later chorus line or a transpose(verse,1,4) line,
+    is a view of its source Phrase: its lyric overlay, generic transposition interval, inversion axis and reversal,
+    applied to the events of the source when they are first needed, rather than a copy of the source notes.
+    A Phrase becomes music21 notes and rests only when the song is assembled, see to_stream.
+    """
+
+    def __init__(self, events=None, source=None, lyric_line=None, transpose=None, invert=None, reverse=False, lyric_context=None):
+        self._events = tuple(events) if events is not None else None
+        self.source = source
+        self.lyric_line = lyric_line
+        self.transpose = transpose
+        self.invert = invert
+        self.reverse = reverse
+        # (sect, section_name_text, section_line_num) of the line, for the lyric overlay warnings
+        self.lyric_context = lyric_context
+
+    @classmethod
+    def from_stream(cls, a_phrase):
+        """
+        given a phrase stream of notes and rests, e.g. from generate_markov_phrase_with_lyrics
+        return its Phrase
+        """
+        return cls(
+            events=[
+                (
+                    n.nameWithOctave if isinstance(n, note.Note) else None,
+                    n.duration.quarterLength,
+                    n.lyrics[0].rawText if n.lyrics else None,  # the raw text keeps the hyphens of the syllables
+                )
+                for n in a_phrase.flatten().notesAndRests
+            ]
+        )
+
+    def derive(self, lyric_line, sect, section_name_text, section_line_num, transpose=None, invert=None, reverse=False):
+        """
+        return a Phrase of this phrase with the lyric_line overlaid, see overlay_lyrics,
+        transposed by the generic interval transpose, inverted about the note invert and / or reversed
+        """
+        return Phrase(
+            source=self,
+            lyric_line=lyric_line,
+            transpose=transpose,
+            invert=invert,
+            reverse=reverse,
+            lyric_context=(sect, section_name_text, section_line_num),
+        )
+
+    @property
+    def events(self):
+        if self._events is None:
+            events = self.source.events
+            if self.reverse:
+                # the lyrics of the source are not reversed, they are replaced by the lyric overlay
+                events = tuple((tone, quarter_length, None) for tone, quarter_length, _ in reversed(events))
+            if self.transpose is not None:
+                events = tuple(
+                    (get_transposed_tone(tone, self.transpose) if tone else None, quarter_length, lyric)
+                    for tone, quarter_length, lyric in events
+                )
+            if self.invert is not None:
+                events = tuple(
+                    (get_inverted_tone(tone, self.invert) if tone else None, quarter_length, lyric)
+                    for tone, quarter_length, lyric in events
+                )
+            self._events = overlay_lyrics(events, self.lyric_line, *self.lyric_context)
+        return self._events
+
+    def to_stream(self):
+        """
+        return a new music21 stream of the notes and rests of the phrase
+        """
+        a_phrase = music21.stream.Stream()
+        for tone, quarter_length, lyric in self.events:
+            if tone is None:
+                n = music21.note.Rest()
+            else:
+                n = music21.note.Note(tone)
+            n.duration.quarterLength = quarter_length
+            if lyric is not None:
+                n.lyric = lyric
+            a_phrase.append(n)
+        return a_phrase
+
+
+# ------------ FUNCTIONS -------------------------------------------
+
+
+@contextlib.contextmanager
+def stage_timer(stage):
+    """
+    adds the wall time of the with block to STAGE_TIMES[stage],
+    less the time of the stage_timer blocks nested in it (in the same thread), so the stage times add up.
+    With --profile the whole time is also a profile_span, with --trace-memory a memory_span
+    """
+    nested_times = getattr(_stage_timer_local, "nested_times", None)
+    if nested_times is None:
+        nested_times = _stage_timer_local.nested_times = []
+    nested_times.append(0.0)
+    start = time.perf_counter()
+    try:
+        with profile_span(stage), memory_span(stage):
+            yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_TIMES[stage] = STAGE_TIMES.get(stage, 0.0) + elapsed - nested_times.pop()
+        if nested_times:
+            nested_times[-1] += elapsed
+        if MAX_MEMORY:
+            check_max_memory(stage)
+
+
+def check_max_memory(where):
+    """
+    with --max-memory, logs a warning the first time the peak memory (RSS) of the run is over MAX_MEMORY MB
+    returns the peak memory in MB, or None where it cannot be measured
+    """
+    global _max_memory_warned
+    peak_rss_mb = get_peak_rss_mb()
+    if peak_rss_mb is not None and peak_rss_mb > MAX_MEMORY and not _max_memory_warned:
+        _max_memory_warned = True
+        logger.warning(f"Warning: peak memory {peak_rss_mb:.0f} MB is over --max-memory {MAX_MEMORY} MB after {where}")
+    return peak_rss_mb
 
-    syllable_list = syllable_line.split()  # Split `a_string` by whitespace.
-    # print('syllable_list', syllable_list)
 
+def overlay_lyrics(events, lyric_line, sect, section_name_text, section_line_num):
+    """
+    function that takes the (tone, quarter length, lyric) events of a Phrase, wipes any old lyrics of the notes,
+    adds the syllables of the new lyric line one per note, extra syllables to the last note or rest,
+    and returns the new events
+    """
+    # split and count new lyric syllables
+    syllable_list = split_hyphens(lyric_line).split()
     number_of_syllables = len(syllable_list)  ## counts he-llo as one syllable not two
-    # print('number_of_syllables', number_of_syllables)
 
+    new_events = []
     note_num = 0
-
-    # wipe any old lyrics and add new lyrics
-    for n in new_stream.flatten():
-        if type(n) == music21.note.Note:
-            # print('note', n, n.duration.quarterLength, n.lyric)
-            # print('n.lyrics', n.lyrics)
-            n.lyric = None
-            if (
-                note_num < number_of_syllables
-            ):  # only set lyric when enough new syllables
-                n.lyric = syllable_list[note_num]
+    for tone, quarter_length, lyric in events:
+        if tone is not None:
+            lyric = None
+            if note_num < number_of_syllables:  # only set lyric when enough new syllables
+                lyric = syllable_list[note_num]
             else:
                 logger.warning(
                     "Warning:Lyric-First %s line %d has a lyric at note %d but later %s has no lyric there.",
@@ -357,12 +822,10 @@ def add_new_lyrics_to_old_phrase(
                     (note_num + 1),
                     section_name_text,
                 )
-
             note_num = note_num + 1
+        new_events.append((tone, quarter_length, lyric))
 
-    # if there are more new lyric syllables than old notes, add them to the next note/rest.
-
-    # if note_num <= number_of_syllables:
+    # if there are more new lyric syllables than old notes, add them to the last note/rest.
     if note_num < number_of_syllables:
         logger.warning(
             "Warning:Lyric-First %s line %d has %d notes, but later %s has %d syllables. %d too many.",
@@ -373,63 +836,33 @@ def add_new_lyrics_to_old_phrase(
             number_of_syllables,
             (number_of_syllables - note_num),
         )
+        if (number_of_syllables - note_num) <= 5 and new_events:
+            tone, quarter_length, _ = new_events[-1]
+            new_events[-1] = (tone, quarter_length, " " + " ".join(syllable_list[note_num:]))
 
-        if (number_of_syllables - note_num) == 1:
-            n.lyric = " " + syllable_list[note_num]
-        if (number_of_syllables - note_num) == 2:
-            n.lyric = " " + syllable_list[note_num] + " " + syllable_list[note_num + 1]
-        if (number_of_syllables - note_num) == 3:
-            n.lyric = (
-                " "
-                + syllable_list[note_num]
-                + " "
-                + syllable_list[note_num + 1]
-                + " "
-                + syllable_list[note_num + 2]
-            )
-        if (number_of_syllables - note_num) == 4:
-            n.lyric = (
-                " "
-                + syllable_list[note_num]
-                + " "
-                + syllable_list[note_num + 1]
-                + " "
-                + syllable_list[note_num + 2]
-                + " "
-                + syllable_list[note_num + 3]
-            )
-        if (number_of_syllables - note_num) == 5:
-            n.lyric = (
-                " "
-                + syllable_list[note_num]
-                + " "
-                + syllable_list[note_num + 1]
-                + " "
-                + syllable_list[note_num + 2]
-                + " "
-                + syllable_list[note_num + 3]
-                + " "
-                + syllable_list[note_num + 4]
-            )
-
-    return new_stream
+    return tuple(new_events)
 
 
-def remove_lyrics_from_phrase(stream_line):
+@functools.lru_cache(maxsize=None)
+def get_transposed_tone(tone, generic_interval):
     """
-    function that takes a stream of notes and rests, wipes any old lyrics
-    and returns the new stream
+    given a nameWithOctave e.g. 'C#4' and a generic interval e.g. 4 (a fourth up) or -2 (a second down)
+    return the nameWithOctave transposed, as music21 stream.transpose(interval.GenericInterval(generic_interval))
     """
+    return interval.GenericInterval(generic_interval).transposePitch(pitch.Pitch(tone)).nameWithOctave
 
-    new_stream = music21.stream.Stream()
-    new_stream.append(stream_line)
 
-    # wipe any old lyrics
-    for n in new_stream.flatten():
-        if type(n) == music21.note.Note or type(n) == music21.note.Rest:
-            n.lyric = None
-
-    return new_stream
+@functools.lru_cache(maxsize=None)
+def get_inverted_tone(tone, inversion_tone):
+    """
+    given a nameWithOctave e.g. 'C#4' and the nameWithOctave of the inversion axis e.g. 'E4'
+    return the nameWithOctave inverted diatonically about the axis in C,
+    as music21 stream.invertDiatonic(note.Note(inversion_tone)) of a phrase without a key signature
+    """
+    inverted_pitch = pitch.Pitch(tone)
+    inverted_pitch.diatonicNoteNum = (2 * pitch.Pitch(inversion_tone).diatonicNoteNum) - inverted_pitch.diatonicNoteNum
+    inverted_pitch.accidental = None  # the accidental of the step in C
+    return inverted_pitch.nameWithOctave
 
 
 def get_semitone_interval(tone_prev, tone):
@@ -457,14 +890,14 @@ def get_semitone_interval(tone_prev, tone):
     return AIntSemi
 
 
-def get_random_octave():
+def get_random_octave(ctx):
     """
     function that uses
     globals to
     returns a valid random octave
     """
-    low_oct = int(TONE_RANGE_BOTTOM.strip()[-1])
-    high_oct = int(TONE_RANGE_TOP.strip()[-1])
+    low_oct = int(ctx.section.TONE_RANGE_BOTTOM.strip()[-1])
+    high_oct = int(ctx.section.TONE_RANGE_TOP.strip()[-1])
     the_valid_tone_octave = random.randint(low_oct, high_oct)
     # print('get_random_octave: TONE_RANGE_BOTTOM',TONE_RANGE_BOTTOM,'TONE_RANGE_TOP',TONE_RANGE_TOP, 'low_oct', low_oct,'high_oct', high_oct , 'the_valid_tone_octave', the_valid_tone_octave  )
     the_valid_tone_octave = validated_octave(the_valid_tone_octave)
@@ -473,7 +906,7 @@ def get_random_octave():
     return the_valid_tone_octave
 
 
-def get_valid_tone_octave(tone_prev, tone, desired_octave):
+def get_valid_tone_octave(ctx, tone_prev, tone, desired_octave):
     """
     function that takes a tone octave,
     if not valid then choose a valid tone octave,
@@ -505,9 +938,9 @@ def get_valid_tone_octave(tone_prev, tone, desired_octave):
 
     # validate tone octave
     if (
-        note.Note(TONE_RANGE_BOTTOM)
+        note.Note(ctx.section.TONE_RANGE_BOTTOM)
         <= note.Note(tone.nameWithOctave)
-        <= note.Note(TONE_RANGE_TOP)
+        <= note.Note(ctx.section.TONE_RANGE_TOP)
     ):
         # a_valid_tone = True
         # print('a valid tone octave', tone.nameWithOctave)
@@ -517,48 +950,48 @@ def get_valid_tone_octave(tone_prev, tone, desired_octave):
         if tone_prev == 0 or type(tone_prev) == music21.note.Rest:  # invalid prev_tone
 
             while True:
-                the_valid_tone_octave = get_random_octave()
-                logger.debug(
+                the_valid_tone_octave = get_random_octave(ctx)
+                note_logger.debug(
                     f"invalid tone_prev 0 or None {tone_prev} new random octave {the_valid_tone_octave}"
                 )
                 tone.octave = the_valid_tone_octave
                 # if note.Note(TONE_RANGE_BOTTOM) <= note.Note(tone.nameWithOctave) <= note.Note(TONE_RANGE_TOP):
                 if (
-                    note.Note(TONE_RANGE_BOTTOM).octave
+                    note.Note(ctx.section.TONE_RANGE_BOTTOM).octave
                     <= note.Note(tone.nameWithOctave).octave
-                    <= note.Note(TONE_RANGE_TOP).octave
+                    <= note.Note(ctx.section.TONE_RANGE_TOP).octave
                 ):
                     break
         else:  # have a prev_tone octave
             tone.octave = tone_prev.octave
             if (
-                note.Note(TONE_RANGE_BOTTOM)
+                note.Note(ctx.section.TONE_RANGE_BOTTOM)
                 <= note.Note(tone.nameWithOctave)
-                <= note.Note(TONE_RANGE_TOP)
+                <= note.Note(ctx.section.TONE_RANGE_TOP)
             ):
                 the_valid_tone_octave = tone.octave
                 # print('tone with tone_prev.octave in range: use tp oct, the_valid_tone_octave', the_valid_tone_octave)
             else:
                 tone.octave = tone_prev.octave + 1
                 if (
-                    note.Note(TONE_RANGE_BOTTOM)
+                    note.Note(ctx.section.TONE_RANGE_BOTTOM)
                     <= note.Note(tone.nameWithOctave)
-                    <= note.Note(TONE_RANGE_TOP)
+                    <= note.Note(ctx.section.TONE_RANGE_TOP)
                 ):
                     the_valid_tone_octave = tone.octave
                     # print('tone with tone_prev.octave+1 in range: use tp oct, the_valid_tone_octave', the_valid_tone_octave)
                 else:
                     tone.octave = tone_prev.octave - 1
                     if (
-                        note.Note(TONE_RANGE_BOTTOM)
+                        note.Note(ctx.section.TONE_RANGE_BOTTOM)
                         <= note.Note(tone.nameWithOctave)
-                        <= note.Note(TONE_RANGE_TOP)
+                        <= note.Note(ctx.section.TONE_RANGE_TOP)
                     ):
                         the_valid_tone_octave = tone.octave
                         # print('tone with tone_prev.octave-1 in range: use tp oct, the_valid_tone_octave',
                         #      the_valid_tone_octave)
                     else:
-                        the_valid_tone_octave = get_random_octave()
+                        the_valid_tone_octave = get_random_octave(ctx)
                         # print('invalid tone_prev octave', note.Note(tone_prev.nameWithOctave), ' new random octave', the_valid_tone_octave)
 
     the_valid_tone_octave = validated_octave(the_valid_tone_octave)
@@ -567,17 +1000,17 @@ def get_valid_tone_octave(tone_prev, tone, desired_octave):
     return the_valid_tone_octave
 
 
-def get_tone_octave(tone_prev, tone, note_num):
+def get_tone_octave(ctx, tone_prev, tone, note_num):
     """
     function that takes the previous note and a note,
     and the number of the note in the stream starting at 0
     and returns the octave of the note
     """
     if note_num == 0:
-        the_tone_octave = get_random_octave()
+        the_tone_octave = get_random_octave(ctx)
     else:
         if tone_prev == 0 or type(tone_prev) == music21.note.Rest:
-            mid_oct = get_random_octave()
+            mid_oct = get_random_octave(ctx)
         else:
             mid_oct = tone_prev.octave
         low_oct = mid_oct - 1
@@ -609,28 +1042,28 @@ def get_tone_octave(tone_prev, tone, note_num):
             smallest_interval_octave = high_oct
             largest_interval_octave = mid_oct
 
-        if TONE_INTERVAL == "smallest":
+        if ctx.TONE_INTERVAL == "smallest":
             # if new note = prev then use same octave as prev
             if tone_prev == tone:
                 the_tone_octave = tone_prev.octave
             else:
                 the_tone_octave = smallest_interval_octave
 
-        if TONE_INTERVAL == "largest":
+        if ctx.TONE_INTERVAL == "largest":
             # if new note = prev then use same octave as prev
             if tone_prev == tone:
                 the_tone_octave = tone_prev.octave + 1
             else:
                 the_tone_octave = largest_interval_octave
 
-        if TONE_INTERVAL == "random":
+        if ctx.TONE_INTERVAL == "random":
             flip = random.randint(0, 1)
             if flip == 0:
                 the_tone_octave = smallest_interval_octave
             else:
                 the_tone_octave = largest_interval_octave
 
-    the_tone_octave = get_valid_tone_octave(tone_prev, tone, the_tone_octave)
+    the_tone_octave = get_valid_tone_octave(ctx, tone_prev, tone, the_tone_octave)
 
     # print('get_tone_octave(tone_prev', tone_prev,' tone ', tone.nameWithOctave, 'note_num in stream', note_num, ' returns ', the_tone_octave)
 
@@ -765,7 +1198,7 @@ def get_random_key(keys):
     """
     draw = choice(keys)
     key = tuple(draw.split())
-    logger.debug(f"get_random_key: keys {keys}, \t return \t {key}")
+    note_logger.debug("get_random_key: keys %s, \t return \t %s", keys, key)
     return key
 
 
@@ -900,7 +1333,7 @@ def get_one_state_key(key, transition):
         return filtered_key
 
 
-def get_note_with_octave(tone_prev, tone_name):
+def get_note_with_octave(ctx, tone_prev, tone_name):
     """
     Given a previous note and a tone_name
     create a note, give it an octave based on the previous note
@@ -908,7 +1341,7 @@ def get_note_with_octave(tone_prev, tone_name):
     """
     tone = music21.note.Note(tone_name)
     # determine the octave for the note
-    octave = get_tone_octave(tone_prev, tone, 1)
+    octave = get_tone_octave(ctx, tone_prev, tone, 1)
     tone.octave = octave
     return tone
 
@@ -962,7 +1395,7 @@ def get_note_with_octave(tone_prev, tone_name):
 
 
 # v2 copilot
-def get_next_beat_placement(n_prev, bpm_key, bpm_transition):
+def get_next_beat_placement(ctx, n_prev, bpm_key, bpm_transition):
     """
     Generates the next beat placement in a sequence based on the given parameters.
 
@@ -985,7 +1418,6 @@ def get_next_beat_placement(n_prev, bpm_key, bpm_transition):
         >>> beat_placement = get_next_beat_placement(n_prev, bpm_key, bpm_transition)
         >>> print(beat_placement)
     """
-    global DUR_RATIONAL
 
     valid = False
     count = 0
@@ -997,7 +1429,7 @@ def get_next_beat_placement(n_prev, bpm_key, bpm_transition):
             break
         beat_placement = get_random_draw(bpm_key, bpm_transition)
 
-        if DUR_RATIONAL:
+        if ctx.section.DUR_RATIONAL:
             # Allow only beat_placement with denominators 1, 2, 4, 8, 16, 32, etc.
             if (
                 beat_placement >= 0.0
@@ -1005,27 +1437,67 @@ def get_next_beat_placement(n_prev, bpm_key, bpm_transition):
                 and (beat_placement.denominator & (beat_placement.denominator - 1) == 0)
             ):
                 valid = True
-                logger.debug(
-                    f"get_next_beat_placement: DUR_RATIONAL=True, valid bpm_transition {beat_placement}"
-                )
+                note_logger.debug("get_next_beat_placement: DUR_RATIONAL=True, valid bpm_transition %s", beat_placement)
         else:
             if beat_placement >= 0.0 and beat_placement < 1.0:
                 valid = True
-                logger.debug(
-                    f"get_next_beat_placement: DUR_RATIONAL=False, valid bpm_transition {beat_placement}"
-                )
+                note_logger.debug("get_next_beat_placement: DUR_RATIONAL=False, valid bpm_transition %s", beat_placement)
 
     if not valid:
         # use fallback beat_placement
         beat_placement = 0.0
-        logger.debug(
-            f"get_next_beat_placement: fallback beat_placement used: {beat_placement}"
-        )
+        note_logger.debug("get_next_beat_placement: fallback beat_placement used: %s", beat_placement)
 
     return beat_placement
 
 
+def get_note_telemetry(ctx):
+    """
+    given the GenerationContext ctx
+    return the note telemetry of the current section, made when first needed:
+    for "pitch" and "duration", draws (attempted), rejections (reason -> count, a draw can fail more than one check),
+    tiers (the tier of get_next_note a valid draw was found in -> count) and fallbacks (the fallback tone C or duration 1.0 used)
+    """
+    telemetry = ctx.NOTE_TELEMETRY.get(ctx.section_name)
+    if telemetry is None:
+        telemetry = {
+            kind: {"draws": 0, "rejections": {}, "tiers": {}, "fallbacks": 0} for kind in ("pitch", "duration")
+        }
+        ctx.NOTE_TELEMETRY[ctx.section_name] = telemetry
+    return telemetry
+
+
+def merge_note_telemetry(total, telemetry):
+    """
+    given a note telemetry total (section name -> counts, see get_note_telemetry) and another note telemetry
+    add the counts of the other to the total, and return the total
+    """
+    for section_name, section_telemetry in telemetry.items():
+        total_section = total.setdefault(
+            section_name,
+            {kind: {"draws": 0, "rejections": {}, "tiers": {}, "fallbacks": 0} for kind in ("pitch", "duration")},
+        )
+        for kind, counts in section_telemetry.items():
+            total_counts = total_section[kind]
+            total_counts["draws"] += counts["draws"]
+            total_counts["fallbacks"] += counts["fallbacks"]
+            for counter in ("rejections", "tiers"):
+                for name, count in counts[counter].items():
+                    total_counts[counter][name] = total_counts[counter].get(name, 0) + count
+    return total
+
+
+def count_rejection(rejections, reason):
+    """
+    if given a rejections dict of the note telemetry, count the reason a draw was not valid
+    """
+    if rejections is not None:
+        rejections[reason] = rejections.get(reason, 0) + 1
+    return
+
+
 def get_next_note(
+    ctx,
     note_num,
     n_prev,
     tone_scale,
@@ -1043,6 +1515,8 @@ def get_next_note(
     Generates the next note in a sequence based on the given parameters.
 
     Args:
+        ctx (GenerationContext): The settings and section values of the song, counts rejected draws in ctx.NOTE_REJECTIONS
+            and the draws, rejections by reason, tiers reached and fallbacks in ctx.NOTE_TELEMETRY.
         note_num (int): The number of the note in the sequence.
         n_prev (music21.note.Note): The previous note in the sequence.
         tone_scale (list): The scale of tones to use.
@@ -1080,8 +1554,9 @@ def get_next_note(
         >>> print(note)
     """
 
-    logger.debug(
-        f"get_next_note(note_num {note_num}, n_prev {n_prev}, tone_scale {tone_scale}, tone_mode {tone_mode}, key {key}, bpm_key {bpm_key}, dkey {dkey}, lyric {lyric_syllable}, ts {ts}"
+    note_logger.debug(
+        "get_next_note(note_num %s, n_prev %s, tone_scale %s, tone_mode %s, key %s, bpm_key %s, dkey %s, lyric %s, ts %s",
+        note_num, n_prev, tone_scale, tone_mode, key, bpm_key, dkey, lyric_syllable, ts,
     )
 
     # input("Press Enter to continue...")
@@ -1096,14 +1571,14 @@ def get_next_note(
     # TBD
 
     # add get_next_offset function which takes in to account the beat placement
-    note_beat_placement = get_next_beat_placement(n_prev, bpm_key, bpm_transition)
+    note_beat_placement = get_next_beat_placement(ctx, n_prev, bpm_key, bpm_transition)
 
     # # convert beat_placement to offset_placement
     # offset_placement = note_beat_placement * ts.beatDuration.quarterLength
-    # logger.debug(f"get_next_note: offset_placement {offset_placement} = note_beat_placement {note_beat_placement} * ts.beatDuration.quarterLength {ts.beatDuration.quarterLength}")
+    # note_logger.debug(f"get_next_note: offset_placement {offset_placement} = note_beat_placement {note_beat_placement} * ts.beatDuration.quarterLength {ts.beatDuration.quarterLength}")
 
     # note_offset = n_prev.offset + n_prev.duration.quarterLength + offset_placement
-    # logger.debug(f"get_next_note: note_offset {note_offset} = n_prev.offset {n_prev.offset} + n_prev.duration.quarterLength {n_prev.duration.quarterLength} + offset_placement  {offset_placement}")
+    # note_logger.debug(f"get_next_note: note_offset {note_offset} = n_prev.offset {n_prev.offset} + n_prev.duration.quarterLength {n_prev.duration.quarterLength} + offset_placement  {offset_placement}")
 
     # work out the default_offset 												e.g. 4.25
     default_offset = n_prev.offset + n_prev.duration.quarterLength
@@ -1115,42 +1590,48 @@ def get_next_note(
     # calculate note_offset 													e.g. 4.5	5.125
     if default_offset_beat_placement == desired_offset_placement:
         note_offset = default_offset
-        logger.debug(
-            f"get_next_note: default_offset_beat_placement == desired_offset_placement: note_offset = default_offset:  = {note_offset} "
+        note_logger.debug(
+            "get_next_note: default_offset_beat_placement == desired_offset_placement: note_offset = default_offset:  = %s ",
+            note_offset,
         )
     if default_offset_beat_placement < desired_offset_placement:
         note_offset = default_offset + (
             desired_offset_placement - default_offset_beat_placement
         )
-        logger.debug(
-            f"default_offset_beat_placement < desired_offset_placement: note_offset {note_offset} = default_offset {default_offset} + (desired_offset_placement {desired_offset_placement} - default_offset_beat_placement {default_offset_beat_placement}"
+        note_logger.debug(
+            "default_offset_beat_placement < desired_offset_placement: note_offset %s = default_offset %s + (desired_offset_placement %s - default_offset_beat_placement %s",
+            note_offset, default_offset, desired_offset_placement, default_offset_beat_placement,
         )
     if default_offset_beat_placement > desired_offset_placement:
         note_offset = math.ceil(default_offset) + desired_offset_placement
-        logger.debug(
-            f"get_next_note: default_offset_beat_placement > desired_offset_placement: note_offset {note_offset} = math.ceil(default_offset) {math.ceil(default_offset)} + desired_offset_placement {desired_offset_placement}"
+        note_logger.debug(
+            "get_next_note: default_offset_beat_placement > desired_offset_placement: note_offset %s = math.ceil(default_offset) %s + desired_offset_placement %s",
+            note_offset, math.ceil(default_offset), desired_offset_placement,
         )
     if note_num == 0:
         note_offset = default_offset
 
-    # amend n_prev duration to include the offset
-    original_n_prev = copy.deepcopy(n_prev)
-    logger.debug(
-        f"get_next_note: n_prev.duration.quarterLength {n_prev.duration.quarterLength} + ( note_offset {note_offset} - default_offset {default_offset} )"
+    # amend n_prev duration to include the offset, with a copy of the original for the debug log
+    debug = note_logger.isEnabledFor(logging.DEBUG)
+    original_n_prev = copy.deepcopy(n_prev) if debug else None
+    note_logger.debug(
+        "get_next_note: n_prev.duration.quarterLength %s + ( note_offset %s - default_offset %s )",
+        n_prev.duration.quarterLength, note_offset, default_offset,
     )
     n_prev.duration.quarterLength = n_prev.duration.quarterLength + (
         note_offset - default_offset
     )
-    logger.debug(
-        f"get_next_note: new n_prev.duration.quarterLength {n_prev.duration.quarterLength}"
-    )
+    note_logger.debug("get_next_note: new n_prev.duration.quarterLength %s", n_prev.duration.quarterLength)
 
     dur_on_beat = is_offset_on_beat(note_offset, ts)
-    logger.debug(
-        f"get_next_note: note_offset {note_offset}, lyric_syllable {lyric_syllable} dur_on_beat {dur_on_beat}"
+    note_logger.debug(
+        "get_next_note: note_offset %s, lyric_syllable %s dur_on_beat %s",
+        note_offset, lyric_syllable, dur_on_beat,
     )
 
     # Get Pitch
+    telemetry = get_note_telemetry(ctx)
+    pitch_telemetry = telemetry["pitch"]
 
     # attempt a valid n with 2 state key
     while not valid and count < CALL_COUNT_MAX:
@@ -1158,10 +1639,14 @@ def get_next_note(
         if key not in transition:
             break
         tone_name = get_random_draw(key, transition)
-        n = get_note_with_octave(n_prev, tone_name)
-        if valid_pitch(n_prev, n, tone_scale, tone_mode):
+        n = get_note_with_octave(ctx, n_prev, tone_name)
+        pitch_telemetry["draws"] += 1
+        if valid_pitch(ctx, n_prev, n, tone_scale, tone_mode, pitch_telemetry["rejections"]):
             valid = True
+            count_rejection(pitch_telemetry["tiers"], "2_state_key")
             # print('2 state key valid_pitch(n_prev, n, ...) == True. n_prev=', n_prev, 'n=', n,)
+        else:
+            ctx.NOTE_REJECTIONS["pitch"] += 1
 
     # attempt a valid tone with 1 state key
     count = 0
@@ -1171,15 +1656,19 @@ def get_next_note(
         if new_key not in transition:
             break
         tone_name = get_random_draw(new_key, transition)
-        n = get_note_with_octave(n_prev, tone_name)
-        if valid_pitch(n_prev, n, tone_scale, tone_mode):
+        n = get_note_with_octave(ctx, n_prev, tone_name)
+        pitch_telemetry["draws"] += 1
+        if valid_pitch(ctx, n_prev, n, tone_scale, tone_mode, pitch_telemetry["rejections"]):
             valid = True
+            count_rejection(pitch_telemetry["tiers"], "1_state_key")
             # print(
             #     "1 state key valid_pitch(n_prev, n, ...) == True. n_prev=",
             #     n_prev,
             #     "n=",
             #     n,
             # )
+        else:
+            ctx.NOTE_REJECTIONS["pitch"] += 1
 
     # attempt a valid tone with random key
     count = 0
@@ -1190,25 +1679,27 @@ def get_next_note(
         if new_key not in transition:
             continue
         tone_name = get_random_draw(new_key, transition)
-        n = get_note_with_octave(n_prev, tone_name)
-        if valid_pitch(n_prev, n, tone_scale, tone_mode):
+        n = get_note_with_octave(ctx, n_prev, tone_name)
+        pitch_telemetry["draws"] += 1
+        if valid_pitch(ctx, n_prev, n, tone_scale, tone_mode, pitch_telemetry["rejections"]):
             valid = True
-            print(
-                "random key valid_pitch(n_prev, n, ...) == True. n_prev=",
-                n_prev,
-                "n=",
-                n,
-            )
+            count_rejection(pitch_telemetry["tiers"], "random_key")
+            note_logger.debug("random key valid_pitch(n_prev, n, ...) == True. n_prev= %s n= %s", n_prev, n)
+        else:
+            ctx.NOTE_REJECTIONS["pitch"] += 1
 
     if not valid:
         # use fallback tone
+        ctx.NOTE_REJECTIONS["pitch_fallback"] += 1
+        pitch_telemetry["fallbacks"] += 1
         tone_name = "C"
-        n = get_note_with_octave(n_prev, tone_name)
-        logger.debug(f"Warning: in get_next_note: fallback tone used:{tone_name}")
+        n = get_note_with_octave(ctx, n_prev, tone_name)
+        note_logger.debug("Warning: in get_next_note: fallback tone used:%s", tone_name)
 
     # get valid duration
     valid = False
     count = 0
+    duration_telemetry = telemetry["duration"]
 
     # attempt a valid duration with 2 state key
     while not valid and count < CALL_COUNT_MAX:
@@ -1217,11 +1708,13 @@ def get_next_note(
             break
         dur = get_random_draw(dkey, dtransition)
 
-        if valid_duration(dkey[1], dur, dur_on_beat):
+        duration_telemetry["draws"] += 1
+        if valid_duration(ctx, dkey[1], dur, dur_on_beat, duration_telemetry["rejections"]):
             valid = True
-            logger.debug(
-                f"2 state key valid_duration(dkey[1], dur) = True, dkey[1]=, {dkey[1]}, dur= {dur}"
-            )
+            count_rejection(duration_telemetry["tiers"], "2_state_key")
+            note_logger.debug("2 state key valid_duration(dkey[1], dur) = True, dkey[1]=, %s, dur= %s", dkey[1], dur)
+        else:
+            ctx.NOTE_REJECTIONS["duration"] += 1
 
     # attempt a valid duration with 1 state key
     count = 0
@@ -1231,9 +1724,13 @@ def get_next_note(
         if new_dkey not in dtransition:
             break
         dur = get_random_draw(new_dkey, dtransition)
-        if valid_duration(dkey[1], dur, dur_on_beat):
+        duration_telemetry["draws"] += 1
+        if valid_duration(ctx, dkey[1], dur, dur_on_beat, duration_telemetry["rejections"]):
             valid = True
+            count_rejection(duration_telemetry["tiers"], "1_state_key")
             # print('1 state key valid_duration(dkey[1], dur) = True','dkey[1]=', dkey[1], 'dur=', dur)
+        else:
+            ctx.NOTE_REJECTIONS["duration"] += 1
 
     # attempt a valid duration with random key
     count = 0
@@ -1245,33 +1742,35 @@ def get_next_note(
             continue
         dur = get_random_draw(new_dkey, dtransition)
         # print('Attempting random key valid_duration(dkey[1], dur) = True', 'dkey[1]=', dkey[1], 'dur=', dur)
-        if valid_duration(dkey[1], dur, dur_on_beat):
+        duration_telemetry["draws"] += 1
+        if valid_duration(ctx, dkey[1], dur, dur_on_beat, duration_telemetry["rejections"]):
             valid = True
-            print(
-                "random key valid_duration(dkey[1], dur) = True",
-                "dkey[1]=",
-                dkey[1],
-                "dur=",
-                dur,
-            )
+            count_rejection(duration_telemetry["tiers"], "random_key")
+            note_logger.debug("random key valid_duration(dkey[1], dur) = True dkey[1]= %s dur= %s", dkey[1], dur)
+        else:
+            ctx.NOTE_REJECTIONS["duration"] += 1
 
     # attempt a valid duration with DURATION_SET
-    if DURATION_SET:
+    if ctx.section.DURATION_SET:
         count = 0
         while not valid and count < CALL_COUNT_MAX:
             count += 1
             # get a random value from list
-            dur = random.choice(DURATION_SET)
-            if valid_duration(0, dur, dur_on_beat):
+            dur = random.choice(ctx.section.DURATION_SET)
+            duration_telemetry["draws"] += 1
+            if valid_duration(ctx, 0, dur, dur_on_beat, duration_telemetry["rejections"]):
                 valid = True
-                logger.debug(
-                    f"get_next_note: fallback dur {dur}, used from DURATION_SET {DURATION_SET}"
-                )
+                count_rejection(duration_telemetry["tiers"], "duration_set")
+                note_logger.debug("get_next_note: fallback dur %s, used from DURATION_SET %s", dur, ctx.section.DURATION_SET)
+            else:
+                ctx.NOTE_REJECTIONS["duration"] += 1
 
     if not valid:
         # use fallback quarterLength duration
+        ctx.NOTE_REJECTIONS["duration_fallback"] += 1
+        duration_telemetry["fallbacks"] += 1
         dur = 1.0
-        logger.debug(f"get_next_note: fallback quarterLength duration used: {dur}")
+        note_logger.debug("get_next_note: fallback quarterLength duration used: %s", dur)
 
     # add offset to note
     n.offset = note_offset
@@ -1285,18 +1784,19 @@ def get_next_note(
     if lyric_syllable != None:
         n.lyric = lyric_syllable
 
-    if n_prev.duration.quarterLength != original_n_prev.duration.quarterLength:
-        logger.debug(
-            f"get_next_note: n_prev.duration.quarterLength changed from {original_n_prev.duration.quarterLength} to {n_prev.duration.quarterLength}"
+    if debug and n_prev.duration.quarterLength != original_n_prev.duration.quarterLength:
+        note_logger.debug(
+            "get_next_note: n_prev.duration.quarterLength changed from %s to %s",
+            original_n_prev.duration.quarterLength, n_prev.duration.quarterLength,
         )
-        logger.debug(f"get_next_note: original_n_prev:")
+        note_logger.debug("get_next_note: original_n_prev:")
         show_text_of_note(original_n_prev, ts)
-        logger.debug(f"get_next_note: changed n_prev:")
+        note_logger.debug("get_next_note: changed n_prev:")
         show_text_of_note(n_prev, ts)
-        logger.debug(f"get_next_note: next n :")
+        note_logger.debug("get_next_note: next n :")
         show_text_of_note(n, ts)
 
-    logger.debug(f"get_next_note:return \t n_prev = {n_prev} n = {n}")
+    note_logger.debug("get_next_note:return \t n_prev = %s n = %s", n_prev, n)
     return n_prev, n
 
 
@@ -1308,11 +1808,11 @@ def get_random_draw(key, transition):
     draw = random.choices(
         list(transition[key].keys()), weights=transition[key].values(), k=1
     )[0]
-    logger.debug(f"get_random_draw: key {key}, \t\t return {draw}")
+    note_logger.debug("get_random_draw: key %s, \t\t return %s", key, draw)
     return draw
 
 
-def validated_duration(quarterLength, transition, fallback_quarterLength):
+def validated_duration(ctx, quarterLength, transition, fallback_quarterLength):
     """
     given a quarterLength and a duration transition and keys
     return a validated rest_note_duration
@@ -1320,7 +1820,7 @@ def validated_duration(quarterLength, transition, fallback_quarterLength):
     call_count = 0
     while True:  # start repeat until valid duration or > CALL_COUNT_MAX
         call_count = call_count + 1
-        if valid_duration(0, quarterLength) or call_count > CALL_COUNT_MAX:
+        if valid_duration(ctx, 0, quarterLength) or call_count > CALL_COUNT_MAX:
             break
         else:
             keys = get_keys(transition)
@@ -1339,14 +1839,14 @@ def validated_duration(quarterLength, transition, fallback_quarterLength):
     return quarterLength
 
 
-def get_nameWithOctave_from_cadence_tones(n_prev):
+def get_nameWithOctave_from_cadence_tones(ctx, n_prev):
     """
     given the previous note,
     get random cadence tone
     get the octave using the previous note
     return the nameWithOctave
     """
-    if CADENCE_TONE_FREQUENCY == "":
+    if ctx.CADENCE_TONE_FREQUENCY == "":
         print(
             "exit: Error get_nameWithOctave_from_cadence_tones called when CADENCE_TONE_FREQUENCY is blank"
         )
@@ -1355,15 +1855,16 @@ def get_nameWithOctave_from_cadence_tones(n_prev):
         sys.exit()
     else:
         # get random cadence tone
-        cadence_tone = random.choice(CADENCE_TONE_SAMPLES)
+        cadence_tone = random.choice(ctx.CADENCE_TONE_SAMPLES)
         # print('cadence_tone=', cadence_tone)
-        cadence_note = get_note_with_octave(n_prev, cadence_tone)
+        cadence_note = get_note_with_octave(ctx, n_prev, cadence_tone)
         print("cadence_note.nameWithOctave=", cadence_note.nameWithOctave)
 
     return cadence_note.nameWithOctave
 
 
 def generate_markov_phrase_with_lyrics(
+    ctx,
     sect,
     ts,
     tone_scale,
@@ -1380,13 +1881,15 @@ def generate_markov_phrase_with_lyrics(
     """
     function that uses musical markov chains and a lyric line to
     return a melodic stream with a line of lyrics
+    ctx is the GenerationContext of the song, with the values of the section sect
     """
-    logger.debug(f"gmpwl Duration set: {DURATION_SET} (type: {type(DURATION_SET)})")
-    logger.debug(f"gmpwl Duration set (PER_SECTION): {PER_SECTION_DURATION_SET}")
+    note_logger.debug("gmpwl Duration set: %s (type: %s)", ctx.section.DURATION_SET, type(ctx.section.DURATION_SET))
+    note_logger.debug("gmpwl Duration set (PER_SECTION): %s", ctx.PER_SECTION_DURATION_SET)
 
     if gmpwl_call_count == 1:
-        logger.debug(
-            f"generate_markov_phrase_with_lyrics: sect {sect}, ts {ts}, tone_scale {tone_scale}, tone_mode {tone_mode}, \n---lyric_line--- {lyric_line}"
+        note_logger.debug(
+            "generate_markov_phrase_with_lyrics: sect %s, ts %s, tone_scale %s, tone_mode %s, \n---lyric_line--- %s",
+            sect, ts, tone_scale, tone_mode, lyric_line,
         )
         log_transition_analysis(transition, "Note transition: transition")
         log_transition_analysis(
@@ -1420,31 +1923,26 @@ def generate_markov_phrase_with_lyrics(
 
     if r.duration.quarterLength > 0:
         r.duration.quarterLength = validated_duration(
+            ctx,
             r.duration.quarterLength, rest_note_transition, 0.0
         )
-    print("Initial initial rest offset", r.duration.quarterLength)
+    note_logger.debug("Initial initial rest offset %s", r.duration.quarterLength)
 
     # override offset on the first note of each line
-    if REST_NOTE_LINE_OFFSET != None:
-        r.duration.quarterLength = REST_NOTE_LINE_OFFSET
-        logger.debug(
-            f"Overriding initial rest offset to REST_NOTE_LINE_OFFSET: {REST_NOTE_LINE_OFFSET}"
-        )
+    if ctx.section.REST_NOTE_LINE_OFFSET != None:
+        r.duration.quarterLength = ctx.section.REST_NOTE_LINE_OFFSET
+        note_logger.debug("Overriding initial rest offset to REST_NOTE_LINE_OFFSET: %s", ctx.section.REST_NOTE_LINE_OFFSET)
 
     if r.duration.quarterLength > 0:
         p_stream.append(r)
 
-        if is_bad_beat_placement(r.offset, ts):
-            logger.debug(
-                f"generate_markov_phrase_with_lyrics: is_bad_beat_placement r.offset {r.offset} "
-            )
+        if is_bad_beat_placement(ctx, r.offset, ts):
+            note_logger.debug("generate_markov_phrase_with_lyrics: is_bad_beat_placement r.offset %s ", r.offset)
 
         show_text_of_note(r, ts)
-        logger.debug(
-            f"rest_note_draw non-zero == {r.duration.quarterLength} so first note of line will start then."
-        )
+        note_logger.debug("rest_note_draw non-zero == %s so first note of line will start then.", r.duration.quarterLength)
     else:
-        logger.debug(
+        note_logger.debug(
             f"rest_note_draw == 0.0 so first note of line will start at the beginning of the bar."
         )
 
@@ -1470,7 +1968,7 @@ def generate_markov_phrase_with_lyrics(
     # print("initial duration key (bpm_key) ", bpm_key)
     bpm_keys = get_keys(bpm_transition)
     bpm_key = get_random_key(bpm_keys)
-    logger.debug(
+    note_logger.debug(
         "new beat placement matrix key (bpm_key) {bpm_key}"
     )  # e.g. ('3/4', '0')
 
@@ -1488,7 +1986,7 @@ def generate_markov_phrase_with_lyrics(
     # set up previous note
     n_prev = music21.note.Note(key[1])
     # determine the octave for the previous note
-    octave = get_tone_octave(0, n_prev, 1)
+    octave = get_tone_octave(ctx, 0, n_prev, 1)
     n_prev.octave = octave
     ddraw = get_random_draw(dkey, dtransition)
 
@@ -1499,13 +1997,12 @@ def generate_markov_phrase_with_lyrics(
     # Append a note or a rest to the score
     # number of notes in phrase determined by the number_of_syllables
     for note_num in range(number_of_syllables):  # if range 6 then for 0 .. 5
-        logger.debug(
-            f"for {note_num} in range(number_of_syllables) {number_of_syllables} "
-        )
+        note_logger.debug("for %s in range(number_of_syllables) %s ", note_num, number_of_syllables)
 
         if note_num == number_of_syllables - 1:  # cadence note
-            print("cadence note: use cad_transition cad_dtransition")
+            note_logger.debug("cadence note: use cad_transition cad_dtransition")
             n_prev, n = get_next_note(
+                ctx,
                 note_num,
                 n_prev,
                 tone_scale,
@@ -1522,6 +2019,7 @@ def generate_markov_phrase_with_lyrics(
         else:
             # use transition dtransition
             n_prev, n = get_next_note(
+                ctx,
                 note_num,
                 n_prev,
                 tone_scale,
@@ -1554,9 +2052,10 @@ def generate_markov_phrase_with_lyrics(
             #    duration.quarterLength = previous_duration
             p_stream.append(n_prev)
 
-            if is_bad_beat_placement(n_prev.offset, ts):
-                logger.debug(
-                    f"generate_markov_phrase_with_lyrics: is_bad_beat_placement n_prev.offset {n_prev.offset} lyric {n_prev.lyric} "
+            if is_bad_beat_placement(ctx, n_prev.offset, ts):
+                note_logger.debug(
+                    "generate_markov_phrase_with_lyrics: is_bad_beat_placement n_prev.offset %s lyric %s ",
+                    n_prev.offset, n_prev.lyric,
                 )
 
             # p_stream.append(copy.deepcopy(n_prev))
@@ -1576,9 +2075,7 @@ def generate_markov_phrase_with_lyrics(
         beat_in_bar = get_beat_in_bar(n, ts)
         bp = fractional_part_as_fraction(beat_in_bar, ts)
         bpm_key = (bpm_key[1], str(bp))
-        logger.debug(
-            f"gmpwl determine bpm_key bpm_key[1] {bpm_key[1]}  bp {bp} bpm_key {bpm_key}"
-        )
+        note_logger.debug("gmpwl determine bpm_key bpm_key[1] %s  bp %s bpm_key %s", bpm_key[1], bp, bpm_key)
 
         # input("Press Enter to continue...")
 
@@ -1594,13 +2091,14 @@ def generate_markov_phrase_with_lyrics(
     #    pitch = previous_pitch
     #    offset = previous_offset
     #    duration.quarterLength = previous_duration
-    if CADENCE_TONE_FREQUENCY != "":
-        n.nameWithOctave = get_nameWithOctave_from_cadence_tones(n_prev)
+    if ctx.CADENCE_TONE_FREQUENCY != "":
+        n.nameWithOctave = get_nameWithOctave_from_cadence_tones(ctx, n_prev)
     p_stream.append(n)
 
-    if is_bad_beat_placement(n.offset, ts):
-        logger.debug(
-            f"generate_markov_phrase_with_lyrics: is_bad_beat_placement cadence n.offset {n.offset} lyric {n_prev.lyric}"
+    if is_bad_beat_placement(ctx, n.offset, ts):
+        note_logger.debug(
+            "generate_markov_phrase_with_lyrics: is_bad_beat_placement cadence n.offset %s lyric %s",
+            n.offset, n_prev.lyric,
         )
 
     show_text_of_note(n, ts)
@@ -1612,13 +2110,11 @@ def generate_markov_phrase_with_lyrics(
         r.duration.quarterLength = duration_to_end_of_bar
         p_stream.append(r)
 
-        if is_bad_beat_placement(r.offset, ts):
-            logger.debug(
-                f"generate_markov_phrase_with_lyrics: is_bad_beat_placement r.offset {r.offset} "
-            )
+        if is_bad_beat_placement(ctx, r.offset, ts):
+            note_logger.debug("generate_markov_phrase_with_lyrics: is_bad_beat_placement r.offset %s ", r.offset)
 
         show_text_of_note(r, ts)
-        print("Added rest duration_to_end_of_bar", duration_to_end_of_bar)
+        note_logger.debug("Added rest duration_to_end_of_bar %s", duration_to_end_of_bar)
 
     return p_stream
 
@@ -1653,6 +2149,8 @@ def get_name_and_args(a_string):
     else:
         root_function, a_string = a_string[:index], a_string[index:]
         # print('root_function, a_string ',root_function, a_string)
+        import pyparsing  # only needed for the post processing function comments of a lyrics file
+
         data = {}
         data[root_function] = (
             pyparsing.nestedExpr().parseString(a_string).asList()[0][0].split(",")
@@ -2128,10 +2626,11 @@ def is_number_an_integer(user_number):
     return is_int
 
 
-def set_cadence(stream):
+@profile_span("set_cadence")
+def set_cadence(generation_config, stream):
     """
     function that takes a stream
-    and returns markov chains for the cadences (last three notes of a phrase)
+    and returns markov chains for the cadences (last three notes of a phrase), with the TONE_EQ of the GenerationConfig
     """
     print("get_cadence")
 
@@ -2192,7 +2691,7 @@ def set_cadence(stream):
         print("total_frequency=", total)
     else:
         cad_transition, total = apply_tone_eq_to_transition_frequency(
-            cad_transition, total, True
+            generation_config, cad_transition, total, True
         )
         print("After apply_tone_eq_to_cad_transition_frequency")
         print("note cad_transition with frequency=", cad_transition)
@@ -2273,12 +2772,13 @@ def is_cadence(n, flat_stream):
     return is_cadence_note
 
 
-def is_bad_beat_placement(value, time_signature):
+def is_bad_beat_placement(ctx, value, time_signature):
     """
     Function that takes a value, converts it to a beat_placement within a beat,
     and returns True if the beat_placement is_bad_beat_placement.
 
     Args:
+        ctx (GenerationContext or GenerationConfig): The BEAT_PLACEMENT* settings.
         value (float): The value to check.
         time_signature (music21.meter.TimeSignature): The time signature of the piece.
 
@@ -2290,35 +2790,24 @@ def is_bad_beat_placement(value, time_signature):
 
     beat_placement = fractional_part_as_fraction(value, time_signature)
 
-    # Check against BEAT_PLACEMENTS_DENIED_SET
-    if beat_placement in BEAT_PLACEMENTS_DENIED_SET:
-        logger.debug(
-            f"is_bad_beat_placement {value} {time_signature} ,in BEAT_PLACEMENTS_DENIED_SET beat_placement {beat_placement} beat_placement.denominator {beat_placement.denominator} - Time Signature: {time_signature}"
-        )
-        return True
-
-    # Check against BEAT_PLACEMENTS_DENOMINATOR_DENIED_SET
-    if beat_placement.denominator in BEAT_PLACEMENTS_DENOMINATOR_DENIED_SET:
-        logger.debug(
-            f"is_bad_beat_placement {value} {time_signature} ,in BEAT_PLACEMENTS_DENOMINATOR_DENIED_SET. beat_placement {beat_placement} beat_placement.denominator {beat_placement.denominator} - Time Signature: {time_signature}"
+    # the BEAT_PLACEMENTS_DENIED_SET, BEAT_PLACEMENTS_DENOMINATOR_DENIED_SET and BEAT_PLACEMENT_DENOMINATOR_MAXIMUM_ALLOWED
+    # checks are looked up in the table of the song constraints
+    reason = ctx.song_constraints.check_beat_placement(beat_placement)
+    if reason:
+        note_logger.debug(
+            f"is_bad_beat_placement {value} {time_signature} beat_placement {beat_placement} {reason} - Time Signature: {time_signature}"
         )
         return True
 
-    # Check against BEAT_PLACEMENT_DENOMINATOR_MAXIMUM_ALLOWED
-    if BEAT_PLACEMENT_DENOMINATOR_MAXIMUM_ALLOWED > 0:
-        if beat_placement.denominator > BEAT_PLACEMENT_DENOMINATOR_MAXIMUM_ALLOWED:
-            logger.debug(
-                f"is_bad_beat_placement {value} {time_signature} beat_placement: {beat_placement} beat_placement.denominator: {beat_placement.denominator} > BEAT_PLACEMENT_DENOMINATOR_MAXIMUM_ALLOWED: {BEAT_PLACEMENT_DENOMINATOR_MAXIMUM_ALLOWED} - Time Signature: {time_signature}"
-            )
-            return True
-
     return False
 
 
-def set_bpm_transition(song, time_signature):
+@profile_span("set_bpm_transition")
+def set_bpm_transition(generation_config, song, time_signature):
     """
     function that takes a song and
     returns bpm_transition -the beat placement matrix transition
+    without bad beat placements of the GenerationConfig BEAT_PLACEMENT* settings
     """
     logger.info(f"set_bpm_transition(song) {song} ")
 
@@ -2351,9 +2840,9 @@ def set_bpm_transition(song, time_signature):
                 if prev:
                     if last:
                         if (
-                            is_bad_beat_placement(prev.beat, time_signature)
-                            or is_bad_beat_placement(last.beat, time_signature)
-                            or is_bad_beat_placement(n.beat, time_signature)
+                            is_bad_beat_placement(generation_config, prev.beat, time_signature)
+                            or is_bad_beat_placement(generation_config, last.beat, time_signature)
+                            or is_bad_beat_placement(generation_config, n.beat, time_signature)
                             # or is_cadence(element_num, song.flatten())
                         ):
                             bad_beat = True
@@ -2436,10 +2925,11 @@ def set_bpm_transition(song, time_signature):
     return bpm_transition
 
 
-def set_duration_transition(song):
+@profile_span("set_duration_transition")
+def set_duration_transition(generation_config, song):
     """
     function that takes a song and
-    returns the markov duration transition
+    returns the markov duration transition, with the DURATION_EQ of the GenerationConfig
     (not including the cadence durations - the last notes of phrases).
     """
     dtransition = {}
@@ -2522,7 +3012,7 @@ def set_duration_transition(song):
     # print('duration transitions with probability', dtransition)
 
     dtransition, dtotal = apply_duration_eq_to_dtransition_frequency(
-        dtransition, dtotal, False
+        generation_config, dtransition, dtotal, False
     )
 
     print("After apply_duration_eq_to_dtransition_frequency")
@@ -2561,9 +3051,9 @@ def get_frequency_total(transition):
     return total
 
 
-def apply_tone_eq_to_transition_frequency(transition, total, is_cadence):
+def apply_tone_eq_to_transition_frequency(generation_config, transition, total, is_cadence):
     """
-    given a transition and a total, and if it is a cadence transition
+    given the GenerationConfig, a transition and a total, and if it is a cadence transition
     apply TONE_EQ to the transition
     recalculate the total frequency
     return the transition, total
@@ -2572,13 +3062,13 @@ def apply_tone_eq_to_transition_frequency(transition, total, is_cadence):
 
     cadence_factor = 100.0
 
-    if TONE_EQ == "":
+    if generation_config.TONE_EQ == "":
         return transition, total
     else:
         # alter transition frequencies
-        for tone_eq_num in range(0, len(TONE_EQ)):
-            tone_name = TONE_EQ[tone_eq_num][0]
-            tone_factor = TONE_EQ[tone_eq_num][1]
+        for tone_eq_num in range(0, len(generation_config.TONE_EQ)):
+            tone_name = generation_config.TONE_EQ[tone_eq_num][0]
+            tone_factor = generation_config.TONE_EQ[tone_eq_num][1]
             print(
                 "tone_eq_num=",
                 tone_eq_num,
@@ -2610,9 +3100,9 @@ def apply_tone_eq_to_transition_frequency(transition, total, is_cadence):
         return transition, total
 
 
-def apply_duration_eq_to_dtransition_frequency(dtransition, dtotal, is_cadence):
+def apply_duration_eq_to_dtransition_frequency(generation_config, dtransition, dtotal, is_cadence):
     """
-    given a duration transition and a dtotal, and if it is a cadence duration transition
+    given the GenerationConfig, a duration transition and a dtotal, and if it is a cadence duration transition
     apply DURATION_EQ to the transition
     recalculate the dtotal frequency
     return the transition, dtotal
@@ -2621,13 +3111,13 @@ def apply_duration_eq_to_dtransition_frequency(dtransition, dtotal, is_cadence):
 
     cadence_factor = 100.0
 
-    if DURATION_EQ == "":
+    if generation_config.DURATION_EQ == "":
         return dtransition, dtotal
     else:
         # alter dtransition frequencies
-        for duration_eq_num in range(0, len(DURATION_EQ)):
-            duration_name = DURATION_EQ[duration_eq_num][0]
-            duration_factor = DURATION_EQ[duration_eq_num][1]
+        for duration_eq_num in range(0, len(generation_config.DURATION_EQ)):
+            duration_name = generation_config.DURATION_EQ[duration_eq_num][0]
+            duration_factor = generation_config.DURATION_EQ[duration_eq_num][1]
             # print('duration_eq_num=',duration_eq_num,'duration_name=', duration_name,'duration_factor=', duration_factor)
             for k, v in dtransition.items():
                 for i, j in v.items():
@@ -2671,10 +3161,11 @@ def apply_duration_eq_to_dtransition_frequency(dtransition, dtotal, is_cadence):
         return dtransition, dtotal
 
 
-def set_note_transition(song):
+@profile_span("set_note_transition")
+def set_note_transition(generation_config, song):
     """
     function that takes a song and
-    returns the markov note transition
+    returns the markov note transition, with the TONE_EQ of the GenerationConfig
     (not including the cadence notes - the last notes of phrases).
     """
 
@@ -2723,7 +3214,7 @@ def set_note_transition(song):
     )  # e.g. {('A', 'A'): {'G': 15, 'D': 4, 'B-': 1, 'A': 2, 'B': 1, 'F': 1, 'C': 1}, ('A', 'G'): {'F': 10, 'G': 6, 'F#': 2}, ...
     print("total_frequency=", total)
 
-    transition, total = apply_tone_eq_to_transition_frequency(transition, total, False)
+    transition, total = apply_tone_eq_to_transition_frequency(generation_config, transition, total, False)
 
     print("After apply_tone_eq_to_transition_frequency")
     print("note transition with frequency=", transition)
@@ -3116,8 +3607,30 @@ def split_hyphens(lyric_line):
 #     return result
 
 
+@functools.lru_cache(maxsize=None)
+def get_key_scale(tone_scale, tone_mode):
+    """
+    given the tonic and mode of a key e.g. 'C', 'major'
+    return its music21 scale. Cached, as a song has few keys.
+    The scale degrees are not cached: music21 draws from random to choose an end of the scale
+    when a tone is the tonic, so caching them would change the melody of a seed
+    """
+    if tone_mode == "major":
+        return scale.MajorScale(tone_scale)
+    return scale.MinorScale(tone_scale)
+
+
+@functools.lru_cache(maxsize=None)
+def get_tone_name_ps(tone_name):
+    """
+    given a tone name e.g. 'D#'
+    return its pitch space number (in octave 4), as compared with the TONE_SCALE_SET
+    """
+    return pitch.Pitch(tone_name).ps
+
+
 # v3 rewrite Gemini
-def valid_duration(dur_prev, dur, dur_on_beat=False):
+def valid_duration(ctx, dur_prev, dur, dur_on_beat=False, rejections=None):
     """
     function that takes a duration and
     returns false if not a valid duration and true otherwise
@@ -3136,17 +3649,20 @@ def valid_duration(dur_prev, dur, dur_on_beat=False):
 
     if dur is a tuplet and NOT dur_on_beat and dur_prev is not a tuplet then result = False
 
+    the settings are read from the GenerationContext ctx.
+    if given the rejections dict of the note telemetry, each check failed is counted in it, see get_note_telemetry
     """
 
-    global DURATION_SET  # Ensure DURATION_SET is accessed as a global variable
 
-    logger.debug(
-        f"valid_duration: dur_prev {dur_prev}, dur {dur}, dur_on_beat {dur_on_beat}, DURATION_SET {DURATION_SET}\t\t start #########################################"
+    section = ctx.section
+    note_logger.debug(
+        "valid_duration: dur_prev %s, dur %s, dur_on_beat %s, DURATION_SET %s\t\t start #########################################",
+        dur_prev, dur, dur_on_beat, section.DURATION_SET,
     )
 
-    if DUR_LEAST > DUR_LONGEST:
+    if section.DUR_LEAST > section.DUR_LONGEST:
         print("exit: Error DUR_LEAST > DUR_LONGEST")
-        error_message = f"Error DUR_LEAST > DUR_LONGEST: DUR_LEAST {DUR_LEAST} DUR_LONGEST {DUR_LONGEST}"
+        error_message = f"Error DUR_LEAST > DUR_LONGEST: DUR_LEAST {section.DUR_LEAST} DUR_LONGEST {section.DUR_LONGEST}"
         log_error_and_pause(error_message)
         sys.exit()
     # duration is valid until proved invalid
@@ -3156,12 +3672,12 @@ def valid_duration(dur_prev, dur, dur_on_beat=False):
     # DUR_PREV_DIFF - compare duration with previous duration, e.g. where 2, duration is >= 1/2 previous and <= 2 x previous etc ,
     # where 0 and <= 1, do not compare with previous duration.
     if (
-        (DUR_PREV_DIFF != 0)
-        and (DUR_PREV_DIFF > 1)
+        (section.DUR_PREV_DIFF != 0)
+        and (section.DUR_PREV_DIFF > 1)
         and (float(Fraction(dur_prev) != 0.0))
     ):
-        min_dur = float(Fraction(dur_prev)) / float(DUR_PREV_DIFF)
-        max_dur = float(Fraction(dur_prev)) * float(DUR_PREV_DIFF)
+        min_dur = float(Fraction(dur_prev)) / float(section.DUR_PREV_DIFF)
+        max_dur = float(Fraction(dur_prev)) * float(section.DUR_PREV_DIFF)
         if (float(Fraction(dur)) < min_dur) or (float(Fraction(dur)) > max_dur):
             result = False
             reason = (
@@ -3171,96 +3687,45 @@ def valid_duration(dur_prev, dur, dur_on_beat=False):
                 + str(max_dur)
                 + "float(Fraction(dur)) < min_dur) or (float(Fraction(dur)) > max_dur)",
             )
+            count_rejection(rejections, "prev_diff")
 
-    # simple durations
-    s0_25 = Fraction(0.25)
-    s0_5 = Fraction(0.5)
-    s0_75 = Fraction(0.75)
-    s1_0 = Fraction(1.0)
-    s1_25 = Fraction(1.25)
-    s1_5 = Fraction(1.5)
-    s1_75 = Fraction(1.75)
-    s2_0 = Fraction(2.0)
-    s2_5 = Fraction(2.5)
-    s3_0 = Fraction(3.0)
-    s3_5 = Fraction(3.5)
-    s4_0 = Fraction(4.0)
-
-    # complex durations
-    c1_6 = Fraction(1, 6)
-    c1_3 = Fraction(1, 3)
-    c2_3 = Fraction(2, 3)
-    c4_3 = Fraction(4, 3)
-    c8_3 = Fraction(8, 3)
-
-    if DUR_RATIONAL == True:
-        if is_tuplet(dur):
-            result = False
-            reason = "DUR_RATIONAL == True: is_tuplet(dur)"
-
-    if DUR_TUPLET == True:
-        pass  # any duration is valid, rational or tuplet.
-
-    if DUR_LEAST != 0:  # any duration < DUR_LEAST is invalid
-        if dur < DUR_LEAST:
-            result = False
-            reason = "DUR_LEAST= " + str(DUR_LEAST) + " DUR_LEAST != 0: dur < DUR_LEAST"
-    if DUR_LONGEST != 0:  # any duration > DUR_LONGEST is invalid
-        if dur > DUR_LONGEST:
-            result = False
-            reason = (
-                "DUR_LONGEST= "
-                + str(DUR_LONGEST)
-                + " DUR_LONGEST != 0, dur > DUR_LONGEST"
-            )
-
-    # zero or very small durations not allowed
-    if dur < DURATION_MIN_MUSIC21:
+    # the checks of the duration alone (DUR_RATIONAL, DUR_LEAST, DUR_LONGEST, DURATION_MIN_MUSIC21 and DURATION_SET)
+    # are looked up in the table of the section constraints
+    duration_valid, duration_reason, duration_is_tuplet, duration_rejections = section.check_duration(dur)
+    if not duration_valid:
         result = False
-        reason = (
-            "DURATION_MIN_MUSIC21= ",
-            str(DURATION_MIN_MUSIC21) + " dur < DURATION_MIN_MUSIC21",
-        )
-
-    if DURATION_SET:  # if duration is NOT in duration set then the tone is invalid
-        duration_found = False
-        for dur_from_set in DURATION_SET:
-            if Fraction(dur) == Fraction(dur_from_set):
-                duration_found = True
-                break  # Exit the loop once a match is found
-        if not duration_found:
-            result = False
-            reason = (
-                "DURATION_SET "
-                + str(DURATION_SET)
-                + " if DURATION_SET: not duration_found"
-            )
+        reason = duration_reason
+        for duration_rejection in duration_rejections:
+            count_rejection(rejections, duration_rejection)
 
     # Invalid tuplets
 
     # If dur is tuplet:
-    if is_tuplet(Fraction(dur)):
+    if duration_is_tuplet:
         # If dur not on beat
         if dur_on_beat == False:
             # If prev_dur != dur
             if Fraction(dur_prev) != Fraction(dur) or (dur_prev == 0):
                 # Invalid
-                logger.debug(
-                    f"is_tuplet(Fraction(dur)) and (dur_on_beat == False) and ((Fraction(dur_prev) != Fraction(dur)) or (dur_prev == 0) {is_tuplet(Fraction(dur))} {(dur_on_beat == False)} {(Fraction(dur_prev) != Fraction(dur))} {(dur_prev == 0)}"
+                note_logger.debug(
+                    "is_tuplet(Fraction(dur)) and (dur_on_beat == False) and ((Fraction(dur_prev) != Fraction(dur)) or (dur_prev == 0) %s %s %s %s",
+                    is_tuplet(Fraction(dur)), dur_on_beat == False, Fraction(dur_prev) != Fraction(dur), dur_prev == 0,
                 )
                 result = False
                 reason = "is_tuplet(Fraction(dur)) & dur_on_beat == False &  Fraction(dur_prev) != Fraction(dur) or (dur_prev == 0)"
+                count_rejection(rejections, "tuplet_on_beat")
 
-    logger.debug(
-        f"valid_duration: dur_prev {dur_prev}, dur {dur}, dur_on_beat {dur_on_beat} \t\t return {result} #########################################"
+    note_logger.debug(
+        "valid_duration: dur_prev %s, dur %s, dur_on_beat %s \t\t return %s #########################################",
+        dur_prev, dur, dur_on_beat, result,
     )
 
-    logger.debug(f"valid_duration result reason {reason} ")
+    note_logger.debug("valid_duration result reason %s ", reason)
 
     return result
 
 
-def valid_pitch(n_prev, n, tone_scale, tone_mode):
+def valid_pitch(ctx, n_prev, n, tone_scale, tone_mode, rejections=None):
     """
     function that takes a note and
     returns false if not a valid note and true otherwise
@@ -3276,88 +3741,86 @@ def valid_pitch(n_prev, n, tone_scale, tone_mode):
     if TONE_PREV_INTERVAL 0  # where 0, do not compare with previous tone,
     if TONE_PREV_INTERVAL > 0 # maximum number of semitones between notes
 
+    the settings are read from the GenerationContext ctx, which also holds the TONE_ASCENT and TONE_DESCENT state.
+    if given the rejections dict of the note telemetry, each check failed is counted in it, see get_note_telemetry
     """
     result = True
+    section = ctx.section
 
-    if TONES_ON_KEY == True and TONES_OFF_KEY == True:
+    if section.TONES_ON_KEY == True and ctx.TONES_OFF_KEY == True:
         print("exit: Error TONES_ON_KEY == True and TONES_OFF_KEY == True")
-        error_message = f"Error TONES_ON_KEY {TONES_ON_KEY} == True and TONES_OFF_KEY {TONES_OFF_KEY} == True"
+        error_message = f"Error TONES_ON_KEY {section.TONES_ON_KEY} == True and TONES_OFF_KEY {ctx.TONES_OFF_KEY} == True"
         log_error_and_pause(error_message)
         sys.exit()
-    if TONE_SCALE_ON_ANHEMITONIC == True and (
-        TONES_ON_KEY == True or TONES_OFF_KEY == True
+    if ctx.TONE_SCALE_ON_ANHEMITONIC == True and (
+        section.TONES_ON_KEY == True or ctx.TONES_OFF_KEY == True
     ):
         print(
             "exit: Error TONE_SCALE_ON_ANHEMITONIC == True and (TONES_ON_KEY == True or TONES_OFF_KEY == True)"
         )
-        error_message = f"Error TONE_SCALE_ON_ANHEMITONIC {TONE_SCALE_ON_ANHEMITONIC} == True and (TONES_ON_KEY {TONES_ON_KEY} == True or TONES_OFF_KEY {TONES_OFF_KEY} == True)"
+        error_message = f"Error TONE_SCALE_ON_ANHEMITONIC {ctx.TONE_SCALE_ON_ANHEMITONIC} == True and (TONES_ON_KEY {section.TONES_ON_KEY} == True or TONES_OFF_KEY {ctx.TONES_OFF_KEY} == True)"
         log_error_and_pause(error_message)
         sys.exit()
-    if TONE_SCALE_ON_ANHEMITONIC == True and TONE_SCALE_ON_HEMITONIC == True:
+    if ctx.TONE_SCALE_ON_ANHEMITONIC == True and ctx.TONE_SCALE_ON_HEMITONIC == True:
         print(
             "exit: Error TONE_SCALE_ON_ANHEMITONIC == True and TONE_SCALE_ON_HEMITONIC == True"
         )
-        error_message = f"Error TONE_SCALE_ON_ANHEMITONIC {TONE_SCALE_ON_ANHEMITONIC} == True and TONE_SCALE_ON_HEMITONIC {TONE_SCALE_ON_HEMITONIC} == True"
+        error_message = f"Error TONE_SCALE_ON_ANHEMITONIC {ctx.TONE_SCALE_ON_ANHEMITONIC} == True and TONE_SCALE_ON_HEMITONIC {ctx.TONE_SCALE_ON_HEMITONIC} == True"
         log_error_and_pause(error_message)
         sys.exit()
-    if (TONE_SCALE_SET != [] and TONE_SCALE_ON_ANHEMITONIC == True) or (
-        TONE_SCALE_SET != [] and TONE_SCALE_ON_HEMITONIC == True
+    if (section.TONE_SCALE_SET != [] and ctx.TONE_SCALE_ON_ANHEMITONIC == True) or (
+        section.TONE_SCALE_SET != [] and ctx.TONE_SCALE_ON_HEMITONIC == True
     ):
         print(
             "exit: Error TONE_SCALE_SET not empty list and TONE_SCALE_ON_ANHEMITONIC == True) or (TONE_SCALE_SET not empty list and TONE_SCALE_ON_HEMITONIC == True) "
         )
-        error_message = f"Error TONE_SCALE_SET {TONE_SCALE_SET} not empty list and TONE_SCALE_ON_ANHEMITONIC {TONE_SCALE_ON_ANHEMITONIC} == True) or (TONE_SCALE_SET {TONE_SCALE_SET} not empty list and TONE_SCALE_ON_HEMITONIC {TONE_SCALE_ON_HEMITONIC} == True) "
+        error_message = f"Error TONE_SCALE_SET {section.TONE_SCALE_SET} not empty list and TONE_SCALE_ON_ANHEMITONIC {ctx.TONE_SCALE_ON_ANHEMITONIC} == True) or (TONE_SCALE_SET {section.TONE_SCALE_SET} not empty list and TONE_SCALE_ON_HEMITONIC {ctx.TONE_SCALE_ON_HEMITONIC} == True) "
         log_error_and_pause(error_message)
         sys.exit()
 
     # if note is less than TONE_RANGE_BOTTOM or greater than TONE_RANGE_TOP then note is note valid.
-    min_note = note.Note()
-    max_note = note.Note()
-    min_note.nameWithOctave = TONE_RANGE_BOTTOM
-    max_note.nameWithOctave = TONE_RANGE_TOP
-    if note.Note(n.nameWithOctave) < note.Note(min_note.nameWithOctave):
+    if n.pitch.ps < section.tone_range_bottom_ps:
         result = False
-    if note.Note(n.nameWithOctave) > note.Note(max_note.nameWithOctave):
+        count_rejection(rejections, "range")
+    if n.pitch.ps > section.tone_range_top_ps:
         result = False
+        count_rejection(rejections, "range")
 
     # print('tone_scale = ', tone_scale)
-    if tone_mode == "major":
-        sc = scale.MajorScale(tone_scale)
-    else:
-        sc = scale.MinorScale(tone_scale)
+    sc = get_key_scale(tone_scale, tone_mode)
     scale_degree = sc.getScaleDegreeFromPitch(n)
 
-    if TONES_ON_KEY == True:  # if tone is in scale then tone is valid
+    if section.TONES_ON_KEY == True:  # if tone is in scale then tone is valid
         scale_degree = sc.getScaleDegreeFromPitch(n)
         if scale_degree == None:
             result = False
+            count_rejection(rejections, "scale")
 
-    if TONES_OFF_KEY == True:  # if tone is not in scale then tone is valid
+    if ctx.TONES_OFF_KEY == True:  # if tone is not in scale then tone is valid
         if scale_degree != None:
             result = False
+            count_rejection(rejections, "scale")
 
     if (
-        TONE_SCALE_ON_ANHEMITONIC == True
+        ctx.TONE_SCALE_ON_ANHEMITONIC == True
     ):  # if tone is in scale [1, 2, 4, 5, 6] then the tone is valid
         if scale_degree not in TONE_SCALE_ANHEMITONIC:
             result = False
-        print(
-            "TONE_SCALE_ANHEMITONIC, scale_degree, result =",
-            TONE_SCALE_ANHEMITONIC,
-            scale_degree,
-            result,
+            count_rejection(rejections, "scale")
+        note_logger.debug(
+            "TONE_SCALE_ANHEMITONIC, scale_degree, result = %s %s %s",
+            TONE_SCALE_ANHEMITONIC, scale_degree, result,
         )
 
     if (
-        TONE_SCALE_ON_HEMITONIC == True
+        ctx.TONE_SCALE_ON_HEMITONIC == True
     ):  # if tone is in scale = [1, 3, 4, 5, 7] then the tone is valid e.g., c–e–f–g–b–c pentatonic scale with semitones
         if scale_degree not in TONE_SCALE_HEMITONIC:
             result = False
-        print(
-            "TONE_SCALE_HEMITONIC, scale_degree, result =",
-            TONE_SCALE_HEMITONIC,
-            scale_degree,
-            result,
+            count_rejection(rejections, "scale")
+        note_logger.debug(
+            "TONE_SCALE_HEMITONIC, scale_degree, result = %s %s %s",
+            TONE_SCALE_HEMITONIC, scale_degree, result,
         )
 
     # if TONE_SCALE_ON_NEW == True:  # if tone is in scale [2, 3, 4, 6, 7] then the tone is valid
@@ -3365,23 +3828,20 @@ def valid_pitch(n_prev, n, tone_scale, tone_mode):
     #         result = False
     #     print('TONE_SCALE_ON_NEW, scale_degree, result =', TONE_SCALE_NEW, scale_degree, result)
 
-    if TONE_SCALE_SET:  # if tone is NOT in tone scale set then the tone is invalid
+    if section.TONE_SCALE_SET:  # if tone is NOT in tone scale set then the tone is invalid
         # TBD enharmonic comparison
         # if n.name not in TONE_SCALE_SET:
-        scale_tone_found = False
-        for scale_tone in TONE_SCALE_SET:
-            if pitch.Pitch(n.name).ps == pitch.Pitch(scale_tone).ps:
-                scale_tone_found = True
-        if not scale_tone_found:
+        if not section.in_tone_scale_set(n):
             result = False
+            count_rejection(rejections, "tone_scale_set")
 
     if (
-        TONE_PREV_INTERVAL and TONE_PREV_INTERVAL > 0
+        section.TONE_PREV_INTERVAL and section.TONE_PREV_INTERVAL > 0
     ):  # maximum number of semitones between notes
-        aInterval = interval.Interval(n_prev, n)
-        AIntSemi = abs(aInterval.semitones)
-        if AIntSemi > TONE_PREV_INTERVAL:
+        AIntSemi = abs(n.pitch.ps - n_prev.pitch.ps)
+        if AIntSemi > section.TONE_PREV_INTERVAL:
             result = False
+            count_rejection(rejections, "interval")
             # print('TONE_PREV_INTERVAL, n_prev, n, aInterval.semitones, AIntSemi, result = ', TONE_PREV_INTERVAL, n_prev, n,
             #       aInterval.semitones, AIntSemi, result)
 
@@ -3392,84 +3852,70 @@ def valid_pitch(n_prev, n, tone_scale, tone_mode):
     # -1
 
     # TONE_ASCENT
-    global TONE_ASCENT_TRIGGER
-    global TONE_ASCENT_TRIGGERED
-    global TONE_ASCENT_COUNT
-    global TONE_ASCENT_TRIGGER_COUNT
 
-    if TONE_ASCENT == True and TONE_ASCENT_TRIGGER != None:
+    if ctx.TONE_ASCENT == True and ctx.TONE_ASCENT_TRIGGER != None:
 
-        if TONE_ASCENT_TRIGGERED and (n_prev != None):
+        if ctx.TONE_ASCENT_TRIGGERED and (n_prev != None):
             aInterval = interval.Interval(noteStart=n_prev, noteEnd=n)
             AIntSemi = abs(aInterval.semitones)
 
             # valid
-            if (int(AIntSemi) >= int(TONE_ASCENT_MIN_INTERVAL)) and n > n_prev:
-                TONE_ASCENT_COUNT = TONE_ASCENT_COUNT + 1
-                print("TONE_ASCENT_COUNT =", TONE_ASCENT_COUNT)
-                print(
-                    "TONE_ASCENT valid",
-                    AIntSemi,
-                    ">= TONE_ASCENT_MIN_INTERVAL",
-                    TONE_ASCENT_MIN_INTERVAL,
-                    "and tone",
-                    n.nameWithOctave,
-                    "> n_prev",
-                    n_prev.nameWithOctave,
+            if (int(AIntSemi) >= int(ctx.TONE_ASCENT_MIN_INTERVAL)) and n > n_prev:
+                ctx.TONE_ASCENT_COUNT = ctx.TONE_ASCENT_COUNT + 1
+                note_logger.debug("TONE_ASCENT_COUNT = %s", ctx.TONE_ASCENT_COUNT)
+                note_logger.debug(
+                    "TONE_ASCENT valid %s >= TONE_ASCENT_MIN_INTERVAL %s and tone %s > n_prev %s",
+                    AIntSemi, ctx.TONE_ASCENT_MIN_INTERVAL, n.nameWithOctave, n_prev.nameWithOctave,
                 )
             else:  # invalid
                 # print('TONE_ASCENT invalid interval', AIntSemi ,'TONE_ASCENT_MIN_INTERVAL', TONE_ASCENT_MIN_INTERVAL, 'and tone', n.nameWithOctave, ' n_prev', n_prev.nameWithOctave)
                 result = False
-
-            if n_prev >= note.Note(TONE_RANGE_MID):
-                print(n_prev, ">= TONE_RANGE_MID : TONE_ASCENT CLEARED", TONE_RANGE_MID)
-                TONE_ASCENT_COUNT = 0
-                TONE_ASCENT_TRIGGERED = False
-
-        lowest_note = note.Note(TONE_ASCENT_TRIGGER)
-        if lowest_note >= n and TONE_ASCENT_COUNT == 0:
-            TONE_ASCENT_TRIGGER_COUNT = TONE_ASCENT_TRIGGER_COUNT + 1
-            print("TONE_ASCENT_TRIGGER_COUNT =", TONE_ASCENT_TRIGGER_COUNT)
-            if TONE_ASCENT_TRIGGER_COUNT % TONE_ASCENT_TRIGGER_EVERY_N_TIMES == 0:
-                TONE_ASCENT_COUNT = TONE_ASCENT_COUNT + 1
-                TONE_ASCENT_TRIGGERED = True
-                print("TONE_ASCENT_TRIGGERED, n_prev, n =", n_prev, n)
+                count_rejection(rejections, "ascent")
+
+            if n_prev >= note.Note(ctx.TONE_RANGE_MID):
+                note_logger.debug("%s >= TONE_RANGE_MID : TONE_ASCENT CLEARED %s", n_prev, ctx.TONE_RANGE_MID)
+                ctx.TONE_ASCENT_COUNT = 0
+                ctx.TONE_ASCENT_TRIGGERED = False
+
+        lowest_note = note.Note(ctx.TONE_ASCENT_TRIGGER)
+        if lowest_note >= n and ctx.TONE_ASCENT_COUNT == 0:
+            ctx.TONE_ASCENT_TRIGGER_COUNT = ctx.TONE_ASCENT_TRIGGER_COUNT + 1
+            note_logger.debug("TONE_ASCENT_TRIGGER_COUNT = %s", ctx.TONE_ASCENT_TRIGGER_COUNT)
+            if ctx.TONE_ASCENT_TRIGGER_COUNT % ctx.TONE_ASCENT_TRIGGER_EVERY_N_TIMES == 0:
+                ctx.TONE_ASCENT_COUNT = ctx.TONE_ASCENT_COUNT + 1
+                ctx.TONE_ASCENT_TRIGGERED = True
+                note_logger.debug("TONE_ASCENT_TRIGGERED, n_prev, n = %s %s", n_prev, n)
 
     # TONE_DESCENT
-    global TONE_DESCENT_TRIGGER
-    global TONE_DESCENT_TRIGGERED
-    global TONE_DESCENT_COUNT
-    global TONE_DESCENT_TRIGGER_COUNT
 
-    if TONE_DESCENT == True and TONE_DESCENT_TRIGGER != None:
+    if ctx.TONE_DESCENT == True and ctx.TONE_DESCENT_TRIGGER != None:
 
-        if TONE_DESCENT_TRIGGERED and (n_prev != None):
+        if ctx.TONE_DESCENT_TRIGGERED and (n_prev != None):
             aInterval = interval.Interval(noteStart=n_prev, noteEnd=n)
             AIntSemi = abs(aInterval.semitones)
 
             # valid
-            if (int(AIntSemi) <= int(TONE_DESCENT_MAX_INTERVAL)) and n < n_prev:
-                TONE_DESCENT_COUNT = TONE_DESCENT_COUNT + 1
+            if (int(AIntSemi) <= int(ctx.TONE_DESCENT_MAX_INTERVAL)) and n < n_prev:
+                ctx.TONE_DESCENT_COUNT = ctx.TONE_DESCENT_COUNT + 1
                 # print('TONE_DESCENT_COUNT =', TONE_DESCENT_COUNT)
                 # print('TONE_DESCENT valid', AIntSemi ,'<= TONE_DESCENT_MAX_INTERVAL', TONE_DESCENT_MAX_INTERVAL, 'and note', n.nameWithOctave, '< n_prev', n_prev.nameWithOctave)
             else:  # invalid
                 # print('TONE_DESCENT invalid interval', AIntSemi ,'TONE_DESCENT_MAX_INTERVAL', TONE_DESCENT_MAX_INTERVAL, 'and note', n.nameWithOctave, ' n_prev', n_prev.nameWithOctave)
                 result = False
-
-            if n_prev <= note.Note(TONE_RANGE_MID):
-                print(
-                    n_prev, "<= TONE_RANGE_MID : TONE_DESCENT CLEARED", TONE_RANGE_MID
-                )
-                TONE_DESCENT_COUNT = 0
-                TONE_DESCENT_TRIGGERED = False
-        highest_note = note.Note(TONE_DESCENT_TRIGGER)
-        if highest_note <= n and TONE_DESCENT_COUNT == 0:
-            TONE_DESCENT_TRIGGER_COUNT = TONE_DESCENT_TRIGGER_COUNT + 1
-            print("TONE_DESCENT_TRIGGER_COUNT =", TONE_DESCENT_TRIGGER_COUNT)
-            if TONE_DESCENT_TRIGGER_COUNT % TONE_DESCENT_TRIGGER_EVERY_N_TIMES == 0:
-                TONE_DESCENT_COUNT = TONE_DESCENT_COUNT + 1
-                TONE_DESCENT_TRIGGERED = True
-                print("TONE_DESCENT_TRIGGERED, n_prev, n =", n_prev, n)
+                count_rejection(rejections, "descent")
+
+            if n_prev <= note.Note(ctx.TONE_RANGE_MID):
+                note_logger.debug("%s <= TONE_RANGE_MID : TONE_DESCENT CLEARED %s", n_prev, ctx.TONE_RANGE_MID)
+                ctx.TONE_DESCENT_COUNT = 0
+                ctx.TONE_DESCENT_TRIGGERED = False
+        highest_note = note.Note(ctx.TONE_DESCENT_TRIGGER)
+        if highest_note <= n and ctx.TONE_DESCENT_COUNT == 0:
+            ctx.TONE_DESCENT_TRIGGER_COUNT = ctx.TONE_DESCENT_TRIGGER_COUNT + 1
+            note_logger.debug("TONE_DESCENT_TRIGGER_COUNT = %s", ctx.TONE_DESCENT_TRIGGER_COUNT)
+            if ctx.TONE_DESCENT_TRIGGER_COUNT % ctx.TONE_DESCENT_TRIGGER_EVERY_N_TIMES == 0:
+                ctx.TONE_DESCENT_COUNT = ctx.TONE_DESCENT_COUNT + 1
+                ctx.TONE_DESCENT_TRIGGERED = True
+                note_logger.debug("TONE_DESCENT_TRIGGERED, n_prev, n = %s %s", n_prev, n)
 
     return result
 
@@ -3481,8 +3927,9 @@ def calc_duration_to_end_of_bar(last_note, ts):
     and returns the duration to the end of the bar (e.g. 1.0)
     Note: beat_count = numerator / (denominator / 4)
     """
-    logger.debug(
-        f"calc_duration_to_end_of_bar: last_note.offset, last_note.duration.quarterLength, ts {last_note.offset} {last_note.duration.quarterLength} {ts}"
+    note_logger.debug(
+        "calc_duration_to_end_of_bar: last_note.offset, last_note.duration.quarterLength, ts %s %s %s",
+        last_note.offset, last_note.duration.quarterLength, ts,
     )
     beat_count = ts.numerator / (ts.denominator / 4)
     offset_last_note_end = last_note.offset + last_note.duration.quarterLength
@@ -3492,16 +3939,17 @@ def calc_duration_to_end_of_bar(last_note, ts):
     offset_end_bar = bar_last_note_end * beat_count
     # print('offset_end_bar          = bar_last_note_end * beat_count', offset_end_bar, bar_last_note_end, beat_count )
     duration_to_end_of_bar = offset_end_bar - offset_last_note_end
-    logger.debug(
-        f"duration_to_end_of_bar  = offset_end_bar - offset_last_note_end {duration_to_end_of_bar} {offset_end_bar} {offset_last_note_end}"
+    note_logger.debug(
+        "duration_to_end_of_bar  = offset_end_bar - offset_last_note_end %s %s %s",
+        duration_to_end_of_bar, offset_end_bar, offset_last_note_end,
     )
-    logger.debug(
+    note_logger.debug(
         "common.addFloatPrecision(duration_to_end_of_bar) {common.addFloatPrecision(duration_to_end_of_bar)}"
     )
     return duration_to_end_of_bar
 
 
-def amend_cadence(a_phrase, the_tonic, ts):
+def amend_cadence(ctx, a_phrase, the_tonic, ts):
     """
     function that takes a phrase of notes,
     amends the cadence,
@@ -3536,18 +3984,18 @@ def amend_cadence(a_phrase, the_tonic, ts):
         elif n == note_to_cadence:  # create new note with cadence pitch and append
             new_note = music21.note.Note(the_tonic)
             # Ensure the minimum duration of the last note of a cadence
-            if a_phrase.flatten()[n].duration.quarterLength >= CADENCE_DUR_MIN:
+            if a_phrase.flatten()[n].duration.quarterLength >= ctx.CADENCE_DUR_MIN:
                 new_note.duration.quarterLength = a_phrase.flatten()[
                     n
                 ].duration.quarterLength
             else:
-                new_note.duration.quarterLength = CADENCE_DUR_MIN
+                new_note.duration.quarterLength = ctx.CADENCE_DUR_MIN
                 print(
                     "changed cadence final note duration from x to CADENCE_DUR_MIN:",
                     a_phrase.flatten()[n].duration.quarterLength,
-                    CADENCE_DUR_MIN,
+                    ctx.CADENCE_DUR_MIN,
                 )
-            octave = get_tone_octave(a_phrase.flatten()[n - 1], new_note, 1)
+            octave = get_tone_octave(ctx, a_phrase.flatten()[n - 1], new_note, 1)
             new_note.octave = octave
             # if lyrics then copy too
             if a_phrase.flatten()[n].lyric != None:
@@ -4020,10 +4468,11 @@ def show_histograms(score, label):
     p.run()  # with defaults and proper configuration, will open graph
 
 
-def set_cadence_duration_transition(song):
+@profile_span("set_cadence_duration_transition")
+def set_cadence_duration_transition(generation_config, song):
     """
     function that takes a song and
-    returns the markov cadence duration transition
+    returns the markov cadence duration transition, with the DURATION_EQ of the GenerationConfig
     (not including the non-cadence durations - the notes leading up to the last notes of the phrases).
     """
     # print(' ')
@@ -4093,7 +4542,7 @@ def set_cadence_duration_transition(song):
     print("cadence duration transitions with frequency", cdtransition)
 
     cdtransition, cdtotal = apply_duration_eq_to_dtransition_frequency(
-        cdtransition, cdtotal, True
+        generation_config, cdtransition, cdtotal, True
     )
 
     print("After apply_duration_eq_to_dtransition_frequency for cadence True")
@@ -4132,6 +4581,7 @@ def set_cadence_duration_transition(song):
     return cdtransition
 
 
+@profile_span("append_rest_note_transition")
 def append_rest_note_transition(rest_note_transition, a_song):
     """
     Given a rest_note_transition and a_song stream
@@ -4361,91 +4811,16 @@ def validate_later_lines_per_section(lyrics, section_name_matches, lines_per_sec
     return
 
 
-def get_section_values(sect):
+def get_section_values(ctx, sect):
     """
     for the given section
-    load the key values relevant to the new section
-    into the section global variables
-    """
-    global BEAT_PLACEMENT_DENOMINATOR_MAXIMUM_ALLOWED
-    global BEAT_PLACEMENTS_DENIED_SET
-    global BEAT_PLACEMENTS_DENOMINATOR_DENIED_SET
-    global DURATION_SET
-    global DUR_LEAST
-    global DUR_LONGEST
-    global DUR_PREV_DIFF
-    global DUR_RATIONAL
-    global DUR_TUPLET
-    global REST_NOTE_LINE_OFFSET
-    global TONES_ON_KEY
-    global TONE_PREV_INTERVAL
-    global TONE_RANGE_BOTTOM
-    global TONE_RANGE_TOP
-    global TONE_SCALE_SET
-
-    DURATION_SET = PER_SECTION_DURATION_SET[sect.value]
-    DUR_LEAST = PER_SECTION_DUR_LEAST[sect.value]
-    DUR_LONGEST = PER_SECTION_DUR_LONGEST[sect.value]
-    DUR_PREV_DIFF = PER_SECTION_DUR_PREV_DIFF[sect.value]
-    DUR_RATIONAL = PER_SECTION_DUR_RATIONAL[sect.value]
-    DUR_TUPLET = PER_SECTION_DUR_TUPLET[sect.value]
-    REST_NOTE_LINE_OFFSET = PER_SECTION_REST_NOTE_LINE_OFFSET[sect.value]
-    TONES_ON_KEY = PER_SECTION_TONES_ON_KEY[sect.value]
-    TONE_PREV_INTERVAL = PER_SECTION_TONE_PREV_INTERVAL[sect.value]
-    TONE_RANGE_BOTTOM = PER_SECTION_TONE_RANGE_BOTTOM[sect.value]
-    TONE_RANGE_TOP = PER_SECTION_TONE_RANGE_TOP[sect.value]
-    TONE_SCALE_SET = PER_SECTION_TONE_SCALE_SET[sect.value]
-
-    return
-
-
-# reverse function from https://github.com/cuthbertLab/music21-tools/blob/bb2d78b6ad18d68ac77418b41fd995f74de6afb4/trecento/quodJactatur.py#L267
-def reverse(
-    self,
-    *,
-    inPlace=False,
-    classesToMove=(
-        key.KeySignature,
-        meter.TimeSignature,
-        clef.Clef,
-        metadata.Metadata,
-        instrument.Instrument,
-        layout.SystemLayout,
-    ),
-    makeNotation=False,
-):
-    """
-    reverse the order of stream members
+    select the SectionConstraints of the new section, compiled when the configuration was loaded,
+    as the section values of the GenerationContext ctx
     """
-    highestTime = self.highestTime
+    ctx.section = ctx.section_constraints[sect.value]
+    ctx.section_name = sect.name
 
-    if inPlace is True:
-        returnObj = self
-        raise Exception("Whoops haven't written inPlace=True yet for reverse")
-    else:
-        returnObj = stream.Part()
-
-    sf = self.flatten()
-    for myEl in sf:
-        if isinstance(myEl, classesToMove):
-            continue
-
-        if myEl.duration is not None:
-            releaseTime = myEl.getOffsetBySite(sf) + myEl.duration.quarterLength
-        else:
-            releaseTime = myEl.getOffsetBySite(sf)
-        newOffset = highestTime - releaseTime
-
-        returnObj.insert(newOffset, myEl)
-
-    for thisP in returnObj.flatten().pitches:
-        if thisP.accidental is not None:
-            thisP.accidental.displayStatus = None
-
-    if makeNotation is True:
-        return returnObj.makeNotation()
-    else:
-        return returnObj
+    return
 
 
 def has_tuplet(the_stream):
@@ -4506,34 +4881,230 @@ def filter_output_stream_for_MuseScore(
     return returnObj
 
 
-def process_lyrics(
-    INPUT_LYRICS_FULLY_QUALIFIED,
-    _section_name_matches,
-    p0,
-    ts,
-    song_key,
-    transition,
-    bpm_transition,
-    dtransition,
-    cad_transition,
-    cad_dtransition,
-    rest_note_transition,
-    gmpwl_call_count,
-    score,
-    mxl_files,
-    style,
-):
+def plan_song_lines(lyrics, call_attributes_list, section_name_matches, lines_per_section, gmpwl_call_count=0):
+    """
+    Plans the lines of a song as a dependency graph, before any melody is made.
 
-    global TIME_SIG_WANTED
-    logger.debug(f"")
-    logger.debug(
-        f"process_lyrics Duration set: {DURATION_SET} (type: {type(DURATION_SET)})"
-    )
+    The first occurrence of each section (Intro, Verse ...) has its melody generated line by line,
+    unless a line copies, transposes, inverts or reverses an earlier first section line.
+    The lines of later occurrences of a section repeat the melody of the same line of its first occurrence.
+    So only the generated lines are independent, each line derived from another depends on that line alone.
+
+    Args:
+        lyrics (list): The lyric lines, see get_lyrics.
+        call_attributes_list (list): The post processing function of each lyric line, or None, see get_lyrics.
+        section_name_matches (list): The section names e.g. _section_name_matches
+        lines_per_section (list): The number of lines of each section, see get_lines_per_section.
+        gmpwl_call_count (int): The number of phrases generated before this song.
+
+    Returns:
+        list: a dict per lyric line with
+              line (the lyric line number), lyric, kind ("heading", "first", "later" or None for a blank line),
+              first (a heading of the first occurrence of its section), sect, section_name_text, section_line_num,
+              depends_on (the (sect, section_line_num) of the line it is derived from, or None),
+              generate (True if the melody is generated), gmpwl_call_count (of a generated line),
+              last_section_line (the line is the last of its section, see is_last_line).
+    """
+    line_plan = []
+    first_section_lines = set()
+    sections_found = set()
+    later_section = False
+    sect = None
+    section_name_text = ""
+    section_line_num = 0
+
+    for p in range(0, len(lyrics)):
+        line = {
+            "line": p,
+            "lyric": lyrics[p],
+            "kind": None,
+            "first": False,
+            "sect": sect,
+            "section_name_text": section_name_text,
+            "section_line_num": section_line_num,
+            "depends_on": None,
+            "generate": False,
+            "gmpwl_call_count": None,
+            "last_section_line": False,
+        }
+        if any(x in lyrics[p].casefold() for x in section_name_matches):
+            section_name_text = lyrics[p]
+            section_line_num = 0
+            for a_section in Section:
+                if lyrics[p].casefold().startswith(a_section.name.casefold()):
+                    sect = a_section
+                    later_section = sect in sections_found
+                    sections_found.add(sect)
+                    break
+            line.update(
+                kind="heading", first=not later_section, sect=sect, section_name_text=section_name_text, section_line_num=0
+            )
+        elif lyrics[p] != "" and sect is not None:
+            section_line_num = section_line_num + 1
+            line.update(section_line_num=section_line_num)
+            if not later_section:
+                line["kind"] = "first"
+                line["last_section_line"] = is_last_line(section_line_num, sect, lines_per_section)
+                if call_attributes_list[p] != None:
+                    for k, v in call_attributes_list[p].items():
+                        if k == "copy" or k == "transpose" or k == "invert" or k == "reverse":
+                            depends_on = (Section[v[0].upper()] if v[0].upper() in Section.__members__ else None, int(v[1]))
+                            if depends_on not in first_section_lines:
+                                print("exit: invalid post processing function:", call_attributes_list[p])
+                                error_message = (
+                                    f"Error {v[0]} line {v[1]} is not an earlier first section line"
+                                    f"\nexit: invalid post processing function: {call_attributes_list[p]}"
+                                )
+                                log_error_and_pause(error_message)
+                                sys.exit()
+                            line["depends_on"] = depends_on
+                else:
+                    gmpwl_call_count = gmpwl_call_count + 1
+                    line.update(generate=True, gmpwl_call_count=gmpwl_call_count)
+                first_section_lines.add((sect, section_line_num))
+            else:
+                line.update(kind="later", depends_on=(sect, section_line_num))
+        line_plan.append(line)
+
+    generated = sum(1 for line in line_plan if line["generate"])
+    derived = sum(1 for line in line_plan if line["depends_on"] is not None)
+    logger.info(f"plan_song_lines: {generated} lines to generate, {derived} lines derived from them")
+    return line_plan
+
+
+def generate_song_line(ctx, line, ts, song_key, transitions):
+    """
+    given the GenerationContext ctx and a generated line of plan_song_lines
+    return the phrase of the line, made with generate_markov_phrase_with_lyrics and amend_cadence
+    """
+    get_section_values(ctx, line["sect"])
+    with profile_span(f"generate_markov_phrase_with_lyrics {line['sect'].name.lower()}"):
+        a_phrase = generate_markov_phrase_with_lyrics(
+            ctx,
+            line["sect"],
+            ts,
+            song_key.tonic.name,
+            song_key.mode,
+            *transitions,
+            line["lyric"],
+            line["gmpwl_call_count"],
+        )
+
+    # if an alternating line cadence is desired and the line is an even number then amend cadence
+    if ctx.CADENCE_ALTERNATE_PHRASE_END == True and ((line["section_line_num"] % 2) == 0):
+        a_phrase = amend_cadence(ctx, a_phrase, song_key.tonic.name, ts)
+
+    # if an end section cadence is desired and this is the last section line then amend cadence
+    if ctx.CADENCE_SECTION_END == True and line["last_section_line"] == True:
+        a_phrase = amend_cadence(ctx, a_phrase, song_key.tonic.name, ts)
+    return a_phrase
+
+
+def generate_seeded_song_line(line):
+    """
+    generate_song_line with its own GenerationContext and random draws seeded from the song seed and the line number,
+    so the phrase of a line does not depend on the other lines or the worker that makes it.
+    returns the phrase, the NOTE_REJECTIONS counts and the NOTE_TELEMETRY of the line
+    """
+    ctx, ts, song_key, transitions, song_seed = _song_lines_context
+    line_seed = random.Random(song_seed * 100003 + line["line"]).getrandbits(32)
+    random.seed(line_seed)
+    numpy.random.seed(line_seed)
+    line_ctx = GenerationContext(ctx.config)
+    a_phrase = generate_song_line(line_ctx, line, ts, song_key, transitions)
+    return a_phrase, line_ctx.NOTE_REJECTIONS, line_ctx.NOTE_TELEMETRY
+
+
+def _generate_seeded_song_line_in_worker(line):
+    """
+    generate_seeded_song_line in a forked section worker.
+    returns the Phrase of the line, the NOTE_REJECTIONS counts and the NOTE_TELEMETRY of the line
+    """
+    a_phrase, note_rejections, note_telemetry = generate_seeded_song_line(line)
+    return Phrase.from_stream(a_phrase), note_rejections, note_telemetry
+
+
+def generate_song_lines(ctx, line_plan, ts, song_key, transitions):
+    """
+    Generates the phrase of each generated line of plan_song_lines.
+
+    The lines are independent: each is generated with its own GenerationContext, so its own
+    TONE_ASCENT / TONE_DESCENT state, and random draws seeded from a song seed and its line number
+    (see generate_seeded_song_line). With SECTION_WORKERS 0 or 1 they are generated in turn,
+    with SECTION_WORKERS N in N forked worker processes where processes can be forked, else in turn.
+    The random state of the song is restored after the lines made in turn, as it is untouched by forked workers,
+    so the same song seed makes the same song whatever the number of workers.
+
+    Args:
+        ctx (GenerationContext): The settings and state of the song, the NOTE_REJECTIONS and NOTE_TELEMETRY of the lines
+            are added to it.
+        line_plan (list): The lines of the song, see plan_song_lines.
+        ts (music21.meter.TimeSignature): The time signature of the song.
+        song_key (music21.key.Key): The key of the song.
+        transitions (tuple): transition, bpm_transition, dtransition, cad_transition, cad_dtransition, rest_note_transition
+
+    Returns:
+        dict: lyric line number -> Phrase
+    """
+    global _song_lines_context
+
+    generated_lines = [line for line in line_plan if line["generate"]]
+    _song_lines_context = (ctx, ts, song_key, transitions, random.getrandbits(32))
+    random_state, numpy_random_state = random.getstate(), numpy.random.get_state()
+    workers = min(ctx.SECTION_WORKERS, len(generated_lines))
+    try:
+        if workers <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+            results = [
+                (Phrase.from_stream(a_phrase), note_rejections, note_telemetry)
+                for a_phrase, note_rejections, note_telemetry in map(generate_seeded_song_line, generated_lines)
+            ]
+        else:
+            logger.info(f"generate_song_lines {len(generated_lines)} lines with {workers} worker processes")
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("fork")
+            ) as executor:
+                results = list(executor.map(_generate_seeded_song_line_in_worker, generated_lines))
+    finally:
+        _song_lines_context = None
+        random.setstate(random_state)
+        numpy.random.set_state(numpy_random_state)
+
+    generated_phrases = {}
+    for line, (a_phrase, note_rejections, note_telemetry) in zip(generated_lines, results):
+        generated_phrases[line["line"]] = a_phrase
+        for name, count in note_rejections.items():
+            ctx.NOTE_REJECTIONS[name] += count
+        merge_note_telemetry(ctx.NOTE_TELEMETRY, note_telemetry)
+    return generated_phrases
+
+
+def process_lyrics(
+    ctx,
+    INPUT_LYRICS_FULLY_QUALIFIED,
+    _section_name_matches,
+    p0,
+    ts,
+    song_key,
+    transition,
+    bpm_transition,
+    dtransition,
+    cad_transition,
+    cad_dtransition,
+    rest_note_transition,
+    score,
+    mxl_files,
+    style,
+):
+
+    logger.debug(f"")
     logger.debug(
-        f"process_lyrics Duration set (PER_SECTION): {PER_SECTION_DURATION_SET}"
+        f"process_lyrics Duration set: {ctx.section.DURATION_SET} (type: {type(ctx.section.DURATION_SET)})"
+    )
+    logger.debug(
+        f"process_lyrics Duration set (PER_SECTION): {ctx.PER_SECTION_DURATION_SET}"
     )
 
-    print("process_lyrics USE_STYLES", USE_STYLES, "Current style", style)
+    print("process_lyrics USE_STYLES", ctx.USE_STYLES, "Current style", style)
     # input("Press Enter to continue...")
 
     print("INPUT_LYRICS_FULLY_QUALIFIED", INPUT_LYRICS_FULLY_QUALIFIED)
@@ -4546,106 +5117,41 @@ def process_lyrics(
     )
     validate_later_lines_per_section(lyrics, _section_name_matches, lines_per_section)
 
-    first_intro = False
-    later_intro = False
-    first_verse = False
-    later_verse = False
-    first_prechorus = False
-    later_prechorus = False
-    first_chorus = False
-    later_chorus = False
-    first_solo = False
-    later_solo = False
-    first_bridge = False
-    later_bridge = False
-    first_outro = False
-    later_outro = False
+    line_plan = plan_song_lines(lyrics, call_attributes_list, _section_name_matches, lines_per_section)
+    generated_phrases = generate_song_lines(
+        ctx,
+        line_plan,
+        ts,
+        song_key,
+        (transition, bpm_transition, dtransition, cad_transition, cad_dtransition, rest_note_transition),
+    )
 
-    section_line_num = 0
-    sect = None  # Initialize sect to avoid UnboundLocalError
+    # the Phrase of each first section line, (sect, section_line_num) -> Phrase, for later section repeats
+    section_line_phrases = {}
+    # the rehearsal marks and the Phrases of the lines in song order, see Phrase.to_stream
+    song_elements = []
 
-    for p in range(0, len(lyrics)):
+    for line in line_plan:
+        p = line["line"]
+        sect = line["sect"]
+        section_line_num = line["section_line_num"]
+        section_name_text = line["section_name_text"]
         print("                                           ", lyrics[p])
-        if any(x in lyrics[p].casefold() for x in _section_name_matches):
-            section_name_text = lyrics[p]
-            section_line_num = 0
-
+        if line["kind"] == "heading":
             # te = expressions.TextExpression(lyrics[p].upper())
             # te.placement = "above"
-            # p0.append(te)
+            # song_elements.append(te)
 
             rm = expressions.RehearsalMark(lyrics[p].upper())
             rm.placement = "above"
-            p0.append(rm)
+            song_elements.append(rm)
 
-            if lyrics[p].casefold().startswith(("intro")):
-                sect = Section.INTRO
-                if first_intro == False:
-                    print(" found first Intro")
-                    first_intro = True
-                else:
-                    print(" found later Intro")
-                    later_intro = True
-            elif lyrics[p].casefold().startswith(("verse")):
-                sect = Section.VERSE
-                if first_verse == False:
-                    print(" found first Verse")
-                    first_verse = True
-                else:
-                    print(" found later Verse")
-                    later_verse = True
-            elif lyrics[p].casefold().startswith("prechorus"):
-                sect = Section.PRECHORUS
-                if first_prechorus == False:
-                    print(" found first Prechorus")
-                    first_prechorus = True
-                else:
-                    print(" found later Prechorus")
-                    later_prechorus = True
-            elif lyrics[p].casefold().startswith(("chorus")):
-                sect = Section.CHORUS
-                if first_chorus == False:
-                    print(" found first Chorus")
-                    first_chorus = True
-                else:
-                    print(" found later Chorus")
-                    later_chorus = True
-            elif lyrics[p].casefold().startswith(("solo")):
-                sect = Section.SOLO
-                if first_solo == False:
-                    print(" found first Solo")
-                    first_solo = True
-                else:
-                    print(" found later Solo")
-                    later_solo = True
-            elif lyrics[p].casefold().startswith(("bridge")):
-                sect = Section.BRIDGE
-                if first_bridge == False:
-                    print(" found first Bridge")
-                    first_bridge = True
-                else:
-                    print(" found later Bridge")
-                    later_bridge = True
-            elif lyrics[p].casefold().startswith(("outro")):
-                sect = Section.OUTRO
-                if first_outro == False:
-                    print(" found first Outro")
-                    first_outro = True
-                else:
-                    print(" found later Outro")
-                    later_outro = True
-            get_section_values(sect)
-        elif lyrics[p] != "" and (
-            (sect == Section.INTRO and not later_intro)
-            or (sect == Section.VERSE and not later_verse)
-            or (sect == Section.PRECHORUS and not later_prechorus)
-            or (sect == Section.CHORUS and not later_chorus)
-            or (sect == Section.SOLO and not later_solo)
-            or (sect == Section.BRIDGE and not later_bridge)
-            or (sect == Section.OUTRO and not later_outro)
-        ):
+            if line["first"]:
+                print(" found first", sect.name.capitalize())
+            else:
+                print(" found later", sect.name.capitalize())
+        elif line["kind"] == "first":
             print("found first section line")
-            section_line_num = section_line_num + 1
             print("section_line_num", section_line_num)
             print("input lyrics line num (p)", p)
             print("lyrics[p]", lyrics[p])
@@ -4665,34 +5171,7 @@ def process_lyrics(
                             int(v[1]),
                         )
                         try:
-                            if v[0].casefold() == "intro":
-                                new_section_stream = copy.deepcopy(
-                                    intro_line_stream_list[int(v[1]) - 1]
-                                )
-                            if v[0].casefold() == "verse":
-                                new_section_stream = copy.deepcopy(
-                                    verse_line_stream_list[int(v[1]) - 1]
-                                )
-                            if v[0].casefold() == "prechorus":
-                                new_section_stream = copy.deepcopy(
-                                    prechorus_line_stream_list[int(v[1]) - 1]
-                                )
-                            if v[0].casefold() == "chorus":
-                                new_section_stream = copy.deepcopy(
-                                    chorus_line_stream_list[int(v[1]) - 1]
-                                )
-                            if v[0].casefold() == "solo":
-                                new_section_stream = copy.deepcopy(
-                                    solo_line_stream_list[int(v[1]) - 1]
-                                )
-                            if v[0].casefold() == "outro":
-                                new_section_stream = copy.deepcopy(
-                                    outro_line_stream_list[int(v[1]) - 1]
-                                )
-                            if v[0].casefold() == "bridge":
-                                new_section_stream = copy.deepcopy(
-                                    bridge_line_stream_list[int(v[1]) - 1]
-                                )
+                            source_phrase = section_line_phrases[(Section[v[0].upper()], int(v[1]))]
                         except BaseException as err:
                             print(f"Unexpected {err=}, {type(err)=}")
                             print(
@@ -4702,175 +5181,30 @@ def process_lyrics(
                             error_message = f"Unexpected {err=}, {type(err)=}\nexit: invalid post processing function: {call_attributes_list[p]}"
                             log_error_and_pause(error_message)
                             sys.exit()
-                        a_phrase = add_new_lyrics_to_old_phrase(
-                            sect,
-                            section_name_text,
-                            section_line_num,
-                            lyrics[p],
-                            new_section_stream,
-                        )
-                    if k == "transpose":
-                        print("a_phrase = transpose_phrase_with_lyrics")
-                        transpose_phrase = add_new_lyrics_to_old_phrase(
-                            sect,
-                            section_name_text,
-                            section_line_num,
+                        if k != "copy":
+                            print(f"a_phrase = {k}_phrase_with_lyrics")
+                        # a view of the source line: new lyrics, transposed, inverted or reversed as it is made
+                        # (the lyrics of a reversed line are not reversed)
+                        a_phrase = source_phrase.derive(
                             lyrics[p],
-                            new_section_stream,
-                        )
-                        a_phrase = transpose_phrase.transpose(
-                            interval.GenericInterval(int(v[2]))
-                        )
-                        # a_phrase = add_new_lyrics_to_old_phrase(sect, section_name_text, section_line_num,
-                        #                                     lyrics[p], new_section_stream)
-                    if k == "invert":
-                        print("a_phrase = invert_phrase_with_lyrics")
-                        invert_phrase = add_new_lyrics_to_old_phrase(
                             sect,
                             section_name_text,
                             section_line_num,
-                            lyrics[p],
-                            new_section_stream,
-                        )
-                        a_phrase = invert_phrase.invertDiatonic(
-                            note.Note(str(v[2])), inPlace=False
-                        )
-
-                    if k == "reverse":
-                        print("a_phrase = reverse_phrase_with_lyrics")
-                        # # notes and rests reversed as desired, but also lyrics which should not be reversed
-                        # reverse_phrase = add_new_lyrics_to_old_phrase(sect, section_name_text, section_line_num,
-                        #                                                 lyrics[p], new_section_stream)
-                        # a_phrase = reverse(reverse_phrase, makeNotation = False)
-                        new_section_stream_without_lyrics = remove_lyrics_from_phrase(
-                            new_section_stream
-                        )
-                        reverse_phrase = reverse(
-                            new_section_stream_without_lyrics, makeNotation=False
-                        )
-                        a_phrase = add_new_lyrics_to_old_phrase(
-                            sect,
-                            section_name_text,
-                            section_line_num,
-                            lyrics[p],
-                            reverse_phrase,
+                            transpose=int(v[2]) if k == "transpose" else None,
+                            invert=str(v[2]) if k == "invert" else None,
+                            reverse=k == "reverse",
                         )
                 # input('Press Enter to continue...')
             else:
-                # generate phrase with lyrics
-                gmpwl_call_count = gmpwl_call_count + 1
-                a_phrase = generate_markov_phrase_with_lyrics(
-                    sect,
-                    ts,
-                    song_key.tonic.name,
-                    song_key.mode,
-                    transition,
-                    bpm_transition,
-                    dtransition,
-                    cad_transition,
-                    cad_dtransition,
-                    rest_note_transition,
-                    lyrics[p],
-                    gmpwl_call_count,
-                )
+                # the phrase generated with lyrics by generate_song_lines
+                a_phrase = generated_phrases[p]
 
-                # if an alternating line cadence is desired and the line is an even number then amend cadence
-                if CADENCE_ALTERNATE_PHRASE_END == True and (
-                    (section_line_num % 2) == 0
-                ):
-                    a_phrase = amend_cadence(a_phrase, song_key.tonic.name, ts)
-
-                last_section_line_num = is_last_line(
-                    section_line_num, sect, lines_per_section
-                )
-                # if an end section cadence is desired and this is the last section line then amend cadence
-                if CADENCE_SECTION_END == True and last_section_line_num == True:
-                    a_phrase = amend_cadence(a_phrase, song_key.tonic.name, ts)
-
-            p0.append(a_phrase)
+            song_elements.append(a_phrase)
 
             # save the melody for later section repeats
-            line_stream = stream.Stream()
-
-            if sect == Section.INTRO:
-                if section_line_num == 1:  # declare list
-                    intro_line_stream_list = [line_stream]
-                    # print("intro_line_stream_list 1", intro_line_stream_list)
-                else:  # append list
-                    intro_line_stream_list.append(line_stream)
-                    print("intro_line_stream_list", intro_line_stream_list)
-                intro_line_stream_list[section_line_num - 1].append(a_phrase)
-                # intro_line_stream_list[section_line_num - 1].show('text')
-                show_text_in_stream(intro_line_stream_list[section_line_num - 1], ts)
-
-            if sect == Section.VERSE:
-                if section_line_num == 1:  # declare list
-                    verse_line_stream_list = [line_stream]
-                    # print("verse_line_stream_list 1", verse_line_stream_list)
-                else:  # append list
-                    verse_line_stream_list.append(line_stream)
-                    # print("verse_line_stream_list", verse_line_stream_list)
-                verse_line_stream_list[section_line_num - 1].append(a_phrase)
-                # verse_line_stream_list[section_line_num - 1].show('text')
-                show_text_in_stream(verse_line_stream_list[section_line_num - 1], ts)
-
-            if sect == Section.PRECHORUS:
-                if section_line_num == 1:  # declare list
-                    prechorus_line_stream_list = [line_stream]
-                    # print("prechorus_line_stream_list 1", prechorus_line_stream_list)
-                else:  # append list
-                    prechorus_line_stream_list.append(line_stream)
-                    print("prechorus_line_stream_list", prechorus_line_stream_list)
-                prechorus_line_stream_list[section_line_num - 1].append(a_phrase)
-                # prechorus_line_stream_list[section_line_num - 1].show('text')
-                show_text_in_stream(
-                    prechorus_line_stream_list[section_line_num - 1], ts
-                )
-
-            if sect == Section.CHORUS:
-                if section_line_num == 1:  # declare list
-                    chorus_line_stream_list = [line_stream]
-                    # print("chorus_line_stream_list 1", chorus_line_stream_list)
-                else:  # append list
-                    chorus_line_stream_list.append(line_stream)
-                    # print("chorus_line_stream_list", chorus_line_stream_list)
-
-                chorus_line_stream_list[section_line_num - 1].append(a_phrase)
-                # chorus_line_stream_list[section_line_num - 1].show('text')
-                show_text_in_stream(chorus_line_stream_list[section_line_num - 1], ts)
-
-            if sect == Section.SOLO:
-                if section_line_num == 1:  # declare list
-                    solo_line_stream_list = [line_stream]
-                    # print("solo_line_stream_list 1", solo_line_stream_list)
-                else:  # append list
-                    solo_line_stream_list.append(line_stream)
-                    print("solo_line_stream_list", solo_line_stream_list)
-                solo_line_stream_list[section_line_num - 1].append(a_phrase)
-                # solo_line_stream_list[section_line_num - 1].show('text')
-                show_text_in_stream(solo_line_stream_list[section_line_num - 1], ts)
-
-            if sect == Section.BRIDGE:
-                if section_line_num == 1:  # declare list
-                    bridge_line_stream_list = [line_stream]
-                    # print("bridge_line_stream_list 1", bridge_line_stream_list)
-                else:  # append list
-                    bridge_line_stream_list.append(line_stream)
-                    # print("bridge_line_stream_list", bridge_line_stream_list)
-                bridge_line_stream_list[section_line_num - 1].append(a_phrase)
-                # bridge_line_stream_list[section_line_num - 1].show('text')
-                show_text_in_stream(bridge_line_stream_list[section_line_num - 1], ts)
-
-            if sect == Section.OUTRO:
-                if section_line_num == 1:  # declare list
-                    outro_line_stream_list = [line_stream]
-                    # print("outro_line_stream_list 1", outro_line_stream_list)
-                else:  # append list
-                    outro_line_stream_list.append(line_stream)
-                    print("outro_line_stream_list", outro_line_stream_list)
-                outro_line_stream_list[section_line_num - 1].append(a_phrase)
-                # outro_line_stream_list[section_line_num - 1].show('text')
-                show_text_in_stream(outro_line_stream_list[section_line_num - 1], ts)
+            section_line_phrases[(sect, section_line_num)] = a_phrase
+            if logger.isEnabledFor(logging.DEBUG):
+                show_text_in_stream(a_phrase.to_stream(), ts)
 
             # change keys between generate # 20210821: only needed if key not in transition? Comment out next 8 lines.
             # draw = choice(list(transition[key].keys()), 1, list(transition[key].values()))
@@ -4880,110 +5214,15 @@ def process_lyrics(
             # rest_phrase_draw = choice(list(rest_phrase_transition[rest_note_key].keys()), 1, list(rest_phrase_transition[rest_note_key].values()))
             # rest_note_key = (rest_note_key[1], rest_phrase_draw[0])
 
-        elif lyrics[p] != "" and (
-            (sect == Section.INTRO and later_intro)
-            or (sect == Section.VERSE and later_verse)
-            or (sect == Section.PRECHORUS and later_prechorus)
-            or (sect == Section.CHORUS and later_chorus)
-            or (sect == Section.SOLO and later_solo)
-            or (sect == Section.BRIDGE and later_bridge)
-            or (sect == Section.OUTRO and later_outro)
-        ):
+        elif line["kind"] == "later":
             print("found later section line")
-            section_line_num = section_line_num + 1
             print("section_line_num", section_line_num)
 
-            # add new lyrics to old phrase. Need deepcopy of stream to avoid corrupting the initial copy
-            if sect == Section.INTRO:
-                later_section_stream = copy.deepcopy(
-                    intro_line_stream_list[section_line_num - 1]
-                )
-                later_phrase = add_new_lyrics_to_old_phrase(
-                    sect,
-                    section_name_text,
-                    section_line_num,
-                    lyrics[p],
-                    later_section_stream,
-                )
-                p0.append(later_phrase)
-
-            if sect == Section.VERSE:
-                later_section_stream = copy.deepcopy(
-                    verse_line_stream_list[section_line_num - 1]
-                )
-                later_phrase = add_new_lyrics_to_old_phrase(
-                    sect,
-                    section_name_text,
-                    section_line_num,
-                    lyrics[p],
-                    later_section_stream,
-                )
-                p0.append(later_phrase)
-
-            if sect == Section.PRECHORUS:
-                later_section_stream = copy.deepcopy(
-                    prechorus_line_stream_list[section_line_num - 1]
-                )
-                later_phrase = add_new_lyrics_to_old_phrase(
-                    sect,
-                    section_name_text,
-                    section_line_num,
-                    lyrics[p],
-                    later_section_stream,
-                )
-                p0.append(later_phrase)
-
-            if sect == Section.CHORUS:
-                later_section_stream = copy.deepcopy(
-                    chorus_line_stream_list[section_line_num - 1]
-                )
-                later_phrase = add_new_lyrics_to_old_phrase(
-                    sect,
-                    section_name_text,
-                    section_line_num,
-                    lyrics[p],
-                    later_section_stream,
-                )
-                p0.append(later_phrase)
-
-            if sect == Section.SOLO:
-                later_section_stream = copy.deepcopy(
-                    solo_line_stream_list[section_line_num - 1]
-                )
-                later_phrase = add_new_lyrics_to_old_phrase(
-                    sect,
-                    section_name_text,
-                    section_line_num,
-                    lyrics[p],
-                    later_section_stream,
-                )
-                p0.append(later_phrase)
-
-            if sect == Section.BRIDGE:
-                later_section_stream = copy.deepcopy(
-                    bridge_line_stream_list[section_line_num - 1]
-                )
-                later_phrase = add_new_lyrics_to_old_phrase(
-                    sect,
-                    section_name_text,
-                    section_line_num,
-                    lyrics[p],
-                    later_section_stream,
-                )
-                p0.append(later_phrase)
-
-            if sect == Section.OUTRO:
-                later_section_stream = copy.deepcopy(
-                    outro_line_stream_list[section_line_num - 1]
-                )
-                later_phrase = add_new_lyrics_to_old_phrase(
-                    sect,
-                    section_name_text,
-                    section_line_num,
-                    lyrics[p],
-                    later_section_stream,
-                )
-                p0.append(later_phrase)
+            # add new lyrics to old phrase, a view of the first section line rather than a copy of its notes
+            later_phrase = section_line_phrases[(sect, section_line_num)].derive(
+                lyrics[p], sect, section_name_text, section_line_num
+            )
+            song_elements.append(later_phrase)
 
         elif lyrics[p] == "":
             # print('found blank line')
@@ -4998,14 +5237,21 @@ def process_lyrics(
         #   else
         #       fit lyrics to verse/chorus/Prechorus/Bridge phrase
 
+    # assemble the song, the Phrases become music21 notes and rests
+    for element in song_elements:
+        if isinstance(element, Phrase):
+            p0.append(element.to_stream())
+        else:
+            p0.append(element)
+
     # insert tempo
 
     # if TEMPO_BPM == 0.0:
     #   elsewhere tempo is taken from INPUT_MUSIC. If INPUT_MUSIC has no tempo, default to 120.0
     # if TEMPO_BPM != 0.0:
     #   use TEMPO_BPM
-    if TEMPO_BPM != 0.0:
-        songTempo = tempo.MetronomeMark(number=TEMPO_BPM)
+    if ctx.TEMPO_BPM != 0.0:
+        songTempo = tempo.MetronomeMark(number=ctx.TEMPO_BPM)
     else:
         songTempo = tempo.MetronomeMark(number=120)  # Default tempo
 
@@ -5023,7 +5269,7 @@ def process_lyrics(
     # p0.insert(0, instrument.Clarinet())
 
     # the_instrument_name = 'Electric Piano'
-    the_instrument = music21.instrument.Instrument(instrumentName=INSTRUMENT)
+    the_instrument = music21.instrument.Instrument(instrumentName=ctx.INSTRUMENT)
     p0.insert(0, the_instrument)
 
     d = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
@@ -5033,22 +5279,22 @@ def process_lyrics(
 
     score.insert(0, metadata.Metadata())
     score.metadata.title = (
-        os.path.splitext(INPUT_MUSIC_FILENAME)[0]
+        os.path.splitext(ctx.INPUT_MUSIC_FILENAME)[0]
         + "\n"
-        + os.path.splitext(INPUT_LYRICS_FILENAME)[0]
+        + os.path.splitext(ctx.INPUT_LYRICS_FILENAME)[0]
     )
     if len(mxl_files) == 1:
         score.metadata.title = (
             os.path.splitext(mxl_files[0])[0]
             + "\n"
-            + os.path.splitext(INPUT_LYRICS_FILENAME)[0]
+            + os.path.splitext(ctx.INPUT_LYRICS_FILENAME)[0]
         )
         output_filename = (
-            os.path.splitext(CONF_FILENAME)[0]
+            os.path.splitext(ctx.CONF_FILENAME)[0]
             + "-"
-            + os.path.splitext(INPUT_LYRICS_FILENAME)[0]
+            + os.path.splitext(ctx.INPUT_LYRICS_FILENAME)[0]
             + "-"
-            + os.path.splitext(INPUT_MUSIC_FILENAME)[0]
+            + os.path.splitext(ctx.INPUT_MUSIC_FILENAME)[0]
             + "-"
             + dt
         )
@@ -5058,12 +5304,12 @@ def process_lyrics(
             + "..."
             + os.path.splitext(mxl_files[len(mxl_files) - 1])[0]
             + "\n"
-            + os.path.splitext(INPUT_LYRICS_FILENAME)[0]
+            + os.path.splitext(ctx.INPUT_LYRICS_FILENAME)[0]
         )
         output_filename = (
-            os.path.splitext(CONF_FILENAME)[0]
+            os.path.splitext(ctx.CONF_FILENAME)[0]
             + "-"
-            + os.path.splitext(INPUT_LYRICS_FILENAME)[0]
+            + os.path.splitext(ctx.INPUT_LYRICS_FILENAME)[0]
             + "-"
             + os.path.splitext(mxl_files[0])[0]
             + "-"
@@ -5072,28 +5318,28 @@ def process_lyrics(
             + dt
         )
     elif style != "":
-        score.metadata.title = os.path.splitext(INPUT_LYRICS_FILENAME)[0] + "\n" + style
+        score.metadata.title = os.path.splitext(ctx.INPUT_LYRICS_FILENAME)[0] + "\n" + style
         output_filename = (
-            os.path.splitext(CONF_FILENAME)[0]
+            os.path.splitext(ctx.CONF_FILENAME)[0]
             + "-"
-            + os.path.splitext(INPUT_LYRICS_FILENAME)[0]
+            + os.path.splitext(ctx.INPUT_LYRICS_FILENAME)[0]
             + "-"
             + style
             + "-"
             + dt
         )
     score.metadata.composer = (
-        "MarkMelGen " + MARKMELGEN_VERSION + "\n" + CONF_FILENAME + "\n" + d
+        "MarkMelGen " + MARKMELGEN_VERSION + "\n" + ctx.CONF_FILENAME + "\n" + d
     )
 
     # Build standardized filename components
     # prefix: <conf>-<music>-<lyrics>
-    config_name = os.path.splitext(CONF_FILENAME)[0]
+    config_name = os.path.splitext(ctx.CONF_FILENAME)[0]
     if mxl_files and len(mxl_files) >= 1:
         music_name = os.path.splitext(mxl_files[0])[0]
     else:
-        music_name = os.path.splitext(INPUT_MUSIC_FILENAME)[0]
-    lyrics_name = os.path.splitext(INPUT_LYRICS_FILENAME)[0]
+        music_name = os.path.splitext(ctx.INPUT_MUSIC_FILENAME)[0]
+    lyrics_name = os.path.splitext(ctx.INPUT_LYRICS_FILENAME)[0]
     prefix = f"{config_name}-{music_name}-{lyrics_name}"
 
     # key: e.g. Am or C
@@ -5110,7 +5356,7 @@ def process_lyrics(
         bpm_val = int(songTempo.number)
     except Exception:
         try:
-            bpm_val = int(TEMPO_BPM)
+            bpm_val = int(ctx.TEMPO_BPM)
         except Exception:
             bpm_val = 120
     bpm_tag = f"bpm{bpm_val}"
@@ -5150,32 +5396,67 @@ def process_lyrics(
     # sanitize: replace any '.' in pieces (e.g. decimal in numbers) with '_'
     output_filename = output_filename.replace(".", "_")
 
-    # Save the stream as a .kar file
-    output_path = OUTPUT_PATH + output_filename + ".kar"
-    stream_to_midi_with_lyrics(score, output_path)
-    kar_filename = output_path
-
-    # Save the stream as a MIDI file
-    output_path = OUTPUT_PATH + output_filename + ".mid"
-    score.write("midi", fp=output_path)
+    song = {
+        "name": output_filename,
+        "score": score,
+        "ts": ts,
+        "metadata": {
+            "name": output_filename,
+            "title": score.metadata.title,
+            "composer": score.metadata.composer,
+            "conf": ctx.CONF_FILENAME,
+            "lyrics": ctx.INPUT_LYRICS_FILENAME,
+            "music": music_name,
+            "style": style,
+            "key": key_tag,
+            "bpm": bpm_val,
+            "time_signature": ts.ratioString,
+            "pitch_range": pitch_range,
+            "notes": len(notes),
+            "note_rejections": dict(ctx.NOTE_REJECTIONS),
+            "note_telemetry": copy.deepcopy(ctx.NOTE_TELEMETRY),
+            "version": MARKMELGEN_VERSION,
+        },
+    }
+    if ctx.WRITE_OUTPUT_FILES:
+        with stage_timer("output"):
+            write_song(ctx, song)
+
+    return song
+
+
+def write_song(ctx, song):
+    """
+    given a song from process_lyrics
+    write its OUTPUTS to OUTPUT_PATH, then show it if DISPLAY_GRAPHS, DISPLAY_HTML, DISPLAY_MXL or DISPLAY_KAR
+    """
+    score = song["score"]
+    ts = song["ts"]
+    output_filename = song["name"]
+
+    # write the .kar, .mid and .mxl and analyse the score concurrently, each from its own snapshot of the score.
+    # The .kar and the .mid are written from one compile of the MIDI events
+    output_results = write_outputs(
+        score, ts, ctx.OUTPUT_PATH + output_filename, ctx.OUTPUTS, ctx.OUTPUT_WORKERS, log_filename
+    )
+    kar_filename = output_results.get("kar")
 
     # Save the MIDI file as a musicxml file #  most still have musescore tuple bar errors
     # midi_file_path = output_path
     # musicxml_file_path = OUTPUT_PATH + output_filename + "-midi_to_musicxml.mxl"
     # midi_to_musicxml(midi_file_path, musicxml_file_path)
 
-    logger.info(f"check_stream_structure score ")
-    structure_report = check_stream_structure(score)
-    if "Error" in structure_report:
-        print(structure_report["Error"])
-    else:
-        print("Stream Structure Report:")
-    for key, value in structure_report.items():
-        print(f"{key}: {value}")
-        # logger.info(f"\fscore well_formed = {well_formed} ")
+    if "analysis" in output_results:
+        structure_report, well_formed = output_results["analysis"]
+        if "Error" in structure_report:
+            print(structure_report["Error"])
+        else:
+            print("Stream Structure Report:")
+        for key, value in structure_report.items():
+            print(f"{key}: {value}")
+            # logger.info(f"\fscore well_formed = {well_formed} ")
 
-    well_formed = check_score_well_formedness(score)
-    logger.info(f"check 1 : score well_formed = {well_formed} ")
+        logger.info(f"check 1 : score well_formed = {well_formed} ")
 
     # Prepare the score for XML
     # prepared_score = prepare_stream_for_xml(score)
@@ -5185,17 +5466,23 @@ def process_lyrics(
     #     score.write("xml", OUTPUT_PATH + output_filename + "_prepared.xml")
     #     compressXML(OUTPUT_PATH + output_filename + "_prepared.xml", deleteOriginal=True)
 
-    # filter score
-    filtered_score = filter_output_stream_for_MuseScore(score, ts, makeNotation=True)
-
-    logger.debug(f"\n check_stream_structure filtered_score ")
-    structure_report = check_stream_structure(filtered_score)
-    if "Error" in structure_report:
-        logger.debug(structure_report["Error"])
-    else:
-        logger.debug("Stream Structure Report:")
-    for key, value in structure_report.items():
-        logger.debug(f"{key}: {value}")
+    # write compressed musicxml output directly from the bar-aligned phrases.
+    # The music21 filtered score is only needed if the melody has durations the direct writer
+    # can't notate (e.g. quintuplets) or the score is to be displayed
+    mxl_written = output_results.get("mxl") is not False
+    filtered_score = None
+    if not mxl_written or ctx.DISPLAY_GRAPHS or ctx.SAVE_GRAPHS or ctx.DISPLAY_HTML or ctx.DISPLAY_MXL:
+        # filter score
+        filtered_score = filter_output_stream_for_MuseScore(score, ts, makeNotation=True)
+
+        logger.debug(f"\n check_stream_structure filtered_score ")
+        structure_report = check_stream_structure(filtered_score)
+        if "Error" in structure_report:
+            logger.debug(structure_report["Error"])
+        else:
+            logger.debug("Stream Structure Report:")
+        for key, value in structure_report.items():
+            logger.debug(f"{key}: {value}")
 
     # filtered_score.show() # triplet bad beats
 
@@ -5216,10 +5503,11 @@ def process_lyrics(
     # filtered_score.write('musicxml', OUTPUT_PATH + output_filename + ".musicxml")
     # print ('end of writing musicxml')
 
-    # write compressed musicxml output
-    with contextlib.redirect_stderr(open(os.devnull, "w")):
-        filtered_score.write("xml", OUTPUT_PATH + output_filename + ".xml")
-        compressXML(OUTPUT_PATH + output_filename + ".xml", deleteOriginal=True)
+    # write compressed musicxml output with music21, e.g. for exotic tuplets
+    if not mxl_written:
+        with contextlib.redirect_stderr(open(os.devnull, "w")):
+            filtered_score.write("xml", ctx.OUTPUT_PATH + output_filename + ".xml")
+            compressXML(ctx.OUTPUT_PATH + output_filename + ".xml", deleteOriginal=True)
 
     # show_text_in_stream(filtered_score, ts)
 
@@ -5230,21 +5518,25 @@ def process_lyrics(
     # for key, value in analysis_results.items():
     #     print(f"{key}: {value}")
 
-    log_analyze_melody_beats(filtered_score, "filtered_score")
-    log_analyze_melody_notes(filtered_score, "filtered_score")
-
     print(
         "Final output =================================================================="
     )
     logger.info(f"Logging to {log_filename}")
-    logger.info(f"Score to {OUTPUT_PATH}{output_filename}.mxl")
+    logger.info(f"Score to {ctx.OUTPUT_PATH}{output_filename}.mxl")
     # print(OUTPUT_PATH + output_filename + ".mxl")
 
-    if DISPLAY_GRAPHS == True:
-        label = "Output " + INPUT_MUSIC_FILENAME
+    if ctx.SAVE_GRAPHS:
+        save_histograms(
+            filtered_score,
+            "Output " + output_filename,
+            ctx.OUTPUT_PATH + output_filename + "-histograms." + ctx.SAVE_GRAPHS,
+            log_filename,
+        )
+    elif ctx.DISPLAY_GRAPHS == True:
+        label = "Output " + ctx.INPUT_MUSIC_FILENAME
         show_histograms(filtered_score, label)
 
-    if DISPLAY_HTML == True:
+    if ctx.DISPLAY_HTML == True:
 
         # show score with showscore. e.g.
         # Just remember when using it to remove MetronomeMarks to avoid a bug in OSMD:
@@ -5252,9 +5544,11 @@ def process_lyrics(
         # for el in score[tempo.MetronomeMark]:
         #     el.activeSite.remove(el)
         # show(score)
+        from showscore import show  # imported when shown, it is slow to import
+
         show(filtered_score)
 
-    if DISPLAY_MXL == True:
+    if ctx.DISPLAY_MXL == True:
         print(
             "Close this score show subprocess to continue ",
             environment.UserSettings()["musicxmlPath"],
@@ -5262,110 +5556,710 @@ def process_lyrics(
         with contextlib.redirect_stderr(open(os.devnull, "w")):
             filtered_score.show()  # hangs python on musicxml viewer e.g. MuseScore
 
-    if DISPLAY_KAR == True:
+    if ctx.DISPLAY_KAR == True and kar_filename:
         print(
             "Close this score show subprocess to exit: ",
             environment.UserSettings()["musicxmlPath"],
             kar_filename,
         )
-        subprocess.run([environment.UserSettings()["musicxmlPath"], kar_filename])
+        subprocess.run([environment.UserSettings()["musicxmlPath"], kar_filename])
+
+    print("MarkMelGen version " + MARKMELGEN_VERSION)
+    logger.debug(f"MarkMelGen version {MARKMELGEN_VERSION}")
+
+    return
+
+
+def create_score_and_part(songTimeSig, song_key, TIME_SIG_WANTED):
+    """
+    Creates a music21 score with a part, measure, time signature, clef, and key signature.
+
+    Args:
+        songTimeSig (music21.meter.TimeSignature): The time signature from the input song.
+        song_key (music21.key.Key): The key signature from the input song.
+        TIME_SIG_WANTED (str): An optional desired time signature (e.g., '4/4').
+
+    Returns:
+        tuple: A tuple containing the created score (music21.stream.Score),
+               the part (music21.stream.Part), and the time signature
+               (music21.meter.TimeSignature).
+    """
+
+    # Create a score, part, and measure
+    score = stream.Score()
+    p0 = stream.Part()
+    m1 = stream.Measure()
+
+    # Determine the time signature
+    ts = songTimeSig
+    if TIME_SIG_WANTED is not None:
+        ts = meter.TimeSignature(TIME_SIG_WANTED)  # Force desired time signature
+        print("ts = TIME_SIG_WANTED ", ts, TIME_SIG_WANTED)
+
+    print(
+        "TIME_SIG numerator =",
+        ts.numerator,
+        " denominator =",
+        ts.denominator,
+        " beatCount",
+        ts.beatCount,
+    )
+
+    # Insert the time signature into the measure
+    m1.insert(0, ts)
+    p0.insert(0, m1)
+
+    # Check and log if the part is well-formed
+    well_formed = check_score_well_formedness(p0)
+    logger.info(f"check 0  : part p0 well_formed = {well_formed} ")
+
+    # Insert the part into the score
+    score.insert(0, p0)
+
+    # Insert a treble clef
+    score.insert(0, clef.TrebleClef())
+
+    # Determine the key signature
+    if song_key.mode == "major":
+        the_Key = key.Key(song_key.tonic.name)
+    else:
+        the_Key = key.Key(song_key.tonic.name.lower())
+
+    # Insert the key signature, with its mode for the .mxl, .kar and .mid
+    score.keySignature = the_Key
+
+    return score, p0, ts
+
+
+def get_lyrics_files(generation_config):
+    """
+    returns the lyrics files to make songs for: those of LYRICS_BATCH, a directory (its .txt files) or a glob,
+    else INPUT_LYRICS_FULLY_QUALIFIED
+    """
+    if not generation_config.LYRICS_BATCH:
+        return [generation_config.INPUT_LYRICS_FULLY_QUALIFIED]
+    if os.path.isdir(generation_config.LYRICS_BATCH):
+        lyrics_files = sorted(glob.glob(os.path.join(generation_config.LYRICS_BATCH, "*.txt")))
+    else:
+        lyrics_files = sorted(glob.glob(generation_config.LYRICS_BATCH))
+    if not lyrics_files:
+        print("exit: Error no lyrics files in --lyrics-batch", generation_config.LYRICS_BATCH)
+        error_message = f"Error no lyrics files in --lyrics-batch {generation_config.LYRICS_BATCH}"
+        log_error_and_pause(error_message)
+        sys.exit()
+    return lyrics_files
+
+
+def process_lyrics_file(ctx, lyrics_file, songTimeSig, song_key, transitions, mxl_files=(), style=""):
+    """
+    Makes the song of a lyrics file with process_lyrics.
+    Only the GenerationContext ctx is changed, so songs can be made concurrently e.g. in threads, each with its own ctx.
+
+    Args:
+        ctx (GenerationContext): The settings and state of the song.
+        lyrics_file (str): The lyrics file.
+        songTimeSig (music21.meter.TimeSignature): The time signature from the input song.
+        song_key (music21.key.Key): The key signature from the input song.
+        transitions (tuple): transition, bpm_transition, dtransition, cad_transition, cad_dtransition, rest_note_transition
+        mxl_files (list): The input music files.
+        style (str): The style, "" if the transitions are from the input music.
+
+    Returns:
+        dict: The song, see process_lyrics
+    """
+    ctx.INPUT_LYRICS_FULLY_QUALIFIED = lyrics_file
+    ctx.INPUT_LYRICS_PATH = os.path.dirname(lyrics_file) + os.sep
+    ctx.INPUT_LYRICS_FILENAME = os.path.basename(lyrics_file)
+
+    score, p0, ts = create_score_and_part(songTimeSig, song_key, ctx.TIME_SIG_WANTED)
+    with stage_timer("generation"):
+        return process_lyrics(
+            ctx,
+            lyrics_file,
+            _section_name_matches,
+            p0,
+            ts,
+            song_key,
+            *transitions,
+            score,
+            mxl_files,
+            style,
+        )
+
+
+def _process_lyrics_file_in_worker(lyrics_file):
+    """
+    process_lyrics_file in a forked lyrics worker, with its own random draws and the outputs written in turn.
+    returns the song name and metadata, the score stays in the worker once its files are written.
+    Without WRITE_OUTPUT_FILES (e.g. generate_song_buffers) the song is returned with its score frozen by converter.freezeStr
+    """
+    random.seed()
+    numpy.random.seed()
+    generation_config, *song_context = _lyrics_batch_context
+    ctx = GenerationContext(generation_config)
+    ctx.OUTPUT_WORKERS = 0
+    ctx.SECTION_WORKERS = min(ctx.SECTION_WORKERS, 1)
+    song = process_lyrics_file(ctx, lyrics_file, *song_context)
+    if generation_config.WRITE_OUTPUT_FILES:
+        return {"name": song["name"], "metadata": song["metadata"]}
+    return {
+        "name": song["name"],
+        "score": converter.freezeStr(song["score"]),
+        "ts": song["ts"].ratioString,
+        "metadata": song["metadata"],
+    }
+
+
+def get_unigram_probabilities(table):
+    """
+    given a transition table, key -> {next value: frequency or probability}
+    returns the add-one smoothed probability of each next value, each row of the table counting alike,
+    and the probability of a next value not in the table
+    """
+    totals = {}
+    for row in table.values():
+        row_total = sum(row.values())
+        if not row_total:
+            continue
+        for value, frequency in row.items():
+            totals[value] = totals.get(value, 0.0) + frequency / row_total
+    denominator = sum(totals.values()) + len(totals) + 1
+    return {value: (total + 1) / denominator for value, total in totals.items()}, 1 / denominator
+
+
+def score_song_variant(ctx, song, transitions):
+    """
+    Scores a song with cheap metrics, to choose the best of the VARIANTS made for the same lyrics.
+
+    Args:
+        ctx (GenerationContext): The context the song was made with, with its NOTE_REJECTIONS counts.
+        song (dict): A song returned by process_lyrics.
+        transitions (tuple): transition, bpm_transition, dtransition, cad_transition, cad_dtransition, rest_note_transition
+
+    Returns:
+        dict: log_likelihood, rejections, range_usage and cadence (see VARIANT_SCORE_WEIGHTS), notes,
+              misses, the fraction of the pitch and duration transitions not in the style tables,
+              and score, the weighted sum of the metrics.
+    """
+    transition, bpm_transition, dtransition, cad_transition, cad_dtransition, rest_note_transition = transitions
+    notes_and_rests = list(song["score"].recurse().notesAndRests)
+    notes = [n for n in notes_and_rests if isinstance(n, note.Note)]
+    if len(notes) < 3:
+        return {
+            "log_likelihood": 0.0, "rejections": 0.0, "range_usage": 0.0, "cadence": 0.0,
+            "notes": len(notes), "misses": 0.0, "score": 0.0,
+        }
+
+    misses = 0
+
+    def log_probability(table, unigram, key, value):
+        # interpolated with the style's unigram probability of the value, which alone is the probability
+        # of a transition not in the table e.g. a fallback or a random key draw
+        nonlocal misses
+        unigram_probabilities, unseen_probability = unigram
+        backoff = unigram_probabilities.get(value, unseen_probability)
+        row = table.get(key)
+        if not row or value not in row:
+            misses += 1
+            return math.log2(backoff)
+        probability = row[value] / sum(row.values())
+        return math.log2((1 - VARIANT_BACKOFF_WEIGHT) * probability + VARIANT_BACKOFF_WEIGHT * backoff)
+
+    pitch_unigram = get_unigram_probabilities(transition)
+    duration_unigram = get_unigram_probabilities(dtransition)
+    log_likelihood = 0.0
+    for i in range(2, len(notes)):
+        log_likelihood += log_probability(
+            transition, pitch_unigram, (notes[i - 2].name, notes[i - 1].name), notes[i].name
+        )
+        # keyed as the styles are, by str() of the quarterLength, so a tuplet key is e.g. '1/3', with Fraction or float values
+        log_likelihood += log_probability(
+            dtransition,
+            duration_unigram,
+            (str(notes[i - 2].duration.quarterLength), str(notes[i - 1].duration.quarterLength)),
+            notes[i].duration.quarterLength,
+        )
+    transition_count = 2 * (len(notes) - 2)
+    log_likelihood /= transition_count
 
-    print("MarkMelGen version " + MARKMELGEN_VERSION)
-    logger.debug(f"MarkMelGen version {MARKMELGEN_VERSION}")
+    rejected = sum(ctx.NOTE_REJECTIONS.values())
 
-    return
+    midi_notes = [n.pitch.midi for n in notes]
+    tone_range = pitch.Pitch(ctx.config.TONE_RANGE_TOP).midi - pitch.Pitch(ctx.config.TONE_RANGE_BOTTOM).midi
+    range_usage = min(1.0, (max(midi_notes) - min(midi_notes)) / tone_range) if tone_range > 0 else 0.0
+
+    # a phrase ends at a note followed by a rest, and at the last note
+    cadences = 0
+    phrase_ends = 0
+    note_index = -1
+    for i, n in enumerate(notes_and_rests):
+        if not isinstance(n, note.Note):
+            continue
+        note_index += 1
+        if note_index < 2:
+            continue
+        if i + 1 < len(notes_and_rests) and isinstance(notes_and_rests[i + 1], note.Note):
+            continue
+        phrase_ends += 1
+        cad_row = cad_transition.get((notes[note_index - 2].name, notes[note_index - 1].name), {})
+        if n.name in cad_row:
+            cadences += 1
+    cadence = cadences / phrase_ends if phrase_ends else 0.0
+
+    metrics = {
+        "log_likelihood": log_likelihood,
+        "rejections": rejected / len(notes),
+        "range_usage": range_usage,
+        "cadence": cadence,
+    }
+    metrics["score"] = sum(VARIANT_SCORE_WEIGHTS[name] * value for name, value in metrics.items())
+    metrics["notes"] = len(notes)
+    metrics["misses"] = misses / transition_count
+    return metrics
+
+
+def make_song_variant(lyrics_file, section_workers=None):
+    """
+    given a lyrics file
+    make a song with process_lyrics_file, without writing it, with at most section_workers SECTION_WORKERS
+    return the song and its score_song_variant metrics
+    """
+    generation_config, *song_context = _lyrics_batch_context
+    ctx = GenerationContext(generation_config)
+    ctx.WRITE_OUTPUT_FILES = False
+    if section_workers is not None:
+        ctx.SECTION_WORKERS = min(ctx.SECTION_WORKERS, section_workers)
+    song = process_lyrics_file(ctx, lyrics_file, *song_context)
+    return song, score_song_variant(ctx, song, song_context[2])
 
 
-def create_score_and_part(songTimeSig, song_key, TIME_SIG_WANTED):
+def _make_song_variant_in_worker(lyrics_file):
     """
-    Creates a music21 score with a part, measure, time signature, clef, and key signature.
+    make_song_variant in a forked lyrics worker, with its own random draws.
+    returns the song with its score frozen by converter.freezeStr, and the metrics
+    """
+    random.seed()
+    numpy.random.seed()
+    song, metrics = make_song_variant(lyrics_file, section_workers=1)
+    frozen_song = {
+        "name": song["name"],
+        "score": converter.freezeStr(song["score"]),
+        "ts": song["ts"].ratioString,
+        "metadata": song["metadata"],
+    }
+    return frozen_song, metrics
+
+
+def process_lyrics_variants(lyrics_file):
+    """
+    Makes VARIANTS songs for one lyrics file from the same transitions, scores each with score_song_variant
+    and writes the KEEP_VARIANTS best. With LYRICS_WORKERS the variants are made in forked worker processes.
+
+    Args:
+        lyrics_file (str): The lyrics file.
+
+    Returns:
+        list: The kept songs, best first, each named with a -v<variant number> suffix
+              and with variant and variant_score in its metadata.
+    """
+    generation_config = _lyrics_batch_context[0]
+    variant_count = generation_config.VARIANTS
+    workers = min(generation_config.LYRICS_WORKERS, variant_count)
+    if workers <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        variants = [make_song_variant(lyrics_file) for _ in range(variant_count)]
+    else:
+        logger.info(f"process_lyrics_variants {variant_count} variants with {workers} worker processes")
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("fork")
+        ) as executor:
+            variants = list(executor.map(_make_song_variant_in_worker, [lyrics_file] * variant_count))
+        for song, _ in variants:
+            song["score"] = converter.thawStr(song["score"])
+            song["ts"] = meter.TimeSignature(song["ts"])
+
+    ranking = sorted(range(len(variants)), key=lambda i: variants[i][1]["score"], reverse=True)
+    kept = ranking[:generation_config.KEEP_VARIANTS]
+
+    text = f"variants of {os.path.basename(lyrics_file)}, keeping the best {len(kept)} of {len(variants)}"
+    logger.info(text)
+    text = f"{'variant':>7} {'score':>8} {'log_lik':>8} {'reject':>7} {'range':>6} {'cadence':>7} {'notes':>5} {'misses':>6}"
+    logger.info(text)
+    for i in ranking:
+        metrics = variants[i][1]
+        text = (
+            f"{i + 1:>7} {metrics['score']:>8.3f} {metrics['log_likelihood']:>8.3f} {metrics['rejections']:>7.2f} "
+            f"{metrics['range_usage']:>6.2f} {metrics['cadence']:>7.2f} {metrics['notes']:>5} {metrics['misses']:>6.2f}"
+            + ("  kept" if i in kept else "")
+        )
+        logger.info(text)
+
+    songs = []
+    for i in kept:
+        song, metrics = variants[i]
+        song["name"] = f"{song['name']}-v{i + 1}"
+        song["metadata"]["name"] = song["name"]
+        song["metadata"]["variant"] = i + 1
+        song["metadata"]["variant_score"] = metrics["score"]
+        if generation_config.WRITE_OUTPUT_FILES:
+            with stage_timer("output"):
+                write_song(GenerationContext(generation_config), song)
+        songs.append(song)
+    return songs
+
+
+def process_lyrics_batch(generation_config, songTimeSig, song_key, transitions, mxl_files, style):
+    """
+    Makes a song for each lyrics file of get_lyrics_files, all from the same transitions.
+    With LYRICS_WORKERS the songs are made in forked worker processes, which share the transitions read only.
+    With VARIANTS the lyrics files are taken in turn and the workers make the variants of each, see process_lyrics_variants.
 
     Args:
+        generation_config (GenerationConfig): The settings, each song is made with its own GenerationContext of them.
         songTimeSig (music21.meter.TimeSignature): The time signature from the input song.
         song_key (music21.key.Key): The key signature from the input song.
-        TIME_SIG_WANTED (str): An optional desired time signature (e.g., '4/4').
+        transitions (tuple): transition, bpm_transition, dtransition, cad_transition, cad_dtransition, rest_note_transition
+        mxl_files (list): The input music files.
+        style (str): The style, "" if the transitions are from the input music.
 
     Returns:
-        tuple: A tuple containing the created score (music21.stream.Score),
-               the part (music21.stream.Part), and the time signature
-               (music21.meter.TimeSignature).
+        list: The songs. Songs made by workers have no score if their files are already written.
     """
+    global _lyrics_batch_context
 
-    # Create a score, part, and measure
-    score = stream.Score()
-    p0 = stream.Part()
-    m1 = stream.Measure()
+    lyrics_files = get_lyrics_files(generation_config)
+    if len(lyrics_files) > 1:
+        print("lyrics batch of", len(lyrics_files), "lyrics files", lyrics_files)
+    _lyrics_batch_context = (generation_config, songTimeSig, song_key, transitions, mxl_files, style)
+    try:
+        return _process_lyrics_batch(lyrics_files)
+    finally:
+        # a failed batch leaves no context for the next
+        _lyrics_batch_context = None
 
-    # Determine the time signature
-    ts = songTimeSig
-    if TIME_SIG_WANTED is not None:
-        ts = meter.TimeSignature(TIME_SIG_WANTED)  # Force desired time signature
-        print("ts = TIME_SIG_WANTED ", ts, TIME_SIG_WANTED)
 
-    print(
-        "TIME_SIG numerator =",
-        ts.numerator,
-        " denominator =",
-        ts.denominator,
-        " beatCount",
-        ts.beatCount,
-    )
+def _process_lyrics_batch(lyrics_files):
+    """
+    process_lyrics_batch of lyrics files, with _lyrics_batch_context set
+    """
+    generation_config, songTimeSig, song_key, transitions, mxl_files, style = _lyrics_batch_context
+
+    if generation_config.VARIANTS > 1:
+        songs = []
+        for lyrics_file in lyrics_files:
+            songs += process_lyrics_variants(lyrics_file)
+        return songs
+
+    workers = min(generation_config.LYRICS_WORKERS, len(lyrics_files))
+    if workers <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        return [
+            process_lyrics_file(
+                GenerationContext(generation_config), lyrics_file, songTimeSig, song_key, transitions, mxl_files, style
+            )
+            for lyrics_file in lyrics_files
+        ]
+
+    logger.info(f"process_lyrics_batch {len(lyrics_files)} lyrics files with {workers} worker processes")
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("fork")
+    ) as executor:
+        songs = list(executor.map(_process_lyrics_file_in_worker, lyrics_files))
+    for song in songs:
+        if "score" in song:
+            song["score"] = converter.thawStr(song["score"])
+            song["ts"] = meter.TimeSignature(song["ts"])
+    return songs
+
+
+@profile_span("parse_music_file")
+def parse_music_file(music_file):
+    """
+    given an input music file
+    return the music21 stream, from memory if CACHE_MUSIC is True and the file has been parsed before and not changed
+    """
+    if not CACHE_MUSIC:
+        return music21.converter.parse(music_file)
+    mtime = os.path.getmtime(music_file)
+    cached = _music_cache.get(music_file)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, music21.converter.parse(music_file))
+        _music_cache[music_file] = cached
+    else:
+        logger.debug(f"parse_music_file using cached {music_file}")
+    # a copy, as the song is changed by the caller e.g. appended to the input stream
+    return copy.deepcopy(cached[1])
 
-    # Insert the time signature into the measure
-    m1.insert(0, ts)
-    p0.insert(0, m1)
 
-    # Check and log if the part is well-formed
-    well_formed = check_score_well_formedness(p0)
-    logger.info(f"check 0  : part p0 well_formed = {well_formed} ")
+@profile_span("song_to_buffers")
+def song_to_buffers(song, outputs=("kar", "mid", "mxl")):
+    """
+    Returns the outputs of a song from process_lyrics as in-memory bytes, without writing files.
 
-    # Insert the part into the score
-    score.insert(0, p0)
+    Args:
+        song (dict): A song returned by process_lyrics, with name, score, ts and metadata.
+        outputs (list): The file types wanted, of kar, mid and mxl.
 
-    # Insert a treble clef
-    score.insert(0, clef.TrebleClef())
+    Returns:
+        dict: output type -> bytes e.g. {"kar": b"MThd...", "mid": b"MThd...", "mxl": b"PK..."}
+    """
+    score = song["score"]
+    buffers = {}
+    if "kar" in outputs or "mid" in outputs:
+        midi_events = compile_midi_events(score)
+        if "kar" in outputs:
+            buffers["kar"] = midi_file_to_bytes(
+                midi_events_to_kar(midi_events, song["name"] + ".kar", save=False)
+            )
+        if "mid" in outputs:
+            buffers["mid"] = midi_file_to_bytes(
+                midi_events_to_mid(midi_events, song["name"] + ".mid", save=False)
+            )
+    if "mxl" in outputs:
+        mxl_bytes = stream_to_musicxml_bytes(score, song["ts"], song["name"])
+        if mxl_bytes is None:
+            # e.g. quintuplets, notated by music21 makeNotation
+            filtered_score = filter_output_stream_for_MuseScore(score, song["ts"], makeNotation=True)
+            with contextlib.redirect_stderr(open(os.devnull, "w")):
+                xml_bytes = GeneralObjectExporter(filtered_score).parse()
+            mxl_bytes = musicxml_to_mxl_bytes(xml_bytes, song["name"])
+        buffers["mxl"] = mxl_bytes
+    return buffers
+
+
+def format_note_telemetry_prometheus(telemetry):
+    """
+    given a note telemetry (section name -> counts, see get_note_telemetry)
+    return it as Prometheus text exposition format counters, labelled by section and kind (pitch or duration)
+    """
+    metrics = [
+        ("markmelgen_note_draws_total", "Pitch and duration draws attempted by get_next_note.", "draws", None),
+        ("markmelgen_note_rejections_total", "Checks of valid_pitch and valid_duration failed, by reason.", "rejections", "reason"),
+        ("markmelgen_note_tier_total", "Valid draws found in each tier of get_next_note.", "tiers", "tier"),
+        ("markmelgen_note_fallbacks_total", "Fallback tones (C) and durations (1.0) used by get_next_note.", "fallbacks", None),
+    ]
+    lines = []
+    for metric, help_text, counter, label in metrics:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} counter")
+        for section_name, section_telemetry in telemetry.items():
+            for kind, counts in section_telemetry.items():
+                labels = f'section="{section_name}",kind="{kind}"'
+                if label is None:
+                    lines.append(f"{metric}{{{labels}}} {counts[counter]}")
+                    continue
+                for name, count in sorted(counts[counter].items()):
+                    lines.append(f'{metric}{{{labels},{label}="{name}"}} {count}')
+    return "\n".join(lines) + "\n"
+
+
+def write_note_telemetry(songs, report_stem, telemetry_format="json"):
+    """
+    Writes the note telemetry of the songs of a run, the draws, rejections by reason, tiers reached and fallbacks
+    of get_next_note for each section, see get_note_telemetry.
 
-    # Determine the key signature
-    if song_key.mode == "major":
-        the_Key = key.Key(song_key.tonic.name)
-    else:
-        the_Key = key.Key(song_key.tonic.name.lower())
+    Args:
+        songs (list): The songs of the run, each with note_telemetry in its metadata.
+        report_stem (str): The file name without an extension, e.g. the log file name.
+        telemetry_format (str): "json", the run totals and each song, or "prometheus", the run totals as
+                                Prometheus text exposition format, e.g. for a node_exporter textfile collector.
+
+    Returns:
+        str: The file name written.
+    """
+    run_telemetry = {}
+    for song in songs:
+        merge_note_telemetry(run_telemetry, song["metadata"].get("note_telemetry", {}))
+    # the sections added together
+    total_telemetry = {}
+    for section_telemetry in run_telemetry.values():
+        merge_note_telemetry(total_telemetry, {"ALL": section_telemetry})
+
+    filename = report_stem + "-telemetry" + TELEMETRY_EXTENSIONS[telemetry_format]
+    with open(filename, "w", encoding="utf-8") as f:
+        if telemetry_format == "prometheus":
+            f.write(format_note_telemetry_prometheus(run_telemetry))
+        else:
+            json.dump(
+                {
+                    "run": run_telemetry,
+                    "total": total_telemetry.get("ALL", {}),
+                    "songs": {song["metadata"]["name"]: song["metadata"].get("note_telemetry", {}) for song in songs},
+                },
+                f,
+                indent=2,
+            )
+    logger.info(f"write_note_telemetry {len(songs)} songs to {filename}")
+    print("Note telemetry written to", filename)
+    return filename
+
+
+def generate_song_buffers(
+    config="MarkMelGen.conf",
+    overrides=None,
+    outputs=("kar", "mid", "mxl"),
+    write_files=False,
+    buffers=True,
+    seed=None,
+    output_workers=None,
+    quiet=False,
+    lyrics_batch=None,
+    lyrics_workers=None,
+    section_workers=None,
+):
+    """
+    Library entry point: generates the songs of a configuration file and returns them in memory,
+    so a service can stream them without a round trip through OUTPUT_PATH.
+    e.g.
+        import MarkMelGen
+        for song in MarkMelGen.generate_song_buffers("conf/v2.0.0/early_jazz_1.conf", ["markmelgen.TEMPO_BPM=90.0"]):
+            send(song["metadata"]["name"] + ".mid", song["mid"])
 
-    # Insert the key signature
-    score.keySignature = key.KeySignature(the_Key.sharps)
+    Args:
+        config (str): The configuration file path.
+        overrides (list): Configuration overrides as for -o, e.g. ["filenames.INPUT_LYRICS_FILENAME=Drifting_Stranger.txt"]
+        outputs (list): The file types wanted, of kar, mid and mxl.
+        write_files (bool): If True also write the outputs to OUTPUT_PATH, as MarkMelGen.py --outputs does.
+        buffers (bool): If False only return the metadata, e.g. when the files are written.
+        seed (int): If given, seeds the random draws so the same seed and configuration give the same melody.
+        output_workers (int): The number of worker processes writing the files, as --output-workers.
+        quiet (bool): If True only log warnings and errors to the console and discard the print output, as --quiet.
+        lyrics_batch (str): A directory or glob of lyrics files to make a song for each, as --lyrics-batch.
+        lyrics_workers (int): The number of worker processes making the lyrics_batch songs, as --lyrics-workers.
+        section_workers (int): The number of worker processes generating the lines of a song, as --section-workers.
 
-    return score, p0, ts
+    Returns:
+        list: One dict per song (one per style when USE_STYLES lists several), with the metadata dict,
+              the path of the written outputs less the extension
+              and the bytes of each output type e.g. {"metadata": {...}, "path": "...", "kar": b"...", "mid": b"...", "mxl": b"..."}
+    """
+    argv = ["-c", config]
+    for override in overrides or []:
+        argv += ["-o", override]
+    if write_files:
+        argv += ["--outputs", ",".join(outputs)]
+    if output_workers is not None:
+        argv += ["--output-workers", str(output_workers)]
+    if quiet:
+        argv += ["--quiet"]
+    if lyrics_batch:
+        argv += ["--lyrics-batch", lyrics_batch]
+    if lyrics_workers is not None:
+        argv += ["--lyrics-workers", str(lyrics_workers)]
+    if section_workers is not None:
+        argv += ["--section-workers", str(section_workers)]
+    with stage_timer("config"):
+        generation_config = read_config(argv)
+
+    # a library caller has no windows to show the song in
+    generation_config.DISPLAY_GRAPHS = generation_config.DISPLAY_HTML = False
+    generation_config.DISPLAY_MXL = generation_config.DISPLAY_KAR = False
+    generation_config.WRITE_OUTPUT_FILES = write_files
+
+    if seed is not None:
+        random.seed(seed)
+        numpy.random.seed(seed)
+
+    with quiet_stdout(generation_config.QUIET):
+        songs = main(generation_config)
+
+    song_buffers = []
+    for song in songs:
+        with stage_timer("output"):
+            song_buffer = song_to_buffers(song, outputs) if buffers else {}
+        song_buffer["metadata"] = song["metadata"]
+        song_buffer["path"] = generation_config.OUTPUT_PATH + song["metadata"]["name"]
+        song_buffers.append(song_buffer)
+    return song_buffers
+
+
+def stream_input_music(generation_config, mxl_files):
+    """
+    --max-memory: makes the transitions of the input music one file at a time, as create_style does
+    (see markmelgen_style.count_mxl_files), adding the transitions of each file to count tables and letting go
+    of its score before the next file is parsed, rather than appending every file to one song stream.
+    The memory then grows with the count tables, not with the music21 objects of the whole corpus.
+
+    Args:
+        generation_config (GenerationConfig): The settings of the run.
+        mxl_files (list): The .mxl file names in INPUT_MUSIC_PATH.
+
+    Returns:
+        tuple: The time signature of the first file, and the transitions
+               (transition, bpm_transition, dtransition, cad_transition, cad_dtransition, rest_note_transition)
+    """
+    time_signatures = []
+    note_events = []
+
+    def on_score(file_path, transposed_score):
+        if not time_signatures:
+            time_signatures.append(get_first_time_signature(transposed_score))
+        if generation_config.SAVE_GRAPHS:
+            note_events.append(get_note_events(transposed_score))
+        peak_rss_mb = check_max_memory(file_path)
+        logger.info(f"stream_input_music {file_path} peak memory {peak_rss_mb} MB")
+
+    with stage_timer("parse"):
+        counts = markmelgen_style.count_mxl_files(
+            [generation_config.INPUT_MUSIC_PATH + mxl_file for mxl_file in mxl_files],
+            generation_config.DISPLAY_HTML,
+            on_score,
+        )
+    with stage_timer("transitions"):
+        transitions = markmelgen_style.calculate_transition_probabilities(counts)
+    for transition, name in zip(transitions, ("transition", "bpm_transition", "dtransition", "cad_transition",
+                                              "cad_dtransition", "rest_note_transition")):
+        log_transition_analysis(transition, f"stream_input_music: {name}")
+
+    if generation_config.SAVE_GRAPHS:
+        save_histograms(
+            None,
+            "Input " + (generation_config.INPUT_MUSIC_FILENAME or generation_config.INPUT_MUSIC_PATH),
+            os.path.splitext(log_filename)[0] + "-input-histograms." + generation_config.SAVE_GRAPHS,
+            log_filename,
+            {name: numpy.concatenate([events[name] for events in note_events]) for name in note_events[0]},
+        )
+    elif generation_config.DISPLAY_GRAPHS == True:
+        print("DISPLAY_GRAPHS of the input music needs the whole input music stream, so is skipped with --max-memory, see --save-graphs")
 
+    print("Using the first time signature of the input music:", time_signatures[0])
+    return time_signatures[0], transitions
 
-def main():
+
+def main(generation_config):
+    """
+    makes the transitions of the input music, or loads those of the USE_STYLES,
+    then the songs of the lyrics with the settings of the GenerationConfig generation_config
+    returns the songs
+    """
 
     # Capture and log the command line arguments
     command_line = " ".join(sys.argv)
     logger.debug(f"Command line: {command_line}")
 
-    global TIME_SIG_WANTED
-    global USE_STYLES
-    global INPUT_MUSIC_FULLY_QUALIFIED
-
-    gmpwl_call_count = 0
     songTimeSig = meter.TimeSignature("4/4")  # default time signature
     song_key = music21.key.Key("C")  # default key signature
+    songs = []
 
-    if not USE_STYLES:
+    if not generation_config.USE_STYLES:
 
-        if INPUT_MUSIC_FILENAME != "":  # only one mxl file to process
-            mxl_files = [INPUT_MUSIC_FILENAME]
+        if generation_config.INPUT_MUSIC_FILENAME != "":  # only one mxl file to process
+            mxl_files = [generation_config.INPUT_MUSIC_FILENAME]
         else:  # process all .mxl files in INPUT_MUSIC_PATH
-            mxl_files = [f for f in os.listdir(INPUT_MUSIC_PATH) if f.endswith(".mxl")]
+            mxl_files = [f for f in os.listdir(generation_config.INPUT_MUSIC_PATH) if f.endswith(".mxl")]
 
-        print("INPUT_MUSIC_PATH, mxl_files", INPUT_MUSIC_PATH, mxl_files)
+        print("INPUT_MUSIC_PATH, mxl_files", generation_config.INPUT_MUSIC_PATH, mxl_files)
 
         if mxl_files == []:
-            print("exit: Error no mxl_files in INPUT_MUSIC_PATH", INPUT_MUSIC_PATH)
-            error_message = f"Error no mxl_files in INPUT_MUSIC_PATH {INPUT_MUSIC_PATH}"
+            print("exit: Error no mxl_files in INPUT_MUSIC_PATH", generation_config.INPUT_MUSIC_PATH)
+            error_message = f"Error no mxl_files in INPUT_MUSIC_PATH {generation_config.INPUT_MUSIC_PATH}"
             log_error_and_pause(error_message)
             sys.exit()
 
+        if generation_config.MAX_MEMORY:
+            # count the transitions one file at a time rather than hold them all in one song stream
+            songTimeSig, transitions = stream_input_music(generation_config, mxl_files)
+            songs += process_lyrics_batch(generation_config, songTimeSig, song_key, transitions, mxl_files, "")
+            return songs  # end of main
+
         # append each normalised mxl file to form one long "song"
         # song = music21.stream.Stream()
         song = music21.stream.Stream()
@@ -5374,55 +6268,56 @@ def main():
         slist = []
         rest_note_transition = {}
 
-        for mxl_file in mxl_files:
-            # print('mxl_file ',mxl_file )
-            INPUT_MUSIC_FULLY_QUALIFIED = INPUT_MUSIC_PATH + mxl_file
-            print("Processing INPUT_MUSIC_FULLY_QUALIFIED", INPUT_MUSIC_FULLY_QUALIFIED)
-            a_song = music21.converter.parse(INPUT_MUSIC_FULLY_QUALIFIED)
-            rest_note_transition = append_rest_note_transition(
-                rest_note_transition, a_song
-            )
-            print(
-                "after parse mxl_file resulting rest_note_transition",
-                mxl_file,
-                rest_note_transition,
-            )
-            slist.append(a_song)
+        with stage_timer("parse"):
+            for mxl_file in mxl_files:
+                # print('mxl_file ',mxl_file )
+                input_music_fully_qualified = generation_config.INPUT_MUSIC_PATH + mxl_file
+                print("Processing INPUT_MUSIC_FULLY_QUALIFIED", input_music_fully_qualified)
+                a_song = parse_music_file(input_music_fully_qualified)
+                rest_note_transition = append_rest_note_transition(
+                    rest_note_transition, a_song
+                )
+                print(
+                    "after parse mxl_file resulting rest_note_transition",
+                    mxl_file,
+                    rest_note_transition,
+                )
+                slist.append(a_song)
 
-            # analyze the key of the input song
-            song_key = a_song.analyze(
-                "key"
-            )  # music21 generic algorithm for key finding
-            # print('Input song raw song_key.tonic.name, song_key.mode = ', song_key.tonic.name,
-            #       song_key.mode)  # # e.g. song_key.tonic.name, song_key.mode =  B major or D minor
+                # analyze the key of the input song
+                song_key = a_song.analyze(
+                    "key"
+                )  # music21 generic algorithm for key finding
+                # print('Input song raw song_key.tonic.name, song_key.mode = ', song_key.tonic.name,
+                #       song_key.mode)  # # e.g. song_key.tonic.name, song_key.mode =  B major or D minor
 
-            if (song_key.tonic.name == "C" and song_key.mode == "major") or (
-                song_key.tonic.name == "A" and song_key.mode == "minor"
-            ):
-                # print('No need to normalise as already normal C major or A minor.')
-                song_transpose_interval = 0
-            else:
-                # print('Need to normalise to C major or A minor.')
-                # if minor find interval to A
-                if song_key.mode == "minor":
-                    song_transpose_interval = interval.Interval(
-                        song_key.tonic, pitch.Pitch("A")
-                    )
-                else:  # song is major, find interval to C
-                    song_transpose_interval = interval.Interval(
-                        song_key.tonic, pitch.Pitch("C")
-                    )
-                a_song = a_song.transpose(song_transpose_interval)
+                if (song_key.tonic.name == "C" and song_key.mode == "major") or (
+                    song_key.tonic.name == "A" and song_key.mode == "minor"
+                ):
+                    # print('No need to normalise as already normal C major or A minor.')
+                    song_transpose_interval = 0
+                else:
+                    # print('Need to normalise to C major or A minor.')
+                    # if minor find interval to A
+                    if song_key.mode == "minor":
+                        song_transpose_interval = interval.Interval(
+                            song_key.tonic, pitch.Pitch("A")
+                        )
+                    else:  # song is major, find interval to C
+                        song_transpose_interval = interval.Interval(
+                            song_key.tonic, pitch.Pitch("C")
+                        )
+                    a_song = a_song.transpose(song_transpose_interval)
 
-            # analyze the key of the transposed input song
-            song_key = a_song.analyze(
-                "key"
-            )  # music21 generic algorithm for key finding
-            # print('Transposed (if required) input song interval song_key.tonic.name, song_key.mode = ',
-            #       song_transpose_interval, song_key.tonic.name,
-            #       song_key.mode)  # # e.g. song_key.tonic.name, song_key.mode =  C major or A minor
+                # analyze the key of the transposed input song
+                song_key = a_song.analyze(
+                    "key"
+                )  # music21 generic algorithm for key finding
+                # print('Transposed (if required) input song interval song_key.tonic.name, song_key.mode = ',
+                #       song_transpose_interval, song_key.tonic.name,
+                #       song_key.mode)  # # e.g. song_key.tonic.name, song_key.mode =  C major or A minor
 
-            song.append(a_song)
+                song.append(a_song)
 
         rest_note_transition = transition_frequency_to_probability(rest_note_transition)
         log_transition_analysis(
@@ -5435,8 +6330,15 @@ def main():
         # print('keycount',keycount)
         # print('')
 
-        if DISPLAY_GRAPHS == True:
-            label = "Input " + INPUT_MUSIC_FILENAME
+        if generation_config.SAVE_GRAPHS:
+            save_histograms(
+                song,
+                "Input " + generation_config.INPUT_MUSIC_FILENAME,
+                os.path.splitext(log_filename)[0] + "-input-histograms." + generation_config.SAVE_GRAPHS,
+                log_filename,
+            )
+        elif generation_config.DISPLAY_GRAPHS == True:
+            label = "Input " + generation_config.INPUT_MUSIC_FILENAME
             show_histograms(song, label)
 
         # get the timesignatures
@@ -5502,39 +6404,40 @@ def main():
             print("key:", k)
 
         # Remove ties and merge tied notes
-        song = song.stripTies()
+        with stage_timer("transitions"):
+            song = song.stripTies()
 
-        # Gather the note transitions
-        transition = set_note_transition(song)
-        log_transition_analysis(transition, "Note transition: transition")
+            # Gather the note transitions
+            transition = set_note_transition(generation_config, song)
+            log_transition_analysis(transition, "Note transition: transition")
 
-        # Gather the beat placement matrix transitions
-        bpm_transition = set_bpm_transition(song, songTimeSig)
-        log_transition_analysis(
-            bpm_transition, "Beat placement transition: bpm_transition"
-        )
+            # Gather the beat placement matrix transitions
+            bpm_transition = set_bpm_transition(generation_config, song, songTimeSig)
+            log_transition_analysis(
+                bpm_transition, "Beat placement transition: bpm_transition"
+            )
 
-        # Gather the duration transitions
-        dtransition = set_duration_transition(song)
-        log_transition_analysis(dtransition, "Duration transition: dtransition")
+            # Gather the duration transitions
+            dtransition = set_duration_transition(generation_config, song)
+            log_transition_analysis(dtransition, "Duration transition: dtransition")
 
-        # Gather the note cadence transitions
-        cad_transition = set_cadence(song)
-        # print('cad_transition:', cad_transition)
-        cad_transition_key = list(cad_transition.keys())[0]
-        # print('cad_transition_key:', cad_transition_key) # e.g.
+            # Gather the note cadence transitions
+            cad_transition = set_cadence(generation_config, song)
+            # print('cad_transition:', cad_transition)
+            cad_transition_key = list(cad_transition.keys())[0]
+            # print('cad_transition_key:', cad_transition_key) # e.g.
 
-        # Analyze the transition and print results
-        transition_analysis = analyze_transition(cad_transition)
-        log_transition_analysis(
-            cad_transition, "Cadence note transition: cad_transition"
-        )
+            # Analyze the transition and print results
+            transition_analysis = analyze_transition(cad_transition)
+            log_transition_analysis(
+                cad_transition, "Cadence note transition: cad_transition"
+            )
 
-        # Gather the cadence duration transitions
-        cad_dtransition = set_cadence_duration_transition(song)
-        log_transition_analysis(
-            cad_dtransition, "Cadence duration transition: cad_dtransition"
-        )
+            # Gather the cadence duration transitions
+            cad_dtransition = set_cadence_duration_transition(generation_config, song)
+            log_transition_analysis(
+                cad_dtransition, "Cadence duration transition: cad_dtransition"
+            )
 
         # # Create a score based on the transition probabilities --------------------------------------------------------------------------------------
         # #
@@ -5588,8 +6491,6 @@ def main():
 
         # score.keySignature = music21.key.KeySignature(the_Key.sharps)
 
-        score, p0, ts = create_score_and_part(songTimeSig, song_key, TIME_SIG_WANTED)
-
         key = list(transition.keys())[0]
         print("key:", key)  # e.g. key: ('C', 'A')
 
@@ -5620,27 +6521,40 @@ def main():
 
         # have lyrics (see https://en.wikipedia.org/wiki/Syllabic_verse )
 
-        process_lyrics(
-            INPUT_LYRICS_FULLY_QUALIFIED,
-            _section_name_matches,
-            p0,
-            ts,
+        songs += process_lyrics_batch(
+            generation_config,
+            songTimeSig,
             song_key,
-            transition,
-            bpm_transition,
-            dtransition,
-            cad_transition,
-            cad_dtransition,
-            rest_note_transition,
-            gmpwl_call_count,
-            score,
+            (
+                transition,
+                bpm_transition,
+                dtransition,
+                cad_transition,
+                cad_dtransition,
+                rest_note_transition,
+            ),
             mxl_files,
             "",
         )
 
     else:  # USE_STYLES
 
-        for style in USE_STYLES:
+        # if any style has a weight e.g. ['early_jazz_1:0.7','blues_1:0.3'] then blend all the styles into one song,
+        # else generate a song per style
+        styles_to_use = generation_config.USE_STYLES
+        if is_style_blend(generation_config.USE_STYLES):
+            try:
+                style_weights = [parse_style_weight(style) for style in generation_config.USE_STYLES]
+                with stage_timer("transitions"):
+                    styles_to_use = [blend_styles(generation_config.INPUT_STYLE_PATH, style_weights)]
+            except (ValueError, FileNotFoundError) as err:
+                print("exit: Error blending USE_STYLES", generation_config.USE_STYLES, err)
+                error_message = f"Error: blending USE_STYLES {generation_config.USE_STYLES}: {err}"
+                log_error_and_pause(error_message)
+                sys.exit()
+            print("using blend", styles_to_use[0], "of", generation_config.USE_STYLES)
+
+        for style in styles_to_use:
             # print("using", style)
             # # # Load the style files for the style in USE_STYLES
             # # style_path = os.path.join(INPUT_STYLE_PATH, style)
@@ -5667,15 +6581,16 @@ def main():
             #     print("Failed to load all transition files. Check the error log for details.")
             #     sys.exit()
             print("using", style)
-            style_path = os.path.join(INPUT_STYLE_PATH, style)
-            (
-                transition,
-                bpm_transition,
-                dtransition,
-                cad_transition,
-                cad_dtransition,
-                rest_note_transition,
-            ) = load_transition_files(style_path)
+            style_path = os.path.join(generation_config.INPUT_STYLE_PATH, style)
+            with stage_timer("transitions"):
+                (
+                    transition,
+                    bpm_transition,
+                    dtransition,
+                    cad_transition,
+                    cad_dtransition,
+                    rest_note_transition,
+                ) = load_transition_files(style_path)
 
             # Check if transitions not loaded successfully
             if not (
@@ -5699,33 +6614,26 @@ def main():
             # p0 = music21.stream.Part()
             # score = music21.stream.Score()
 
-            score, p0, ts = create_score_and_part(
-                songTimeSig, song_key, TIME_SIG_WANTED
-            )
-
             mxl_files = []  # Example list of mxl files, set appropriately
-            gmpwl_call_count = 0
 
             # input('USE_STYLES Press Enter to continue...')
-            process_lyrics(
-                INPUT_LYRICS_FULLY_QUALIFIED,
-                _section_name_matches,
-                p0,
-                ts,
+            songs += process_lyrics_batch(
+                generation_config,
+                songTimeSig,
                 song_key,
-                transition,
-                bpm_transition,
-                dtransition,
-                cad_transition,
-                cad_dtransition,
-                rest_note_transition,
-                gmpwl_call_count,
-                score,
+                (
+                    transition,
+                    bpm_transition,
+                    dtransition,
+                    cad_transition,
+                    cad_dtransition,
+                    rest_note_transition,
+                ),
                 mxl_files,
                 style,
             )
 
-    return  # end of main
+    return songs  # end of main
 
 
 def parse_configuration_file(config):
@@ -5942,101 +6850,17 @@ def parse_configuration_file(config):
     return
 
 
-def get_config():
+def read_config(argv=None):
     """
-    function that reads the config
-    returns text
+    reads the command line argv (default sys.argv) and the configuration file it names,
+    starting from the DEFAULT_GENERATION_SETTINGS rather than the module globals, and sets no module globals,
+    so the configurations read one after another in one process do not change each other, see GenerationConfig.from_conf
+    returns the GenerationConfig of the settings
     """
+    config_start = time.perf_counter()
 
-    global CONF_FILENAME
-
-    # [paths]
-    global INPUT_LYRICS_PATH
-    global INPUT_LYRICS_FULLY_QUALIFIED
-    global INPUT_MUSIC_PATH
-    global INPUT_MUSIC_FULLY_QUALIFIED
-    global INPUT_STYLE_PATH
-
-    global OUTPUT_PATH
-
-    # [filenames]
-    global INPUT_LYRICS_FILENAME
-    global INPUT_MUSIC_FILENAME
-
-    # [markmelgen]
-    global BEAT_PLACEMENT_DENOMINATOR_MAXIMUM_ALLOWED
-    global BEAT_PLACEMENTS_DENIED_SET
-    global BEAT_PLACEMENTS_DENOMINATOR_DENIED_SET
-    global CADENCE_ALTERNATE_PHRASE_END
-    global CADENCE_DUR_MIN
-    global CADENCE_SECTION_END
-    global CADENCE_TONE_FREQUENCY
-    global CADENCE_TONE_PROBABILITY
-    global CADENCE_TONE_SAMPLES
-
-    global DISPLAY_GRAPHS
-    global DISPLAY_HTML
-    global DISPLAY_MXL
-    global DISPLAY_KAR
-
-    global DURATION_EQ
-    global DURATION_SET
-    global DUR_RATIONAL
-    global DUR_TUPLET
-    global DUR_LEAST
-    global DUR_LONGEST
-    global DUR_PREV_DIFF
-
-    global INSTRUMENT
-
-    global MAX_PHRASE_REST
-
-    global PER_SECTION_LIST_LENGTH
-
-    global PER_SECTION_DURATION_SET
-    global PER_SECTION_DUR_LEAST
-    global PER_SECTION_DUR_LONGEST
-    global PER_SECTION_DUR_PREV_DIFF
-    global PER_SECTION_DUR_RATIONAL
-    global PER_SECTION_DUR_TUPLET
-    global PER_SECTION_REST_NOTE_LINE_OFFSET
-    global PER_SECTION_TONES_ON_KEY
-    global PER_SECTION_TONE_PREV_INTERVAL
-    global PER_SECTION_TONE_RANGE_BOTTOM
-    global PER_SECTION_TONE_RANGE_TOP
-    global PER_SECTION_TONE_SCALE_SET
-
-    global REST_NOTE_LINE_OFFSET
-
-    global TEMPO_BPM
-    global TIME_SIG_WANTED
-
-    global TONE_ASCENT
-    global TONE_ASCENT_MIN_INTERVAL
-    global TONE_ASCENT_TRIGGER
-    global TONE_ASCENT_TRIGGER_EVERY_N_TIMES
-
-    global TONE_DESCENT
-    global TONE_DESCENT_MAX_INTERVAL
-    global TONE_DESCENT_TRIGGER
-    global TONE_DESCENT_TRIGGER_EVERY_N_TIMES
-
-    global TONE_EQ
-    global TONE_INTERVAL
-    global TONES_ON_KEY
-    global TONES_OFF_KEY
-    global TONE_PREV_INTERVAL
-
-    global TONE_RANGE_MID
-    global TONE_RANGE_BOTTOM
-    global TONE_RANGE_TOP
-
-    global TONE_SCALE_SET
-    global TONE_SCALE_ON_ANHEMITONIC
-    global TONE_SCALE_ON_HEMITONIC
-
-    global USE_STYLES
-    USE_STYLES = False
+    settings = types.SimpleNamespace(**copy.deepcopy(DEFAULT_GENERATION_SETTINGS))
+    settings.USE_STYLES = False
 
     # Capture and log the command line arguments
     command_line = " ".join(sys.argv)
@@ -6081,6 +6905,57 @@ def get_config():
         action="store_true",
     )
 
+    # Select the outputs to write, e.g. batch jobs that only need the .mid
+    parser.add_argument(
+        "--outputs",
+        default=",".join(OUTPUT_TYPES),
+        help=f"Comma separated outputs to write (default: {','.join(OUTPUT_TYPES)})",
+    )
+    parser.add_argument(
+        "--output-workers",
+        type=int,
+        default=None,
+        help="Number of worker processes writing the outputs concurrently, 0 writes them in turn "
+        "(default: one per output where processes can be forked)",
+    )
+
+    # Make a song for each of many lyrics files from one model
+    parser.add_argument(
+        "--lyrics-batch",
+        default="",
+        help="Directory or glob of lyrics files, e.g. input/lyrics/ or 'input/lyrics/*Blues*.txt', "
+        "to make a song for each instead of INPUT_LYRICS_FILENAME",
+    )
+    parser.add_argument(
+        "--lyrics-workers",
+        type=int,
+        default=0,
+        help="Number of worker processes making the --lyrics-batch songs or the --variants (default: 0, one after another)",
+    )
+
+    # Generate the independent lines of a song in parallel
+    parser.add_argument(
+        "--section-workers",
+        type=int,
+        default=0,
+        help="Number of worker processes generating the lines of a song, each line from its own seed, "
+        "the same song whatever the number (default: 0, one after another)",
+    )
+
+    # Make several melodies for the same lyrics and keep the best
+    parser.add_argument(
+        "--variants",
+        type=int,
+        default=1,
+        help="Number of melodies to make for each lyrics file, scored to keep the best --keep (default: 1)",
+    )
+    parser.add_argument(
+        "--keep",
+        type=int,
+        default=1,
+        help="Number of the best scoring --variants to write (default: 1)",
+    )
+
     # Specify the log level
     parser.add_argument(
         "-l",
@@ -6090,6 +6965,14 @@ def get_config():
         help="Set the logging level (default: INFO)",
     )
 
+    # Only warnings and errors on the console
+    parser.add_argument(
+        "-q",
+        "--quiet",
+        action="store_true",
+        help="Quiet: only show warnings and errors, log at INFO rather than DEBUG and discard the print output",
+    )
+
     # Override configuration settings
     parser.add_argument(
         "-o",
@@ -6108,6 +6991,20 @@ def get_config():
         type=str,
         help="Path to input music directory (must be a directory)",
     )
+    parser.add_argument(
+        "--shard-files",
+        type=int,
+        default=0,
+        metavar="N",
+        help="With --create-style, count N .mxl files at a time into sorted shard files on disk and merge them into "
+        "the style, so the memory does not grow with the corpus (default: 0, count them all in memory)",
+    )
+    parser.add_argument(
+        "--shard-path",
+        type=str,
+        default="",
+        help="Directory for the --shard-files shard files, removed afterwards (default: the system temporary directory)",
+    )
 
     parser.add_argument(
         "-lS",
@@ -6123,23 +7020,112 @@ def get_config():
         help="Show version and exit",
     )
 
-    # Parse command line arguments.
-    args = parser.parse_args()
+    # Find where a slow configuration spends its time
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="spans",
+        choices=["spans", "cprofile"],
+        help="Time the stages (get_config, parse, each set_*_transition, each section, each output) and count the calls of "
+        f"{', '.join(PROFILE_COUNTED_FUNCTIONS)}, writing a summary next to the log file in log/. "
+        "--profile cprofile also runs cProfile and writes its .pstats",
+    )
+
+    # Render the graphs to files rather than show them
+    parser.add_argument(
+        "--save-graphs",
+        choices=["png", "svg"],
+        help="Render the input and output histograms (pitch space, pitch class, quarter length and beat placement) "
+        "headless to .png or .svg files in a background process, rather than show the DISPLAY_GRAPHS graphs: "
+        "the output histograms next to the song outputs, the input music histograms next to the log file in log/",
+    )
+
+    # Memory of the stages, and a memory budget
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="Trace the memory of the stages (config, parse, transitions, generation, output) with tracemalloc, "
+        "logging the current and peak memory and the allocation sites holding the most memory at the end of each",
+    )
+    parser.add_argument(
+        "--max-memory",
+        type=int,
+        default=0,
+        metavar="MB",
+        help="Peak memory budget in MB: read the input music one file at a time into count tables rather than into "
+        "one song stream, and log a warning if the peak memory (RSS) goes over MB (default: 0, no budget)",
+    )
+
+    # Count how get_next_note finds its notes
+    parser.add_argument(
+        "--telemetry",
+        choices=list(TELEMETRY_EXTENSIONS),
+        help="Write the note telemetry of the run next to the log file in log/: for each section the pitch and duration "
+        "draws, rejections by reason, tiers reached and fallbacks used by get_next_note, as json or prometheus text",
+    )
+
+    # Parse command line arguments, or the argv of generate_song_buffers
+    args = parser.parse_args(argv)
 
     if args.version:
         # print(f"Processing argument: --version (value: {args.version})")
         print(MARKMELGEN_VERSION)
         sys.exit()
 
-    setup_logger(args.loglevel)
+    setup_logger(args.loglevel, args.quiet)
+    settings.QUIET = args.quiet
+
+    settings.DISPLAY_HTML = args.display_html
+    settings.DISPLAY_MXL = args.display_mxl
+    settings.DISPLAY_KAR = args.display_kar
+
+    settings.OUTPUTS = [output.strip() for output in args.outputs.split(",") if output.strip()]
+    unknown_outputs = [output for output in settings.OUTPUTS if output not in OUTPUT_TYPES]
+    if unknown_outputs or not settings.OUTPUTS:
+        print("exit: Error --outputs", args.outputs)
+        error_message = f"Error in command line. --outputs {args.outputs} is not valid, use a comma separated list of {OUTPUT_TYPES}"
+        log_error_and_pause(error_message)
+        sys.exit()
+    settings.OUTPUT_WORKERS = args.output_workers
+
+    settings.LYRICS_BATCH = args.lyrics_batch
+    settings.LYRICS_WORKERS = args.lyrics_workers
+    settings.SECTION_WORKERS = args.section_workers
 
-    DISPLAY_HTML = args.display_html
-    DISPLAY_MXL = args.display_mxl
-    DISPLAY_KAR = args.display_kar
+    settings.VARIANTS = args.variants
+    settings.KEEP_VARIANTS = args.keep
+    if settings.VARIANTS < 1 or settings.KEEP_VARIANTS < 1:
+        print("exit: Error --variants", args.variants, "--keep", args.keep)
+        error_message = f"Error in command line. --variants {args.variants} and --keep {args.keep} must be at least 1"
+        log_error_and_pause(error_message)
+        sys.exit()
 
-    logger.debug(f"DISPLAY_HTML: {DISPLAY_HTML}")
-    logger.debug(f"DISPLAY_MXL: {DISPLAY_MXL}")
-    logger.debug(f"DISPLAY_KAR: {DISPLAY_KAR}")
+    logger.debug(f"DISPLAY_HTML: {settings.DISPLAY_HTML}")
+    logger.debug(f"DISPLAY_MXL: {settings.DISPLAY_MXL}")
+    logger.debug(f"DISPLAY_KAR: {settings.DISPLAY_KAR}")
+    logger.debug(f"OUTPUTS: {settings.OUTPUTS} OUTPUT_WORKERS: {settings.OUTPUT_WORKERS}")
+    logger.debug(f"LYRICS_BATCH: {settings.LYRICS_BATCH} LYRICS_WORKERS: {settings.LYRICS_WORKERS}")
+    logger.debug(f"SECTION_WORKERS: {settings.SECTION_WORKERS}")
+    logger.debug(f"VARIANTS: {settings.VARIANTS} KEEP_VARIANTS: {settings.KEEP_VARIANTS}")
+
+    settings.TELEMETRY = args.telemetry
+    logger.debug(f"TELEMETRY: {settings.TELEMETRY}")
+    settings.SAVE_GRAPHS = args.save_graphs
+    logger.debug(f"SAVE_GRAPHS: {settings.SAVE_GRAPHS}")
+    settings.MAX_MEMORY = args.max_memory
+    logger.debug(f"MAX_MEMORY: {settings.MAX_MEMORY}")
+    if args.trace_memory:
+        start_trace_memory()
+        logger.info("Tracing the memory of the stages with tracemalloc")
+
+    if args.profile:
+        start_profile(args.profile == "cprofile")
+        count_calls(globals(), PROFILE_COUNTED_FUNCTIONS)
+        # spans and calls are only recorded in this process, so do the work here
+        settings.OUTPUT_WORKERS = 0
+        settings.LYRICS_WORKERS = 0
+        settings.SECTION_WORKERS = min(settings.SECTION_WORKERS, 1)
+        logger.info(f"Profiling ({args.profile}) with the output, lyrics and section work in this process")
 
     # input('Press Enter to continue...')
 
@@ -6150,43 +7136,43 @@ def get_config():
     with open(args.config, encoding="utf-8") as f:
         config.read_file(f)
 
-    CONF_FILENAME = os.path.basename(args.config)
+    settings.CONF_FILENAME = os.path.basename(args.config)
     print("MarkMelGen version " + MARKMELGEN_VERSION)
-    print("args.config, CONF_FILENAME", args.config, CONF_FILENAME)
+    print("args.config, CONF_FILENAME", args.config, settings.CONF_FILENAME)
     # e.g. default  = MarkMelGen.conf MarkMelGen.conf
     # e.g. override = conf\test\All-Sections.conf All-Sections.conf
 
     parse_configuration_file(config)
 
-    INPUT_LYRICS_FILENAME = config["filenames"]["INPUT_LYRICS_FILENAME"]
-    INPUT_MUSIC_FILENAME = config["filenames"]["INPUT_MUSIC_FILENAME"]
+    settings.INPUT_LYRICS_FILENAME = config["filenames"]["INPUT_LYRICS_FILENAME"]
+    settings.INPUT_MUSIC_FILENAME = config["filenames"]["INPUT_MUSIC_FILENAME"]
 
     temp_INPUT_LYRICS_PATH = config["paths"]["INPUT_LYRICS_PATH"]
     if temp_INPUT_LYRICS_PATH != None:
-        INPUT_LYRICS_PATH = temp_INPUT_LYRICS_PATH
+        settings.INPUT_LYRICS_PATH = temp_INPUT_LYRICS_PATH
 
     temp_INPUT_MUSIC_PATH = config["paths"]["INPUT_MUSIC_PATH"]
     # print('INPUT_MUSIC_PATH = temp_INPUT_MUSIC_PATH', INPUT_MUSIC_PATH, temp_INPUT_MUSIC_PATH )
     if temp_INPUT_MUSIC_PATH != "":
-        INPUT_MUSIC_PATH = temp_INPUT_MUSIC_PATH
-    print("INPUT_MUSIC_PATH", INPUT_MUSIC_PATH)
+        settings.INPUT_MUSIC_PATH = temp_INPUT_MUSIC_PATH
+    print("INPUT_MUSIC_PATH", settings.INPUT_MUSIC_PATH)
 
     temp_INPUT_STYLE_PATH = config["paths"]["INPUT_STYLE_PATH"]
     # print('INPUT_STYLE_PATH = temp_INPUT_STYLE_PATH', INPUT_STYLE_PATH, temp_INPUT_STYLE_PATH )
     if temp_INPUT_STYLE_PATH != "":
-        INPUT_STYLE_PATH = temp_INPUT_STYLE_PATH
-    print("INPUT_STYLE_PATH", INPUT_STYLE_PATH)
+        settings.INPUT_STYLE_PATH = temp_INPUT_STYLE_PATH
+    print("INPUT_STYLE_PATH", settings.INPUT_STYLE_PATH)
 
-    INPUT_LYRICS_FULLY_QUALIFIED = INPUT_LYRICS_PATH + INPUT_LYRICS_FILENAME
-    print("INPUT_LYRICS_FULLY_QUALIFIED", INPUT_LYRICS_FULLY_QUALIFIED)
+    settings.INPUT_LYRICS_FULLY_QUALIFIED = settings.INPUT_LYRICS_PATH + settings.INPUT_LYRICS_FILENAME
+    print("INPUT_LYRICS_FULLY_QUALIFIED", settings.INPUT_LYRICS_FULLY_QUALIFIED)
 
-    INPUT_MUSIC_FULLY_QUALIFIED = INPUT_MUSIC_PATH + INPUT_MUSIC_FILENAME
-    print("INPUT_MUSIC_FULLY_QUALIFIED", INPUT_MUSIC_FULLY_QUALIFIED)
+    settings.INPUT_MUSIC_FULLY_QUALIFIED = settings.INPUT_MUSIC_PATH + settings.INPUT_MUSIC_FILENAME
+    print("INPUT_MUSIC_FULLY_QUALIFIED", settings.INPUT_MUSIC_FULLY_QUALIFIED)
 
     temp_OUTPUT_PATH = config["paths"]["OUTPUT_PATH"]
     if temp_OUTPUT_PATH != None:
-        OUTPUT_PATH = temp_OUTPUT_PATH
-    print("OUTPUT_PATH", OUTPUT_PATH)
+        settings.OUTPUT_PATH = temp_OUTPUT_PATH
+    print("OUTPUT_PATH", settings.OUTPUT_PATH)
 
     # [markmelgen]
     temp_BEAT_PLACEMENTS_DENIED_SET = config["markmelgen"]["BEAT_PLACEMENTS_DENIED_SET"]
@@ -6199,16 +7185,16 @@ def get_config():
                 temp_BEAT_PLACEMENTS_DENIED_SET
             )
             # Convert each string in the list to a Fraction
-            BEAT_PLACEMENTS_DENIED_SET = [
+            settings.BEAT_PLACEMENTS_DENIED_SET = [
                 eval(f) for f in temp_BEAT_PLACEMENTS_DENIED_SET
             ]
         except BaseException as err:
             print(f"Unexpected {err=}, {type(err)=}")
-            print("exit: Error BEAT_PLACEMENTS_DENIED_SET", BEAT_PLACEMENTS_DENIED_SET)
+            print("exit: Error BEAT_PLACEMENTS_DENIED_SET", settings.BEAT_PLACEMENTS_DENIED_SET)
             error_message = f"Error in configuration file. BEAT_PLACEMENTS_DENIED_SET {temp_BEAT_PLACEMENTS_DENIED_SET} is not valid."
             log_error_and_pause(error_message)
             sys.exit()
-    print("BEAT_PLACEMENTS_DENIED_SET", BEAT_PLACEMENTS_DENIED_SET)
+    print("BEAT_PLACEMENTS_DENIED_SET", settings.BEAT_PLACEMENTS_DENIED_SET)
     # input('Press Enter to continue...')
 
     # BEAT_PLACEMENTS_DENOMINATOR_DENIED_SET is a set of integers
@@ -6225,11 +7211,11 @@ def get_config():
         # The string or node provided may only consist of the following Python literal structures:
         # strings, bytes, numbers, tuples, lists, dicts, sets, booleans, None, bytes and sets.
         try:
-            BEAT_PLACEMENTS_DENOMINATOR_DENIED_SET = ast.literal_eval(
+            settings.BEAT_PLACEMENTS_DENOMINATOR_DENIED_SET = ast.literal_eval(
                 temp_BEAT_PLACEMENTS_DENOMINATOR_DENIED_SET
             )
             if not all(
-                isinstance(item, int) for item in BEAT_PLACEMENTS_DENOMINATOR_DENIED_SET
+                isinstance(item, int) for item in settings.BEAT_PLACEMENTS_DENOMINATOR_DENIED_SET
             ):
                 raise ValueError(
                     "All items in BEAT_PLACEMENTS_DENOMINATOR_DENIED_SET must be integers"
@@ -6238,13 +7224,13 @@ def get_config():
             print(f"Unexpected {err=}, {type(err)=}")
             print(
                 "exit: Error BEAT_PLACEMENTS_DENOMINATOR_DENIED_SET",
-                BEAT_PLACEMENTS_DENOMINATOR_DENIED_SET,
+                settings.BEAT_PLACEMENTS_DENOMINATOR_DENIED_SET,
             )
             error_message = f"Error in configuration file. BEAT_PLACEMENTS_DENOMINATOR_DENIED_SET {temp_BEAT_PLACEMENTS_DENOMINATOR_DENIED_SET} is not valid."
             log_error_and_pause(error_message)
             sys.exit()
     print(
-        "BEAT_PLACEMENTS_DENOMINATOR_DENIED_SET", BEAT_PLACEMENTS_DENOMINATOR_DENIED_SET
+        "BEAT_PLACEMENTS_DENOMINATOR_DENIED_SET", settings.BEAT_PLACEMENTS_DENOMINATOR_DENIED_SET
     )
     # input('Press Enter to continue...')
 
@@ -6254,10 +7240,10 @@ def get_config():
     ]
     try:
         if is_number_an_integer(temp_BEAT_PLACEMENT_DENOMINATOR_MAXIMUM_ALLOWED):
-            BEAT_PLACEMENT_DENOMINATOR_MAXIMUM_ALLOWED = int(
+            settings.BEAT_PLACEMENT_DENOMINATOR_MAXIMUM_ALLOWED = int(
                 temp_BEAT_PLACEMENT_DENOMINATOR_MAXIMUM_ALLOWED
             )
-            if BEAT_PLACEMENT_DENOMINATOR_MAXIMUM_ALLOWED < 0:
+            if settings.BEAT_PLACEMENT_DENOMINATOR_MAXIMUM_ALLOWED < 0:
                 raise ValueError(
                     "BEAT_PLACEMENT_DENOMINATOR_MAXIMUM_ALLOWED must be >= 0"
                 )
@@ -6277,27 +7263,27 @@ def get_config():
         sys.exit()
     print(
         "BEAT_PLACEMENT_DENOMINATOR_MAXIMUM_ALLOWED",
-        BEAT_PLACEMENT_DENOMINATOR_MAXIMUM_ALLOWED,
+        settings.BEAT_PLACEMENT_DENOMINATOR_MAXIMUM_ALLOWED,
     )
     # input('Press Enter to continue...')
 
-    CADENCE_ALTERNATE_PHRASE_END = config["markmelgen"].getboolean(
+    settings.CADENCE_ALTERNATE_PHRASE_END = config["markmelgen"].getboolean(
         "CADENCE_ALTERNATE_PHRASE_END"
     )
-    print("CADENCE_ALTERNATE_PHRASE_END", CADENCE_ALTERNATE_PHRASE_END)
+    print("CADENCE_ALTERNATE_PHRASE_END", settings.CADENCE_ALTERNATE_PHRASE_END)
 
     # CADENCE_DUR_MIN can be a Fraction or a float
     temp_CADENCE_DUR_MIN = config["markmelgen"]["CADENCE_DUR_MIN"]
     try:
         if not temp_CADENCE_DUR_MIN.isnumeric():
-            CADENCE_DUR_MIN = Fraction(temp_CADENCE_DUR_MIN)
+            settings.CADENCE_DUR_MIN = Fraction(temp_CADENCE_DUR_MIN)
     except ValueError:
         print("ValueError", temp_CADENCE_DUR_MIN, " is not a number")
         # throw ValueError(temp_CADENCE_DUR_MIN + " is not a number")
-    print("CADENCE_DUR_MIN", CADENCE_DUR_MIN)
+    print("CADENCE_DUR_MIN", settings.CADENCE_DUR_MIN)
 
-    CADENCE_SECTION_END = config["markmelgen"].getboolean("CADENCE_SECTION_END")
-    print("CADENCE_SECTION_END", CADENCE_SECTION_END)
+    settings.CADENCE_SECTION_END = config["markmelgen"].getboolean("CADENCE_SECTION_END")
+    print("CADENCE_SECTION_END", settings.CADENCE_SECTION_END)
 
     temp_CADENCE_TONE_FREQUENCY = config["markmelgen"]["CADENCE_TONE_FREQUENCY"]
     print("string CADENCE_TONE_FREQUENCY", temp_CADENCE_TONE_FREQUENCY)
@@ -6307,11 +7293,11 @@ def get_config():
         # The string or node provided may only consist of the following Python literal structures:
         # strings, bytes, numbers, tuples, lists, dicts, sets, booleans, None, bytes and sets.
         total = 0
-        CADENCE_TONE_FREQUENCY = ast.literal_eval(temp_CADENCE_TONE_FREQUENCY)
-        print("Python literal structure CADENCE_TONE_FREQUENCY", CADENCE_TONE_FREQUENCY)
-        for cadence_tone_frequency_num in range(0, len(CADENCE_TONE_FREQUENCY)):
-            cadence_tone_name = CADENCE_TONE_FREQUENCY[cadence_tone_frequency_num][0]
-            cadence_tone_frequency = CADENCE_TONE_FREQUENCY[cadence_tone_frequency_num][
+        settings.CADENCE_TONE_FREQUENCY = ast.literal_eval(temp_CADENCE_TONE_FREQUENCY)
+        print("Python literal structure CADENCE_TONE_FREQUENCY", settings.CADENCE_TONE_FREQUENCY)
+        for cadence_tone_frequency_num in range(0, len(settings.CADENCE_TONE_FREQUENCY)):
+            cadence_tone_name = settings.CADENCE_TONE_FREQUENCY[cadence_tone_frequency_num][0]
+            cadence_tone_frequency = settings.CADENCE_TONE_FREQUENCY[cadence_tone_frequency_num][
                 1
             ]
             total = total + cadence_tone_frequency
@@ -6334,34 +7320,34 @@ def get_config():
 
         # Compute the probability for each transition -----------------------------------------------------------
         ptotal = 0
-        CADENCE_TONE_PROBABILITY = CADENCE_TONE_FREQUENCY
-        for cadence_tone_num in range(0, len(CADENCE_TONE_PROBABILITY)):
-            CADENCE_TONE_PROBABILITY[cadence_tone_num][1] = (
-                CADENCE_TONE_PROBABILITY[cadence_tone_num][1] / total
+        settings.CADENCE_TONE_PROBABILITY = settings.CADENCE_TONE_FREQUENCY
+        for cadence_tone_num in range(0, len(settings.CADENCE_TONE_PROBABILITY)):
+            settings.CADENCE_TONE_PROBABILITY[cadence_tone_num][1] = (
+                settings.CADENCE_TONE_PROBABILITY[cadence_tone_num][1] / total
             )
-            ptotal = ptotal + CADENCE_TONE_PROBABILITY[cadence_tone_num][1]
-        print("CADENCE_TONE_PROBABILITY=", CADENCE_TONE_PROBABILITY)
+            ptotal = ptotal + settings.CADENCE_TONE_PROBABILITY[cadence_tone_num][1]
+        print("CADENCE_TONE_PROBABILITY=", settings.CADENCE_TONE_PROBABILITY)
         print("Probability total=", ptotal)
 
         # create a 100 element sample of cadence tones which can be used to choose a random cadence tone.
-        CADENCE_TONE_SAMPLES = sum(
-            ([val] * int((prob * 100)) for val, prob in CADENCE_TONE_PROBABILITY), []
+        settings.CADENCE_TONE_SAMPLES = sum(
+            ([val] * int((prob * 100)) for val, prob in settings.CADENCE_TONE_PROBABILITY), []
         )
-        print("CADENCE_TONE_SAMPLES=", CADENCE_TONE_SAMPLES)
+        print("CADENCE_TONE_SAMPLES=", settings.CADENCE_TONE_SAMPLES)
     else:
-        CADENCE_TONE_FREQUENCY = ""
+        settings.CADENCE_TONE_FREQUENCY = ""
 
-    DISPLAY_GRAPHS = config["markmelgen"].getboolean("DISPLAY_GRAPHS")
-    print("DISPLAY_GRAPHS", DISPLAY_GRAPHS)
+    settings.DISPLAY_GRAPHS = config["markmelgen"].getboolean("DISPLAY_GRAPHS")
+    print("DISPLAY_GRAPHS", settings.DISPLAY_GRAPHS)
 
-    DISPLAY_HTML = config["markmelgen"].getboolean("DISPLAY_HTML")
-    print("DISPLAY_HTML", DISPLAY_HTML)
+    settings.DISPLAY_HTML = config["markmelgen"].getboolean("DISPLAY_HTML")
+    print("DISPLAY_HTML", settings.DISPLAY_HTML)
 
-    DISPLAY_MXL = config["markmelgen"].getboolean("DISPLAY_MXL")
-    print("DISPLAY_MXL", DISPLAY_MXL)
+    settings.DISPLAY_MXL = config["markmelgen"].getboolean("DISPLAY_MXL")
+    print("DISPLAY_MXL", settings.DISPLAY_MXL)
 
-    DISPLAY_KAR = config["markmelgen"].getboolean("DISPLAY_KAR")
-    print("DISPLAY_KAR", DISPLAY_KAR)
+    settings.DISPLAY_KAR = config["markmelgen"].getboolean("DISPLAY_KAR")
+    print("DISPLAY_KAR", settings.DISPLAY_KAR)
 
     # input('Press Enter to continue...')
 
@@ -6372,11 +7358,11 @@ def get_config():
         # ast.literal_eval: Safely evaluate an expression node or a string containing a Python literal or container display.
         # The string or node provided may only consist of the following Python literal structures:
         # strings, bytes, numbers, tuples, lists, dicts, sets, booleans, None, bytes and sets.
-        DURATION_EQ = ast.literal_eval(temp_DURATION_EQ)
-        print("Python literal structure DURATION_EQ", DURATION_EQ)
-        for duration_eq_num in range(0, len(DURATION_EQ)):
-            duration_name = DURATION_EQ[duration_eq_num][0]
-            duration_factor = DURATION_EQ[duration_eq_num][1]
+        settings.DURATION_EQ = ast.literal_eval(temp_DURATION_EQ)
+        print("Python literal structure DURATION_EQ", settings.DURATION_EQ)
+        for duration_eq_num in range(0, len(settings.DURATION_EQ)):
+            duration_name = settings.DURATION_EQ[duration_eq_num][0]
+            duration_factor = settings.DURATION_EQ[duration_eq_num][1]
             # print('duration_eq_num=',duration_eq_num,'duration_name=', duration_name,'duration_factor=', duration_factor)
             if duration_factor <= 0.0:
                 print("exit: Error DURATION_EQ factor <= 0.0")
@@ -6384,7 +7370,7 @@ def get_config():
                 log_error_and_pause(error_message)
                 sys.exit()
     else:
-        DURATION_EQ = ""
+        settings.DURATION_EQ = ""
     # input('Press Enter to continue...')
 
     temp_DURATION_SET = config["markmelgen"]["DURATION_SET"]
@@ -6395,23 +7381,23 @@ def get_config():
         # The string or node provided may only consist of the following Python literal structures:
         # strings, bytes, numbers, tuples, lists, dicts, sets, booleans, None, bytes and sets.
         try:
-            DURATION_SET = ast.literal_eval(temp_DURATION_SET)
+            settings.DURATION_SET = ast.literal_eval(temp_DURATION_SET)
         except BaseException as err:
             print(f"Unexpected {err=}, {type(err)=}")
-            print("exit: Error DURATION_SET", DURATION_SET)
-            error_message = f"Error DURATION_SET {DURATION_SET} is not a valid list e.g. ['0.5','1.0','1.5']."
+            print("exit: Error DURATION_SET", settings.DURATION_SET)
+            error_message = f"Error DURATION_SET {settings.DURATION_SET} is not a valid list e.g. ['0.5','1.0','1.5']."
             log_error_and_pause(error_message)
             sys.exit()
 
         # print('Python literal structure for DURATION_SET strings evaluated to:', DURATION_SET, type(DURATION_SET))
-        if not isinstance(DURATION_SET, list):
+        if not isinstance(settings.DURATION_SET, list):
             print("exit: DURATION_SET is not a list e.g. []")
-            error_message = f"Error DURATION_SET {DURATION_SET} is not a list e.g. []."
+            error_message = f"Error DURATION_SET {settings.DURATION_SET} is not a list e.g. []."
             log_error_and_pause(error_message)
             sys.exit()
-        for dur_num in range(0, len(DURATION_SET)):
+        for dur_num in range(0, len(settings.DURATION_SET)):
             # print('dur type()', DURATION_SET[dur_num], type(DURATION_SET[dur_num]))
-            temp_dur = DURATION_SET[dur_num]
+            temp_dur = settings.DURATION_SET[dur_num]
             if is_number_an_integer(temp_dur):
                 print(
                     "exit: ValueError dur_frac",
@@ -6424,7 +7410,7 @@ def get_config():
             try:
                 if not temp_dur.isnumeric():
                     dur_frac = Fraction(temp_dur)
-                    DURATION_SET[dur_num] = dur_frac
+                    settings.DURATION_SET[dur_num] = dur_frac
             except ValueError:
                 print("exit: ValueError dur_frac", temp_dur, " is not a number")
                 error_message = f"Error dur_frac {temp_dur} is not a number."
@@ -6433,9 +7419,9 @@ def get_config():
                 # throw ValueError(temp_dur + " is not a number")
             # print("dur_frac", dur_frac)
     else:
-        DURATION_SET = []
-    print("DURATION_SET strings converted to Fractions:", DURATION_SET)
-    PER_SECTION_DURATION_SET = [DURATION_SET] * PER_SECTION_LIST_LENGTH
+        settings.DURATION_SET = []
+    print("DURATION_SET strings converted to Fractions:", settings.DURATION_SET)
+    settings.PER_SECTION_DURATION_SET = [settings.DURATION_SET] * settings.PER_SECTION_LIST_LENGTH
 
     # input('Press Enter to continue...')
 
@@ -6443,124 +7429,124 @@ def get_config():
     temp_DUR_LEAST = config["markmelgen"]["DUR_LEAST"]
     try:
         if not temp_DUR_LEAST.isnumeric():
-            DUR_LEAST = Fraction(temp_DUR_LEAST)
+            settings.DUR_LEAST = Fraction(temp_DUR_LEAST)
     except ValueError:
         print("exit: ValueError DUR_LEAST", temp_DUR_LEAST, " is not a number")
         error_message = f"Error DUR_LEAST {temp_DUR_LEAST} is not a number."
         log_error_and_pause(error_message)
         sys.exit()
         # throw ValueError(temp_DUR_LEAST + " is not a number")
-    print("DUR_LEAST", DUR_LEAST)
+    print("DUR_LEAST", settings.DUR_LEAST)
     # PER_SECTION_DUR_LEAST[PER_SECTION_LIST_LENGTH - 1] = DUR_LEAST
-    PER_SECTION_DUR_LEAST = [DUR_LEAST] * PER_SECTION_LIST_LENGTH
+    settings.PER_SECTION_DUR_LEAST = [settings.DUR_LEAST] * settings.PER_SECTION_LIST_LENGTH
 
     # DUR_LONGEST can be a Fraction or a float
     temp_DUR_LONGEST = config["markmelgen"]["DUR_LONGEST"]
     try:
         if not temp_DUR_LONGEST.isnumeric():
-            DUR_LONGEST = Fraction(temp_DUR_LONGEST)
+            settings.DUR_LONGEST = Fraction(temp_DUR_LONGEST)
     except ValueError:
         print("exit: ValueError DUR_LONGEST", temp_DUR_LONGEST, " is not a number")
         error_message = f"Error DUR_LONGEST {temp_DUR_LONGEST} is not a number."
         log_error_and_pause(error_message)
         sys.exit()
         # throw ValueError(temp_DUR_LONGEST + " is not a number")
-    print("DUR_LONGEST", DUR_LONGEST)
+    print("DUR_LONGEST", settings.DUR_LONGEST)
     # PER_SECTION_DUR_LONGEST[PER_SECTION_LIST_LENGTH - 1] = DUR_LONGEST
-    PER_SECTION_DUR_LONGEST = [DUR_LONGEST] * PER_SECTION_LIST_LENGTH
+    settings.PER_SECTION_DUR_LONGEST = [settings.DUR_LONGEST] * settings.PER_SECTION_LIST_LENGTH
 
-    DUR_RATIONAL = config["markmelgen"].getboolean("DUR_RATIONAL")
-    print("DUR_RATIONAL", DUR_RATIONAL)
-    PER_SECTION_DUR_RATIONAL = [DUR_RATIONAL] * PER_SECTION_LIST_LENGTH
+    settings.DUR_RATIONAL = config["markmelgen"].getboolean("DUR_RATIONAL")
+    print("DUR_RATIONAL", settings.DUR_RATIONAL)
+    settings.PER_SECTION_DUR_RATIONAL = [settings.DUR_RATIONAL] * settings.PER_SECTION_LIST_LENGTH
 
-    DUR_TUPLET = config["markmelgen"].getboolean("DUR_TUPLET")
-    print("DUR_TUPLET", DUR_TUPLET)
+    settings.DUR_TUPLET = config["markmelgen"].getboolean("DUR_TUPLET")
+    print("DUR_TUPLET", settings.DUR_TUPLET)
     # PER_SECTION_DUR_TUPLET[PER_SECTION_LIST_LENGTH - 1] = DUR_TUPLET
-    PER_SECTION_DUR_TUPLET = [DUR_TUPLET] * PER_SECTION_LIST_LENGTH
+    settings.PER_SECTION_DUR_TUPLET = [settings.DUR_TUPLET] * settings.PER_SECTION_LIST_LENGTH
 
-    if DUR_RATIONAL and DUR_TUPLET:
+    if settings.DUR_RATIONAL and settings.DUR_TUPLET:
         print("exit: Error DUR_RATIONAL and DUR_TUPLET cannot both be True ")
-        error_message = f"Error DUR_RATIONAL {DUR_RATIONAL} and DUR_TUPLET {DUR_TUPLET} cannot both be True."
+        error_message = f"Error DUR_RATIONAL {settings.DUR_RATIONAL} and DUR_TUPLET {settings.DUR_TUPLET} cannot both be True."
         log_error_and_pause(error_message)
         sys.exit()
 
-    DUR_PREV_DIFF = config["markmelgen"].getfloat("DUR_PREV_DIFF")
-    print("DUR_PREV_DIFF", DUR_PREV_DIFF)
-    if DUR_PREV_DIFF != 0 and DUR_PREV_DIFF <= 1:
+    settings.DUR_PREV_DIFF = config["markmelgen"].getfloat("DUR_PREV_DIFF")
+    print("DUR_PREV_DIFF", settings.DUR_PREV_DIFF)
+    if settings.DUR_PREV_DIFF != 0 and settings.DUR_PREV_DIFF <= 1:
         print("exit: Error DUR_PREV_DIFF != 0 and DUR_PREV_DIFF <= 1 ")
         error_message = (
-            f"Error DUR_PREV_DIFF {DUR_PREV_DIFF} != 0 and DUR_PREV_DIFF <= 1."
+            f"Error DUR_PREV_DIFF {settings.DUR_PREV_DIFF} != 0 and DUR_PREV_DIFF <= 1."
         )
         log_error_and_pause(error_message)
         sys.exit()
-    PER_SECTION_DUR_PREV_DIFF = [DUR_PREV_DIFF] * PER_SECTION_LIST_LENGTH
+    settings.PER_SECTION_DUR_PREV_DIFF = [settings.DUR_PREV_DIFF] * settings.PER_SECTION_LIST_LENGTH
 
-    INSTRUMENT = config["markmelgen"]["INSTRUMENT"]
-    print("INSTRUMENT", INSTRUMENT)
+    settings.INSTRUMENT = config["markmelgen"]["INSTRUMENT"]
+    print("INSTRUMENT", settings.INSTRUMENT)
 
-    MAX_PHRASE_REST = config["markmelgen"].getfloat("MAX_PHRASE_REST")
-    print("MAX_PHRASE_REST", MAX_PHRASE_REST)
+    settings.MAX_PHRASE_REST = config["markmelgen"].getfloat("MAX_PHRASE_REST")
+    print("MAX_PHRASE_REST", settings.MAX_PHRASE_REST)
 
     # REST_NOTE_LINE_OFFSET can be a Fraction or a float or '' (blank for default which is internally set to None)
     temp_REST_NOTE_LINE_OFFSET = config["markmelgen"]["REST_NOTE_LINE_OFFSET"]
     if temp_REST_NOTE_LINE_OFFSET == "":
-        REST_NOTE_LINE_OFFSET = None
+        settings.REST_NOTE_LINE_OFFSET = None
     else:
         try:
             if not temp_REST_NOTE_LINE_OFFSET.isnumeric():
-                REST_NOTE_LINE_OFFSET = Fraction(temp_REST_NOTE_LINE_OFFSET)
+                settings.REST_NOTE_LINE_OFFSET = Fraction(temp_REST_NOTE_LINE_OFFSET)
         except ValueError:
             print("ValueError", temp_REST_NOTE_LINE_OFFSET, " is not a number")
             # throw ValueError(temp_REST_NOTE_LINE_OFFSET + " is not a number")
-    print("REST_NOTE_LINE_OFFSET", REST_NOTE_LINE_OFFSET)
+    print("REST_NOTE_LINE_OFFSET", settings.REST_NOTE_LINE_OFFSET)
     # copy markmelgen value to PER_SECTION values
-    PER_SECTION_REST_NOTE_LINE_OFFSET = [
-        REST_NOTE_LINE_OFFSET
-    ] * PER_SECTION_LIST_LENGTH
+    settings.PER_SECTION_REST_NOTE_LINE_OFFSET = [
+        settings.REST_NOTE_LINE_OFFSET
+    ] * settings.PER_SECTION_LIST_LENGTH
 
-    TEMPO_BPM = config["markmelgen"].getfloat("TEMPO_BPM")
-    print("TEMPO_BPM", TEMPO_BPM)
+    settings.TEMPO_BPM = config["markmelgen"].getfloat("TEMPO_BPM")
+    print("TEMPO_BPM", settings.TEMPO_BPM)
 
     temp_TIME_SIG_WANTED = config["markmelgen"]["TIME_SIG_WANTED"]
     if temp_TIME_SIG_WANTED != "":
-        TIME_SIG_WANTED = temp_TIME_SIG_WANTED
-    print("TIME_SIG_WANTED", TIME_SIG_WANTED)
+        settings.TIME_SIG_WANTED = temp_TIME_SIG_WANTED
+    print("TIME_SIG_WANTED", settings.TIME_SIG_WANTED)
 
     # TONE_ASCENT
-    TONE_ASCENT = config["markmelgen"].getboolean("TONE_ASCENT")
-    print("TONE_ASCENT", TONE_ASCENT)
+    settings.TONE_ASCENT = config["markmelgen"].getboolean("TONE_ASCENT")
+    print("TONE_ASCENT", settings.TONE_ASCENT)
 
-    TONE_ASCENT_MIN_INTERVAL = config["markmelgen"].getint("TONE_ASCENT_MIN_INTERVAL")
-    print("TONE_ASCENT_MIN_INTERVAL", TONE_ASCENT_MIN_INTERVAL)
-    if TONE_ASCENT_MIN_INTERVAL < 2:
+    settings.TONE_ASCENT_MIN_INTERVAL = config["markmelgen"].getint("TONE_ASCENT_MIN_INTERVAL")
+    print("TONE_ASCENT_MIN_INTERVAL", settings.TONE_ASCENT_MIN_INTERVAL)
+    if settings.TONE_ASCENT_MIN_INTERVAL < 2:
         print("exit: Error TONE_ASCENT_MIN_INTERVAL < 2 ")
         error_message = (
-            f"Error TONE_ASCENT_MIN_INTERVAL {TONE_ASCENT_MIN_INTERVAL} < 2."
+            f"Error TONE_ASCENT_MIN_INTERVAL {settings.TONE_ASCENT_MIN_INTERVAL} < 2."
         )
         log_error_and_pause(error_message)
         sys.exit()
 
-    TONE_ASCENT_TRIGGER_EVERY_N_TIMES = config["markmelgen"].getint(
+    settings.TONE_ASCENT_TRIGGER_EVERY_N_TIMES = config["markmelgen"].getint(
         "TONE_ASCENT_TRIGGER_EVERY_N_TIMES"
     )
-    print("TONE_ASCENT_TRIGGER_EVERY_N_TIMES", TONE_ASCENT_TRIGGER_EVERY_N_TIMES)
+    print("TONE_ASCENT_TRIGGER_EVERY_N_TIMES", settings.TONE_ASCENT_TRIGGER_EVERY_N_TIMES)
 
     # TONE_DESCENT
-    TONE_DESCENT = config["markmelgen"].getboolean("TONE_DESCENT")
-    print("TONE_DESCENT", TONE_DESCENT)
+    settings.TONE_DESCENT = config["markmelgen"].getboolean("TONE_DESCENT")
+    print("TONE_DESCENT", settings.TONE_DESCENT)
 
-    TONE_DESCENT_MAX_INTERVAL = config["markmelgen"].getint("TONE_DESCENT_MAX_INTERVAL")
-    print("TONE_DESCENT_MAX_INTERVAL", TONE_DESCENT_MAX_INTERVAL)
-    if TONE_DESCENT_MAX_INTERVAL < 2:
+    settings.TONE_DESCENT_MAX_INTERVAL = config["markmelgen"].getint("TONE_DESCENT_MAX_INTERVAL")
+    print("TONE_DESCENT_MAX_INTERVAL", settings.TONE_DESCENT_MAX_INTERVAL)
+    if settings.TONE_DESCENT_MAX_INTERVAL < 2:
         print("exit: Error TONE_DESCENT_MAX_INTERVAL < 2 ")
-        error_message = f"Error {TONE_DESCENT_MAX_INTERVAL} < 2."
+        error_message = f"Error {settings.TONE_DESCENT_MAX_INTERVAL} < 2."
         log_error_and_pause(error_message)
         sys.exit()
 
-    TONE_DESCENT_TRIGGER_EVERY_N_TIMES = config["markmelgen"].getint(
+    settings.TONE_DESCENT_TRIGGER_EVERY_N_TIMES = config["markmelgen"].getint(
         "TONE_DESCENT_TRIGGER_EVERY_N_TIMES"
     )
-    print("TONE_DESCENT_TRIGGER_EVERY_N_TIMES", TONE_DESCENT_TRIGGER_EVERY_N_TIMES)
+    print("TONE_DESCENT_TRIGGER_EVERY_N_TIMES", settings.TONE_DESCENT_TRIGGER_EVERY_N_TIMES)
 
     temp_TONE_EQ = config["markmelgen"]["TONE_EQ"]
     print("string TONE_EQ", temp_TONE_EQ)
@@ -6569,11 +7555,11 @@ def get_config():
         # ast.literal_eval: Safely evaluate an expression node or a string containing a Python literal or container display.
         # The string or node provided may only consist of the following Python literal structures:
         # strings, bytes, numbers, tuples, lists, dicts, sets, booleans, None, bytes and sets.
-        TONE_EQ = ast.literal_eval(temp_TONE_EQ)
-        print("Python literal structure TONE_EQ", TONE_EQ)
-        for tone_eq_num in range(0, len(TONE_EQ)):
-            tone_name = TONE_EQ[tone_eq_num][0]
-            tone_factor = TONE_EQ[tone_eq_num][1]
+        settings.TONE_EQ = ast.literal_eval(temp_TONE_EQ)
+        print("Python literal structure TONE_EQ", settings.TONE_EQ)
+        for tone_eq_num in range(0, len(settings.TONE_EQ)):
+            tone_name = settings.TONE_EQ[tone_eq_num][0]
+            tone_factor = settings.TONE_EQ[tone_eq_num][1]
             print(
                 "tone_eq_num=",
                 tone_eq_num,
@@ -6588,85 +7574,85 @@ def get_config():
                 log_error_and_pause(error_message)
                 sys.exit()
     else:
-        TONE_EQ = ""
+        settings.TONE_EQ = ""
     # input('Press Enter to continue...')
 
-    TONE_INTERVAL = config["markmelgen"]["TONE_INTERVAL"]
+    settings.TONE_INTERVAL = config["markmelgen"]["TONE_INTERVAL"]
     if (
-        TONE_INTERVAL == "smallest"
-        or TONE_INTERVAL == "largest"
-        or TONE_INTERVAL == "random"
+        settings.TONE_INTERVAL == "smallest"
+        or settings.TONE_INTERVAL == "largest"
+        or settings.TONE_INTERVAL == "random"
     ):
-        print("TONE_INTERVAL", TONE_INTERVAL)
+        print("TONE_INTERVAL", settings.TONE_INTERVAL)
     else:
         print(
             "exit: Error TONE_INTERVAL = ",
-            TONE_INTERVAL,
+            settings.TONE_INTERVAL,
             " should be [smallest | largest | random]",
         )
-        error_message = f"Error TONE_INTERVAL = {TONE_INTERVAL} should be [smallest | largest | random]."
+        error_message = f"Error TONE_INTERVAL = {settings.TONE_INTERVAL} should be [smallest | largest | random]."
         log_error_and_pause(error_message)
         sys.exit()
 
-    TONES_ON_KEY = config["markmelgen"].getboolean("TONES_ON_KEY")
-    print("TONES_ON_KEY", TONES_ON_KEY)
+    settings.TONES_ON_KEY = config["markmelgen"].getboolean("TONES_ON_KEY")
+    print("TONES_ON_KEY", settings.TONES_ON_KEY)
     # copy markmelgen value to PER_SECTION values
-    PER_SECTION_TONES_ON_KEY = [TONES_ON_KEY] * PER_SECTION_LIST_LENGTH
+    settings.PER_SECTION_TONES_ON_KEY = [settings.TONES_ON_KEY] * settings.PER_SECTION_LIST_LENGTH
 
-    TONES_OFF_KEY = config["markmelgen"].getboolean("TONES_OFF_KEY")
-    print("TONES_OFF_KEY", TONES_OFF_KEY)
+    settings.TONES_OFF_KEY = config["markmelgen"].getboolean("TONES_OFF_KEY")
+    print("TONES_OFF_KEY", settings.TONES_OFF_KEY)
 
-    TONE_PREV_INTERVAL = config["markmelgen"].getint("TONE_PREV_INTERVAL")
-    print("TONE_PREV_INTERVAL", TONE_PREV_INTERVAL)
-    PER_SECTION_TONE_PREV_INTERVAL = [TONE_PREV_INTERVAL] * PER_SECTION_LIST_LENGTH
+    settings.TONE_PREV_INTERVAL = config["markmelgen"].getint("TONE_PREV_INTERVAL")
+    print("TONE_PREV_INTERVAL", settings.TONE_PREV_INTERVAL)
+    settings.PER_SECTION_TONE_PREV_INTERVAL = [settings.TONE_PREV_INTERVAL] * settings.PER_SECTION_LIST_LENGTH
 
-    TONE_RANGE_BOTTOM = config["markmelgen"]["TONE_RANGE_BOTTOM"]
-    print("TONE_RANGE_BOTTOM", TONE_RANGE_BOTTOM)
+    settings.TONE_RANGE_BOTTOM = config["markmelgen"]["TONE_RANGE_BOTTOM"]
+    print("TONE_RANGE_BOTTOM", settings.TONE_RANGE_BOTTOM)
     # copy markmelgen value to PER_SECTION values
-    PER_SECTION_TONE_RANGE_BOTTOM = [TONE_RANGE_BOTTOM] * PER_SECTION_LIST_LENGTH
+    settings.PER_SECTION_TONE_RANGE_BOTTOM = [settings.TONE_RANGE_BOTTOM] * settings.PER_SECTION_LIST_LENGTH
 
-    TONE_RANGE_TOP = config["markmelgen"]["TONE_RANGE_TOP"]
-    print("TONE_RANGE_TOP", TONE_RANGE_TOP)
+    settings.TONE_RANGE_TOP = config["markmelgen"]["TONE_RANGE_TOP"]
+    print("TONE_RANGE_TOP", settings.TONE_RANGE_TOP)
     # copy markmelgen value to PER_SECTION values
-    PER_SECTION_TONE_RANGE_TOP = [TONE_RANGE_TOP] * PER_SECTION_LIST_LENGTH
+    settings.PER_SECTION_TONE_RANGE_TOP = [settings.TONE_RANGE_TOP] * settings.PER_SECTION_LIST_LENGTH
 
     n_min = music21.note.Note()
-    n_min.nameWithOctave = TONE_RANGE_BOTTOM
+    n_min.nameWithOctave = settings.TONE_RANGE_BOTTOM
     n_max = music21.note.Note()
-    n_max.nameWithOctave = TONE_RANGE_TOP
+    n_max.nameWithOctave = settings.TONE_RANGE_TOP
 
     if n_max.nameWithOctave < n_min.nameWithOctave:
         print("exit: Error in configuration file. TONE_RANGE_TOP < TONE_RANGE_BOTTOM.")
-        error_message = f"Error in configuration file. TONE_RANGE_TOP {TONE_RANGE_TOP} < TONE_RANGE_BOTTOM {TONE_RANGE_BOTTOM}."
+        error_message = f"Error in configuration file. TONE_RANGE_TOP {settings.TONE_RANGE_TOP} < TONE_RANGE_BOTTOM {settings.TONE_RANGE_BOTTOM}."
         log_error_and_pause(error_message)
         sys.exit()
 
-    TONE_ASCENT_TRIGGER = TONE_RANGE_BOTTOM
-    TONE_DESCENT_TRIGGER = TONE_RANGE_TOP
+    settings.TONE_ASCENT_TRIGGER = settings.TONE_RANGE_BOTTOM
+    settings.TONE_DESCENT_TRIGGER = settings.TONE_RANGE_TOP
 
     tone_range_semis = get_semitone_interval(n_min, n_max)
     print("tone_range in semitones", tone_range_semis)
 
-    TONE_RANGE_MID = n_min.pitch.transpose(int(tone_range_semis / 2))
-    print("TONE_RANGE_MID", TONE_RANGE_MID)
+    settings.TONE_RANGE_MID = n_min.pitch.transpose(int(tone_range_semis / 2))
+    print("TONE_RANGE_MID", settings.TONE_RANGE_MID)
 
     if tone_range_semis < 12:
         print(
             "exit: Error tone range in semitones must be at least one octave (12 semitones)"
         )
-        error_message = f"Error tone range {TONE_RANGE_BOTTOM} - {TONE_RANGE_TOP} in semitones must be at least one octave (12 semitones)."
+        error_message = f"Error tone range {settings.TONE_RANGE_BOTTOM} - {settings.TONE_RANGE_TOP} in semitones must be at least one octave (12 semitones)."
         log_error_and_pause(error_message)
         sys.exit()
 
     print("n_min.octave", n_min.octave, "n_max.octave", n_max.octave)
 
     tone_range_oct_min_str = ""
-    for i in TONE_RANGE_BOTTOM:
+    for i in settings.TONE_RANGE_BOTTOM:
         if i.isdigit() or i == "-":
             tone_range_oct_min_str = tone_range_oct_min_str + i
 
     tone_range_oct_max_str = ""
-    for i in TONE_RANGE_TOP:
+    for i in settings.TONE_RANGE_TOP:
         if i.isdigit() or i == "-":
             tone_range_oct_max_str = tone_range_oct_max_str + i
 
@@ -6702,10 +7688,10 @@ def get_config():
         # ast.literal_eval: Safely evaluate an expression node or a string containing a Python literal or container display.
         # The string or node provided may only consist of the following Python literal structures:
         # strings, bytes, numbers, tuples, lists, dicts, sets, booleans, None, bytes and sets.
-        TONE_SCALE_SET = ast.literal_eval(temp_TONE_SCALE_SET)
+        settings.TONE_SCALE_SET = ast.literal_eval(temp_TONE_SCALE_SET)
         # print('Python literal structure for TONE_SCALE_SET evaluated to:', TONE_SCALE_SET)
-        for tone_num in range(0, len(TONE_SCALE_SET)):
-            tone_name = TONE_SCALE_SET[tone_num]
+        for tone_num in range(0, len(settings.TONE_SCALE_SET)):
+            tone_name = settings.TONE_SCALE_SET[tone_num]
             # print('tone_num=',tone_num,'tone_name=', tone_name)
             try:
                 # temp_n = note.Note.name(tone_name)
@@ -6718,17 +7704,17 @@ def get_config():
                 log_error_and_pause(error_message)
                 sys.exit()
     else:
-        TONE_SCALE_SET = ""
-    PER_SECTION_TONE_SCALE_SET = [TONE_SCALE_SET] * PER_SECTION_LIST_LENGTH
+        settings.TONE_SCALE_SET = ""
+    settings.PER_SECTION_TONE_SCALE_SET = [settings.TONE_SCALE_SET] * settings.PER_SECTION_LIST_LENGTH
     # input('Press Enter to continue...')
 
-    TONE_SCALE_ON_ANHEMITONIC = config["markmelgen"].getboolean(
+    settings.TONE_SCALE_ON_ANHEMITONIC = config["markmelgen"].getboolean(
         "TONE_SCALE_ON_ANHEMITONIC"
     )
-    print("TONE_SCALE_ON_ANHEMITONIC", TONE_SCALE_ON_ANHEMITONIC)
+    print("TONE_SCALE_ON_ANHEMITONIC", settings.TONE_SCALE_ON_ANHEMITONIC)
 
-    TONE_SCALE_ON_HEMITONIC = config["markmelgen"].getboolean("TONE_SCALE_ON_HEMITONIC")
-    print("TONE_SCALE_ON_HEMITONIC", TONE_SCALE_ON_HEMITONIC)
+    settings.TONE_SCALE_ON_HEMITONIC = config["markmelgen"].getboolean("TONE_SCALE_ON_HEMITONIC")
+    print("TONE_SCALE_ON_HEMITONIC", settings.TONE_SCALE_ON_HEMITONIC)
 
     temp_USE_STYLES = config["markmelgen"].get(
         "USE_STYLES", "[]"
@@ -6738,17 +7724,17 @@ def get_config():
     if temp_USE_STYLES != "":
         try:
             # Safely evaluate the string to a Python list
-            USE_STYLES = ast.literal_eval(temp_USE_STYLES)
-            if not isinstance(USE_STYLES, list):
+            settings.USE_STYLES = ast.literal_eval(temp_USE_STYLES)
+            if not isinstance(settings.USE_STYLES, list):
                 raise ValueError("USE_STYLES must be a list of strings")
             # Ensure all elements are strings
-            USE_STYLES = [str(style) for style in USE_STYLES]
+            settings.USE_STYLES = [str(style) for style in settings.USE_STYLES]
         except (ValueError, SyntaxError) as err:
             print(f"Error parsing USE_STYLES: {err}")
             sys.exit("exit: Invalid USE_STYLES format in configuration file")
     else:
-        USE_STYLES = []
-    print("USE_STYLES", USE_STYLES)
+        settings.USE_STYLES = []
+    print("USE_STYLES", settings.USE_STYLES)
 
     # list section keys
     # print('list(config[DEFAULT].keys()))')
@@ -6841,7 +7827,7 @@ def get_config():
                     "DURATION_SET strings converted to Fractions:",
                     section_DURATION_SET,
                 )
-                PER_SECTION_DURATION_SET[sect.value] = section_DURATION_SET
+                settings.PER_SECTION_DURATION_SET[sect.value] = section_DURATION_SET
 
             if config.has_option(sect.name, "DUR_LEAST"):
                 # DUR_LEAST can be a Fraction or a float
@@ -6864,7 +7850,7 @@ def get_config():
                     sys.exit()
                     # throw ValueError(temp_DUR_LEAST + " is not a number")
                 print(sect.name, "DUR_LEAST", section_DUR_LEAST)
-                PER_SECTION_DUR_LEAST[sect.value] = section_DUR_LEAST
+                settings.PER_SECTION_DUR_LEAST[sect.value] = section_DUR_LEAST
 
             if config.has_option(sect.name, "DUR_LONGEST"):
                 # DUR_LONGEST can be a Fraction or a float
@@ -6887,7 +7873,7 @@ def get_config():
                     sys.exit()
                     # throw ValueError(temp_DUR_LONGEST + " is not a number")
                 print(sect.name, "DUR_LONGEST", section_DUR_LONGEST)
-                PER_SECTION_DUR_LONGEST[sect.value] = section_DUR_LONGEST
+                settings.PER_SECTION_DUR_LONGEST[sect.value] = section_DUR_LONGEST
 
             if config.has_option(sect.name, "DUR_PREV_DIFF"):
                 section_DUR_PREV_DIFF = config[sect.name].getfloat("DUR_PREV_DIFF")
@@ -6901,17 +7887,17 @@ def get_config():
                     log_error_and_pause(error_message)
                     sys.exit()
                 print(sect.name, "DUR_PREV_DIFF", section_DUR_PREV_DIFF)
-                PER_SECTION_DUR_PREV_DIFF[sect.value] = section_DUR_PREV_DIFF
+                settings.PER_SECTION_DUR_PREV_DIFF[sect.value] = section_DUR_PREV_DIFF
 
             if config.has_option(sect.name, "DUR_RATIONAL"):
                 section_dur_rational = config[sect.name].getboolean("DUR_RATIONAL")
                 print(sect.name, "DUR_RATIONAL", section_dur_rational)
-                PER_SECTION_DUR_RATIONAL[sect.value] = section_dur_rational
+                settings.PER_SECTION_DUR_RATIONAL[sect.value] = section_dur_rational
 
             if config.has_option(sect.name, "DUR_TUPLET"):
                 section_dur_tuplet = config[sect.name].getboolean("DUR_TUPLET")
                 print(sect.name, "DUR_TUPLET", section_dur_tuplet)
-                PER_SECTION_DUR_TUPLET[sect.value] = section_dur_tuplet
+                settings.PER_SECTION_DUR_TUPLET[sect.value] = section_dur_tuplet
 
             if config.has_option(sect.name, "REST_NOTE_LINE_OFFSET"):
                 # REST_NOTE_LINE_OFFSET can be a Fraction or a float or '' (blank for default which is internally set to None)
@@ -6938,31 +7924,31 @@ def get_config():
                         log_error_and_pause(error_message)
                         sys.exit()
                 print(sect.name, "REST_NOTE_LINE_OFFSET", section_REST_NOTE_LINE_OFFSET)
-                PER_SECTION_REST_NOTE_LINE_OFFSET[sect.value] = (
+                settings.PER_SECTION_REST_NOTE_LINE_OFFSET[sect.value] = (
                     section_REST_NOTE_LINE_OFFSET
                 )
 
             if config.has_option(sect.name, "TONES_ON_KEY"):
                 section_tones_on_key = config[sect.name].getboolean("TONES_ON_KEY")
                 print(sect.name, "TONES_ON_KEY", section_tones_on_key)
-                PER_SECTION_TONES_ON_KEY[sect.value] = section_tones_on_key
+                settings.PER_SECTION_TONES_ON_KEY[sect.value] = section_tones_on_key
 
             if config.has_option(sect.name, "TONE_PREV_INTERVAL"):
                 section_TONE_PREV_INTERVAL = config[sect.name].getint(
                     "TONE_PREV_INTERVAL"
                 )
                 print(sect.name, "TONE_PREV_INTERVAL", section_TONE_PREV_INTERVAL)
-                PER_SECTION_TONE_PREV_INTERVAL[sect.value] = section_TONE_PREV_INTERVAL
+                settings.PER_SECTION_TONE_PREV_INTERVAL[sect.value] = section_TONE_PREV_INTERVAL
 
             if config.has_option(sect.name, "TONE_RANGE_BOTTOM"):
                 section_tone_range_bottom = config[sect.name]["TONE_RANGE_BOTTOM"]
                 print(sect.name, "TONE_RANGE_BOTTOM", section_tone_range_bottom)
-                PER_SECTION_TONE_RANGE_BOTTOM[sect.value] = section_tone_range_bottom
+                settings.PER_SECTION_TONE_RANGE_BOTTOM[sect.value] = section_tone_range_bottom
 
             if config.has_option(sect.name, "TONE_RANGE_TOP"):
                 section_tone_range_top = config[sect.name]["TONE_RANGE_TOP"]
                 print(sect.name, "TONE_RANGE_TOP   ", section_tone_range_top)
-                PER_SECTION_TONE_RANGE_TOP[sect.value] = section_tone_range_top
+                settings.PER_SECTION_TONE_RANGE_TOP[sect.value] = section_tone_range_top
 
                 n_min = music21.note.Note()
                 n_min.nameWithOctave = section_tone_range_bottom
@@ -7010,7 +7996,7 @@ def get_config():
                 else:
                     section_TONE_SCALE_SET = ""
 
-                PER_SECTION_TONE_SCALE_SET[sect.value] = section_TONE_SCALE_SET
+                settings.PER_SECTION_TONE_SCALE_SET[sect.value] = section_TONE_SCALE_SET
 
     # print the PER_SECTION lists
     print("")
@@ -7021,23 +8007,23 @@ def get_config():
         "========================================================================================="
     )
 
-    print("PER_SECTION_DURATION_SET ", PER_SECTION_DURATION_SET)
-    print("PER_SECTION_DUR_LEAST    ", PER_SECTION_DUR_LEAST)
-    print("PER_SECTION_DUR_LONGEST  ", PER_SECTION_DUR_LONGEST)
-    print("PER_SECTION_DUR_PREV_DIFF", PER_SECTION_DUR_PREV_DIFF)
-    print("PER_SECTION_DUR_RATIONAL ", PER_SECTION_DUR_RATIONAL)
-    print("PER_SECTION_DUR_TUPLET   ", PER_SECTION_DUR_TUPLET)
-    print("PER_SECTION_REST_NOTE_LINE_OFFSET    ", PER_SECTION_REST_NOTE_LINE_OFFSET)
-    print("PER_SECTION_TONES_ON_KEY      ", PER_SECTION_TONES_ON_KEY)
-    print("PER_SECTION_TONE_PREV_INTERVAL", PER_SECTION_TONE_PREV_INTERVAL)
-    print("PER_SECTION_TONE_RANGE_BOTTOM ", PER_SECTION_TONE_RANGE_BOTTOM)
-    print("PER_SECTION_TONE_RANGE_TOP    ", PER_SECTION_TONE_RANGE_TOP)
-    print("PER_SECTION_TONE_SCALE_SET    ", PER_SECTION_TONE_SCALE_SET)
+    print("PER_SECTION_DURATION_SET ", settings.PER_SECTION_DURATION_SET)
+    print("PER_SECTION_DUR_LEAST    ", settings.PER_SECTION_DUR_LEAST)
+    print("PER_SECTION_DUR_LONGEST  ", settings.PER_SECTION_DUR_LONGEST)
+    print("PER_SECTION_DUR_PREV_DIFF", settings.PER_SECTION_DUR_PREV_DIFF)
+    print("PER_SECTION_DUR_RATIONAL ", settings.PER_SECTION_DUR_RATIONAL)
+    print("PER_SECTION_DUR_TUPLET   ", settings.PER_SECTION_DUR_TUPLET)
+    print("PER_SECTION_REST_NOTE_LINE_OFFSET    ", settings.PER_SECTION_REST_NOTE_LINE_OFFSET)
+    print("PER_SECTION_TONES_ON_KEY      ", settings.PER_SECTION_TONES_ON_KEY)
+    print("PER_SECTION_TONE_PREV_INTERVAL", settings.PER_SECTION_TONE_PREV_INTERVAL)
+    print("PER_SECTION_TONE_RANGE_BOTTOM ", settings.PER_SECTION_TONE_RANGE_BOTTOM)
+    print("PER_SECTION_TONE_RANGE_TOP    ", settings.PER_SECTION_TONE_RANGE_TOP)
+    print("PER_SECTION_TONE_SCALE_SET    ", settings.PER_SECTION_TONE_SCALE_SET)
 
     print(
         "========================================================================================="
     )
-    print(f"Configuration file loaded: {CONF_FILENAME}")
+    print(f"Configuration file loaded: {settings.CONF_FILENAME}")
     print("")
     print("")
     print("")
@@ -7048,45 +8034,32 @@ def get_config():
     # Bind reference to final parameter values.
 
     if args.display_graphs == True:
-        DISPLAY_GRAPHS = args.display_graphs
+        settings.DISPLAY_GRAPHS = args.display_graphs
     if args.display_html == True:
-        DISPLAY_HTML = args.display_html
+        settings.DISPLAY_HTML = args.display_html
     if args.display_mxl == True:
-        DISPLAY_MXL = args.display_mxl
+        settings.DISPLAY_MXL = args.display_mxl
     if args.display_kar == True:
-        DISPLAY_KAR = args.display_kar
+        settings.DISPLAY_KAR = args.display_kar
 
     if args.list_styles:
         # In MarkMelGen.py, after the config is loaded (e.g., after config.read(CONF_FILENAME))
         # print(f"INPUT_STYLE_PATH from config: {INPUT_STYLE_PATH}")
 
-        # List the styles and exit
+        # List the styles and exit, python MarkMelGen.py -lS does this in markmelgen_cli.fast_path before music21 is imported
         # print(f"Processing argument: --list-styles (value: {args.list_styles})")
-        print(f"Available styles in {INPUT_STYLE_PATH} :")
-        style_list = []
-        try:
-            for style_dir in os.listdir(INPUT_STYLE_PATH):
-                if os.path.isdir(os.path.join(INPUT_STYLE_PATH, style_dir)):
-                    print(f"- {style_dir}")
-                    style_list.append(style_dir)
-        except FileNotFoundError:
-            print(f"Error: Style directory not found at {INPUT_STYLE_PATH}")
-        if style_list:
-            print(
-                "\nTo configure the use styles, copy & paste the line below to your .conf file :"
-            )
-            print(f"USE_STYLES=[{','.join(repr(style) for style in style_list)}]")
-            print(
-                "\nTo override .conf styles, copy & paste the line below to your -o override :"
-            )
-            print(
-                f"-o markmelgen.USE_STYLES=[{','.join(repr(style) for style in style_list)}]"
-            )
+        list_styles(settings.INPUT_STYLE_PATH)
         sys.exit()
 
     if args.create_style:
         # print(f"Processing argument: --create_style (value: {args.create_style})")
-        create_style(args.create_style, DISPLAY_HTML, INPUT_STYLE_PATH)
+        if args.shard_files < 0:
+            print("exit: Error --shard-files must be 0 or more, not", args.shard_files)
+            error_message = f"Error --shard-files must be 0 or more, not {args.shard_files}"
+            log_error_and_pause(error_message)
+            sys.exit()
+        create_style(args.create_style, settings.DISPLAY_HTML, settings.INPUT_STYLE_PATH, args.shard_files, args.shard_path)
+        stop_profile(os.path.splitext(log_filename)[0])
         sys.exit(0)
 
     # Add a flag to track the override
@@ -7122,8 +8095,8 @@ def get_config():
                         # Ensure the result is a list of strings
                         if not isinstance(temp_USE_STYLES, list):
                             raise ValueError("USE_STYLES must be a list of strings")
-                        USE_STYLES = [str(style) for style in temp_USE_STYLES]
-                        logger.debug(f"USE_STYLES overridden to: {USE_STYLES}")
+                        settings.USE_STYLES = [str(style) for style in temp_USE_STYLES]
+                        logger.debug(f"USE_STYLES overridden to: {settings.USE_STYLES}")
                     except (ValueError, SyntaxError) as err:
                         logger.error(f"Error parsing overridden USE_STYLES: {err}")
                         sys.exit("exit: Invalid USE_STYLES format in override argument")
@@ -7144,9 +8117,9 @@ def get_config():
 
         # Execute the assignment based on the flag
         if duration_set_override:
-            PER_SECTION_DURATION_SET = [DURATION_SET] * PER_SECTION_LIST_LENGTH
+            settings.PER_SECTION_DURATION_SET = [settings.DURATION_SET] * settings.PER_SECTION_LIST_LENGTH
             logger.debug(
-                f"duration_set_override DURATION_SET: {DURATION_SET} PER_SECTION_DURATION_SET: {PER_SECTION_DURATION_SET}"
+                f"duration_set_override DURATION_SET: {settings.DURATION_SET} PER_SECTION_DURATION_SET: {settings.PER_SECTION_DURATION_SET}"
             )
 
         # 4. Access the settings (example - showing how to get different types)
@@ -7155,37 +8128,74 @@ def get_config():
         # if not lyrics_path:
         #     lyrics_path = os.getcwd()
 
-        INPUT_LYRICS_PATH = config["paths"]["INPUT_LYRICS_PATH"]
-        INPUT_LYRICS_FILENAME = config["filenames"]["INPUT_LYRICS_FILENAME"]
-        INPUT_LYRICS_FULLY_QUALIFIED = INPUT_LYRICS_PATH + INPUT_LYRICS_FILENAME
-        TEMPO_BPM = config["markmelgen"].getfloat("TEMPO_BPM")
-        TIME_SIG_WANTED = config["markmelgen"]["TIME_SIG_WANTED"]
-        DISPLAY_GRAPHS = config["markmelgen"].getboolean("DISPLAY_GRAPHS")
+        settings.INPUT_LYRICS_PATH = config["paths"]["INPUT_LYRICS_PATH"]
+        settings.INPUT_LYRICS_FILENAME = config["filenames"]["INPUT_LYRICS_FILENAME"]
+        settings.INPUT_LYRICS_FULLY_QUALIFIED = settings.INPUT_LYRICS_PATH + settings.INPUT_LYRICS_FILENAME
+        # the music, style and output paths may be overridden too e.g. paths.INPUT_STYLE_PATH=private/input/test_styles/
+        if config["paths"]["INPUT_MUSIC_PATH"] != "":
+            settings.INPUT_MUSIC_PATH = config["paths"]["INPUT_MUSIC_PATH"]
+        if config["paths"]["INPUT_STYLE_PATH"] != "":
+            settings.INPUT_STYLE_PATH = config["paths"]["INPUT_STYLE_PATH"]
+        settings.OUTPUT_PATH = config["paths"]["OUTPUT_PATH"]
+        settings.INPUT_MUSIC_FILENAME = config["filenames"]["INPUT_MUSIC_FILENAME"]
+        settings.INPUT_MUSIC_FULLY_QUALIFIED = settings.INPUT_MUSIC_PATH + settings.INPUT_MUSIC_FILENAME
+        settings.TEMPO_BPM = config["markmelgen"].getfloat("TEMPO_BPM")
+        settings.TIME_SIG_WANTED = config["markmelgen"]["TIME_SIG_WANTED"]
+        settings.DISPLAY_GRAPHS = config["markmelgen"].getboolean("DISPLAY_GRAPHS")
 
         duration_set_str = config.get("markmelgen", "DURATION_SET", fallback="[]")
-        DURATION_SET = parse_value(duration_set_str)
+        settings.DURATION_SET = parse_value(duration_set_str)
         temp_DURATION_SET = get_duration_set(
-            DURATION_SET
+            settings.DURATION_SET
         )  # Convert to list of Fractions
-        PER_SECTION_DURATION_SET = [temp_DURATION_SET] * PER_SECTION_LIST_LENGTH
+        settings.PER_SECTION_DURATION_SET = [temp_DURATION_SET] * settings.PER_SECTION_LIST_LENGTH
+
+        logger.info(f"Using lyrics path: {settings.INPUT_LYRICS_PATH}")
+        logger.info(f"Using lyrics filename: {settings.INPUT_LYRICS_FILENAME}")
+        logger.info(f"Using lyrics fully qualified: {settings.INPUT_LYRICS_FULLY_QUALIFIED}")
+        logger.info(f"Using music fully qualified: {settings.INPUT_MUSIC_FULLY_QUALIFIED}")
+        logger.info(f"Using style path: {settings.INPUT_STYLE_PATH}")
+        logger.info(f"Using output path: {settings.OUTPUT_PATH}")
+        logger.info(f"Using tempo (BPM): {settings.TEMPO_BPM}")
+        logger.info(f"Using time sig wanted: {settings.TIME_SIG_WANTED}")
+        logger.info(f"Using Display graphs: {settings.DISPLAY_GRAPHS}")
+        logger.info(f"Using Duration set: {settings.DURATION_SET} (type: {type(settings.DURATION_SET)})")
+        logger.info(f"Using Duration set (PER_SECTION): {settings.PER_SECTION_DURATION_SET}")
+        logger.info(f"Using USE_STYLES: {settings.USE_STYLES}")
+
+    if MarkMelGen_utilities.PROFILE:
+        PROFILE_SPANS["get_config"] = [1, time.perf_counter() - config_start]
 
-        logger.info(f"Using lyrics path: {INPUT_LYRICS_PATH}")
-        logger.info(f"Using lyrics filename: {INPUT_LYRICS_FILENAME}")
-        logger.info(f"Using lyrics fully qualified: {INPUT_LYRICS_FULLY_QUALIFIED}")
-        logger.info(f"Using tempo (BPM): {TEMPO_BPM}")
-        logger.info(f"Using time sig wanted: {TIME_SIG_WANTED}")
-        logger.info(f"Using Display graphs: {DISPLAY_GRAPHS}")
-        logger.info(f"Using Duration set: {DURATION_SET} (type: {type(DURATION_SET)})")
-        logger.info(f"Using Duration set (PER_SECTION): {PER_SECTION_DURATION_SET}")
-        logger.info(f"Using USE_STYLES: {USE_STYLES}")
+    return GenerationConfig(**vars(settings))  # end of read_config()
 
-    return  # end of get_config()
+
+def get_config(argv=None):
+    """
+    reads the configuration with read_config,
+    then sets the module globals of its GENERATION_SETTINGS e.g. TEMPO_BPM from it,
+    for the code that reads the settings of the run from the module globals rather than a GenerationConfig
+    e.g. stage_timer (MAX_MEMORY), and for scripts that read e.g. MarkMelGen.OUTPUT_PATH after running MarkMelGen.py
+    returns the GenerationConfig
+    """
+    generation_config = read_config(argv)
+    globals().update({name: getattr(generation_config, name) for name in GENERATION_SETTINGS})
+    return generation_config
 
 
 if __name__ == "__main__":
 
-    get_config()
+    generation_config = get_config()
 
     # input('After get_config() Press Enter to continue...')
 
-    main()
+    try:
+        with quiet_stdout(generation_config.QUIET):
+            songs = main(generation_config)
+        for histograms_filename in wait_for_histograms():
+            logger.info(f"Histograms written to {histograms_filename}")
+        if generation_config.TELEMETRY:
+            write_note_telemetry(songs, os.path.splitext(log_filename)[0], generation_config.TELEMETRY)
+    finally:
+        # the profile of a run that fails is still written
+        stop_profile(os.path.splitext(log_filename)[0])
+        stop_trace_memory()
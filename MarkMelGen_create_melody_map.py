@@ -50,6 +50,7 @@ import sys
 from fractions import Fraction
 from music21 import *
 from music21.harmony import ChordSymbol, NoChord
+from markmelgen_cli import MARKMELGEN_VERSION
 from MarkMelGen_utilities import *
 
 
@@ -7,24 +7,34 @@
 # free and open-source software, Paul Wardley Davies, see license.txt
 
 import ast
+import concurrent.futures
+import contextlib
 import copy
+import cProfile
 import datetime
+import functools
+import io
 import json
+import logging
 import math
-import mido
+import multiprocessing
 import music21
+import os
+import pstats
 import re
 import sys
+import threading
+import time
 import traceback
+import tracemalloc
+import xml.etree.ElementTree as ET
+import zipfile
 
 from fractions import Fraction
-from logging_config import logger
-from mido import *
+from logging_config import logger, note_logger
 from music21 import *
 from music21 import meter
 
-MARKMELGEN_VERSION = "3.1.0"
-
 
 def analyze_melody_beats(melody_stream, strip=True):
     """
@@ -283,6 +293,8 @@ def log_transition_analysis(transition, transition_name="Transition"):
         transition (dict): The transition dictionary to analyze and log.
         transition_name (str): The name of the transition to log.
     """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return  # the whole table is only wanted in a debug log
     logger.debug(f"{transition_name} Dictionary:")
     for key, sub_dict in transition.items():
         logger.debug(f"{key}: {sub_dict}")
@@ -611,14 +623,17 @@ def fractional_part_as_fraction(value, time_signature):
         # beats_per_measure = time_signature.numerator
         beat_duration = time_signature.beatDuration.quarterLength
         beat_placement = fractional_part * beat_duration
-        logger.debug(
-            f"fractional_part_as_fraction value = {value} frac = {frac} fractional_part = {fractional_part} beat_duration = time_signature.beatDuration.quarterLength = {beat_duration} beat_placement {beat_placement}"
+        note_logger.debug(
+            "fractional_part_as_fraction value = %s frac = %s fractional_part = %s beat_duration = time_signature.beatDuration.quarterLength = %s beat_placement %s",
+            value, frac, fractional_part, beat_duration, beat_placement,
         )
-        logger.debug(
-            f"fractional_part_as_fraction return  = {Fraction(beat_placement).limit_denominator()} where value = {value} time_signature = {time_signature}"
+        beat_placement = Fraction(beat_placement).limit_denominator()
+        note_logger.debug(
+            "fractional_part_as_fraction return  = %s where value = %s time_signature = %s",
+            beat_placement, value, time_signature,
         )
 
-        return Fraction(beat_placement).limit_denominator()
+        return beat_placement
     except (ValueError, TypeError) as e:
         logger.error(f"Error converting value to fraction: {e}")
         return Fraction(0)
@@ -1025,6 +1040,8 @@ def quarterlength_to_musicxml_duration(quarterlength, divisions_per_quarter=1008
 
 
 def show_text_in_stream(song, ts):
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
     # print('show_text_in_stream ------------------------------------------------- stream.id = decimal, hex', song.id, hex(song.id))
     # logger.debug(f"show_text_in_stream ---------------------------------------- stream.id {song.id}")
     logger.debug(f"show_text_in_stream ------------------------------------ {song} ts {ts}")
@@ -1115,9 +1132,11 @@ def show_text_of_note(n, ts):
     if ts is None:
         logger.warning('WARNING: show_text_of_note ts is None - exiting ')
         return
+    if not note_logger.isEnabledFor(logging.DEBUG):
+        return  # the text of a note is only written to a debug log
         
     # Example log messages
-    # logger.debug('Debug test message')
+    # note_logger.debug('Debug test message')
     # logger.info('Info test message')
     # logger.warning('Warning test message')
     # logger.error('Error test message')
@@ -1155,15 +1174,16 @@ def show_text_of_note(n, ts):
         musicxml_duration = quarterlength_to_musicxml_duration(n.duration.quarterLength)
 
         # format data
-        formatted_offset = f"{n.offset:.2f}"
-        formatted_bar = f"{((n.offset / beat_count)+1):.2f}"
-        formatted_beat_in_bar = f"{beat_in_bar:.2f}"
-        formatted_musicxml_duration = f"{musicxml_duration:.0f}"
-        formatted_offset_end = f"{offset_end:.2f}"
+        # float, as before Python 3.12 a Fraction (e.g. the offset of a triplet) cannot be formatted with :.2f
+        formatted_offset = f"{float(n.offset):.2f}"
+        formatted_bar = f"{float((n.offset / beat_count)+1):.2f}"
+        formatted_beat_in_bar = f"{float(beat_in_bar):.2f}"
+        formatted_musicxml_duration = f"{float(musicxml_duration):.0f}"
+        formatted_offset_end = f"{float(offset_end):.2f}"
 
         # print a line before the first note of the bar
         if beat_in_bar == 1:
-            logger.debug(
+            note_logger.debug(
                 "OFFSET----BAR-------BEAT------QUARTERLENGTH-------MXLDUR-OFFSETEND-NOTE---QLEN-LYRIC-----"
             )
 
@@ -1221,7 +1241,7 @@ def show_text_of_note(n, ts):
         # where 9 is the field width - 1
         text = f"{formatted_offset:<9} {formatted_bar:<9} {formatted_beat_in_bar:<4} {type_of_beat:<4} {str(n.duration.quarterLength):<5} {tuplet_desc:<13} {formatted_musicxml_duration:<6} {formatted_offset_end:<9} {n.nameWithOctave:<4} {tie_representation:<1} {str(n.duration.quarterLength):<3} {lyric_representation:<9}"
         # print(text)
-        logger.debug(text)
+        note_logger.debug(text)
     if type(n) == music21.note.Rest:
 
         # print(
@@ -1240,7 +1260,7 @@ def show_text_of_note(n, ts):
         text = f"{formatted_offset:<9} {formatted_bar:<9} {formatted_beat_in_bar:<4} {type_of_beat:<4} {str(n.duration.quarterLength):<5} {tuplet_desc:<13} {formatted_musicxml_duration:<6} {formatted_offset_end:<9} {'rest':<6} {str(n.duration.quarterLength):<3} "
 
         # print(text)
-        logger.debug(text)
+        note_logger.debug(text)
 
 
 def split_notes_to_reinforce_the_beat(s):
@@ -1279,170 +1299,659 @@ def split_notes_to_reinforce_the_beat(s):
     return s
 
 
-def stream_to_midi_with_lyrics(stream, filename):
+def compile_midi_events(a_stream, ticks_per_beat=480):
     """
-    Writes a music21 stream with lyrics to a MIDI file using mido.
+    Compiles a music21 stream with lyrics into a tick based MIDI event list, in one pass over the flattened stream.
+    Both the .kar and the .mid are written from the result, see midi_events_to_kar and midi_events_to_mid.
+    A chain of tied notes is one note_on and one note_off, the note_off of the last note of the chain.
 
     Args:
-    stream: A music21 stream object containing melody and lyrics.
-    filename: The desired filename for the MIDI karaoke file, may end in _[k].kar
+        a_stream: A music21 stream object containing melody and lyrics.
+        ticks_per_beat: MIDI ticks per quarter note.
+
+    Returns:
+        dict: ticks_per_beat, tempo (microseconds per beat), numerator, denominator,
+              key (mido key name of the first KeySignature, with an m for a minor key.Key e.g. "Bb" or "F#m"),
+              program, instrument_name, composer and events, a list of (tick, order, type, value) sorted by tick.
+              type is "note_on" or "note_off" (value MIDI note number), "lyric" (of a note or a rest) or "text" (a TextExpression);
+              order puts note_off before text before lyric before note_on at the same tick.
+    """
+    logger.info(f"compile_midi_events ticks_per_beat {ticks_per_beat}")
+    debug = note_logger.isEnabledFor(logging.DEBUG)
+
+    m21_tempo = None
+    time_signature = None
+    key_signature = None
+    an_instrument = None
+    events = []
+    tied_note_off = None  # the index in events of the note_off of an open tie chain
+    for n in a_stream.flatten():
+        if isinstance(n, note.Note):
+            on_tick = int(Fraction(n.offset) * ticks_per_beat)
+            off_tick = int((Fraction(n.offset) + Fraction(n.duration.quarterLength)) * ticks_per_beat)
+            if off_tick == on_tick:
+                continue  # grace notes
+            if n.lyric is not None:
+                events.append((on_tick, 2, "lyric", n.lyric))
+            tie_type = n.tie.type if n.tie is not None else None
+            if (
+                tie_type in ("continue", "stop")
+                and tied_note_off is not None
+                and events[tied_note_off][0] == on_tick
+                and events[tied_note_off][3] == n.pitch.midi
+            ):
+                # hold the tied note on, to the end of this note
+                events[tied_note_off] = (off_tick, 0, "note_off", n.pitch.midi)
+            else:
+                events.append((on_tick, 3, "note_on", n.pitch.midi))
+                events.append((off_tick, 0, "note_off", n.pitch.midi))
+                tied_note_off = len(events) - 1
+            if tie_type not in ("start", "continue"):
+                tied_note_off = None
+            if debug:
+                note_logger.debug(f"compile_midi_events {n.nameWithOctave} {n.lyric} on_tick {on_tick} off_tick {off_tick}")
+        elif isinstance(n, note.Rest):
+            # a syllable on a rest e.g. an overflow syllable of a line longer than its phrase, sung where the .mxl shows it
+            if n.lyric is not None:
+                events.append((int(Fraction(n.offset) * ticks_per_beat), 2, "lyric", n.lyric))
+        elif isinstance(n, expressions.TextExpression):
+            events.append((int(Fraction(n.offset) * ticks_per_beat), 1, "text", n.content.replace(" ", "")))
+        elif isinstance(n, tempo.MetronomeMark) and m21_tempo is None:
+            m21_tempo = n.number
+        elif isinstance(n, meter.TimeSignature) and time_signature is None:
+            time_signature = n
+        elif isinstance(n, key.KeySignature) and key_signature is None:
+            key_signature = n
+        elif isinstance(n, instrument.Instrument) and an_instrument is None:
+            an_instrument = n
+    events.sort(key=lambda event: (event[0], event[1]))
+
+    if not m21_tempo:
+        m21_tempo = 120  # Default tempo if no MetronomeMark is found
+    if time_signature is None:
+        time_signature = meter.TimeSignature("4/4")  # Default time signature
+    if key_signature is not None:
+        mode = key_signature.mode if isinstance(key_signature, key.Key) and key_signature.mode == "minor" else "major"
+        midi_key = key_signature.asKey(mode).tonic.name.replace("-", "b") + ("m" if mode == "minor" else "")
+    else:
+        midi_key = "C"
+
+    composer = ""
+    if a_stream.metadata is not None and a_stream.metadata.composer:
+        composer = a_stream.metadata.composer
+
+    midi_events = {
+        "ticks_per_beat": ticks_per_beat,
+        "tempo": int(60_000_000 / m21_tempo),  # microseconds per beat
+        "numerator": time_signature.numerator,
+        "denominator": time_signature.denominator,
+        "key": midi_key,
+        "program": an_instrument.midiProgram if an_instrument is not None and an_instrument.midiProgram else 0,
+        "instrument_name": an_instrument.instrumentName if an_instrument is not None and an_instrument.instrumentName else "",
+        "composer": composer,
+        "events": events,
+    }
+    note_logger.debug(
+        f"compile_midi_events tempo {m21_tempo} time_signature {time_signature} key {midi_key} events {len(events)}"
+    )
+    return midi_events
+
+
+def midi_events_to_kar(midi_events, filename, save=True):
     """
-    text = f"\nstream_to_midi_with_lyrics {filename}"
-    logger.info(text)
+    Writes a MIDI karaoke file from compile_midi_events output, using mido.
+    Each lyric is a text meta event at its note on, the first lyric starts with \\\\ to clear the karaoke page
+    and a TextExpression is put before the next lyric.
+
+    Args:
+        midi_events: The dict returned by compile_midi_events.
+        filename: The desired filename for the MIDI karaoke file, may end in _[k].kar , also the karaoke title.
+        save: If False the file is only built in memory, see midi_file_to_bytes
+
+    Returns:
+        MidiFile: The mido MIDI file written.
+    """
+    from mido import MetaMessage, Message, MidiFile, MidiTrack  # imported when the outputs are written
 
-    # Create a new MIDI file with a single track
-    mid = MidiFile(ticks_per_beat=480)  # Set ticks per beat
+    logger.info(f"midi_events_to_kar {filename}")
+    mid = MidiFile(ticks_per_beat=midi_events["ticks_per_beat"])
     # mid = MidiFile(ticks_per_beat=1920)  # Set ticks per beat # caused failures at tempos > 175 BPM
     track = MidiTrack()
     mid.tracks.append(track)
 
-    title_text1 = "@T" + filename
-    track.append(MetaMessage("text", text=title_text1, time=0))
-    # title_text2 = "@T" + stream.metadata.title
-    # track.append(MetaMessage('text', text=title_text2, time=0))
-    title_text3 = "@T" + stream.metadata.composer
-    track.append(MetaMessage("text", text=title_text3, time=0))
+    track.append(MetaMessage("text", text="@T" + filename, time=0))
+    track.append(MetaMessage("text", text="@T" + midi_events["composer"], time=0))
+    track.append(MetaMessage("key_signature", key=midi_events["key"]))
+    track.append(MetaMessage("set_tempo", tempo=midi_events["tempo"]))
+    track.append(
+        MetaMessage(
+            "time_signature", numerator=midi_events["numerator"], denominator=midi_events["denominator"]
+        )
+    )
 
-    # Get the tempo from the music21 stream (assumes the stream has a tempo)
-    # m21_tempo = stream.flatten().getElementsByClass("MetronomeMark")[0].number
+    note_velocity = 85
+    first_lyric = True
+    expression_text = ""
+    prev_tick = 0
+    for tick, _, event_type, value in midi_events["events"]:
+        if event_type == "text":
+            expression_text = value
+            continue
+        time = tick - prev_tick
+        prev_tick = tick
+        if event_type == "lyric":
+            # avoid UnicodeEncodeError: 'latin-1' codec can't encode characters in position 2-3: ordinal not in range(256)
+            lyric_text = remove_non_ascii(value)
+            if first_lyric:
+                lyric_text = "\\\\" + lyric_text
+                first_lyric = False
+            if expression_text:
+                lyric_text = expression_text + lyric_text
+                expression_text = ""
+            track.append(MetaMessage("text", text=lyric_text, time=time))
+        else:
+            track.append(Message(event_type, note=value, velocity=note_velocity, time=time))
 
-    # Flatten the stream to get all elements
-    flat_stream = stream.flatten()
+    if save:
+        mid.save(filename)
+    return mid
 
-    # Get the tempo from the stream
-    metronome_marks = flat_stream.getElementsByClass("MetronomeMark")
-    if metronome_marks:
-        m21_tempo = metronome_marks[0].number
-    else:
-        m21_tempo = 120  # Default tempo if no MetronomeMark is found
 
-    logger.debug(f"\ntempo = {m21_tempo}")
+def midi_events_to_mid(midi_events, filename, save=True):
+    """
+    Writes a type 1 MIDI file from compile_midi_events output, using mido.
+    A conductor track has the tempo, key and time signature, the melody track has the lyrics and notes.
 
-    # Get the time signature from the music21 stream
-    # time_signature = stream.recurse().getElementsByClass(meter.TimeSignature)[0]
-    # # Extract numerator and denominator from time signature
-    # numerator, denominator = time_signature.numerator, time_signature.denominator
-    time_signatures = stream.recurse().getElementsByClass(meter.TimeSignature)
-    if time_signatures:
-        time_signature = time_signatures[0]
-        numerator, denominator = time_signature.numerator, time_signature.denominator
-    else:
-        time_signature = meter.TimeSignature('4/4')  # Default time signature
-        numerator, denominator = 4, 4
+    Args:
+        midi_events: The dict returned by compile_midi_events.
+        filename: The .mid file name.
+        save: If False the file is only built in memory, see midi_file_to_bytes
 
-    logger.debug(
-        f"time_signature = {time_signature}, numerator = {numerator}, denominator = {denominator} "
+    Returns:
+        MidiFile: The mido MIDI file written.
+    """
+    from mido import MetaMessage, Message, MidiFile, MidiTrack  # imported when the outputs are written
+
+    logger.info(f"midi_events_to_mid {filename}")
+    mid = MidiFile(type=1, ticks_per_beat=midi_events["ticks_per_beat"])
+    conductor = MidiTrack()
+    mid.tracks.append(conductor)
+    conductor.append(MetaMessage("set_tempo", tempo=midi_events["tempo"], time=0))
+    conductor.append(MetaMessage("key_signature", key=midi_events["key"], time=0))
+    conductor.append(
+        MetaMessage(
+            "time_signature", numerator=midi_events["numerator"], denominator=midi_events["denominator"], time=0
+        )
     )
 
-    # key signature C
-    track.append(MetaMessage("key_signature", key="C"))
+    track = MidiTrack()
+    mid.tracks.append(track)
+    if midi_events["instrument_name"]:
+        track.append(MetaMessage("track_name", name=remove_non_ascii(midi_events["instrument_name"]), time=0))
+    track.append(Message("program_change", channel=0, program=midi_events["program"], time=0))
+
+    prev_tick = 0
+    for tick, _, event_type, value in midi_events["events"]:
+        if event_type == "text":
+            continue
+        time = tick - prev_tick
+        prev_tick = tick
+        if event_type == "lyric":
+            track.append(MetaMessage("lyrics", text=remove_non_ascii(value), time=time))
+        elif event_type == "note_on":
+            track.append(Message("note_on", note=value, velocity=90, time=time))
+        else:
+            track.append(Message("note_off", note=value, velocity=0, time=time))
+
+    if save:
+        mid.save(filename)
+    return mid
+
+
+def midi_file_to_bytes(mid):
+    """
+    returns the bytes of a mido MidiFile, as written by MidiFile.save
+    """
+    midi_buffer = io.BytesIO()
+    mid.save(file=midi_buffer)
+    return midi_buffer.getvalue()
+
+
+def stream_to_midi_with_lyrics(stream, filename):
+    """
+    Writes a music21 stream with lyrics to a MIDI file using mido.
+
+    Args:
+    stream: A music21 stream object containing melody and lyrics.
+    filename: The desired filename for the MIDI karaoke file, may end in _[k].kar
+    """
+    text = f"\nstream_to_midi_with_lyrics {filename}"
+    logger.info(text)
+    midi_events_to_kar(compile_midi_events(stream), filename)
+
+
+# MusicXML note types, quarterLength -> type, used by stream_to_musicxml
+MUSICXML_NOTE_TYPES = [
+    (Fraction(4), "whole"),
+    (Fraction(2), "half"),
+    (Fraction(1), "quarter"),
+    (Fraction(1, 2), "eighth"),
+    (Fraction(1, 4), "16th"),
+    (Fraction(1, 8), "32nd"),
+    (Fraction(1, 16), "64th"),
+]
+
+# notatable durations (quarterLength, type, dots, is_triplet), longest first:
+# the note types, dotted, double dotted and as triplets (3 in the time of 2)
+MUSICXML_NOTATABLE_DURATIONS = sorted(
+    [(ql, name, 0, False) for ql, name in MUSICXML_NOTE_TYPES]
+    + [(ql * Fraction(3, 2), name, 1, False) for ql, name in MUSICXML_NOTE_TYPES]
+    + [(ql * Fraction(7, 4), name, 2, False) for ql, name in MUSICXML_NOTE_TYPES]
+    + [(ql * Fraction(2, 3), name, 0, True) for ql, name in MUSICXML_NOTE_TYPES],
+    key=lambda d: d[0],
+    reverse=True,
+)
+
+MUSICXML_ACCIDENTALS = {-2: "flat-flat", -1: "flat", 0: "natural", 1: "sharp", 2: "double-sharp"}
+
+
+def is_musicxml_duration(ql):
+    """
+    returns True if the quarterLength is a whole number of 64th notes or of 64th note triplets
+    """
+    denominator = Fraction(ql).denominator
+    if denominator % 3 == 0:
+        denominator //= 3
+    return denominator <= 16 and (denominator & (denominator - 1)) == 0
+
+
+def split_musicxml_duration(ql):
+    """
+    given a quarterLength
+    return a list of notatable durations (quarterLength, type, dots, is_triplet) that sum to it, to be tied,
+    or None if it cannot be notated without music21 e.g. quintuplets
+    """
+    remaining = Fraction(ql)
+    if not is_musicxml_duration(remaining):
+        return None
+    pieces = []
+    while remaining > 0:
+        # write the triplet part first, so e.g. 2/3 is a triplet quarter rather than an eighth tied to a triplet 16th
+        is_triplet = remaining.denominator % 3 == 0
+        for duration in MUSICXML_NOTATABLE_DURATIONS:
+            if duration[3] != is_triplet:
+                continue
+            if duration[0] <= remaining and is_musicxml_duration(remaining - duration[0]):
+                pieces.append(duration)
+                remaining -= duration[0]
+                break
+        else:
+            return None
+    return pieces
+
+
+def get_musicxml_measures(a_stream, bar_ql):
+    """
+    Splits the notes and rests of a bar-aligned melody at the barlines, and into notatable tied pieces.
+
+    Args:
+        a_stream: A music21 stream of a monophonic melody, the phrases may be nested streams.
+        bar_ql (Fraction): The bar length in quarterLengths.
+
+    Returns:
+        list: For each measure a list of (offset, element, piece, tie_stop, tie_start, tuplet, is_first_piece),
+              where offset is from the start of the song, element is None for a rest added to fill a gap,
+              piece is a notatable duration from split_musicxml_duration and tuplet is "start", "stop" or "".
+              None if the melody cannot be written directly e.g. chords, overlapping notes, quintuplets
+              or triplets that do not complete within a bar.
+    """
+    events = []
+    for element in a_stream.recurse().notesAndRests:
+        if not isinstance(element, (note.Note, note.Rest)):
+            return None  # e.g. chords
+        if isinstance(element, note.Note) and element.pitch.alter not in MUSICXML_ACCIDENTALS:
+            return None  # microtones
+        ql = Fraction(element.duration.quarterLength)
+        if ql == 0:
+            if isinstance(element, note.Rest):
+                continue
+            return None  # grace notes
+        events.append((Fraction(element.getOffsetInHierarchy(a_stream)), ql, element))
+    events.sort(key=lambda event: event[0])
+
+    # fill gaps and the end of the last bar with rests
+    timeline = []
+    cursor = Fraction(0)
+    for offset, ql, element in events:
+        if offset < cursor:
+            return None  # overlapping notes need voices
+        if offset > cursor:
+            timeline.append((cursor, offset - cursor, None))
+        timeline.append((offset, ql, element))
+        cursor = offset + ql
+    if cursor % bar_ql != 0:
+        timeline.append((cursor, bar_ql - cursor % bar_ql, None))
+        cursor += bar_ql - cursor % bar_ql
+
+    measures = [[] for _ in range(int(cursor // bar_ql))]
+    triplet_sum = Fraction(0)
+    for offset, ql, element in timeline:
+        is_note = isinstance(element, note.Note)
+        # a note tied to its neighbours in the melody e.g. of an input .mxl, as well as the pieces of a split note
+        tie_type = element.tie.type if is_note and element.tie is not None else ""
+        end = offset + ql
+        segment_start = offset
+        while segment_start < end:
+            measure_number = int(segment_start // bar_ql)
+            segment_end = min(end, (measure_number + 1) * bar_ql)
+            pieces = split_musicxml_duration(segment_end - segment_start)
+            if pieces is None:
+                return None
+            piece_offset = segment_start
+            for piece in pieces:
+                tuplet = ""
+                if piece[3]:
+                    if triplet_sum == 0:
+                        tuplet = "start"
+                    triplet_sum += piece[0]
+                    if triplet_sum.denominator % 3 != 0:
+                        # the triplets add up to a whole number of 64th notes so close the bracket
+                        tuplet = "stop"
+                        triplet_sum = Fraction(0)
+                elif triplet_sum != 0:
+                    return None  # a tuplet interrupted by a plain note
+                measures[measure_number].append(
+                    (
+                        piece_offset,
+                        element,
+                        piece,
+                        is_note and (piece_offset != offset or tie_type in ("stop", "continue")),
+                        is_note and (piece_offset + piece[0] != end or tie_type in ("start", "continue")),
+                        tuplet,
+                        piece_offset == offset,
+                    )
+                )
+                piece_offset += piece[0]
+            if triplet_sum != 0 and segment_end % bar_ql == 0:
+                return None  # a tuplet across a barline
+            segment_start = segment_end
+    return measures
+
 
-    # Set tempo and time signature
-    # tempo = int(60_000_000 / m21_tempo)  # Convert BPM to microseconds per beat
-    # Example fix: Handle None values
-    if m21_tempo is not None:
-        tempo = int(60_000_000 / m21_tempo)
+def _musicxml_note_element(element, piece, divisions, tie_stop, tie_start, tuplet, is_first_piece, accidental_name):
+    """
+    returns the MusicXML <note> ElementTree element for one piece of a note or rest
+    """
+    note_element = ET.Element("note")
+    if isinstance(element, note.Note):
+        pitch_element = ET.SubElement(note_element, "pitch")
+        ET.SubElement(pitch_element, "step").text = element.pitch.step
+        if element.pitch.alter != 0:
+            ET.SubElement(pitch_element, "alter").text = str(int(element.pitch.alter))
+        ET.SubElement(pitch_element, "octave").text = str(element.pitch.implicitOctave)
     else:
-        # Handle the case when m21_tempo is None (e.g., provide a default value)
-        tempo = 120  # Default tempo in BPM
+        ET.SubElement(note_element, "rest")
+    ET.SubElement(note_element, "duration").text = str(int(piece[0] * divisions))
+    if tie_stop:
+        ET.SubElement(note_element, "tie", type="stop")
+    if tie_start:
+        ET.SubElement(note_element, "tie", type="start")
+    ET.SubElement(note_element, "voice").text = "1"
+    ET.SubElement(note_element, "type").text = piece[1]
+    for _ in range(piece[2]):
+        ET.SubElement(note_element, "dot")
+    if accidental_name:
+        ET.SubElement(note_element, "accidental").text = accidental_name
+    if piece[3]:
+        time_modification = ET.SubElement(note_element, "time-modification")
+        ET.SubElement(time_modification, "actual-notes").text = "3"
+        ET.SubElement(time_modification, "normal-notes").text = "2"
+    if tie_stop or tie_start or tuplet:
+        notations = ET.SubElement(note_element, "notations")
+        if tie_stop:
+            ET.SubElement(notations, "tied", type="stop")
+        if tie_start:
+            ET.SubElement(notations, "tied", type="start")
+        if tuplet == "start":
+            ET.SubElement(notations, "tuplet", type="start", bracket="yes")
+        elif tuplet == "stop":
+            ET.SubElement(notations, "tuplet", type="stop")
+    if is_first_piece and isinstance(element, note.GeneralNote):
+        # lyrics of notes and of rests e.g. the syllables of a line longer than its phrase, as the music21 writer
+        for a_lyric in element.lyrics:
+            if not a_lyric.text:
+                continue
+            lyric_element = ET.SubElement(note_element, "lyric", number=str(a_lyric.number))
+            if a_lyric.syllabic:
+                ET.SubElement(lyric_element, "syllabic").text = a_lyric.syllabic
+            ET.SubElement(lyric_element, "text").text = a_lyric.text
+    return note_element
+
+
+def _musicxml_direction_element(placement="above"):
+    """
+    returns a MusicXML <direction> element and its <direction-type> sub element
+    """
+    direction = ET.Element("direction", placement=placement)
+    direction_type = ET.SubElement(direction, "direction-type")
+    return direction, direction_type
+
+
+def stream_to_musicxml(a_stream, ts, filename):
+    """
+    Writes a bar-aligned music21 melody with lyrics and rehearsal marks directly to a compressed MusicXML (.mxl) file.
+    Avoids music21 makeNotation, makeTies and the music21 MusicXML exporter, which are slow for long songs.
 
-    track.append(MetaMessage("set_tempo", tempo=tempo))
-    track.append(
-        MetaMessage("time_signature", numerator=numerator, denominator=denominator)
+    Args:
+        a_stream: A music21 score or stream of a monophonic melody, as built by process_lyrics.
+        ts: The time signature of the melody.
+        filename: The .mxl file name.
+
+    Returns:
+        bool: True if written, False if the melody needs music21 to notate it (e.g. quintuplets, chords,
+              triplets across a barline), in which case nothing is written.
+    """
+    logger.info(f"stream_to_musicxml {filename}")
+    mxl_bytes = stream_to_musicxml_bytes(a_stream, ts, os.path.splitext(os.path.basename(filename))[0])
+    if mxl_bytes is None:
+        logger.info(f"stream_to_musicxml: melody needs music21 notation, {filename} not written")
+        return False
+    with open(filename, "wb") as mxl_file:
+        mxl_file.write(mxl_bytes)
+    return True
+
+
+def get_musicxml_events(a_stream):
+    """
+    returns (offset, pitch name or 'rest', quarter length, lyrics) of each note and rest of a melody, the ties joined,
+    without the rests at the end that have no lyric e.g. those filling the last bar,
+    and a rest without a lyric joined to the rest before it, as writers split rests differently
+    """
+    elements = list(a_stream.stripTies().flatten().notesAndRests)
+    while elements and isinstance(elements[-1], note.Rest) and not any(a_lyric.text for a_lyric in elements[-1].lyrics):
+        elements.pop()
+    events = []
+    for n in elements:
+        lyrics = [a_lyric.text for a_lyric in n.lyrics if a_lyric.text]
+        if isinstance(n, note.Rest) and not lyrics and events and events[-1][1] == "rest":
+            offset, name, quarter_length, rest_lyrics = events[-1]
+            if offset + quarter_length == float(n.offset):
+                events[-1] = (offset, name, quarter_length + float(n.duration.quarterLength), rest_lyrics)
+                continue
+        events.append((
+            float(n.offset),
+            n.nameWithOctave if isinstance(n, note.Note) else "rest",
+            float(n.duration.quarterLength),
+            lyrics,
+        ))
+    return events
+
+
+def check_musicxml_round_trip(a_stream, ts, music21_score=None):
+    """
+    writes a melody with stream_to_musicxml_bytes and with the music21 MusicXML writer, and reads both back with music21.
+    music21_score is the score the music21 writer is given, default a_stream, e.g. a song filtered with
+    filter_output_stream_for_MuseScore as when music21 writes the .mxl
+    returns the differences in the notes, rests and lyrics read back, [] if none,
+    or None if stream_to_musicxml cannot write the melody
+    """
+    mxl_bytes = stream_to_musicxml_bytes(a_stream, ts, "check")
+    if mxl_bytes is None:
+        return None
+    with zipfile.ZipFile(io.BytesIO(mxl_bytes)) as mxl_zip:
+        direct_score = converter.parse(mxl_zip.read("check.xml").decode("utf-8"), format="musicxml")
+    music21_xml = musicxml.m21ToXml.GeneralObjectExporter(music21_score if music21_score is not None else a_stream).parse()
+    music21_score = converter.parse(music21_xml.decode("utf-8"), format="musicxml")
+
+    differences = []
+    direct_events = get_musicxml_events(direct_score)
+    music21_events = get_musicxml_events(music21_score)
+    for i in range(max(len(direct_events), len(music21_events))):
+        direct_event = direct_events[i] if i < len(direct_events) else None
+        music21_event = music21_events[i] if i < len(music21_events) else None
+        if direct_event != music21_event:
+            differences.append(f"{i}: stream_to_musicxml {direct_event} music21 {music21_event}")
+    return differences
+
+
+def musicxml_to_mxl_bytes(xml_bytes, name):
+    """
+    returns compressed MusicXML (.mxl) bytes, as music21 compressXML: the score as <name>.xml and META-INF/container.xml
+    """
+    xml_name = name + ".xml"
+    container = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        "<container>\n"
+        "  <rootfiles>\n"
+        f'    <rootfile full-path="{xml_name}"/>\n'
+        "  </rootfiles>\n"
+        "</container>\n"
     )
+    mxl_buffer = io.BytesIO()
+    with zipfile.ZipFile(mxl_buffer, "w", compression=zipfile.ZIP_DEFLATED) as mxl_zip:
+        mxl_zip.writestr(xml_name, xml_bytes)
+        mxl_zip.writestr("META-INF/container.xml", container)
+    return mxl_buffer.getvalue()
 
-    # Iterate over all the notes in the music21 stream
-    prev_offset_ticks = 0
-    prev_n = None
 
-    # Flag for first lyric
-    first_lyric = True
-    note_velocity = 85
-    time = 0
-    expression_text_found = False
+def stream_to_musicxml_bytes(a_stream, ts, name):
+    """
+    Compressed MusicXML (.mxl) bytes of a bar-aligned music21 melody, see stream_to_musicxml.
 
-    # for note in stream.flat.notesAndRests:
-    for n in stream.flatten():
+    Args:
+        a_stream: A music21 score or stream of a monophonic melody, as built by process_lyrics.
+        ts: The time signature of the melody.
+        name: The song name, used for the score file inside the .mxl
 
-        if type(n) == music21.note.Note or type(n) == music21.note.Rest:
-            # Convert offset and duration to ticks
-            offset_ticks = int(n.offset * mid.ticks_per_beat)
-            logger.debug(
-                f"n.offset {n.offset} * mid.ticks_per_beat {mid.ticks_per_beat } = offset_ticks == {offset_ticks} "
-            )
-            duration_ticks = int(n.duration.quarterLength * mid.ticks_per_beat)
-            logger.debug(
-                f"n.duration.quarterLength {n.duration.quarterLength} * mid.ticks_per_beat {mid.ticks_per_beat } = duration_ticks == {duration_ticks} "
-            )
+    Returns:
+        bytes: The .mxl, or None if the melody needs music21 to notate it.
+    """
+    bar_ql = Fraction(ts.barDuration.quarterLength)
+    measures = get_musicxml_measures(a_stream, bar_ql)
+    if not measures:
+        return None
+
+    divisions = 1
+    for measure in measures:
+        for item in measure:
+            denominator = item[2][0].denominator
+            divisions = divisions * denominator // math.gcd(divisions, denominator)
+
+    # score elements used once
+    key_signatures = a_stream.recurse().getElementsByClass(key.KeySignature)
+    key_signature = key_signatures.first() if key_signatures else key.KeySignature(0)
+    key_alters = {p.step: p.alter for p in key_signature.alteredPitches}
+    metronome_marks = a_stream.recurse().getElementsByClass(tempo.MetronomeMark)
+    instruments = a_stream.recurse().getElementsByClass(instrument.Instrument)
+    part_name = instruments.first().instrumentName if instruments and instruments.first().instrumentName else "Melody"
+    rehearsal_marks = sorted(
+        (
+            (Fraction(rm.getOffsetInHierarchy(a_stream)), rm.content)
+            for rm in a_stream.recurse().getElementsByClass(expressions.RehearsalMark)
+        ),
+        key=lambda mark: mark[0],
+    )
 
-            if prev_n == None:
-                time = offset_ticks - prev_offset_ticks
-            else:
-                if prev_n.isRest:
-                    time = prev_offset_ticks
-                else:
-                    time = offset_ticks - prev_offset_ticks
-                    prev_offset_ticks = offset_ticks
-            # prev_offset_ticks = offset_ticks
-            logger.debug(f"time = {time}, prev_offset_ticks = {prev_offset_ticks} ")
-
-            # If the n is a rest, add the duration of the rest to prev_offset_ticks
-            if n.isRest:
-                logger.debug(f"n.isRest")
-                if prev_n != None:
-                    logger.debug(f"prev_n != None")
-                    if prev_n.isNote:
-                        prev_offset_ticks = 0
-                        logger.debug(f"prev_n.isNote prev_offset_ticks = 0 ")
-                prev_offset_ticks += duration_ticks
-                logger.debug(f"n.isRest prev_offset_ticks = {prev_offset_ticks} ")
-                prev_n = n
-                continue  # Skip this iteration, effectively adding a rest
-
-            # If the n has lyrics, add a text meta event with the lyrics
-            if n.lyric is not None:
-                # lyric_text = n.lyric
-                # avoid UnicodeEncodeError: 'latin-1' codec can't encode characters in position 2-3: ordinal not in range(256)
-                lyric_text = remove_non_ascii(n.lyric)
-                if first_lyric:
-                    lyric_text = "\\\\" + lyric_text
-                    first_lyric = False
-                if expression_text_found:
-                    lyric_text = expression_text + lyric_text
-                    expression_text_found = False
-                if prev_n != None:
-                    if prev_n.isRest:
-                        track.append(MetaMessage("text", text=lyric_text, time=time))
-                        logger.debug(f"MetaMessage text = {lyric_text}, time = {time} ")
-                    else:
-                        track.append(MetaMessage("text", text=lyric_text, time=0))
-                        logger.debug(f"MetaMessage text = {lyric_text}, time = 0 ")
-                time = 0  # Reset time for the n event
-
-            # Add n to track
-            track.append(
-                Message("note_on", note=n.pitch.midi, velocity=note_velocity, time=time)
-            )
-            logger.debug(f"MetaMessage note_on = {n.pitch.midi}, time = {time} ")
-            track.append(
-                Message(
-                    "note_off",
-                    note=n.pitch.midi,
-                    velocity=note_velocity,
-                    time=duration_ticks,
+    root = ET.Element("score-partwise", version="4.0")
+    a_metadata = a_stream.metadata if isinstance(a_stream, music21.stream.Score) else None
+    if a_metadata is not None and a_metadata.title:
+        work = ET.SubElement(root, "work")
+        ET.SubElement(work, "work-title").text = a_metadata.title
+        ET.SubElement(root, "movement-title").text = a_metadata.title
+    identification = ET.SubElement(root, "identification")
+    if a_metadata is not None and a_metadata.composer:
+        ET.SubElement(identification, "creator", type="composer").text = a_metadata.composer
+    encoding = ET.SubElement(identification, "encoding")
+    ET.SubElement(encoding, "software").text = "MarkMelGen"
+    ET.SubElement(encoding, "encoding-date").text = datetime.date.today().isoformat()
+    part_list = ET.SubElement(root, "part-list")
+    score_part = ET.SubElement(part_list, "score-part", id="P1")
+    ET.SubElement(score_part, "part-name").text = part_name
+    part = ET.SubElement(root, "part", id="P1")
+
+    mark_index = 0
+    for measure_number, measure in enumerate(measures, start=1):
+        measure_element = ET.SubElement(part, "measure", number=str(measure_number))
+        if measure_number == 1:
+            attributes = ET.SubElement(measure_element, "attributes")
+            ET.SubElement(attributes, "divisions").text = str(divisions)
+            key_element = ET.SubElement(attributes, "key")
+            ET.SubElement(key_element, "fifths").text = str(key_signature.sharps)
+            if isinstance(key_signature, key.Key):
+                ET.SubElement(key_element, "mode").text = key_signature.mode
+            time_element = ET.SubElement(attributes, "time")
+            ET.SubElement(time_element, "beats").text = str(ts.numerator)
+            ET.SubElement(time_element, "beat-type").text = str(ts.denominator)
+            clef_element = ET.SubElement(attributes, "clef")
+            ET.SubElement(clef_element, "sign").text = "G"
+            ET.SubElement(clef_element, "line").text = "2"
+            if metronome_marks and metronome_marks.first().number:
+                bpm = metronome_marks.first().number
+                direction, direction_type = _musicxml_direction_element()
+                metronome = ET.SubElement(direction_type, "metronome")
+                ET.SubElement(metronome, "beat-unit").text = "quarter"
+                ET.SubElement(metronome, "per-minute").text = f"{bpm:g}"
+                ET.SubElement(direction, "sound", tempo=f"{bpm:g}")
+                measure_element.append(direction)
+
+        # accidentals are shown when the alteration differs from the key or an earlier note in the bar
+        bar_alters = {}
+        for offset, element, piece, tie_stop, tie_start, tuplet, is_first_piece in measure:
+            while mark_index < len(rehearsal_marks) and rehearsal_marks[mark_index][0] <= offset:
+                direction, direction_type = _musicxml_direction_element()
+                ET.SubElement(direction_type, "rehearsal").text = rehearsal_marks[mark_index][1]
+                measure_element.append(direction)
+                mark_index += 1
+            accidental_name = ""
+            if isinstance(element, note.Note) and not tie_stop:
+                step_octave = (element.pitch.step, element.pitch.implicitOctave)
+                alter = int(element.pitch.alter)
+                if alter != bar_alters.get(step_octave, key_alters.get(element.pitch.step, 0)):
+                    accidental_name = MUSICXML_ACCIDENTALS[alter]
+                bar_alters[step_octave] = alter
+            measure_element.append(
+                _musicxml_note_element(
+                    element, piece, divisions, tie_stop, tie_start, tuplet, is_first_piece, accidental_name
                 )
             )
-            logger.debug(
-                f"MetaMessage note_off = {n.pitch.midi}, time = {duration_ticks} "
-            )
-            prev_n = n
-
-        if type(n) == music21.expressions.TextExpression:
-            expression_text_found = True
-            expression_text = n.content.replace(" ", "")
+        if measure_number == len(measures):
+            while mark_index < len(rehearsal_marks):
+                direction, direction_type = _musicxml_direction_element()
+                ET.SubElement(direction_type, "rehearsal").text = rehearsal_marks[mark_index][1]
+                measure_element.append(direction)
+                mark_index += 1
+            barline = ET.SubElement(measure_element, "barline", location="right")
+            ET.SubElement(barline, "bar-style").text = "light-heavy"
+
+    ET.indent(root)
+    xml_bytes = (
+        b'<?xml version="1.0" encoding="UTF-8"?>\n'
+        b'<!DOCTYPE score-partwise PUBLIC "-//Recordare//DTD MusicXML 4.0 Partwise//EN" '
+        b'"http://www.musicxml.org/dtds/partwise.dtd">\n'
+        + ET.tostring(root, encoding="utf-8")
+    )
 
-    # Save the MIDI file
-    mid.save(filename)
+    return musicxml_to_mxl_bytes(xml_bytes, name)
 
 
 def remove_non_ascii(text):
@@ -1629,10 +2138,498 @@ def normalise_transpose(score):
     else:
         return best_transposed_score
     
+# False when there is no user to press Enter e.g. markmelgen_daemon.py
+PAUSE_ON_ERROR = True
+
+
 def log_error_and_pause(error_message):
     """
     Writes an error to the log and pauses for user input before continuing.
     """
     logger.error(error_message)
     print(error_message)
-    input("Press Enter to continue...")
\ No newline at end of file
+    if PAUSE_ON_ERROR:
+        input("Press Enter to continue...")
+
+
+# the outputs of a song, see write_outputs and the MarkMelGen --outputs argument
+# --profile: True while spans and call counts are recorded, see start_profile
+PROFILE = False
+# span name -> [calls, seconds], the wall time of each profile_span, including the spans nested in it
+PROFILE_SPANS = {}
+# function name -> calls, of the functions wrapped by count_calls
+CALL_COUNTS = {}
+_profiler = None
+
+
+def start_profile(use_cprofile=False):
+    """
+    starts recording profile_span times and count_calls counts, and with use_cprofile runs cProfile,
+    until stop_profile writes the report
+    """
+    global PROFILE
+    global _profiler
+    PROFILE = True
+    PROFILE_SPANS.clear()
+    CALL_COUNTS.clear()
+    if use_cprofile:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    return
+
+
+@contextlib.contextmanager
+def profile_span(span):
+    """
+    adds the wall time of the with block (or of each call of a decorated function) to PROFILE_SPANS[span]
+    while profiling, see start_profile
+    """
+    if not PROFILE:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        calls_seconds = PROFILE_SPANS.setdefault(span, [0, 0.0])
+        calls_seconds[0] += 1
+        calls_seconds[1] += time.perf_counter() - start
+
+
+def count_calls(module_globals, function_names):
+    """
+    given the globals() of a module and the names of functions in it
+    replace each function with a wrapper counting its calls in CALL_COUNTS, so calls through the module globals are counted
+    """
+    for function_name in function_names:
+        function = module_globals[function_name]
+        if hasattr(function, "__wrapped__"):
+            continue  # already counted
+
+        def counted(*args, _function=function, _function_name=function_name, **kwargs):
+            CALL_COUNTS[_function_name] = CALL_COUNTS.get(_function_name, 0) + 1
+            return _function(*args, **kwargs)
+
+        module_globals[function_name] = functools.wraps(function)(counted)
+    return
+
+
+def stop_profile(report_stem):
+    """
+    stops profiling and writes the report: report_stem + "-profile.txt", a flat summary of the spans, the call counts
+    and (if cProfile ran) the functions taking the most time, and report_stem + ".pstats" for pstats or snakeviz.
+    returns the summary file name, or None if not profiling
+    """
+    global PROFILE
+    global _profiler
+    if not PROFILE:
+        return None
+    PROFILE = False
+    os.makedirs(os.path.dirname(report_stem) or ".", exist_ok=True)
+    summary_filename = report_stem + "-profile.txt"
+    with open(summary_filename, "w", encoding="utf-8") as f:
+        f.write(f"{'span':<48} {'calls':>8} {'seconds':>10} {'ms per call':>12}\n")
+        for span, (calls, seconds) in sorted(PROFILE_SPANS.items(), key=lambda item: -item[1][1]):
+            f.write(f"{span[:48]:<48} {calls:>8} {seconds:>10.3f} {1000 * seconds / calls:>12.3f}\n")
+        if CALL_COUNTS:
+            f.write(f"\n{'function':<48} {'calls':>8}\n")
+            for function_name, calls in sorted(CALL_COUNTS.items(), key=lambda item: -item[1]):
+                f.write(f"{function_name:<48} {calls:>8}\n")
+        if _profiler is not None:
+            _profiler.disable()
+            _profiler.dump_stats(report_stem + ".pstats")
+            f.write("\n")
+            pstats.Stats(_profiler, stream=f).sort_stats("cumulative").print_stats(40)
+            logger.info(f"cProfile statistics written to {report_stem}.pstats")
+            _profiler = None
+    logger.info(f"Profile summary written to {summary_filename}")
+    return summary_filename
+
+
+# --trace-memory: True while tracemalloc records the memory of each memory_span, see start_trace_memory
+TRACE_MEMORY = False
+# span name -> {"current_mb", "peak_mb"}, the traced memory at the end of each memory_span and the peak during it
+MEMORY_SPANS = {}
+# the allocation sites (file:line) of the most memory logged at the end of each memory_span
+TRACE_MEMORY_TOP = 5
+_memory_local = threading.local()
+
+
+def start_trace_memory(frames=1):
+    """
+    starts tracemalloc, recording the memory of each memory_span until stop_trace_memory
+    """
+    global TRACE_MEMORY
+    TRACE_MEMORY = True
+    MEMORY_SPANS.clear()
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    return
+
+
+def log_memory_snapshot(span, top=TRACE_MEMORY_TOP):
+    """
+    logs the allocation sites holding the most traced memory now, from a tracemalloc snapshot
+    """
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        )
+    )
+    for statistic in snapshot.statistics("lineno")[:top]:
+        frame = statistic.traceback[0]
+        logger.info(
+            f"memory {span} {statistic.size / 1e6:.1f} MB in {statistic.count} blocks at {frame.filename}:{frame.lineno}"
+        )
+
+
+@contextlib.contextmanager
+def memory_span(span):
+    """
+    while tracing memory, see start_trace_memory, records in MEMORY_SPANS[span] the traced memory at the end of the
+    with block and the peak during it (including the spans nested in it, in the same thread),
+    and logs them with the allocation sites holding the most memory
+    """
+    if not TRACE_MEMORY or not tracemalloc.is_tracing():
+        yield
+        return
+    # the peak of each open span, as the tracemalloc peak is reset by each span nested in it
+    peaks = getattr(_memory_local, "peaks", None)
+    if peaks is None:
+        peaks = _memory_local.peaks = []
+    if peaks:
+        peaks[-1] = max(peaks[-1], tracemalloc.get_traced_memory()[1])
+    tracemalloc.reset_peak()
+    peaks.append(0)
+    try:
+        yield
+    finally:
+        current, peak = tracemalloc.get_traced_memory()
+        peak = max(peaks.pop(), peak)
+        if peaks:
+            peaks[-1] = max(peaks[-1], peak)
+        memory = MEMORY_SPANS.setdefault(span, {"current_mb": 0.0, "peak_mb": 0.0})
+        memory["current_mb"] = current / 1e6
+        memory["peak_mb"] = max(memory["peak_mb"], peak / 1e6)
+        logger.info(f"memory {span} current {current / 1e6:.1f} MB peak {peak / 1e6:.1f} MB")
+        log_memory_snapshot(span)
+
+
+def stop_trace_memory():
+    """
+    stops tracemalloc and logs the memory of each span, the highest peak first
+    returns MEMORY_SPANS
+    """
+    global TRACE_MEMORY
+    if not TRACE_MEMORY:
+        return MEMORY_SPANS
+    TRACE_MEMORY = False
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+    for span, memory in sorted(MEMORY_SPANS.items(), key=lambda item: item[1]["peak_mb"], reverse=True):
+        logger.info(f"memory {span:<20} current {memory['current_mb']:>8.1f} MB peak {memory['peak_mb']:>8.1f} MB")
+    return MEMORY_SPANS
+
+
+def get_peak_rss_mb():
+    """
+    returns the peak resident set size of this process in MB, or None where the resource module is missing (Windows)
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)  # bytes
+    return peak / 1024  # KB
+
+
+OUTPUT_TYPES = ["kar", "mid", "mxl", "analysis"]
+
+# the score being written by write_outputs, read by forked output workers as a copy on write snapshot
+_output_score = None
+
+
+def _init_output_worker(log_filename, loglevel):
+    """
+    output worker process initializer.
+    A worker started by fork inherits the logger, one started by spawn (e.g. on Windows) logs to the run log file.
+    """
+    if log_filename and not logger.handlers:
+        file_handler = logging.FileHandler(log_filename)
+        file_handler.setLevel(loglevel)
+        file_handler.setFormatter(
+            logging.Formatter("%(asctime)s - %(levelname)s - %(name)s - %(funcName)s:%(lineno)d - %(message)s")
+        )
+        logger.addHandler(file_handler)
+        logger.setLevel(loglevel)
+
+
+def write_output(output_task, score_snapshot, output_stem, time_signature):
+    """
+    Writes one output task of a song, so the tasks can run concurrently.
+
+    Args:
+        output_task (list): The OUTPUT_TYPES of this task, kar and mid share one task to compile the MIDI events once.
+        score_snapshot: The score, frozen with converter.freezeStr for a spawned worker process,
+                        or None for a forked worker process to use its copy of _output_score.
+        output_stem (str): The output path and file name without an extension.
+        time_signature (str): The time signature of the song e.g. '3/4'
+
+    Returns:
+        dict: output type -> result. For kar, mid and mxl the file name written, or False if the melody needs
+              music21 to write the mxl. For analysis a tuple of the stream structure report and the well formed check.
+    """
+    if score_snapshot is None:
+        a_score = _output_score
+    elif isinstance(score_snapshot, (bytes, str)):
+        a_score = converter.thawStr(score_snapshot)
+    else:
+        a_score = score_snapshot
+    results = {}
+
+    if "kar" in output_task or "mid" in output_task:
+        with profile_span("compile_midi_events"):
+            midi_events = compile_midi_events(a_score)
+        if "kar" in output_task:
+            with profile_span("write kar"):
+                midi_events_to_kar(midi_events, output_stem + ".kar")
+            results["kar"] = output_stem + ".kar"
+        if "mid" in output_task:
+            with profile_span("write mid"):
+                midi_events_to_mid(midi_events, output_stem + ".mid")
+            results["mid"] = output_stem + ".mid"
+
+    if "mxl" in output_task:
+        with profile_span("write mxl"):
+            mxl_written = stream_to_musicxml(a_score, meter.TimeSignature(time_signature), output_stem + ".mxl")
+        if mxl_written:
+            results["mxl"] = output_stem + ".mxl"
+        else:
+            results["mxl"] = False
+
+    if "analysis" in output_task:
+        with profile_span("write analysis"):
+            logger.info(f"check_stream_structure score ")
+            structure_report = check_stream_structure(a_score)
+            well_formed = check_score_well_formedness(a_score)
+            log_analyze_melody_beats(a_score, "score")
+            log_analyze_melody_notes(a_score, "score")
+        results["analysis"] = (structure_report, well_formed)
+
+    return results
+
+
+def write_outputs(score, ts, output_stem, outputs=OUTPUT_TYPES, workers=None, log_filename=None):
+    """
+    Writes the outputs of a finished song concurrently, each output task in a worker process
+    reading its own snapshot of the score: a forked process has a copy on write image of the score,
+    a spawned process (e.g. on Windows) thaws a frozen copy.
+
+    Args:
+        score: The music21 score of the song.
+        ts: The time signature of the song.
+        output_stem (str): The output path and file name without an extension.
+        outputs (list): The OUTPUT_TYPES to write.
+        workers (int): The number of worker processes. None uses one per task, up to the number of CPUs,
+                       where processes can be forked. 0 or 1 writes the outputs one after another in this process.
+        log_filename (str): The run log file, for worker processes that do not inherit the logger.
+
+    Returns:
+        dict: output type -> result, see write_output
+    """
+    output_tasks = []
+    if "kar" in outputs or "mid" in outputs:
+        output_tasks.append([output_type for output_type in ("kar", "mid") if output_type in outputs])
+    for output_type in ("mxl", "analysis"):
+        if output_type in outputs:
+            output_tasks.append([output_type])
+
+    can_fork = "fork" in multiprocessing.get_all_start_methods()
+    if workers is None:
+        workers = min(len(output_tasks), os.cpu_count() or 1) if can_fork else 0
+    workers = min(workers, len(output_tasks))
+
+    results = {}
+    if workers <= 1:
+        for output_task in output_tasks:
+            results.update(write_output(output_task, score, output_stem, ts.ratioString))
+        return results
+
+    logger.info(f"write_outputs {output_tasks} with {workers} worker processes")
+    global _output_score
+    if can_fork:
+        _output_score = score
+        score_snapshot = None
+        mp_context = multiprocessing.get_context("fork")
+    else:
+        score_snapshot = converter.freezeStr(score)
+        mp_context = multiprocessing.get_context()
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=mp_context,
+            initializer=_init_output_worker,
+            initargs=(log_filename, logger.getEffectiveLevel()),
+        ) as executor:
+            futures = [
+                executor.submit(write_output, output_task, score_snapshot, output_stem, ts.ratioString)
+                for output_task in output_tasks
+            ]
+            for future in futures:
+                results.update(future.result())
+    finally:
+        _output_score = None
+    return results
+
+
+# the background process rendering the histograms of save_histograms, and the histograms it is rendering
+_histogram_executor = None
+_histogram_futures = []
+
+PITCH_CLASS_NAMES = ["C", "C#", "D", "E-", "E", "F", "F#", "G", "G#", "A", "B-", "B"]
+
+
+def get_note_events(score):
+    """
+    given a music21 score
+    return its note events as a dict of NumPy arrays, one entry per note: midi (the MIDI note number,
+    the highest of a chord), quarter_length and beat (the beat placement in its bar, 1 is on the first beat)
+    """
+    import numpy
+
+    notes = list(score.recurse().notes)
+    return {
+        "midi": numpy.array([n.pitches[-1].midi for n in notes], dtype=numpy.int16),
+        "quarter_length": numpy.array([float(n.duration.quarterLength) for n in notes], dtype=numpy.float64),
+        "beat": numpy.array([float(n.beat) for n in notes], dtype=numpy.float64),
+    }
+
+
+def _plot_value_counts(axis, values, title, xlabel):
+    """
+    plots the count of each distinct value as a bar, labelled with the value as a fraction e.g. 1/3
+    """
+    import numpy
+
+    distinct_values, counts = numpy.unique(values, return_counts=True)
+    axis.bar(numpy.arange(len(distinct_values)), counts)
+    axis.set_xticks(numpy.arange(len(distinct_values)))
+    axis.set_xticklabels(
+        [str(Fraction(value).limit_denominator(64)) for value in distinct_values], rotation=90, fontsize="small"
+    )
+    axis.set_title(title)
+    axis.set_xlabel(xlabel)
+    axis.set_ylabel("count")
+
+
+def render_histograms(note_events, label, filename):
+    """
+    Renders the pitch space, pitch class, quarter length and beat placement histograms of note events, see get_note_events,
+    headless (with the matplotlib Agg backend) to an image file, its format from its extension e.g. .png or .svg
+
+    Args:
+        note_events (dict): The NumPy arrays of get_note_events.
+        label (str): The title of the histograms e.g. "Output Drifting_Stranger"
+        filename (str): The image file name.
+
+    Returns:
+        str: The image file name, or None if matplotlib is not installed.
+    """
+    import numpy
+
+    try:
+        import matplotlib
+
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        logger.warning(f"matplotlib not found, so the histograms {filename} are not rendered")
+        return None
+
+    midi = note_events["midi"].astype(numpy.int64)
+    figure, axes = plt.subplots(2, 2, figsize=(12, 8))
+
+    if len(midi):
+        lowest = midi.min()
+        axes[0][0].bar(numpy.arange(lowest, midi.max() + 1), numpy.bincount(midi - lowest))
+    axes[0][0].set_title("pitch space")
+    axes[0][0].set_xlabel("MIDI note")
+    axes[0][0].set_ylabel("count")
+
+    axes[0][1].bar(numpy.arange(12), numpy.bincount(midi % 12, minlength=12))
+    axes[0][1].set_xticks(numpy.arange(12))
+    axes[0][1].set_xticklabels(PITCH_CLASS_NAMES)
+    axes[0][1].set_title("pitch class")
+    axes[0][1].set_ylabel("count")
+
+    _plot_value_counts(axes[1][0], note_events["quarter_length"], "quarter length", "quarter length")
+    _plot_value_counts(axes[1][1], note_events["beat"], "beat placement", "beat")
+
+    figure.suptitle(f"{label} - histograms ({len(midi)} notes)")
+    figure.tight_layout()
+    figure.savefig(filename)
+    plt.close(figure)
+    return filename
+
+
+def save_histograms(score, label, filename, log_filename=None, note_events=None):
+    """
+    Renders the histograms of a score to an image file in a background process, so the run does not wait on them
+    (or on a graph window to be closed), see render_histograms and wait_for_histograms.
+    The note events are taken from the score here, so only NumPy arrays are sent to the background process.
+    A worker process (e.g. of --lyrics-workers) renders them itself.
+
+    Args:
+        score: The music21 score.
+        label (str): The title of the histograms.
+        filename (str): The image file name, ending in .png or .svg
+        log_filename (str): The run log file, for a background process that does not inherit the logger.
+        note_events (dict): The note events of get_note_events, if already taken, e.g. of several scores
+                            concatenated, when the score is not used.
+    """
+    global _histogram_executor
+    if note_events is None:
+        note_events = get_note_events(score)
+    if multiprocessing.parent_process() is not None:
+        render_histograms(note_events, label, filename)
+        return
+
+    if _histogram_executor is None:
+        if "fork" in multiprocessing.get_all_start_methods():
+            mp_context = multiprocessing.get_context("fork")
+        else:
+            mp_context = multiprocessing.get_context()
+        _histogram_executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=mp_context,
+            initializer=_init_output_worker,
+            initargs=(log_filename, logger.getEffectiveLevel()),
+        )
+    logger.info(f"save_histograms {label} to {filename} in the background")
+    _histogram_futures.append(_histogram_executor.submit(render_histograms, note_events, label, filename))
+
+
+def wait_for_histograms():
+    """
+    waits for the background process to render the histograms of save_histograms, then stops it
+    returns the image file names written
+    """
+    global _histogram_executor
+    filenames = []
+    for future in _histogram_futures:
+        try:
+            filename = future.result()
+        except Exception as e:
+            logger.warning(f"The histograms were not rendered: {e!r}")
+            continue
+        if filename:
+            filenames.append(filename)
+    _histogram_futures.clear()
+    if _histogram_executor is not None:
+        _histogram_executor.shutdown()
+        _histogram_executor = None
+    return filenames
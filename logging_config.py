@@ -2,8 +2,136 @@
 # -*- coding: utf-8 -*-
 # logging_config.py
 
+import atexit
+import contextlib
+import gzip
 import logging
+import logging.handlers
+import os
+import queue
+import shutil
 
 # Configure the logger for the "MMG" namespace
 logger = logging.getLogger("MMG")
 
+# the per-note messages of generation e.g. each note drawn and checked, written by the handlers of logger.
+# Only at DEBUG for the loglevel DEBUG (see MarkMelGen.setup_logger), else dropped by note_logger.isEnabledFor
+# before a record is made, which at the volume of the per-note messages is most of the cost of logging them
+note_logger = logging.getLogger("MMG.notes")
+
+# a log file is rotated when it reaches LOG_MAX_BYTES, keeping LOG_BACKUP_COUNT gzip compressed rotations
+# e.g. log/MarkMelGen_log_<date>.log.1.gz
+LOG_MAX_BYTES = 50 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+# the QueueListener writing the records the logger puts on its queue, see start_log_listener
+_log_listener = None
+
+
+class CompressedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    A RotatingFileHandler of a log file, rotating it to backup_count gzip compressed files
+    e.g. log/MarkMelGen_log_<date>.log.1.gz once it has passed max_bytes.
+    RotatingFileHandler formats each record twice, once to see if it would pass maxBytes,
+    so this handler rotates after the record that passes max_bytes instead.
+    """
+
+    def __init__(self, filename, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+
+    def shouldRollover(self, record):
+        if self.stream is None:
+            self.stream = self._open()
+        return self.maxBytes > 0 and self.stream.tell() >= self.maxBytes
+
+    def rotation_filename(self, default_name):
+        return default_name + ".gz"
+
+    def rotate(self, source, dest):
+        with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.remove(source)
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """
+    A QueueHandler for a listener in this process: it puts the record itself on the queue,
+    with the message merged with its arguments (so a later change to an argument e.g. a note is not logged)
+    but without copying or formatting it, the handlers of the listener format it.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def start_log_listener(handlers):
+    """
+    given the handlers to write the log with e.g. the log file handler
+    add a QueueHandler to the logger, which only puts each record on a queue,
+    and start a QueueListener thread taking the records off the queue and formatting and writing them with the handlers,
+    so the formatting and the disk I/O of the log are off the generation thread.
+    The listener is stopped, writing the records still queued, by stop_log_listener or at exit.
+    """
+    global _log_listener
+
+    stop_log_listener()
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(LogQueueHandler(log_queue))
+    _log_listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
+
+
+def stop_log_listener():
+    """
+    stop the QueueListener of start_log_listener, once it has written the records queued, and close its handlers
+    """
+    global _log_listener
+
+    if _log_listener is None:
+        return
+    _log_listener.stop()
+    for handler in list(logger.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            logger.removeHandler(handler)
+    for handler in _log_listener.handlers:
+        handler.close()
+    _log_listener = None
+
+
+def _after_fork_in_child():
+    """
+    a forked worker process (e.g. an output, lyrics or section worker) has no listener thread,
+    so it writes its records with the handlers of the listener directly, leaving the rotation of the log file to the parent
+    """
+    global _log_listener
+
+    if _log_listener is None:
+        return
+    for handler in list(logger.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            logger.removeHandler(handler)
+    for handler in _log_listener.handlers:
+        if isinstance(handler, logging.handlers.RotatingFileHandler):
+            handler.maxBytes = 0
+        logger.addHandler(handler)
+    _log_listener = None
+
+
+@contextlib.contextmanager
+def quiet_stdout(quiet=True):
+    """
+    with quiet, discard the print output of the with block e.g. the progress of each section line,
+    warnings and errors still reach the console through the logger
+    """
+    if not quiet:
+        yield
+        return
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+atexit.register(stop_log_listener)
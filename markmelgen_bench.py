@@ -0,0 +1,980 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# markmelgen_bench.py
+#
+# which benchmarks MarkMelGen in-process over representative scenarios (styles, input music, short and long lyrics),
+# reporting per stage wall time (config, parse, transitions, generation, output), notes per second,
+# note rejections and peak memory, and writing the results as JSON for comparison between commits.
+# Runs offline, each scenario in a fresh process so a scenario does not warm the next.
+#
+# usage examples:
+# 1. benchmark the default scenarios, writing log/bench-<commit>-<date>.json
+# python markmelgen_bench.py
+#
+# 2. benchmark configuration files, three runs each
+# python markmelgen_bench.py -c "conf/test/*.conf" conf/v2.0.0/early_jazz_1.conf -r 3
+#
+# 3. how create_style, the input music mode and generation grow with synthetic corpora of 1, 10 and 100 times
+#    the bundled input music and lyrics, see markmelgen_corpus.py, plotted to log/bench-<commit>-<date>.png
+# python markmelgen_bench.py --scaling 1 10 100
+#
+# 4. compare two benchmark results
+# python markmelgen_bench.py --compare log/bench-2a4ead7-20261019-151500.json log/bench-86b414b-20261019-152000.json
+#
+# 5. time the cold start of MarkMelGen.py -v, -lS and import MarkMelGen, failing if import MarkMelGen takes over 1.5 seconds
+# python markmelgen_bench.py --startup --startup-budget 1.5
+#
+# 6. check the direct MusicXML writer against the music21 writer, for a melody with lyrics on notes and rests and .mxl outputs
+# python markmelgen_bench.py --check-musicxml output/*.mxl
+#
+# 7. make the seeded regression set of songs, check their .mxl, .kar and .mid lyrics, and compare them with an earlier run
+# python markmelgen_bench.py --regression log/regression-2a4ead7-20261019-151500.json
+#
+# 8. check that a seeded song is the same with 0, 1 and 4 section workers
+# python markmelgen_bench.py --check-section-workers
+#
+# 9. check that the best of the seeded variants of a song is not mostly the one with the fewest missing transitions
+# python markmelgen_bench.py --check-variants
+#
+# free and open-source software, Paul Wardley Davies, see MarkMelGen/license.txt
+
+# standard libraries
+import argparse
+import concurrent.futures
+import contextlib
+import datetime
+import glob
+import json
+import math
+import multiprocessing
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource  # not on Windows
+except ImportError:
+    resource = None
+
+STAGES = ["import", "config", "parse", "transitions", "generation", "output", "other"]
+
+SHORT_LYRICS = "filenames.INPUT_LYRICS_FILENAME=Star_Spangled_Banner.txt"
+LONG_LYRICS = "filenames.INPUT_LYRICS_FILENAME=Memories_of_Central_Park.txt"
+
+# name, configuration file, overrides
+SCENARIOS = [
+    ("early_jazz_1 short lyrics", "conf/v2.0.0/early_jazz_1.conf", [SHORT_LYRICS]),
+    ("early_jazz_1 long lyrics", "conf/v2.0.0/early_jazz_1.conf", [LONG_LYRICS]),
+    ("classical_baroque_7", "conf/v2.0.0/classical_baroque_7.conf", []),
+    ("classical_romantic_1 long lyrics", "conf/v2.0.0/classical_romantic_1.conf", [LONG_LYRICS]),
+    ("blues_1", "conf/v2.0.1/blues_1.conf", []),
+    (
+        "input music Jingle_Bells",
+        "MarkMelGen.conf",
+        [
+            "markmelgen.USE_STYLES=[]",
+            "paths.INPUT_MUSIC_PATH=input/music/",
+            "filenames.INPUT_MUSIC_FILENAME=Jingle_Bells.mxl",
+            SHORT_LYRICS,
+        ],
+    ),
+]
+
+
+# name, the python command line arguments of each cold start timed by --startup
+STARTUP_COMMANDS = [
+    ("MarkMelGen.py -v", ["MarkMelGen.py", "-v"]),
+    ("MarkMelGen.py -lS", ["MarkMelGen.py", "-lS"]),
+    ("import MarkMelGen", ["-c", "import MarkMelGen"]),
+]
+STARTUP_REPEAT = 5  # the least runs of each startup command, the median is reported
+# -v and -lS are answered before music21 is imported, see markmelgen_cli, so take well under the import
+STARTUP_FAST_FRACTION = 0.5
+
+
+def get_peak_rss_mb():
+    """
+    returns the peak resident set size of this process in MB, or None where the resource module is missing
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)  # bytes
+    return peak / 1024  # KB
+
+
+def run_scenario(config, overrides, seed, output_path, log_filename):
+    """
+    given a scenario
+    generate its songs with MarkMelGen in this (fresh) process, writing the outputs to output_path
+    return the run dict of stage times, notes, rejections, note telemetry and peak RSS
+    """
+    start = time.perf_counter()
+    with open(log_filename, "a", encoding="utf-8") as log_file, contextlib.redirect_stdout(
+        log_file
+    ), contextlib.redirect_stderr(log_file):
+        import MarkMelGen
+        import MarkMelGen_utilities
+
+        import_seconds = time.perf_counter() - start
+        MarkMelGen_utilities.PAUSE_ON_ERROR = False
+        MarkMelGen.STAGE_TIMES.clear()
+        run = {"status": "ok"}
+        songs = []
+        try:
+            songs = MarkMelGen.generate_song_buffers(
+                config,
+                overrides + ["paths.OUTPUT_PATH=" + output_path + os.sep],
+                outputs=MarkMelGen.OUTPUT_TYPES,
+                write_files=True,
+                buffers=False,
+                seed=seed,
+                output_workers=0,
+            )
+        except SystemExit:
+            run["status"] = "exit"  # MarkMelGen reported an error e.g. in the configuration file, see the log
+        except Exception as e:
+            run["status"] = "error"
+            run["error"] = repr(e)
+
+    total_seconds = time.perf_counter() - start
+    stages = {"import": import_seconds}
+    stages.update(MarkMelGen.STAGE_TIMES)
+    stages["other"] = max(total_seconds - sum(stages.values()), 0.0)
+    notes = sum(song["metadata"].get("notes", 0) for song in songs)
+    rejections = {}
+    for song in songs:
+        for reason, count in song["metadata"].get("note_rejections", {}).items():
+            rejections[reason] = rejections.get(reason, 0) + count
+    note_telemetry = {}
+    for song in songs:
+        MarkMelGen.merge_note_telemetry(note_telemetry, song["metadata"].get("note_telemetry", {}))
+    generation_seconds = stages.get("generation", 0.0)
+
+    run.update(
+        {
+            "seconds": total_seconds,
+            "stages": stages,
+            "songs": len(songs),
+            "notes": notes,
+            "notes_per_second": notes / generation_seconds if generation_seconds else None,
+            "note_rejections": rejections,
+            "note_telemetry": note_telemetry,
+            "peak_rss_mb": get_peak_rss_mb(),
+        }
+    )
+    return run
+
+
+def run_create_style(music_path, style_path, log_filename):
+    """
+    given a directory of .mxl files
+    create a style from them with markmelgen_style.create_style in this (fresh) process
+    return the run dict of seconds and peak RSS
+    """
+    start = time.perf_counter()
+    run = {"status": "ok"}
+    with open(log_filename, "a", encoding="utf-8") as log_file, contextlib.redirect_stdout(
+        log_file
+    ), contextlib.redirect_stderr(log_file):
+        import markmelgen_style
+
+        import_seconds = time.perf_counter() - start
+        try:
+            markmelgen_style.create_style(music_path, False, style_path)
+        except SystemExit:
+            run["status"] = "exit"
+        except Exception as e:
+            run["status"] = "error"
+            run["error"] = repr(e)
+
+    total_seconds = time.perf_counter() - start
+    run.update(
+        {
+            "seconds": total_seconds,
+            "stages": {"import": import_seconds, "create_style": total_seconds - import_seconds},
+            "peak_rss_mb": get_peak_rss_mb(),
+        }
+    )
+    return run
+
+
+def run_in_fresh_process(function, *args):
+    """
+    returns function(*args) run in a fresh spawned process, so one run does not warm (or bloat) the next
+    """
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=1, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        return executor.submit(function, *args).result()
+
+
+def get_commit():
+    """
+    returns the short git commit hash of the working tree, or "unknown"
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def get_scenarios(configs, overrides):
+    """
+    given configuration files or glob patterns (or none for the default SCENARIOS)
+    return the list of (name, config, overrides) scenarios
+    """
+    if not configs:
+        return [(name, config, scenario_overrides + overrides) for name, config, scenario_overrides in SCENARIOS]
+    scenarios = []
+    for pattern in configs:
+        config_files = sorted(glob.glob(pattern))
+        if not config_files:
+            print(f"exit: Error no configuration file found at {pattern}")
+            sys.exit(1)
+        for config in config_files:
+            scenarios.append((os.path.splitext(os.path.basename(config))[0], config, list(overrides)))
+    return scenarios
+
+
+def summarise_runs(runs):
+    """
+    given the runs of a scenario
+    return the summary dict of the mean stage times, notes per second, rejections and the maximum peak RSS
+    """
+    summary = {"status": runs[0]["status"] if len({run["status"] for run in runs}) == 1 else "mixed"}
+    summary["seconds"] = sum(run["seconds"] for run in runs) / len(runs)
+    summary["stages"] = {
+        stage: sum(run["stages"].get(stage, 0.0) for run in runs) / len(runs) for stage in STAGES
+    }
+    summary["notes"] = sum(run["notes"] for run in runs) / len(runs)
+    rates = [run["notes_per_second"] for run in runs if run["notes_per_second"]]
+    summary["notes_per_second"] = sum(rates) / len(rates) if rates else None
+    summary["note_rejections"] = sum(sum(run["note_rejections"].values()) for run in runs) / len(runs)
+    peaks = [run["peak_rss_mb"] for run in runs if run["peak_rss_mb"] is not None]
+    summary["peak_rss_mb"] = max(peaks) if peaks else None
+    return summary
+
+
+def benchmark(scenarios, repeat, seed, log_filename):
+    """
+    given the scenarios
+    run each one repeat times, each run in a fresh spawned process
+    return the list of scenario result dicts
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as output_path:
+        for name, config, overrides in scenarios:
+            runs = []
+            for run_number in range(repeat):
+                print(f"{name} run {run_number + 1} of {repeat}", flush=True)
+                runs.append(
+                    run_in_fresh_process(run_scenario, config, overrides, seed + run_number, output_path, log_filename)
+                )
+            results.append(
+                {
+                    "name": name,
+                    "config": config,
+                    "overrides": overrides,
+                    "runs": runs,
+                    "summary": summarise_runs(runs),
+                }
+            )
+    return results
+
+
+def benchmark_scaling(scales, seed, corpus_path, log_filename):
+    """
+    given the scales of synthetic corpora, relative to the bundled input music and lyrics
+    write each corpus with markmelgen_corpus, then time in fresh processes:
+    create_style from its .mxl files, the input music mode (USE_STYLES = []) on them and generation with the new style,
+    both with its lyrics
+    return the list of scale result dicts
+    """
+    import markmelgen_corpus
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_path:
+        corpus_path = corpus_path or os.path.join(work_path, "corpus")
+        style_path = os.path.join(work_path, "style")
+        output_path = os.path.join(work_path, "output")
+        os.makedirs(output_path)
+        for scale in scales:
+            print(f"scale {scale:g}x: writing the synthetic corpus to {corpus_path}", flush=True)
+            corpus = markmelgen_corpus.write_synthetic_corpus(corpus_path, scale, seed=seed)
+            lyrics_overrides = [
+                "paths.INPUT_LYRICS_PATH=" + corpus["lyrics_path"] + os.sep,
+                "filenames.INPUT_LYRICS_FILENAME=" + corpus["lyrics_filename"],
+            ]
+            modes = {}
+            print(f"scale {scale:g}x: create_style", flush=True)
+            modes["create_style"] = run_in_fresh_process(
+                run_create_style, corpus["music_path"], style_path, log_filename
+            )
+            print(f"scale {scale:g}x: input music", flush=True)
+            modes["input_music"] = run_in_fresh_process(
+                run_scenario,
+                "MarkMelGen.conf",
+                ["markmelgen.USE_STYLES=[]", "paths.INPUT_MUSIC_PATH=" + corpus["music_path"] + os.sep] + lyrics_overrides,
+                seed,
+                output_path,
+                log_filename,
+            )
+            print(f"scale {scale:g}x: style", flush=True)
+            modes["style"] = run_in_fresh_process(
+                run_scenario,
+                "MarkMelGen.conf",
+                [f"markmelgen.USE_STYLES=['{corpus['name']}']", "paths.INPUT_STYLE_PATH=" + style_path + os.sep]
+                + lyrics_overrides,
+                seed,
+                output_path,
+                log_filename,
+            )
+            results.append(
+                {
+                    "scale": scale,
+                    "files": corpus["files"],
+                    "notes": corpus["notes"],
+                    "lyrics_lines": corpus["lyrics_lines"],
+                    "modes": modes,
+                }
+            )
+    return results
+
+
+# (label, mode, stage or None for the whole run, size the time is plotted against)
+SCALING_SERIES = [
+    ("create_style", "create_style", "create_style", "notes"),
+    ("input music parse", "input_music", "parse", "notes"),
+    ("input music transitions", "input_music", "transitions", "notes"),
+    ("input music generation", "input_music", "generation", "lyrics_lines"),
+    ("style generation", "style", "generation", "lyrics_lines"),
+    ("style output", "style", "output", "lyrics_lines"),
+]
+
+
+def get_slowest_imports(module_name, count=10):
+    """
+    given a module name e.g. MarkMelGen
+    return the count slowest modules it imports itself, as (name, cumulative seconds), from python -X importtime
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module_name}"], capture_output=True, text=True
+    )
+    imports = []
+    direct_imports = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # the header
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            direct_imports.append((name.strip(), int(cumulative) / 1e6))
+        elif depth == 0:
+            # a top level import follows the imports it made
+            if name.strip() == module_name:
+                imports = direct_imports
+            direct_imports = []
+    return sorted(imports, key=lambda an_import: an_import[1], reverse=True)[:count]
+
+
+def benchmark_startup(repeat):
+    """
+    run each of the STARTUP_COMMANDS repeat times (at least STARTUP_REPEAT), each in a fresh python process
+    return the dict of the startup command results, with their median seconds, and the slowest imports of MarkMelGen
+    """
+    commands = []
+    for name, arguments in STARTUP_COMMANDS:
+        seconds = []
+        for run_number in range(max(repeat, STARTUP_REPEAT)):
+            start = time.perf_counter()
+            subprocess.run([sys.executable] + arguments, capture_output=True, check=True)
+            seconds.append(time.perf_counter() - start)
+        print(f"{name} {statistics.median(seconds):.3f} seconds", flush=True)
+        commands.append({"name": name, "arguments": arguments, "seconds": seconds, "median": statistics.median(seconds)})
+    return {
+        "commands": commands,
+        "slowest_imports": [
+            {"name": name, "seconds": seconds} for name, seconds in get_slowest_imports("MarkMelGen")
+        ],
+    }
+
+
+def check_startup_results(results, budget):
+    """
+    given the benchmark_startup results and the budget in seconds of import MarkMelGen (or None)
+    print and return the failed checks: import MarkMelGen over the budget,
+    or a command answered before the import, e.g. -v, taking over STARTUP_FAST_FRACTION of the import
+    """
+    medians = {command["name"]: command["median"] for command in results["commands"]}
+    import_seconds = medians.pop("import MarkMelGen")
+    failures = []
+    if budget is not None and import_seconds > budget:
+        failures.append(f"import MarkMelGen took {import_seconds:.3f} seconds, over the budget of {budget:g}")
+    for name, seconds in medians.items():
+        if seconds > STARTUP_FAST_FRACTION * import_seconds:
+            failures.append(
+                f"{name} took {seconds:.3f} seconds, over {STARTUP_FAST_FRACTION:g} of import MarkMelGen "
+                f"({import_seconds:.3f}), is music21 imported before it is answered?"
+            )
+    for failure in failures:
+        print(f"Error startup check: {failure}")
+    return failures
+
+
+# pitch (or rest), quarter length, lyric: a line whose last syllables fall on rests, as when a line is longer than its phrase
+MUSICXML_CHECK_MELODY = [
+    ("C4", 1.0, "sun"), ("D4", 1.0, "rise"), ("E4", 2.0, "on"),
+    ("rest", 1.0, "the"), ("G4", 0.5, "new"), ("A4", 0.5, None), ("G4", 1.0, "day"), ("rest", 3.0, "way"),
+]
+
+
+def check_musicxml(mxl_filenames):
+    """
+    given .mxl files (e.g. MarkMelGen outputs)
+    check MUSICXML_CHECK_MELODY and the melody of each file with check_musicxml_round_trip,
+    print and return the failed checks
+    """
+    from MarkMelGen_utilities import check_musicxml_round_trip  # imports music21, only for this check
+    from music21 import converter, meter, note, stream
+
+    melodies = []
+    melody = stream.Stream()
+    for name, quarter_length, text in MUSICXML_CHECK_MELODY:
+        element = note.Rest(quarterLength=quarter_length) if name == "rest" else note.Note(name, quarterLength=quarter_length)
+        if text:
+            element.lyric = text
+        melody.append(element)
+    melodies.append(("MUSICXML_CHECK_MELODY", melody, meter.TimeSignature("4/4")))
+    for mxl_filename in mxl_filenames:
+        score = converter.parse(mxl_filename)
+        time_signatures = score.recurse().getElementsByClass(meter.TimeSignature)
+        melodies.append((mxl_filename, score, time_signatures.first() if time_signatures else meter.TimeSignature("4/4")))
+
+    failures = []
+    for name, melody, time_signature in melodies:
+        differences = check_musicxml_round_trip(melody, time_signature)
+        if differences is None:
+            print(f"{name}: needs music21 notation, not checked")
+            continue
+        print(f"{name}: {'ok' if not differences else str(len(differences)) + ' differences'}")
+        failures += [f"{name} {difference}" for difference in differences]
+    for failure in failures:
+        print(f"Error MusicXML check: {failure}")
+    return failures
+
+
+# the seeded regression set: the style of each configuration with each lyrics file in each key, seeded with REGRESSION_SEED
+REGRESSION_CONFIGS = ["conf/v2.0.0/early_jazz_1.conf", "conf/v2.0.0/classical_baroque_7.conf"]
+REGRESSION_LYRICS = [
+    "A_Thousand_Faces", "Another_Monday_In_Lyndhurst", "BellaPopHappy-AllSections", "Blinds_and_Backstreets", "Adventure_Awaits",
+]
+REGRESSION_KEYS = ["C", "a", "E-"]
+REGRESSION_SEED = 3
+
+
+def get_regression_events(score):
+    """
+    returns [class, offset, pitch or None, quarter length, lyric] of each note and rest of a song, offsets as strings
+    """
+    from music21 import note  # imported by MarkMelGen already
+
+    return [
+        [type(n).__name__, str(n.offset), n.nameWithOctave if isinstance(n, note.Note) else None, str(n.quarterLength), n.lyric]
+        for n in score.flatten().notesAndRests
+    ]
+
+
+def run_regression(log_filename):
+    """
+    make the songs of the regression set in this process, each seeded with REGRESSION_SEED, and check that
+    the .mxl reads back as the music21 writer's (check_musicxml_round_trip against filter_output_stream_for_MuseScore)
+    and that each lyric, of a note or a rest, is a lyric event of the .kar and .mid (compile_midi_events)
+    return the dict of the notes and rests of each song, and the list of the failed checks
+    """
+    import random
+
+    import numpy
+    import MarkMelGen
+    import MarkMelGen_utilities
+    from music21 import key, meter
+
+    MarkMelGen_utilities.PAUSE_ON_ERROR = False
+    songs = {}
+    failures = []
+    for config in REGRESSION_CONFIGS:
+        generation_config = MarkMelGen.GenerationConfig.from_conf(config)
+        generation_config.WRITE_OUTPUT_FILES = False
+        style = generation_config.USE_STYLES[0]
+        transitions = MarkMelGen.load_transition_files(os.path.join(generation_config.INPUT_STYLE_PATH, style))
+        for lyrics in REGRESSION_LYRICS:
+            for key_name in REGRESSION_KEYS:
+                name = f"{os.path.basename(config)} {lyrics} {key_name}"
+                random.seed(REGRESSION_SEED)
+                numpy.random.seed(REGRESSION_SEED)
+                ts = meter.TimeSignature("4/4")
+                with open(log_filename, "a", encoding="utf-8") as log_file, contextlib.redirect_stdout(
+                    log_file
+                ), contextlib.redirect_stderr(log_file):
+                    ctx = MarkMelGen.GenerationContext(generation_config)
+                    song = MarkMelGen.process_lyrics_file(
+                        ctx, f"input/lyrics/{lyrics}.txt", ts, key.Key(key_name), transitions, [], style
+                    )
+                    score = song["score"]
+                    differences = MarkMelGen_utilities.check_musicxml_round_trip(
+                        score, ts, MarkMelGen.filter_output_stream_for_MuseScore(score, ts, makeNotation=True)
+                    )
+                    midi_lyrics = [
+                        value for _, _, event_type, value in MarkMelGen_utilities.compile_midi_events(score)["events"]
+                        if event_type == "lyric"
+                    ]
+                songs[name] = get_regression_events(score)
+                score_lyrics = [
+                    n.lyric for n in score.flatten().notesAndRests if n.lyric is not None and n.quarterLength > 0
+                ]
+                failures += [f"{name} .mxl {difference}" for difference in differences or []]
+                if midi_lyrics != score_lyrics:
+                    failures.append(f"{name} .kar/.mid has {len(midi_lyrics)} lyrics, the song {len(score_lyrics)}")
+                print(f"{name}: {len(songs[name])} notes and rests, {len(score_lyrics)} lyrics", flush=True)
+    return songs, failures
+
+
+def compare_regression(baseline, songs):
+    """
+    returns the names of the songs that differ from, or are not in, the baseline, printing the first difference of each
+    """
+    differ = []
+    for name, events in songs.items():
+        baseline_events = baseline.get(name)
+        if events == baseline_events:
+            continue
+        differ.append(name)
+        if baseline_events is None:
+            print(f"{name}: not in the baseline")
+            continue
+        first = next(
+            (i for i, (event, baseline_event) in enumerate(zip(events, baseline_events)) if event != baseline_event),
+            min(len(events), len(baseline_events)),
+        )
+        print(f"{name}: differs from note or rest {first}, {len(baseline_events)} -> {len(events)} notes and rests")
+    return differ
+
+
+# the songs made by --check-section-workers with each number of section workers, which must be the same bytes
+SECTION_WORKERS_CHECK_CONFIGS = ["conf/v2.0.0/early_jazz_1.conf", "conf/v2.0.0/classical_baroque_7.conf"]
+SECTION_WORKERS_CHECK_COUNTS = [0, 1, 4]
+# the date and minute a song was made, e.g. the .kar text 2026-10-19 18:25
+SONG_DATE_PATTERN = re.compile(rb"\d{4}-\d{2}-\d{2} \d{2}:\d{2}")
+
+
+def check_section_workers(log_filename):
+    """
+    make the songs of SECTION_WORKERS_CHECK_CONFIGS, each seeded with REGRESSION_SEED, with each of
+    SECTION_WORKERS_CHECK_COUNTS section workers (generate_song_buffers section_workers),
+    print and return the outputs that differ from those of the first number of workers,
+    other than by the time in the song name (the .kar title) and the date and minute the song was made
+    """
+    import MarkMelGen
+    import MarkMelGen_utilities
+
+    MarkMelGen_utilities.PAUSE_ON_ERROR = False
+    failures = []
+    for config in SECTION_WORKERS_CHECK_CONFIGS:
+        songs = {}
+        for section_workers in SECTION_WORKERS_CHECK_COUNTS:
+            with open(log_filename, "a", encoding="utf-8") as log_file, contextlib.redirect_stdout(
+                log_file
+            ), contextlib.redirect_stderr(log_file):
+                songs[section_workers] = MarkMelGen.generate_song_buffers(
+                    config, outputs=("kar", "mid"), seed=REGRESSION_SEED, section_workers=section_workers
+                )
+        first = SECTION_WORKERS_CHECK_COUNTS[0]
+        for section_workers in SECTION_WORKERS_CHECK_COUNTS[1:]:
+            for song, first_song in zip(songs[section_workers], songs[first]):
+                for output in ("kar", "mid"):
+                    name, first_name = song["metadata"]["name"].encode(), first_song["metadata"]["name"].encode()
+                    song_bytes = song[output].replace(name, first_name)
+                    if SONG_DATE_PATTERN.sub(b"", song_bytes) != SONG_DATE_PATTERN.sub(b"", first_song[output]):
+                        failures.append(
+                            f"{config} {song['metadata']['name']}.{output} with {section_workers} section workers "
+                            f"differs from {first}"
+                        )
+        print(f"{config}: {len(songs[first])} songs with {', '.join(map(str, SECTION_WORKERS_CHECK_COUNTS))} section workers")
+    for failure in failures:
+        print(f"Error section workers check: {failure}")
+    return failures
+
+
+# --check-variants makes VARIANTS_CHECK_COUNT seeded variants of each lyrics file of the regression set, scored with
+# score_song_variant, and fails if more than VARIANTS_CHECK_FEWEST_MISSES of the best are those with the fewest misses
+VARIANTS_CHECK_COUNT = 8
+VARIANTS_CHECK_FEWEST_MISSES = 0.5
+
+
+def check_variants(log_filename):
+    """
+    make VARIANTS_CHECK_COUNT variants of each configuration and lyrics file of the regression set in this process,
+    seeded with REGRESSION_SEED, score them with score_song_variant
+    and check that the best scoring variant is not mostly the one with the fewest transitions missing from the style
+    return the failed checks
+    """
+    import random
+
+    import numpy
+    import MarkMelGen
+    import MarkMelGen_utilities
+    from music21 import key, meter
+
+    MarkMelGen_utilities.PAUSE_ON_ERROR = False
+    fewest_misses = 0
+    variant_sets = 0
+    for config in REGRESSION_CONFIGS:
+        generation_config = MarkMelGen.GenerationConfig.from_conf(config)
+        generation_config.WRITE_OUTPUT_FILES = False
+        style = generation_config.USE_STYLES[0]
+        transitions = MarkMelGen.load_transition_files(os.path.join(generation_config.INPUT_STYLE_PATH, style))
+        for lyrics in REGRESSION_LYRICS:
+            random.seed(REGRESSION_SEED)
+            numpy.random.seed(REGRESSION_SEED)
+            variants = []
+            with open(log_filename, "a", encoding="utf-8") as log_file, contextlib.redirect_stdout(
+                log_file
+            ), contextlib.redirect_stderr(log_file):
+                for _ in range(VARIANTS_CHECK_COUNT):
+                    ctx = MarkMelGen.GenerationContext(generation_config)
+                    song = MarkMelGen.process_lyrics_file(
+                        ctx, f"input/lyrics/{lyrics}.txt", meter.TimeSignature("4/4"), key.Key("C"), transitions, [], style
+                    )
+                    variants.append(MarkMelGen.score_song_variant(ctx, song, transitions))
+            best = max(range(len(variants)), key=lambda i: variants[i]["score"])
+            fewest = min(range(len(variants)), key=lambda i: variants[i]["misses"])
+            variant_sets += 1
+            fewest_misses += best == fewest
+            print(
+                f"{os.path.basename(config)} {lyrics}: best variant {best + 1} score {variants[best]['score']:.3f} "
+                f"misses {variants[best]['misses']:.2f}, fewest misses variant {fewest + 1} "
+                f"score {variants[fewest]['score']:.3f} misses {variants[fewest]['misses']:.2f}",
+                flush=True,
+            )
+    print(f"the best variant has the fewest misses in {fewest_misses} of {variant_sets} sets of {VARIANTS_CHECK_COUNT} variants")
+    failures = []
+    if fewest_misses > VARIANTS_CHECK_FEWEST_MISSES * variant_sets:
+        failures.append(
+            f"the best variant has the fewest misses in over {VARIANTS_CHECK_FEWEST_MISSES:g} of the sets, "
+            f"the score ranks the variants by their misses"
+        )
+    for failure in failures:
+        print(f"Error variants check: {failure}")
+    return failures
+
+
+def print_startup_results(results):
+    """
+    prints the median seconds of each startup command, and the slowest imports of MarkMelGen
+    """
+    print(f"\n{'startup command':<34} {'median s':>9} {'min s':>9} {'max s':>9}")
+    for command in results["commands"]:
+        print(
+            f"{command['name']:<34} {command['median']:>9.3f} {min(command['seconds']):>9.3f} {max(command['seconds']):>9.3f}"
+        )
+    print(f"\n{'slowest imports of MarkMelGen':<34} {'seconds':>9}")
+    for an_import in results["slowest_imports"]:
+        print(f"{an_import['name'][:34]:<34} {an_import['seconds']:>9.3f}")
+    return
+
+
+def get_scaling_seconds(result, mode, stage):
+    run = result["modes"][mode]
+    if stage is None:
+        return run["seconds"]
+    return run["stages"].get(stage, 0.0)
+
+
+def get_growth_exponent(results, mode, stage, size):
+    """
+    returns the slope of log(seconds) against log(size) between the smallest and largest scale,
+    about 1 for linear growth and 2 for quadratic, or None
+    """
+    if len(results) < 2:
+        return None
+    first, last = results[0], results[-1]
+    first_seconds = get_scaling_seconds(first, mode, stage)
+    last_seconds = get_scaling_seconds(last, mode, stage)
+    if first_seconds <= 0 or last_seconds <= 0 or first[size] == last[size]:
+        return None
+    return math.log(last_seconds / first_seconds) / math.log(last[size] / first[size])
+
+
+def print_scaling_results(results):
+    """
+    prints the seconds of each scaling series at each scale, and its growth exponent
+    """
+    print(f"\n{'scale':>7} {'files':>6} {'notes':>8} {'lines':>6} " + " ".join(f"{label[:24]:>24}" for label, *_ in SCALING_SERIES))
+    for result in results:
+        statuses = {run["status"] for run in result["modes"].values()}
+        print(
+            f"{result['scale']:>7g} {result['files']:>6} {result['notes']:>8} {result['lyrics_lines']:>6} "
+            + " ".join(f"{get_scaling_seconds(result, mode, stage):>24.3f}" for _, mode, stage, _ in SCALING_SERIES)
+            + ("" if statuses == {"ok"} else f"  status {sorted(statuses)}")
+        )
+    exponents = [get_growth_exponent(results, mode, stage, size) for _, mode, stage, size in SCALING_SERIES]
+    print(f"{'growth exponent':>30} " + " ".join(format_optional(exponent, 24, 2) for exponent in exponents))
+    return
+
+
+def plot_scaling_results(results, png_filename):
+    """
+    plots the seconds of each scaling series against the corpus notes or lyrics lines, log-log, to png_filename
+    """
+    try:
+        import matplotlib
+
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("matplotlib not found, so the scaling results are not plotted")
+        return
+
+    figure, axes = plt.subplots(1, 2, figsize=(12, 5))
+    for axis, size, xlabel in ((axes[0], "notes", "corpus notes"), (axes[1], "lyrics_lines", "lyrics lines")):
+        for label, mode, stage, series_size in SCALING_SERIES:
+            if series_size != size:
+                continue
+            sizes = [result[size] for result in results]
+            seconds = [max(get_scaling_seconds(result, mode, stage), 1e-4) for result in results]
+            axis.plot(sizes, seconds, marker="o", label=label)
+        axis.set_xscale("log")
+        axis.set_yscale("log")
+        axis.set_xlabel(xlabel)
+        axis.set_ylabel("seconds")
+        axis.grid(True, which="both", alpha=0.3)
+        axis.legend()
+    figure.suptitle("MarkMelGen scaling with synthetic corpora")
+    figure.tight_layout()
+    figure.savefig(png_filename)
+    plt.close(figure)
+    print(f"scaling plot written to {png_filename}")
+    return
+
+
+def format_optional(value, width, precision=1):
+    """
+    returns the value formatted to width, or "-" for None
+    """
+    return f"{'-':>{width}}" if value is None else f"{value:>{width}.{precision}f}"
+
+
+def print_results(results):
+    """
+    prints the summary of each scenario as a table
+    """
+    print(
+        f"\n{'scenario':<34} {'status':>6} "
+        + " ".join(f"{stage:>11}" for stage in STAGES)
+        + f" {'notes':>7} {'notes/s':>8} {'rejects':>8} {'RSS MB':>7}"
+    )
+    for result in results:
+        summary = result["summary"]
+        print(
+            f"{result['name'][:34]:<34} {summary['status']:>6} "
+            + " ".join(f"{summary['stages'][stage]:>11.3f}" for stage in STAGES)
+            + f" {summary['notes']:>7.0f} {format_optional(summary['notes_per_second'], 8)}"
+            + f" {summary['note_rejections']:>8.0f} {format_optional(summary['peak_rss_mb'], 7)}"
+        )
+    return
+
+
+def compare_results(before_filename, after_filename):
+    """
+    prints the change in seconds of each stage, and in notes per second, of the scenarios in both benchmark results
+    """
+    with open(before_filename, encoding="utf-8") as f:
+        before = json.load(f)
+    with open(after_filename, encoding="utf-8") as f:
+        after = json.load(f)
+    before_scenarios = {result["name"]: result["summary"] for result in before.get("scenarios", [])}
+
+    print(f"\n{before['commit']} -> {after['commit']} seconds per stage, % change")
+    print(f"{'scenario':<34} " + " ".join(f"{stage:>17}" for stage in STAGES + ["total"]) + f" {'notes/s':>17}")
+    for result in after.get("scenarios", []):
+        if result["name"] not in before_scenarios:
+            continue
+        old = before_scenarios[result["name"]]
+        new = result["summary"]
+        columns = []
+        for stage in STAGES + ["total"]:
+            old_seconds = old["seconds"] if stage == "total" else old["stages"].get(stage, 0.0)
+            new_seconds = new["seconds"] if stage == "total" else new["stages"].get(stage, 0.0)
+            change = f"{100 * (new_seconds / old_seconds - 1):+.0f}%" if old_seconds > 0.0005 else ""
+            columns.append(f"{new_seconds:>10.3f} {change:>6}")
+        if old["notes_per_second"] and new["notes_per_second"]:
+            change = f"{100 * (new['notes_per_second'] / old['notes_per_second'] - 1):+.0f}%"
+            columns.append(f"{new['notes_per_second']:>10.1f} {change:>6}")
+        print(f"{result['name'][:34]:<34} " + " ".join(columns))
+    return
+
+
+def main():
+    """
+    parse command line arguments
+    benchmark the scenarios and write the JSON results, or compare two results
+    """
+    parser = argparse.ArgumentParser(description="MarkMelGen benchmark")
+    parser.add_argument('-c', '--configs',
+                        help='configuration files or glob patterns to benchmark e.g. "conf/test/*.conf", '
+                             'default the built in scenarios',
+                        nargs='*',
+                        default=[])
+    parser.add_argument('-o', '--override',
+                        help='configuration override for every scenario, as for MarkMelGen.py -o, may be repeated',
+                        action='append',
+                        default=[])
+    parser.add_argument('-r', '--repeat',
+                        help='runs of each scenario, default 1',
+                        default=1,
+                        type=int)
+    parser.add_argument('-s', '--seed',
+                        help='random seed of the first run, default 1',
+                        default=1,
+                        type=int)
+    parser.add_argument('-j', '--json',
+                        help='JSON results file, default log/bench-<commit>-<date>.json',
+                        default='',
+                        type=str)
+    parser.add_argument('--scaling',
+                        help='benchmark create_style, the input music mode and generation on synthetic corpora '
+                             'of these scales of the bundled input music and lyrics, e.g. 1 10 100',
+                        nargs='+',
+                        type=float)
+    parser.add_argument('--corpus-path',
+                        help='directory to write the --scaling synthetic corpora to, default a temporary directory',
+                        default='',
+                        type=str)
+    parser.add_argument('--startup',
+                        help='time the cold start of MarkMelGen.py -v, MarkMelGen.py -lS and import MarkMelGen, '
+                             f'each REPEAT (at least {STARTUP_REPEAT}) times, and list the slowest imports',
+                        action='store_true')
+    parser.add_argument('--startup-budget',
+                        help='with --startup, exit with status 1 if import MarkMelGen takes over this many seconds '
+                             f'(median), or -v or -lS over {STARTUP_FAST_FRACTION:g} of it',
+                        type=float)
+    parser.add_argument('--check-musicxml',
+                        help='check the direct MusicXML writer against the music21 writer, for a melody with lyrics '
+                             'on notes and rests and these .mxl files, exit with status 1 if the notes, rests or lyrics differ',
+                        nargs='*',
+                        metavar='MXL')
+    parser.add_argument('--regression',
+                        help='make the seeded regression set of songs, check their .mxl against the music21 writer and '
+                             'their .kar and .mid lyrics, write the songs to log/regression-<commit>-<date>.json '
+                             'and compare them with the BASELINE results file if given, exit with status 1 on a failure or difference',
+                        nargs='?',
+                        const='',
+                        metavar='BASELINE')
+    parser.add_argument('--check-section-workers',
+                        help='make seeded songs with '
+                             f'{", ".join(map(str, SECTION_WORKERS_CHECK_COUNTS))} --section-workers, '
+                             'exit with status 1 if their .kar or .mid differ',
+                        action='store_true')
+    parser.add_argument('--check-variants',
+                        help=f'make {VARIANTS_CHECK_COUNT} seeded variants of each song of the regression set, '
+                             'exit with status 1 if the best scoring variant is mostly the one with the fewest '
+                             'transitions missing from the style',
+                        action='store_true')
+    parser.add_argument('--compare',
+                        help='compare two JSON results files, BEFORE AFTER',
+                        nargs=2,
+                        metavar=('BEFORE', 'AFTER'))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_results(*args.compare)
+        return
+
+    if args.check_musicxml is not None:
+        if check_musicxml(args.check_musicxml):
+            sys.exit(1)
+        return
+
+    commit = get_commit()
+    date = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    os.makedirs("log", exist_ok=True)
+    if args.check_section_workers:
+        if check_section_workers(os.path.join("log", f"section-workers-{commit}-{date}.log")):
+            sys.exit(1)
+        return
+    if args.check_variants:
+        if check_variants(os.path.join("log", f"variants-{commit}-{date}.log")):
+            sys.exit(1)
+        return
+    if args.regression is not None:
+        json_filename = args.json or os.path.join("log", f"regression-{commit}-{date}.json")
+        songs, failures = run_regression(os.path.splitext(json_filename)[0] + ".log")
+        with open(json_filename, "w", encoding="utf-8") as f:
+            json.dump({"commit": commit, "date": date, "seed": REGRESSION_SEED, "songs": songs}, f, indent=1)
+        differ = []
+        if args.regression:
+            with open(args.regression, encoding="utf-8") as f:
+                differ = compare_regression(json.load(f)["songs"], songs)
+        for failure in failures:
+            print(f"Error regression check: {failure}")
+        print(f"{len(songs)} songs, {len(failures)} failed checks, {len(differ)} differ from the baseline, "
+              f"written to {json_filename}")
+        if failures or differ:
+            sys.exit(1)
+        return
+
+    json_filename = args.json or os.path.join("log", f"bench-{commit}-{date}.json")
+    log_filename = os.path.splitext(json_filename)[0] + ".log"
+
+    start = time.perf_counter()
+    if args.startup:
+        mode = "startup"
+        results = benchmark_startup(args.repeat)
+    elif args.scaling:
+        mode = "scaling"
+        results = benchmark_scaling(sorted(args.scaling), args.seed, args.corpus_path, log_filename)
+    else:
+        mode = "scenarios"
+        results = benchmark(get_scenarios(args.configs, args.override), args.repeat, args.seed, log_filename)
+    bench = {
+        "commit": commit,
+        "date": date,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "repeat": args.repeat,
+        "seed": args.seed,
+        "seconds": time.perf_counter() - start,
+        mode: results,
+    }
+    with open(json_filename, "w", encoding="utf-8") as f:
+        json.dump(bench, f, indent=2)
+
+    if args.startup:
+        print_startup_results(results)
+        failures = check_startup_results(results, args.startup_budget)
+        print(f"\nbenchmark results written to {json_filename}")
+        if failures:
+            sys.exit(1)
+        return
+    if args.scaling:
+        print_scaling_results(results)
+        plot_scaling_results(results, os.path.splitext(json_filename)[0] + ".png")
+    else:
+        print_results(results)
+    print(f"\nbenchmark results written to {json_filename}, MarkMelGen output logged to {log_filename}")
+    return
+
+
+if __name__ == '__main__':
+    main()
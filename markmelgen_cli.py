@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# markmelgen_cli.py
+#
+# which answers the MarkMelGen.py command lines that need neither music21 nor a style, -v and -lS (--list-styles),
+# before MarkMelGen.py imports music21, numpy and the rest, so a job that only asks for the version or the styles
+# starts in a fraction of the time. Only the standard library is imported here.
+#
+# usage examples:
+# python MarkMelGen.py -v
+# python MarkMelGen.py -c conf/v2.0.0/early_jazz_1.conf -lS
+#
+# free and open-source software, Paul Wardley Davies, see MarkMelGen/license.txt
+
+# standard libraries
+import configparser
+import os
+import sys
+
+MARKMELGEN_VERSION = "3.1.0"
+
+# the default INPUT_STYLE_PATH, as in MarkMelGen.py
+here = os.path.dirname(os.path.abspath(__file__)) + "/"
+INPUT_STYLE_PATH = here + "input" + os.sep + "style" + os.sep
+
+# the start of the name of a blended style, which blend_styles caches in INPUT_STYLE_PATH
+BLEND_STYLE_PREFIX = "blend_"
+
+
+def get_config_filename(argv, default="MarkMelGen.conf"):
+    """
+    given the command line arguments
+    return the -c / --config file name, or the default
+    """
+    config_filename = default
+    for i, arg in enumerate(argv):
+        if arg in ("-c", "--config") and i + 1 < len(argv):
+            config_filename = argv[i + 1]
+        elif arg.startswith("--config="):
+            config_filename = arg[len("--config="):]
+        elif arg.startswith("-c") and not arg.startswith("--") and len(arg) > 2:
+            config_filename = arg[2:]
+    return config_filename
+
+
+def get_input_style_path(config_filename):
+    """
+    given a configuration file
+    return its paths.INPUT_STYLE_PATH, or the default INPUT_STYLE_PATH if it is empty
+    """
+    config = configparser.ConfigParser(allow_no_value=True)
+    with open(config_filename, encoding="utf-8") as f:
+        config.read_file(f)
+    input_style_path = config["paths"]["INPUT_STYLE_PATH"]
+    if input_style_path != "":
+        return input_style_path
+    return INPUT_STYLE_PATH
+
+
+def get_styles(input_style_path):
+    """
+    given the style directory
+    return the list of style names in it, without the cached blends of styles
+    raise FileNotFoundError if there is no style directory
+    """
+    return [
+        style_dir for style_dir in os.listdir(input_style_path)
+        if os.path.isdir(os.path.join(input_style_path, style_dir)) and not style_dir.startswith(BLEND_STYLE_PREFIX)
+    ]
+
+
+def list_styles(input_style_path):
+    """
+    given the style directory
+    print the styles in it, and the USE_STYLES line to configure or override them
+    return the list of style names
+    """
+    print(f"Available styles in {input_style_path} :")
+    style_list = []
+    try:
+        style_list = get_styles(input_style_path)
+    except FileNotFoundError:
+        print(f"Error: Style directory not found at {input_style_path}")
+    for style_dir in style_list:
+        print(f"- {style_dir}")
+    if style_list:
+        print(
+            "\nTo configure the use styles, copy & paste the line below to your .conf file :"
+        )
+        print(f"USE_STYLES=[{','.join(repr(style) for style in style_list)}]")
+        print(
+            "\nTo override .conf styles, copy & paste the line below to your -o override :"
+        )
+        print(
+            f"-o markmelgen.USE_STYLES=[{','.join(repr(style) for style in style_list)}]"
+        )
+    return style_list
+
+
+def fast_path(argv):
+    """
+    given the MarkMelGen.py command line arguments
+    print the version for -v (--version), or list the styles of the configuration file for -lS (--list-styles), and exit.
+    Otherwise (or for -h) return, for MarkMelGen.py to import music21 and parse the arguments in full, see get_config.
+    The other arguments are not checked, as -v and -lS exit before they are used.
+    """
+    if "-h" in argv or "--help" in argv:
+        return
+    if "-v" in argv or "--version" in argv:
+        print(MARKMELGEN_VERSION)
+        sys.exit()
+    if "-lS" in argv or "--list-styles" in argv:
+        list_styles(get_input_style_path(get_config_filename(argv)))
+        sys.exit()
+    return
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# markmelgen_corpus.py
+#
+# which writes a synthetic scale-test corpus: monophonic .mxl melodies, with mixed time signatures, triplets and rests,
+# and a sectioned lyrics file, at a scale of the bundled input/music/*.mxl and input/lyrics/*.txt
+# e.g. 10 (times) to 1000 (times), so create_style, the input music mode and generation can be benchmarked
+# at sizes the bundled files never reach, see markmelgen_bench.py --scaling
+#
+# usage examples:
+# 1. a 10x corpus, writing input/synthetic/synthetic_10x/*.mxl and input/synthetic/synthetic_10x.txt
+# python markmelgen_corpus.py -s 10
+#
+# 2. a 100x corpus of 20 long melodies, then a style from it
+# python markmelgen_corpus.py -s 100 --files 20 -o private/synthetic/
+# python MarkMelGen.py --create-style private/synthetic/synthetic_100x
+#
+# free and open-source software, Paul Wardley Davies, see MarkMelGen/license.txt
+
+# standard libraries
+import argparse
+import math
+import os
+import random
+import sys
+from fractions import Fraction
+
+from music21 import key, meter, note, stream
+
+# the size of the bundled corpus, the unit of the scale
+BUNDLED_MUSIC_FILES = 8  # input/music/*.mxl
+BUNDLED_MUSIC_NOTES = 1153  # notes in input/music/*.mxl
+BUNDLED_LYRICS_LINES = 50  # mean lines of input/lyrics/*.txt
+
+TIME_SIGNATURES = ["4/4", "3/4", "2/4", "6/8"]
+KEYS = ["C", "G", "D", "F", "B-", "a", "e", "d"]
+SECTION_ORDER = ["INTRO", "VERSE", "PRECHORUS", "CHORUS", "VERSE", "PRECHORUS", "CHORUS", "SOLO", "BRIDGE", "CHORUS", "OUTRO"]
+SYLLABLES = ["la", "da", "na", "doo", "be", "oh", "yeah", "mel-o-dy", "sing-ing", "a-gain", "to-night", "for-ev-er"]
+
+
+def get_beat_durations(time_signature, rng):
+    """
+    given a time signature
+    return the quarter lengths filling one beat, with a triplet or a rest (a negative quarter length) now and then
+    """
+    if time_signature.denominator == 8:
+        # compound meter, a dotted quarter beat
+        return rng.choice([[1.5], [1.5], [1.0, 0.5], [0.5, 0.5, 0.5], [0.5, 1.0], [-0.5, 1.0]])
+    choice = rng.random()
+    if choice < 0.15:
+        return [Fraction(1, 3)] * 3  # triplet eighths
+    if choice < 0.2:
+        return [-1.0]
+    return rng.choice([[1.0], [1.0], [0.5, 0.5], [0.75, 0.25], [0.25, 0.25, 0.5]])
+
+
+def make_synthetic_melody(notes, rng):
+    """
+    given a number of notes
+    return a monophonic music21 score of a random walk melody of about that many notes, in a random key,
+    changing time signature every 4 to 8 bars and ending its 4 bar phrases on a held note
+    """
+    a_key = key.Key(rng.choice(KEYS))
+    scale_pitches = a_key.getScale().getPitches(a_key.tonic.name + "3", a_key.tonic.name + "6")
+    degree = scale_pitches.index(next(p for p in scale_pitches if p.octave == 4 and p.name == a_key.tonic.name))
+
+    part = stream.Part()
+    note_count = 0
+    bar_number = 0
+    while note_count < notes:
+        time_signature = meter.TimeSignature(rng.choice(TIME_SIGNATURES))
+        for bar in range(rng.randint(4, 8)):
+            bar_number += 1
+            measure = stream.Measure(number=bar_number)
+            if bar == 0:
+                measure.append(time_signature)
+                if bar_number == 1:
+                    measure.append(a_key)
+            if bar_number % 4 == 0:
+                # a phrase end, a note held for the bar
+                beats = [[time_signature.barDuration.quarterLength]]
+            else:
+                beats = [get_beat_durations(time_signature, rng) for _ in range(time_signature.beatCount)]
+            for beat in beats:
+                for quarter_length in beat:
+                    if quarter_length < 0:
+                        measure.append(note.Rest(quarterLength=-quarter_length))
+                        continue
+                    degree = min(max(degree + rng.choice([-2, -1, -1, 0, 1, 1, 2, 3, -3]), 0), len(scale_pitches) - 1)
+                    measure.append(note.Note(scale_pitches[degree], quarterLength=quarter_length))
+                    note_count += 1
+            part.append(measure)
+            if note_count >= notes:
+                break
+
+    score = stream.Score()
+    score.insert(0, part)
+    return score
+
+
+def make_synthetic_lyrics(lines, rng, title="synthetic"):
+    """
+    given a number of lines
+    return the text of a lyrics file of about that many lines, in sections of 4 lines, of 6 to 16 syllables
+    """
+    text = [f"# {title}"]
+    section_numbers = {}
+    line_count = 0
+    section = 0
+    while line_count < lines:
+        section_name = SECTION_ORDER[section % len(SECTION_ORDER)]
+        section_numbers[section_name] = section_numbers.get(section_name, 0) + 1
+        section += 1
+        text.append(f"{section_name} {section_numbers[section_name]}")
+        for _ in range(4):
+            words = []
+            syllable_count = 0
+            target = rng.randint(6, 16)
+            while syllable_count < target:
+                word = rng.choice(SYLLABLES)
+                words.append(word)
+                syllable_count += word.count("-") + 1
+            text.append(" ".join(words))
+            line_count += 1
+        text.append("")
+    return "\n".join(text) + "\n"
+
+
+def write_synthetic_corpus(output_path, scale, files=None, seed=1):
+    """
+    Writes a synthetic corpus of scale times the notes of the bundled input music, and a lyrics file
+    of scale times the lines of a bundled lyrics file.
+
+    Args:
+        output_path (str): The directory of the corpus.
+        scale (float): The size relative to the bundled files e.g. 10
+        files (int): The number of .mxl files, default scale times the bundled number of files.
+        seed (int): The random seed, the same seed and scale give the same corpus.
+
+    Returns:
+        dict: name, music_path (the directory of .mxl files), lyrics_path, lyrics_filename, files, notes and lyrics_lines
+    """
+    rng = random.Random(seed)
+    name = f"synthetic_{scale:g}x"
+    music_path = os.path.join(output_path, name)
+    os.makedirs(music_path, exist_ok=True)
+
+    if not files:
+        files = max(1, round(BUNDLED_MUSIC_FILES * scale))
+    total_notes = round(BUNDLED_MUSIC_NOTES * scale)
+    notes_per_file = math.ceil(total_notes / files)
+    notes = 0
+    for file_number in range(files):
+        score = make_synthetic_melody(notes_per_file, rng)
+        notes += len(score.recurse().notes)
+        score.write("mxl", fp=os.path.join(music_path, f"{name}_{file_number + 1:05d}.mxl"))
+    print(f"Wrote {files} .mxl files of {notes} notes to {music_path}")
+
+    lyrics_lines = max(4, round(BUNDLED_LYRICS_LINES * scale))
+    lyrics_filename = name + ".txt"
+    with open(os.path.join(output_path, lyrics_filename), "w", encoding="utf-8") as f:
+        f.write(make_synthetic_lyrics(lyrics_lines, rng, name))
+    print(f"Wrote {lyrics_lines} lines of lyrics to {os.path.join(output_path, lyrics_filename)}")
+
+    return {
+        "name": name,
+        "music_path": music_path,
+        "lyrics_path": output_path,
+        "lyrics_filename": lyrics_filename,
+        "files": files,
+        "notes": notes,
+        "lyrics_lines": lyrics_lines,
+    }
+
+
+def main():
+    """
+    parse command line arguments
+    write a synthetic corpus
+    """
+    parser = argparse.ArgumentParser(description="MarkMelGen synthetic scale-test corpus")
+    parser.add_argument('-s', '--scale',
+                        help='size relative to the bundled input music and lyrics, e.g. 10, 100 or 1000, default 10',
+                        default=10,
+                        type=float)
+    parser.add_argument('-o', '--output',
+                        help='corpus directory, default input/synthetic/',
+                        default=os.path.join('input', 'synthetic'),
+                        type=str)
+    parser.add_argument('--files',
+                        help='number of .mxl files, default SCALE times the bundled number',
+                        default=0,
+                        type=int)
+    parser.add_argument('--seed',
+                        help='random seed, default 1',
+                        default=1,
+                        type=int)
+    args = parser.parse_args()
+
+    if args.scale <= 0:
+        print(f"exit: Error scale must be greater than 0, not {args.scale}")
+        sys.exit(1)
+    write_synthetic_corpus(args.output, args.scale, args.files, args.seed)
+    return
+
+
+if __name__ == '__main__':
+    main()
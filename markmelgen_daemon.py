@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# markmelgen_daemon.py
+#
+# which keeps MarkMelGen, music21 and the loaded styles warm in one process and generates a song per job.
+# Jobs are JSON lines read from stdin, or from clients of a local Unix socket, and each job is answered
+# with one JSON line of output paths or base64 encoded output bytes.
+#
+# usage examples:
+# 1. jobs on stdin, results on stdout (MarkMelGen progress output goes to stderr)
+# echo '{"id": 1, "config": "conf/v2.0.0/early_jazz_1.conf"}' | python markmelgen_daemon.py
+#
+# 2. jobs on a Unix socket
+# python markmelgen_daemon.py --socket /tmp/markmelgen.sock
+#
+# job:
+# {"id": 1,                                   optional, returned in the result
+#  "config": "conf/v2.0.0/early_jazz_1.conf",  default MarkMelGen.conf
+#  "overrides": ["markmelgen.TEMPO_BPM=90.0"], optional, as for MarkMelGen.py -o
+#  "lyrics": "VERSE\nRag-time sweet-heart #",  optional lyrics text, instead of INPUT_LYRICS_FILENAME,
+#                                             section keywords e.g. VERSE or CHORUS 1 on their own lines, and each lyrics line ending with #
+#  "outputs": ["kar", "mid", "mxl"],           optional
+#  "seed": 42,                                 optional, the same seed and config give the same melody
+#  "return": "paths"}                          "paths" writes the files to OUTPUT_PATH, "bytes" returns them base64 encoded
+#
+# result:
+# {"id": 1, "ok": true, "seconds": 0.9, "songs": [{"metadata": {...}, "mid": "output/....mid", ...}]}
+# {"id": 1, "ok": false, "error": "..."}
+#
+# free and open-source software, Paul Wardley Davies, see MarkMelGen/license.txt
+
+# standard libraries
+import argparse
+import base64
+import contextlib
+import json
+import os
+import signal
+import socketserver
+import sys
+import tempfile
+import time
+
+import MarkMelGen
+import MarkMelGen_utilities
+import markmelgen_style
+
+FILE_OUTPUT_TYPES = ["kar", "mid", "mxl"]
+
+
+def check_lyrics(lyrics):
+    """
+    given the lyrics text of a job
+    raise ValueError if MarkMelGen would not read a song from it, as get_lyrics and plan_song_lines read a lyrics file:
+    the first line naming a section must start with its keyword, e.g. VERSE not [Verse], and a lyrics line must follow
+    """
+    if not isinstance(lyrics, str):
+        raise ValueError(f"lyrics must be text, not {type(lyrics).__name__}")
+    section_keywords = [a_section.name for a_section in MarkMelGen.Section]
+    in_section = False
+    lyrics_lines = 0
+    for line_num, line in enumerate(lyrics.splitlines(), start=1):
+        line = line.split("#", maxsplit=1)[0].strip()
+        if any(x in line.casefold() for x in MarkMelGen._section_name_matches):
+            # a later line naming a section without its keyword continues the section before it
+            if not in_section and not any(line.casefold().startswith(keyword.casefold()) for keyword in section_keywords):
+                raise ValueError(f"lyrics line {line_num} '{line}' names a section but does not start with one of {section_keywords}")
+            in_section = True
+        elif line != "" and in_section:
+            lyrics_lines += 1
+    if lyrics_lines == 0:
+        raise ValueError("lyrics have no lines under a section keyword, e.g. \"VERSE\\nRag-time sweet-heart #\"")
+
+
+def run_job(job):
+    """
+    given a job dict
+    generate its songs with MarkMelGen in this process
+    return the result dict
+    """
+    start = time.perf_counter()
+    result = {"id": job.get("id")}
+    try:
+        config = job.get("config", "MarkMelGen.conf")
+        overrides = list(job.get("overrides", []))
+        outputs = job.get("outputs", FILE_OUTPUT_TYPES)
+        unknown_outputs = [output for output in outputs if output not in FILE_OUTPUT_TYPES]
+        if unknown_outputs:
+            raise ValueError(f"outputs {unknown_outputs} not in {FILE_OUTPUT_TYPES}")
+        return_paths = job.get("return", "paths") == "paths"
+        if job.get("lyrics"):
+            check_lyrics(job["lyrics"])
+
+        with tempfile.TemporaryDirectory() as lyrics_dir:
+            if job.get("lyrics"):
+                with open(os.path.join(lyrics_dir, "lyrics.txt"), "w", encoding="utf-8") as f:
+                    f.write(job["lyrics"])
+                overrides += [
+                    "paths.INPUT_LYRICS_PATH=" + lyrics_dir + os.sep,
+                    "filenames.INPUT_LYRICS_FILENAME=lyrics.txt",
+                ]
+            songs = MarkMelGen.generate_song_buffers(
+                config,
+                overrides,
+                outputs=outputs,
+                write_files=return_paths,
+                buffers=not return_paths,
+                seed=job.get("seed"),
+            )
+
+        result["songs"] = []
+        for song in songs:
+            song_result = {"metadata": song["metadata"]}
+            for output in outputs:
+                if return_paths:
+                    song_result[output] = song["path"] + "." + output
+                else:
+                    song_result[output] = base64.b64encode(song[output]).decode("ascii")
+            result["songs"].append(song_result)
+        result["ok"] = True
+    except SystemExit:
+        # MarkMelGen has logged the error and would have exited
+        result["ok"] = False
+        result["error"] = "MarkMelGen exited, see the log"
+    except Exception as err:
+        result["ok"] = False
+        result["error"] = f"{type(err).__name__}: {err}"
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def run_job_line(line):
+    """
+    given a JSON line
+    return the JSON line of the result, with MarkMelGen progress output sent to stderr
+    """
+    try:
+        job = json.loads(line)
+    except json.JSONDecodeError as err:
+        return json.dumps({"id": None, "ok": False, "error": f"JSONDecodeError: {err}"})
+    with contextlib.redirect_stdout(sys.stderr):
+        result = run_job(job)
+    return json.dumps(result)
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    """
+    answers each JSON line job of a socket client with a JSON line result
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            self.wfile.write((run_job_line(line.decode("utf-8")) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+
+def serve_stdin():
+    """
+    run the JSON line jobs on stdin, until end of file
+    """
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        print(run_job_line(line), flush=True)
+    return
+
+
+def serve_socket(socket_path):
+    """
+    run the JSON line jobs of clients of a Unix socket. Jobs run one at a time as MarkMelGen settings are global.
+    """
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    # stop cleanly on kill as on Ctrl+C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    with socketserver.UnixStreamServer(socket_path, JobHandler) as server:
+        print(f"markmelgen_daemon listening on {socket_path}", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(socket_path)
+    return
+
+
+def main():
+    """
+    parse command line arguments
+    serve jobs from stdin or a Unix socket
+    """
+    parser = argparse.ArgumentParser(description="MarkMelGen daemon: generate songs from JSON line jobs")
+    parser.add_argument('-s', '--socket',
+                        help='Unix socket path to serve jobs on, default read jobs from stdin',
+                        default='',
+                        type=str)
+    args = parser.parse_args()
+
+    # no user to press Enter after an error, and keep the styles in memory between jobs
+    MarkMelGen_utilities.PAUSE_ON_ERROR = False
+    markmelgen_style.CACHE_STYLES = True
+
+    if args.socket:
+        if not hasattr(socketserver, "UnixStreamServer"):
+            print("exit: Error Unix sockets are not available on this platform, use stdin")
+            sys.exit(1)
+        serve_socket(args.socket)
+    else:
+        serve_stdin()
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,408 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# markmelgen_server.py
+#
+# which serves MarkMelGen song generation over local HTTP. Requests are queued to a bounded pool of
+# worker processes, each keeping MarkMelGen, music21 and the loaded styles warm, see markmelgen_daemon.py
+# Only the Python standard library is used, nothing outside this computer is contacted.
+#
+# usage examples:
+# python markmelgen_server.py
+# python markmelgen_server.py --port 8765 --workers 4 --queue-size 32
+#
+# endpoints:
+# POST /jobs                a job (JSON) as for markmelgen_daemon.py, with optional "style" e.g.
+#                           {"style": "early_jazz_1", "lyrics": "VERSE\n...", "overrides": ["markmelgen.TEMPO_BPM=90.0"], "seed": 42}
+#                           the config must be MarkMelGen.conf or a .conf file in --config-dir, the style one of its styles,
+#                           and the overrides of the melody settings only (the [markmelgen] and [song_*] sections,
+#                           not the paths, file names, USE_STYLES or DISPLAY_*), so a client cannot choose the files read
+#                           202 {"id": "...", "status": "queued"}, or 503 with Retry-After when the queue is full
+# GET  /jobs/<id>           202 while queued or running, 200 when done or failed: {"id", "status", "seconds"}
+# GET  /jobs/<id>/result    200 the markmelgen_daemon.py result, outputs base64 encoded, 409 if not finished
+# GET  /health              200 {"ok", "workers", "queue_size", "queued", "running", "finished"}
+#
+# free and open-source software, Paul Wardley Davies, see MarkMelGen/license.txt
+
+# standard libraries
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import json
+import os
+import re
+import sys
+import time
+import uuid
+
+import markmelgen_cli
+import markmelgen_daemon
+
+HTTP_REASONS = {
+    200: "OK",
+    202: "Accepted",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+    413: "Payload Too Large",
+    503: "Service Unavailable",
+}
+
+# the largest job request body accepted, in bytes
+MAX_REQUEST_BYTES = 1_000_000
+
+# finished jobs are kept for their results until this many more have finished
+MAX_FINISHED_JOBS = 1000
+
+# the configuration files a job may use: MarkMelGen.conf and the .conf files in CONFIG_DIR (--config-dir)
+DEFAULT_CONFIG = "MarkMelGen.conf"
+CONFIG_DIR = os.path.join(markmelgen_cli.here, "conf")
+
+# the overrides a job may give: the melody settings, not the paths or file names read and written
+OVERRIDE_PATTERN = re.compile(r"(markmelgen|song_[a-z]+)\.([A-Z][A-Z0-9_]*)=[^\r\n]*")
+REJECTED_OVERRIDE_KEYS = {"USE_STYLES", "DISPLAY_GRAPHS", "DISPLAY_HTML", "DISPLAY_MXL", "DISPLAY_KAR"}
+
+
+def _init_worker():
+    """
+    worker process initializer: no user to press Enter after an error, and keep the styles in memory between jobs
+    """
+    import MarkMelGen_utilities
+    import markmelgen_style
+
+    MarkMelGen_utilities.PAUSE_ON_ERROR = False
+    markmelgen_style.CACHE_STYLES = True
+
+
+def run_job_in_worker(job):
+    """
+    given a job dict
+    return the result dict, generated in a worker process with MarkMelGen progress output sent to stderr
+    """
+    return json.loads(markmelgen_daemon.run_job_line(json.dumps(job)))
+
+
+def get_config(config):
+    """
+    given the config of a request
+    return it if it is DEFAULT_CONFIG or a .conf file in CONFIG_DIR
+    raise ValueError otherwise
+    """
+    if not isinstance(config, str):
+        raise ValueError("config must be a string")
+    if config == DEFAULT_CONFIG:
+        return config
+    config_path = os.path.realpath(config)
+    config_dir = os.path.realpath(CONFIG_DIR)
+    if (
+        not config.endswith(".conf")
+        or os.path.commonpath([config_path, config_dir]) != config_dir
+        or not os.path.isfile(config_path)
+    ):
+        raise ValueError(f"config must be {DEFAULT_CONFIG} or a .conf file in {CONFIG_DIR}")
+    return config
+
+
+def get_overrides(overrides):
+    """
+    given the overrides of a request
+    return them if each is a 'section.key=value' melody setting, see OVERRIDE_PATTERN and REJECTED_OVERRIDE_KEYS
+    raise ValueError otherwise
+    """
+    if not isinstance(overrides, list) or not all(isinstance(override, str) for override in overrides):
+        raise ValueError("overrides must be a list of 'section.key=value' strings")
+    for override in overrides:
+        match = OVERRIDE_PATTERN.fullmatch(override)
+        if not match or match.group(2) in REJECTED_OVERRIDE_KEYS:
+            raise ValueError(
+                f"override {override!r} not allowed, only the [markmelgen] and [song_*] melody settings "
+                f"(not {', '.join(sorted(REJECTED_OVERRIDE_KEYS))}) can be overridden, use style for the style"
+            )
+    return list(overrides)
+
+
+def get_style(style, config):
+    """
+    given the style of a request and its config
+    return the style if it is one of the styles of the config
+    raise ValueError otherwise
+    """
+    try:
+        styles = markmelgen_cli.get_styles(markmelgen_cli.get_input_style_path(config))
+    except (OSError, KeyError):
+        styles = []
+    if style not in styles:
+        raise ValueError(f"style {style!r} not found, the styles are {sorted(styles)}")
+    return style
+
+
+def get_job_from_request(request):
+    """
+    given the JSON body of a POST /jobs request
+    return a markmelgen_daemon.py job, with the outputs returned as bytes
+    raise ValueError if the request is not valid
+    """
+    if not isinstance(request, dict):
+        raise ValueError("a job must be a JSON object")
+    job = {
+        "config": get_config(request.get("config", DEFAULT_CONFIG)),
+        "overrides": get_overrides(request.get("overrides", [])),
+        "outputs": request.get("outputs", markmelgen_daemon.FILE_OUTPUT_TYPES),
+        "return": "bytes",
+    }
+    if request.get("style"):
+        style = get_style(request["style"], job["config"])
+        job["overrides"].append(f"markmelgen.USE_STYLES={[style]!r}")
+    if request.get("lyrics"):
+        job["lyrics"] = str(request["lyrics"])
+    if request.get("seed") is not None:
+        job["seed"] = int(request["seed"])
+    return job
+
+
+class GenerationService:
+    """
+    A queue of generation jobs run by a bounded pool of worker processes.
+    Methods include submit, get_job and get_health
+    """
+
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.jobs = {}
+        self.finished = collections.deque()
+        self.running = 0
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+        self.worker_tasks = [asyncio.create_task(self.run_jobs()) for _ in range(workers)]
+
+    def submit(self, job):
+        """
+        queue a job, return its record or None if the queue is full
+        """
+        job_id = uuid.uuid4().hex
+        record = {"id": job_id, "status": "queued", "submitted": time.time(), "job": job}
+        try:
+            self.queue.put_nowait(record)
+        except asyncio.QueueFull:
+            return None
+        self.jobs[job_id] = record
+        return record
+
+    async def run_jobs(self):
+        """
+        a worker: run the queued jobs one at a time in the process pool
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            record = await self.queue.get()
+            record["status"] = "running"
+            self.running += 1
+            start = time.perf_counter()
+            job = record.pop("job")
+            try:
+                executor = self.executor
+                try:
+                    future = loop.run_in_executor(executor, run_job_in_worker, job)
+                except concurrent.futures.process.BrokenProcessPool:
+                    # the pool broke while idle so this job never ran, start new workers and submit it again
+                    self.restart_executor(executor)
+                    executor = self.executor
+                    future = loop.run_in_executor(executor, run_job_in_worker, job)
+                record["result"] = await future
+                record["status"] = "done" if record["result"]["ok"] else "failed"
+            except concurrent.futures.process.BrokenProcessPool as err:
+                # a worker process died e.g. killed for memory, the pool takes no more jobs so start a new one
+                record["result"] = {"ok": False, "error": f"{type(err).__name__}: {err}"}
+                record["status"] = "failed"
+                self.restart_executor(executor)
+            except Exception as err:
+                record["result"] = {"ok": False, "error": f"{type(err).__name__}: {err}"}
+                record["status"] = "failed"
+            record["seconds"] = round(time.perf_counter() - start, 3)
+            self.running -= 1
+            self.queue.task_done()
+            self.finished.append(record["id"])
+            while len(self.finished) > MAX_FINISHED_JOBS:
+                self.jobs.pop(self.finished.popleft(), None)
+
+    def restart_executor(self, broken_executor):
+        """
+        replace a broken process pool with a new one, once however many jobs it failed
+        """
+        if self.executor is not broken_executor:
+            return
+        print("markmelgen_server worker pool broken, starting new workers", file=sys.stderr)
+        broken_executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+
+    def get_job(self, job_id):
+        return self.jobs.get(job_id)
+
+    def get_health(self):
+        return {
+            "ok": True,
+            "workers": self.workers,
+            "queue_size": self.queue.maxsize,
+            "queued": self.queue.qsize(),
+            "running": self.running,
+            "finished": len(self.finished),
+        }
+
+    def close(self):
+        for task in self.worker_tasks:
+            task.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def read_request(reader):
+    """
+    given a stream reader
+    return the HTTP method, path and body of the request, or None if the connection closed
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path, _ = request_line.decode("latin-1").split(" ", 2)
+    content_length = 0
+    while True:
+        header = await reader.readline()
+        if header in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = header.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            content_length = int(value.strip())
+    if content_length > MAX_REQUEST_BYTES:
+        return method, path, None
+    body = await reader.readexactly(content_length) if content_length else b""
+    return method, path, body
+
+
+def route(service, method, path, body):
+    """
+    given a request
+    return the HTTP status, the JSON response and any extra headers
+    """
+    parts = [part for part in path.split("?", 1)[0].split("/") if part]
+
+    if parts == ["health"] and method == "GET":
+        return 200, service.get_health(), {}
+
+    if parts == ["jobs"]:
+        if method != "POST":
+            return 405, {"error": "use POST /jobs"}, {}
+        if body is None:
+            return 413, {"error": f"request larger than {MAX_REQUEST_BYTES} bytes"}, {}
+        try:
+            job = get_job_from_request(json.loads(body or b"{}"))
+        except (ValueError, TypeError) as err:
+            return 400, {"error": str(err)}, {}
+        record = service.submit(job)
+        if record is None:
+            # back-pressure: the client should retry later
+            return 503, {"error": "queue full", "queue_size": service.queue.maxsize}, {"Retry-After": "5"}
+        return 202, {"id": record["id"], "status": record["status"]}, {"Location": f"/jobs/{record['id']}"}
+
+    if len(parts) in (2, 3) and parts[0] == "jobs" and method == "GET":
+        record = service.get_job(parts[1])
+        if record is None:
+            return 404, {"error": f"job {parts[1]} not found"}, {}
+        finished = record["status"] in ("done", "failed")
+        if len(parts) == 2:
+            status = {"id": record["id"], "status": record["status"], "seconds": record.get("seconds")}
+            return (200 if finished else 202), status, {}
+        if parts[2] == "result":
+            if not finished:
+                return 409, {"id": record["id"], "status": record["status"]}, {}
+            return 200, dict(record["result"], id=record["id"]), {}
+
+    return 404, {"error": f"{method} {path} not found"}, {}
+
+
+async def handle_connection(service, reader, writer):
+    """
+    answer the HTTP requests of a connection, one JSON response per request
+    """
+    try:
+        while True:
+            try:
+                request = await read_request(reader)
+            except (ValueError, asyncio.IncompleteReadError):
+                request = ("", "", b"")
+                status, response, headers = 400, {"error": "bad request"}, {"Connection": "close"}
+            else:
+                if request is None:
+                    break
+                status, response, headers = route(service, *request)
+            body = json.dumps(response).encode("utf-8")
+            head = f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+            head += "Content-Type: application/json\r\n"
+            head += f"Content-Length: {len(body)}\r\n"
+            for name, value in headers.items():
+                head += f"{name}: {value}\r\n"
+            writer.write(head.encode("latin-1") + b"\r\n" + body)
+            await writer.drain()
+            if headers.get("Connection") == "close":
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host, port, workers, queue_size):
+    """
+    run the generation service until interrupted
+    """
+    service = GenerationService(workers, queue_size)
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_connection(service, reader, writer), host, port
+    )
+    print(f"markmelgen_server listening on http://{host}:{port} with {workers} workers", file=sys.stderr)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+def main():
+    """
+    parse command line arguments
+    serve generation jobs over HTTP
+    """
+    global CONFIG_DIR
+
+    parser = argparse.ArgumentParser(description="MarkMelGen server: generate songs over local HTTP")
+    parser.add_argument('--host',
+                        help='address to listen on, default 127.0.0.1 (this computer only)',
+                        default='127.0.0.1',
+                        type=str)
+    parser.add_argument('-p', '--port',
+                        help='port to listen on, default 8765',
+                        default=8765,
+                        type=int)
+    parser.add_argument('-w', '--workers',
+                        help='number of worker processes generating songs, default 2',
+                        default=2,
+                        type=int)
+    parser.add_argument('-c', '--config-dir',
+                        help=f'directory of the .conf files a job may use, as well as {DEFAULT_CONFIG}, default conf/',
+                        default=CONFIG_DIR,
+                        type=str)
+    parser.add_argument('-q', '--queue-size',
+                        help='number of jobs that can wait for a worker before requests are refused with 503, default 16',
+                        default=16,
+                        type=int)
+    args = parser.parse_args()
+
+    CONFIG_DIR = args.config_dir
+    try:
+        asyncio.run(serve(args.host, args.port, max(1, args.workers), max(1, args.queue_size)))
+    except KeyboardInterrupt:
+        pass
+    return
+
+
+if __name__ == '__main__':
+    main()
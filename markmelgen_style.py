@@ -7,20 +7,31 @@
 # free and open-source software, Paul Wardley Davies, see license.txt
 
 import MarkMelGen_utilities
+import argparse
 import copy
+import gc
+import hashlib
+import heapq
 import logging
 import io
+import math
 import os
+import re
+import struct
 import sys
+import tempfile
+import threading
+import time
 # import json
 import pickle
 
 from contextlib import redirect_stdout
+from fractions import Fraction
 from logging_config import logger
+from markmelgen_cli import BLEND_STYLE_PREFIX
 from MarkMelGen_utilities import *
 from music21 import *
 from music21 import meter
-from showscore import show
 
 
 
@@ -43,10 +54,30 @@ def are_dictionaries_the_same(dict1, dict2):
     return True
 
 
+def share_equal_values(table, shared=None):
+    """
+    given a table of dicts, tuples and lists
+    return a copy with each equal value of the same type, e.g. the str '0.5', as one object and no container shared,
+    so pickle writes the same bytes for the same table however it was built, in memory, from shards or by --reduce
+    """
+    if shared is None:
+        shared = {}
+    if isinstance(table, dict):
+        return {share_equal_values(key, shared): share_equal_values(value, shared) for key, value in table.items()}
+    if isinstance(table, (tuple, list)):
+        return type(table)(share_equal_values(item, shared) for item in table)
+    try:
+        return shared.setdefault((type(table), table), table)
+    except TypeError:
+        return table
+
+
 #v2 pickle
 def write_transition_probabilities_to_disk(transition_probabilities, style_path, transition_name):
     """
     Writes transition probabilities to disk as a pickle file.
+    The pickle is written to a temporary file of this process and thread in style_path and renamed over the file with os.replace,
+    so a run reading the style meanwhile (e.g. a daemon, server or runconfs worker) reads the old or the new file, never part of one.
 
     Args:
         transition_probabilities (dict): The transition probabilities dictionary.
@@ -54,8 +85,15 @@ def write_transition_probabilities_to_disk(transition_probabilities, style_path,
         transition_name (str): The name of the transition (e.g., "note_transition_probabilities", "duration_transition_probabilities").
     """
     file_path = os.path.join(style_path, f"{transition_name}.pkl")
-    with open(file_path, 'wb') as f:
-        pickle.dump(transition_probabilities, f)
+    temp_path = f"{file_path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        with open(temp_path, 'wb') as f:
+            pickle.dump(share_equal_values(transition_probabilities), f)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
     print(f"{transition_name} written to {file_path}")
     return
 
@@ -791,7 +829,33 @@ def calculate_cad_dtransition_probabilities(cad_dtransitions, total_cad_dtransit
 #         logger.error(f"An unexpected error occurred: {e}")
 #         return None, None, None, None, None, None
 
+# True to keep loaded styles in memory, for processes that generate many songs e.g. markmelgen_daemon.py
+CACHE_STYLES = False
+
+# style path -> (modification times of the transition files, the loaded transition tables)
+_style_cache = {}
+
+
+@profile_span("load_transition_files")
 def load_transition_files(style_path):
+    """
+    given a style directory
+    return the six transition tables of the style, see TRANSITION_TABLE_NAMES, or six None if a file is missing.
+    If CACHE_STYLES is True a style is read from disk again only if its files have changed.
+    """
+    if CACHE_STYLES:
+        try:
+            mtimes = [
+                os.path.getmtime(os.path.join(style_path, f"{name}_probabilities.pkl"))
+                for name in TRANSITION_TABLE_NAMES
+            ]
+        except OSError:
+            mtimes = None
+        cached = _style_cache.get(style_path)
+        if mtimes is not None and cached is not None and cached[0] == mtimes:
+            logger.debug(f"load_transition_files using cached style {style_path}")
+            return cached[1]
+
     try:
         # Load transition
         transition_file = os.path.join(style_path, "note_transition_probabilities.pkl")
@@ -823,13 +887,192 @@ def load_transition_files(style_path):
         with open(rest_note_transition_file, "rb") as f:
             rest_note_transition = pickle.load(f)
 
+        if CACHE_STYLES and mtimes is not None:
+            _style_cache[style_path] = (
+                mtimes,
+                (transition, bpm_transition, dtransition, cad_transition, cad_dtransition, rest_note_transition),
+            )
         return transition, bpm_transition, dtransition, cad_transition, cad_dtransition, rest_note_transition
 
     except FileNotFoundError as e:
         print(f"Error loading transition files: {e}")
         return None, None, None, None, None, None
-    
 
+
+# The transition table names, in the order returned by load_transition_files.
+# Each table is stored as <name>_probabilities.pkl and, for styles created since counts were kept, <name>_counts.pkl
+TRANSITION_TABLE_NAMES = [
+    "note_transition",
+    "bpm_transition",
+    "dtransition",
+    "cad_transition",
+    "cad_dtransition",
+    "rest_note_transition",
+]
+
+
+def parse_style_weight(style):
+    """
+    Splits a USE_STYLES entry of the form 'style' or 'style:weight' into its name and weight.
+
+    Args:
+        style (str): The USE_STYLES entry e.g. 'early_jazz_1:0.7'
+
+    Returns:
+        tuple: (style_name, weight) where weight defaults to 1.0
+
+    Raises:
+        ValueError: if the weight is not a finite positive number e.g. 0, -1, nan or inf.
+    """
+    if ":" not in style:
+        return style.strip(), 1.0
+    style_name, weight_str = style.rsplit(":", 1)
+    weight = float(weight_str)
+    if not math.isfinite(weight) or weight <= 0:
+        raise ValueError(f"style weight must be a finite number > 0, got {weight_str} in {style}")
+    return style_name.strip(), weight
+
+
+def is_style_blend(use_styles):
+    """
+    returns True if any USE_STYLES entry has a weight i.e. 'style:weight', so the styles are blended into one model.
+    """
+    return any(":" in style for style in use_styles)
+
+
+def get_blend_style_name(style_weights):
+    """
+    returns the style directory name of a blend e.g. [('early_jazz_1', 0.7), ('blues_1', 0.3)] gives
+    blend_early_jazz_1_70_blues_1_30_<hash> where the weights are normalised to percentages,
+    and <hash> is of the exact normalised weights, so blends that round to the same percentages
+    e.g. 0.334/0.666 and 0.33/0.67 have a directory each.
+    """
+    total_weight = sum(weight for _, weight in style_weights)
+    parts = [f"{style_name}_{round(100 * weight / total_weight)}" for style_name, weight in style_weights]
+    exact_weights = ",".join(f"{style_name}:{weight / total_weight!r}" for style_name, weight in style_weights)
+    parts.append(hashlib.sha1(exact_weights.encode("utf-8")).hexdigest()[:10])
+    return BLEND_STYLE_PREFIX + "_".join(parts)
+
+
+def blend_transition_tables(tables, weights, counts_tables=None):
+    """
+    Merges the same transition table of several styles into one weighted mixture.
+
+    If counts_tables is given (one count table per style) the counts are merged, each style's counts scaled by
+    weight / total count of that style's table, so a row seen often in a style carries more evidence than a row seen once.
+    Otherwise the probabilities are mixed, each row renormalised over the styles that have that row.
+
+    Args:
+        tables (list): The probability tables, dict of (prev, current) -> {next: probability}, one per style.
+        weights (list): The style weights, normalised to sum to 1.
+        counts_tables (list): Optional count tables, dict of (prev, current) -> {next: count}, one per style.
+
+    Returns:
+        dict: The blended probability table, each row summing to 1.
+    """
+    blended = {}
+    row_totals = {}
+    if counts_tables is not None:
+        for counts, weight in zip(counts_tables, weights):
+            table_total = sum(sum(row.values()) for row in counts.values())
+            if table_total == 0:
+                continue
+            scale = weight / table_total
+            for key, row in counts.items():
+                blended_row = blended.setdefault(key, {})
+                for next_value, count in row.items():
+                    blended_row[next_value] = blended_row.get(next_value, 0) + count * scale
+                row_totals[key] = row_totals.get(key, 0) + sum(row.values()) * scale
+    else:
+        for table, weight in zip(tables, weights):
+            for key, row in table.items():
+                blended_row = blended.setdefault(key, {})
+                # divide by the row sum so compacted styles with integer weights (see compact_style) mix correctly
+                row_sum = sum(row.values())
+                for next_value, probability in row.items():
+                    blended_row[next_value] = blended_row.get(next_value, 0) + probability / row_sum * weight
+                row_totals[key] = row_totals.get(key, 0) + weight
+
+    for key, blended_row in blended.items():
+        total = row_totals[key]
+        for next_value in blended_row:
+            blended_row[next_value] /= total
+    return blended
+
+
+def is_blend_cache_current(blend_path, style_paths):
+    """
+    returns True if the cached blend in blend_path has all its transition files and is newer than every source style file.
+    """
+    blend_files = [os.path.join(blend_path, f"{name}_probabilities.pkl") for name in TRANSITION_TABLE_NAMES]
+    if not all(os.path.exists(file_path) for file_path in blend_files):
+        return False
+    blend_mtime = min(os.path.getmtime(file_path) for file_path in blend_files)
+    for style_path in style_paths:
+        for filename in os.listdir(style_path):
+            if filename.endswith(".pkl") and os.path.getmtime(os.path.join(style_path, filename)) > blend_mtime:
+                return False
+    return True
+
+
+@profile_span("blend_styles")
+def blend_styles(INPUT_STYLE_PATH, style_weights):
+    """
+    Blends the six transition tables of several styles into one weighted mixture style, written to
+    INPUT_STYLE_PATH/<blend name> so that later runs with the same blend load it directly.
+    Count files are merged when every style has them, otherwise the probabilities are mixed.
+
+    Args:
+        INPUT_STYLE_PATH (str): The directory containing the style directories.
+        style_weights (list): (style_name, weight) tuples e.g. from parse_style_weight
+
+    Returns:
+        str: The blend style name, loadable with load_transition_files(os.path.join(INPUT_STYLE_PATH, name))
+
+    Raises:
+        ValueError: if the weights add up to more than a float can hold.
+        FileNotFoundError: if a style directory or one of its transition files does not exist.
+    """
+    if not math.isfinite(sum(weight for _, weight in style_weights)):
+        raise ValueError(f"style weights must add up to a finite number, got {style_weights}")
+    blend_name = get_blend_style_name(style_weights)
+    blend_path = os.path.join(INPUT_STYLE_PATH, blend_name)
+    style_paths = [os.path.join(INPUT_STYLE_PATH, style_name) for style_name, _ in style_weights]
+    for style_path in style_paths:
+        if not os.path.isdir(style_path):
+            raise FileNotFoundError(f"Style directory not found at {style_path}")
+
+    if is_blend_cache_current(blend_path, style_paths):
+        logger.info(f"Using cached style blend {blend_path}")
+        return blend_name
+
+    total_weight = sum(weight for _, weight in style_weights)
+    weights = [weight / total_weight for _, weight in style_weights]
+    logger.info(f"Blending styles {style_weights} into {blend_path}")
+
+    os.makedirs(blend_path, exist_ok=True)
+    for name in TRANSITION_TABLE_NAMES:
+        tables = []
+        for style_path in style_paths:
+            table = read_transition_probabilities_from_disk(style_path, f"{name}_probabilities")
+            if table is None:
+                raise FileNotFoundError(f"{name}_probabilities.pkl not found in {style_path}")
+            tables.append(table)
+
+        counts_tables = None
+        if all(os.path.exists(os.path.join(style_path, f"{name}_counts.pkl")) for style_path in style_paths):
+            counts_tables = [read_transition_probabilities_from_disk(style_path, f"{name}_counts") for style_path in style_paths]
+            logger.debug(f"Blending {name} by counts")
+        else:
+            logger.debug(f"Blending {name} by probabilities")
+
+        blended = blend_transition_tables(tables, weights, counts_tables)
+        write_transition_probabilities_to_disk(blended, blend_path, f"{name}_probabilities")
+
+    return blend_name
+
+
+@profile_span("process_mxl_file")
 def process_mxl_file(file_path, note_transitions, total_note_transitions, rest_note_transitions, total_rest_note_transitions, bpm_transitions, total_bpm_transitions, dtransitions, total_dtransitions, cad_transitions, total_cad_transitions, cad_dtransitions, total_cad_dtransitions, display_html):
        
     print(f"Processing file: {file_path}")
@@ -850,6 +1093,8 @@ def process_mxl_file(file_path, note_transitions, total_note_transitions, rest_n
     for el in score[tempo.MetronomeMark]:
         el.activeSite.remove(el)
     if display_html:
+        from showscore import show  # imported when shown, it is slow to import
+
         show(score)
 
     # Log the analysis results of the melody notes
@@ -880,6 +1125,8 @@ def process_mxl_file(file_path, note_transitions, total_note_transitions, rest_n
     # Set or append to the title
     append_or_set_title(transposed_score, "Transpose.")
     if display_html:
+        from showscore import show  # imported when shown, it is slow to import
+
         show(transposed_score)
     # Log the analysis results of the melody notes
     log_analyze_melody_notes(transposed_score, "input Melody after transpose")
@@ -895,60 +1142,426 @@ def process_mxl_file(file_path, note_transitions, total_note_transitions, rest_n
         _extract_cad_transitions_from_part(part, cad_transitions, total_cad_transitions)
         _extract_cad_dtransitions_from_part(part, cad_dtransitions, total_cad_dtransitions)
 
-    return
+    return transposed_score
+
+
+def count_mxl_files(file_paths, display_html=False, on_score=None):
+    """
+    given .mxl file paths
+    add the transitions of each file in turn to the count tables with process_mxl_file,
+    letting go of its score (and collecting the reference cycles of its music21 objects) before the next file is parsed,
+    so only one score is held at a time. on_score(file_path, transposed_score) is called after each file.
+    return the 12 count tables in the order of the process_mxl_file arguments:
+    note_transitions, total_note_transitions, rest_note_transitions, total_rest_note_transitions,
+    bpm_transitions, total_bpm_transitions, dtransitions, total_dtransitions,
+    cad_transitions, total_cad_transitions, cad_dtransitions, total_cad_dtransitions
+    """
+    counts = tuple({} for _ in range(12))
+    for file_path in file_paths:
+        transposed_score = process_mxl_file(file_path, *counts, display_html)
+        if on_score is not None:
+            on_score(file_path, transposed_score)
+        del transposed_score
+        gc.collect()
+    return counts
+
+
+def calculate_transition_probabilities(counts):
+    """
+    given the count tables of count_mxl_files
+    return the transition probabilities in the order of load_transition_files:
+    transition, bpm_transition, dtransition, cad_transition, cad_dtransition, rest_note_transition
+    """
+    (
+        note_transitions, total_note_transitions, rest_note_transitions, total_rest_note_transitions,
+        bpm_transitions, total_bpm_transitions, dtransitions, total_dtransitions,
+        cad_transitions, total_cad_transitions, cad_dtransitions, total_cad_dtransitions,
+    ) = counts
+    return (
+        calculate_note_transition_probabilities(note_transitions, total_note_transitions),
+        calculate_bpm_transition_probabilities(bpm_transitions, total_bpm_transitions),
+        calculate_dtransition_probabilities(dtransitions, total_dtransitions),
+        calculate_cad_transition_probabilities(cad_transitions, total_cad_transitions),
+        calculate_cad_dtransition_probabilities(cad_dtransitions, total_cad_dtransitions),
+        calculate_rest_note_transition_probabilities(rest_note_transitions, total_rest_note_transitions),
+    )
+
+
+# --shard-files: create_style counts SHARD_FILES .mxl files at a time, spills their count tables to a sorted shard file
+# of integer coded records on disk, then merges the shards with a k-way merge into the style one table at a time,
+# so the memory is bounded by a shard and one table, not by the corpus.
+# A shard file is SHARD_MAGIC, the length of its header, the pickled header (the vocabulary of symbol codes,
+# the number of records and the .mxl files counted) then the records, sorted.
+SHARD_MAGIC = b"MarkMelGen shard 1\n"
+# a record: table number (in TRANSITION_TABLE_NAMES), row key code, next code, count, and where the row and the
+# transition were first seen (shard number << 32 | index), to keep the order of the transitions as create_style does
+SHARD_RECORD = struct.Struct("<BIIQQQ")
+SHARD_READ_RECORDS = 4096  # records read from a shard at a time
+SHARD_MERGE_FAN_IN = 64  # shards merged at once, more are merged in passes so the open files are bounded
+
+
+def get_count_tables(counts):
+    """
+    given the 12 count tables of count_mxl_files
+    return the 6 transition count tables in the order of TRANSITION_TABLE_NAMES (the totals are their row sums)
+    """
+    return [counts[0], counts[4], counts[6], counts[8], counts[10], counts[2]]
+
+
+def get_symbol_code(vocabulary, symbol):
+    """
+    given the vocabulary of a shard build {"codes": {}, "symbols": []} and a row key or next symbol
+    return the integer code of the symbol, adding it to the vocabulary if new.
+    The type is part of the symbol, so e.g. the float 1.0 and the string '1.0' have different codes.
+    """
+    vocabulary_key = (type(symbol).__name__, symbol)
+    code = vocabulary["codes"].get(vocabulary_key)
+    if code is None:
+        code = len(vocabulary["symbols"])
+        vocabulary["codes"][vocabulary_key] = code
+        vocabulary["symbols"].append(symbol)
+    return code
+
+
+def write_count_shard(count_tables, vocabulary, shard_number, shard_filename, files=()):
+    """
+    given the count tables of a shard (see get_count_tables), the vocabulary and the shard number
+    write the integer coded records of the counts, sorted, to shard_filename
+    return the number of records
+    """
+    records = []
+    for table_number, table in enumerate(count_tables):
+        for row_index, (row_key, row) in enumerate(table.items()):
+            row_code = get_symbol_code(vocabulary, row_key)
+            for entry_index, (next_symbol, count) in enumerate(row.items()):
+                records.append((
+                    table_number, row_code, get_symbol_code(vocabulary, next_symbol), count,
+                    shard_number << 32 | row_index, shard_number << 32 | entry_index,
+                ))
+    records.sort()
+    write_shard_records(shard_filename, records, vocabulary["symbols"], files)
+    return len(records)
+
+
+def write_shard_records(shard_filename, records, symbols, files=()):
+    """
+    given sorted records (an iterable) and the symbols of their codes
+    write a shard file
+    """
+    if not isinstance(records, list):
+        records = list(records)
+    header = pickle.dumps({"vocabulary": list(symbols), "records": len(records), "files": list(files)})
+    with open(shard_filename, "wb") as f:
+        f.write(SHARD_MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for start in range(0, len(records), SHARD_READ_RECORDS):
+            f.write(b"".join(SHARD_RECORD.pack(*record) for record in records[start:start + SHARD_READ_RECORDS]))
+    logger.debug(f"write_shard_records {len(records)} records to {shard_filename}")
+
+
+def read_shard_header(shard_filename):
+    """
+    given a shard file
+    return its header: vocabulary, records and files
+    """
+    with open(shard_filename, "rb") as f:
+        return _read_shard_header(f, shard_filename)
+
+
+def _read_shard_header(f, shard_filename):
+    if f.read(len(SHARD_MAGIC)) != SHARD_MAGIC:
+        raise ValueError(f"{shard_filename} is not a MarkMelGen shard file")
+    (header_length,) = struct.unpack("<Q", f.read(8))
+    return pickle.loads(f.read(header_length))
 
 
-def create_style(input_path, display_html, INPUT_STYLE_PATH):
+def iter_shard_records(shard_filename):
+    """
+    given a shard file
+    yield its records in order, reading SHARD_READ_RECORDS at a time
+    """
+    with open(shard_filename, "rb") as f:
+        _read_shard_header(f, shard_filename)
+        while True:
+            chunk = f.read(SHARD_RECORD.size * SHARD_READ_RECORDS)
+            if not chunk:
+                break
+            yield from SHARD_RECORD.iter_unpack(chunk)
+
+
+def _merge_shard_records(shard_filenames):
+    """
+    given shard files with the same symbol codes
+    yield their records merged in order, the records of the same transition summed into one
+    """
+    merged = None
+    for record in heapq.merge(*(iter_shard_records(shard_filename) for shard_filename in shard_filenames)):
+        if merged is not None and record[:3] == merged[:3]:
+            merged = (*merged[:3], merged[3] + record[3], min(merged[4], record[4]), min(merged[5], record[5]))
+            continue
+        if merged is not None:
+            yield merged
+        merged = record
+    if merged is not None:
+        yield merged
+
+
+def merge_count_shards(shard_filenames, shard_path, symbols):
+    """
+    given shard files with the same symbol codes, a directory for intermediate shards and the symbols
+    return an iterator of the records of all the shards merged in order (a k-way merge),
+    merging SHARD_MERGE_FAN_IN shards at a time into intermediate shards first if there are more
+    """
+    merge_pass = 0
+    while len(shard_filenames) > SHARD_MERGE_FAN_IN:
+        merge_pass += 1
+        merged_filenames = []
+        for start in range(0, len(shard_filenames), SHARD_MERGE_FAN_IN):
+            merged_filename = os.path.join(shard_path, f"merge_{merge_pass}_{len(merged_filenames):05d}.shard")
+            write_shard_records(merged_filename, _merge_shard_records(shard_filenames[start:start + SHARD_MERGE_FAN_IN]), symbols)
+            merged_filenames.append(merged_filename)
+        logger.info(f"merge_count_shards pass {merge_pass} merged {len(shard_filenames)} shards into {len(merged_filenames)}")
+        shard_filenames = merged_filenames
+    return _merge_shard_records(shard_filenames)
+
+
+def iter_merged_count_tables(records, symbols):
+    """
+    given the merged records of merge_count_shards and the symbols of their codes
+    yield (table number, count table) one table at a time, for every table in TRANSITION_TABLE_NAMES,
+    the rows and transitions in the order create_style would first have seen them
+    """
+    def build_table(rows):
+        table = {}
+        for row_code, (row_seen, entries) in sorted(rows.items(), key=lambda item: item[1][0]):
+            table[symbols[row_code]] = {symbols[next_code]: count for entry_seen, next_code, count in sorted(entries)}
+        return table
+
+    table_number = 0
+    rows = {}
+    for record_table, row_code, next_code, count, row_seen, entry_seen in records:
+        while record_table > table_number:
+            yield table_number, build_table(rows)
+            table_number += 1
+            rows = {}
+        row = rows.setdefault(row_code, [row_seen, []])
+        row[0] = min(row[0], row_seen)
+        row[1].append((entry_seen, next_code, count))
+    while table_number < len(TRANSITION_TABLE_NAMES):
+        yield table_number, build_table(rows)
+        table_number += 1
+        rows = {}
+
+
+def write_style_table(style_path, table_number, counts_table):
+    """
+    given a style directory and a count table of TRANSITION_TABLE_NAMES
+    write <name>_probabilities.pkl and <name>_counts.pkl of the table
+    """
+    name = TRANSITION_TABLE_NAMES[table_number]
+    totals = {row_key: sum(row.values()) for row_key, row in counts_table.items()}
+    calculate_probabilities = [
+        calculate_note_transition_probabilities,
+        calculate_bpm_transition_probabilities,
+        calculate_dtransition_probabilities,
+        calculate_cad_transition_probabilities,
+        calculate_cad_dtransition_probabilities,
+        calculate_rest_note_transition_probabilities,
+    ][table_number]
+    write_transition_probabilities_to_disk(calculate_probabilities(counts_table, totals), style_path, f"{name}_probabilities")
+    write_transition_probabilities_to_disk(counts_table, style_path, f"{name}_counts")
+
+
+@profile_span("create_style_external")
+def create_style_external(mxl_paths, display_html, style_path, shard_files, shard_path=""):
+    """
+    Creates a style in external memory: counts shard_files .mxl files at a time into sorted shard files,
+    then merges the shards into the style one table at a time. The style is the same as create_style makes in memory.
+
+    Args:
+        mxl_paths (list): The .mxl files of the style.
+        display_html (bool): Show each score.
+        style_path (str): The style directory to write.
+        shard_files (int): The number of .mxl files counted into each shard.
+        shard_path (str): The directory of the shard files (in a temporary directory removed afterwards),
+                          default the system temporary directory.
+    """
+    vocabulary = {"codes": {}, "symbols": []}
+    with tempfile.TemporaryDirectory(prefix="markmelgen_shards_", dir=shard_path or None) as shard_dir:
+        shard_filenames = []
+        for start in range(0, len(mxl_paths), shard_files):
+            batch = mxl_paths[start:start + shard_files]
+            with profile_span("count_shard"):
+                counts = count_mxl_files(batch, display_html)
+                shard_filename = os.path.join(shard_dir, f"shard_{len(shard_filenames):05d}.shard")
+                records = write_count_shard(get_count_tables(counts), vocabulary, len(shard_filenames), shard_filename, batch)
+            print(f"Counted {len(batch)} files into {shard_filename} ({records} records)")
+            logger.info(f"create_style_external shard {shard_filename} of {len(batch)} files, {records} records")
+            shard_filenames.append(shard_filename)
+            del counts
+            gc.collect()
+
+        write_style_from_shards(shard_filenames, shard_dir, vocabulary["symbols"], style_path)
+    print(f"Merged {len(shard_filenames)} shards into style {style_path}")
+
+
+@profile_span("merge_shards")
+def write_style_from_shards(shard_filenames, shard_path, symbols, style_path):
+    """
+    given shard files with the same symbol codes, a directory for intermediate shards and the symbols
+    merge the shards and write the style, one table at a time
+    """
+    records = merge_count_shards(shard_filenames, shard_path, symbols)
+    for table_number, counts_table in iter_merged_count_tables(records, symbols):
+        write_style_table(style_path, table_number, counts_table)
+        logger.info(f"write_style_from_shards wrote {TRANSITION_TABLE_NAMES[table_number]} of {len(counts_table)} rows")
+        del counts_table
+
+
+def get_mxl_paths(paths, part=""):
+    """
+    given .mxl files and directories of .mxl files, and optionally a part I/N e.g. '2/4'
+    return the .mxl files, sorted so every map of a corpus sees them in the same order,
+    or only the I th of N consecutive parts of them
+    """
+    mxl_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            mxl_paths += [os.path.join(path, filename) for filename in os.listdir(path) if filename.endswith(".mxl")]
+        elif path.endswith(".mxl") and os.path.isfile(path):
+            mxl_paths.append(path)
+        else:
+            print(f"exit: Error {path} is not a .mxl file or a directory")
+            sys.exit(1)
+    mxl_paths.sort()
+    if part:
+        part_number, parts = (int(number) for number in part.split("/"))
+        if not 1 <= part_number <= parts:
+            print(f"exit: Error part {part} must be I/N with I from 1 to N")
+            sys.exit(1)
+        mxl_paths = mxl_paths[len(mxl_paths) * (part_number - 1) // parts:len(mxl_paths) * part_number // parts]
+    return mxl_paths
+
+
+@profile_span("map_style")
+def map_style(mxl_paths, map_filename, display_html=False, shard_files=0, shard_path=""):
+    """
+    Map of a style build: counts the transitions of .mxl files into a map file, a shard file (see SHARD_MAGIC)
+    with its own vocabulary, which can be copied to another machine. reduce_style merges map files into a style.
+
+    Args:
+        mxl_paths (list): The .mxl files to count, see get_mxl_paths.
+        map_filename (str): The map file to write.
+        display_html (bool): Show each score.
+        shard_files (int): Count shard_files .mxl files at a time into shards merged into the map file,
+                           default 0, count them all in memory.
+        shard_path (str): The directory of the shard files, default the system temporary directory.
+
+    Returns:
+        int: The number of records written.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(map_filename)), exist_ok=True)
+    vocabulary = {"codes": {}, "symbols": []}
+    if not shard_files:
+        counts = count_mxl_files(mxl_paths, display_html)
+        records = write_count_shard(get_count_tables(counts), vocabulary, 0, map_filename, mxl_paths)
+    else:
+        with tempfile.TemporaryDirectory(prefix="markmelgen_shards_", dir=shard_path or None) as shard_dir:
+            shard_filenames = []
+            for start in range(0, len(mxl_paths), shard_files):
+                counts = count_mxl_files(mxl_paths[start:start + shard_files], display_html)
+                shard_filename = os.path.join(shard_dir, f"shard_{len(shard_filenames):05d}.shard")
+                write_count_shard(get_count_tables(counts), vocabulary, len(shard_filenames), shard_filename)
+                shard_filenames.append(shard_filename)
+                del counts
+                gc.collect()
+            merged_records = list(merge_count_shards(shard_filenames, shard_dir, vocabulary["symbols"]))
+            write_shard_records(map_filename, merged_records, vocabulary["symbols"], mxl_paths)
+            records = len(merged_records)
+    print(f"Mapped {len(mxl_paths)} files into {map_filename} ({records} records)")
+    logger.info(f"map_style {len(mxl_paths)} files into {map_filename}, {records} records")
+    return records
+
+
+# the map number of a record where it was first seen, above the shard number (16 bits) and the index (32 bits)
+MAP_NUMBER_SHIFT = 48
+
+
+@profile_span("reduce_style")
+def reduce_style(map_filenames, style_path, shard_path=""):
+    """
+    Reduce of a style build: merges map files of map_style, in the order given, into a style directory.
+    Each map has its own vocabulary, so its records are first coded with the vocabulary of all the maps and sorted
+    again into a shard, one map at a time, then the shards are merged as by create_style_external.
+    The style is the same as create_style makes from the files of the maps in the order of the maps.
+
+    Args:
+        map_filenames (list): The map files, in order.
+        style_path (str): The style directory to write.
+        shard_path (str): The directory of the shard files, default the system temporary directory.
+    """
+    vocabulary = {"codes": {}, "symbols": []}
+    seen_files = set()
+    with tempfile.TemporaryDirectory(prefix="markmelgen_shards_", dir=shard_path or None) as shard_dir:
+        shard_filenames = []
+        for map_number, map_filename in enumerate(map_filenames):
+            header = read_shard_header(map_filename)
+            for mxl_path in set(header["files"]) & seen_files:
+                print(f"Warning: {mxl_path} is in more than one map, its transitions are counted more than once")
+                logger.warning(f"reduce_style {mxl_path} is in more than one map, its transitions are counted more than once")
+            seen_files.update(header["files"])
+            codes = [get_symbol_code(vocabulary, symbol) for symbol in header["vocabulary"]]
+            map_seen = map_number << MAP_NUMBER_SHIFT
+            records = sorted(
+                (table_number, codes[row_code], codes[next_code], count, map_seen | row_seen, map_seen | entry_seen)
+                for table_number, row_code, next_code, count, row_seen, entry_seen in iter_shard_records(map_filename)
+            )
+            shard_filename = os.path.join(shard_dir, f"map_{map_number:05d}.shard")
+            write_shard_records(shard_filename, records, vocabulary["symbols"], header["files"])
+            shard_filenames.append(shard_filename)
+            logger.info(f"reduce_style {map_filename} of {len(header['files'])} files, {len(records)} records")
+            del records
+
+        os.makedirs(style_path, exist_ok=True)
+        write_style_from_shards(shard_filenames, shard_dir, vocabulary["symbols"], style_path)
+    print(f"Reduced {len(map_filenames)} maps of {len(seen_files)} files into style {style_path}")
+
+
+@profile_span("create_style")
+def create_style(input_path, display_html, INPUT_STYLE_PATH, shard_files=0, shard_path=""):
     
     logger.debug(f"create_style function called with parameters:")
     logger.debug(f"  input_path: {input_path}")
     logger.debug(f"  display_html: {display_html}")
     logger.debug(f"  INPUT_STYLE_PATH: {INPUT_STYLE_PATH}")
 
-    note_transitions = {}
-    total_note_transitions = {}
-    rest_note_transitions = {}
-    total_rest_note_transitions = {}
-    bpm_transitions = {}
-    total_bpm_transitions = {}
-    dtransitions = {}
-    total_dtransitions = {}
-    cad_transitions = {}
-    total_cad_transitions = {}
-    cad_dtransitions = {}
-    total_cad_dtransitions = {}
-
-    mxl_files_found = False
-
     if os.path.isdir(input_path):
         print(f"Creating style from directory: {input_path}")
-        for filename in os.listdir(input_path):
-            if filename.endswith(".mxl"):
-                mxl_files_found = True
-                process_mxl_file(
-                    os.path.join(input_path, filename),
-                    note_transitions,
-                    total_note_transitions,
-                    rest_note_transitions,
-                    total_rest_note_transitions,
-                    bpm_transitions,
-                    total_bpm_transitions,
-                    dtransitions,
-                    total_dtransitions,
-                    cad_transitions,
-                    total_cad_transitions,
-                    cad_dtransitions,
-                    total_cad_dtransitions,                    
-                    display_html
-                )
+        # sorted as for map_style, so -s, --shard-files and --map/--reduce make the same style of a corpus
+        mxl_paths = get_mxl_paths([input_path])
     else:
         print(f"Invalid path: {input_path}. The path must be a directory.")
         sys.exit(1)
 
-    if not mxl_files_found:
+    if not mxl_paths:
         print(f"No .mxl files found in directory: {input_path}")
         sys.exit(1)
 
+    if shard_files:
+        # external memory, see create_style_external
+        style_path = os.path.join(INPUT_STYLE_PATH, os.path.basename(os.path.normpath(input_path)))
+        os.makedirs(style_path, exist_ok=True)
+        print(f"Created style directory: {style_path}")
+        create_style_external(mxl_paths, display_html, style_path, shard_files, shard_path)
+        return
+
+    (
+        note_transitions, total_note_transitions, rest_note_transitions, total_rest_note_transitions,
+        bpm_transitions, total_bpm_transitions, dtransitions, total_dtransitions,
+        cad_transitions, total_cad_transitions, cad_dtransitions, total_cad_dtransitions,
+    ) = count_mxl_files(mxl_paths, display_html)
+
     note_transition_probabilities = calculate_note_transition_probabilities(
         note_transitions, total_note_transitions
     )
@@ -999,6 +1612,14 @@ def create_style(input_path, display_html, INPUT_STYLE_PATH):
     write_transition_probabilities_to_disk(cad_transition_probabilities, style_path, "cad_transition_probabilities")
     write_transition_probabilities_to_disk(cad_dtransition_probabilities, style_path, "cad_dtransition_probabilities")
 
+    # Keep the counts so that styles can be blended by evidence rather than by probability, see blend_styles
+    write_transition_probabilities_to_disk(note_transitions, style_path, "note_transition_counts")
+    write_transition_probabilities_to_disk(rest_note_transitions, style_path, "rest_note_transition_counts")
+    write_transition_probabilities_to_disk(bpm_transitions, style_path, "bpm_transition_counts")
+    write_transition_probabilities_to_disk(dtransitions, style_path, "dtransition_counts")
+    write_transition_probabilities_to_disk(cad_transitions, style_path, "cad_transition_counts")
+    write_transition_probabilities_to_disk(cad_dtransitions, style_path, "cad_dtransition_counts")
+
     # Test reading
     read_probabilities = read_transition_probabilities_from_disk(style_path, "note_transition_probabilities")
     logger.debug(f"read_transition_probabilities_from_disk success, first key : {list(read_probabilities.keys())[0]} ")    
@@ -1110,4 +1731,280 @@ def create_style(input_path, display_html, INPUT_STYLE_PATH):
     else:
         logger.debug(f"Differences found: {comparison_result}")
 
-    return 
+    return
+
+
+# 16 bit integer weights used by compact_style, random.choices in get_random_draw accepts them unchanged
+QUANTISE_MAXIMUM = 65535
+
+
+def estimate_counts_from_probabilities(row, max_denominator=100000):
+    """
+    given a transition row of probabilities {next: count / total}
+    return the estimated counts {next: count}, using the lowest common denominator of the probabilities as the total.
+    Used when a style has no *_counts.pkl files.
+    """
+    total = 1
+    for probability in row.values():
+        denominator = Fraction(probability).limit_denominator(max_denominator).denominator
+        total = total * denominator // math.gcd(total, denominator)
+        if total > max_denominator:
+            # not a ratio of small counts e.g. a blended style, so treat the row as one observation per entry
+            return {next_value: 1 for next_value in row}
+    return {next_value: round(probability * total) for next_value, probability in row.items()}
+
+
+def compact_transition_table(table, counts=None, min_count=0, min_probability=0.0, quantise=True):
+    """
+    Prunes and quantises one transition table.
+
+    Args:
+        table (dict): The probability table, dict of (prev, current) -> {next: probability}.
+        counts (dict): Optional count table with the same keys, else counts are estimated from the probabilities.
+        min_count (int): Transitions seen fewer times than this are pruned.
+        min_probability (float): Transitions with a lower probability than this are pruned.
+        quantise (bool): If True the weights are 16 bit integers, else renormalised probabilities.
+
+    Returns:
+        dict: The compact table. The most likely transition of every row is always kept so no row becomes empty.
+    """
+    compact = {}
+    for key, row in table.items():
+        row_sum = sum(row.values())
+        if min_count > 0:
+            row_counts = counts.get(key, {}) if counts is not None else estimate_counts_from_probabilities(row)
+        most_likely = max(row, key=row.get)
+        kept = {}
+        for next_value, weight in row.items():
+            probability = weight / row_sum
+            if next_value != most_likely:
+                if probability < min_probability:
+                    continue
+                if min_count > 0 and row_counts.get(next_value, 0) < min_count:
+                    continue
+            kept[next_value] = probability
+
+        kept_sum = sum(kept.values())
+        if quantise:
+            compact[key] = {
+                next_value: max(1, round(probability / kept_sum * QUANTISE_MAXIMUM))
+                for next_value, probability in kept.items()
+            }
+        else:
+            compact[key] = {next_value: probability / kept_sum for next_value, probability in kept.items()}
+    return compact
+
+
+def transition_table_kl_divergence(table, compact_table):
+    """
+    returns the mean and maximum, over the rows, of the KL divergence D(compact || original) in bits.
+    The compact table only holds transitions of the original, so the divergence is finite.
+    """
+    row_divergences = []
+    for key, compact_row in compact_table.items():
+        row = table[key]
+        row_sum = sum(row.values())
+        compact_sum = sum(compact_row.values())
+        divergence = 0.0
+        for next_value, weight in compact_row.items():
+            q = weight / compact_sum
+            p = row[next_value] / row_sum
+            divergence += q * math.log2(q / p)
+        row_divergences.append(max(divergence, 0.0))
+    if not row_divergences:
+        return 0.0, 0.0
+    return sum(row_divergences) / len(row_divergences), max(row_divergences)
+
+
+def get_style_load_time(style_path, repeats=20):
+    """
+    returns the mean time in seconds to load the six transition files of a style with load_transition_files
+    """
+    start = time.perf_counter()
+    for _ in range(repeats):
+        load_transition_files(style_path)
+    return (time.perf_counter() - start) / repeats
+
+
+@profile_span("compact_style")
+def compact_style(style_path, compact_path="", min_count=0, min_probability=0.0, quantise=True):
+    """
+    Writes a compact copy of a style, with rarely seen transitions pruned and the weights quantised to 16 bit integers,
+    then reports the size and load time savings and the KL divergence of each compact table from the original.
+    The compact style is loaded like any other style e.g. USE_STYLES = ['classical_baroque_7_compact']
+
+    Args:
+        style_path (str): The style directory e.g. input/style/classical_baroque_7
+        compact_path (str): The compact style directory, default <style_path>_compact
+        min_count (int): Transitions seen fewer times than this are pruned. Uses *_counts.pkl if present, else estimated counts.
+        min_probability (float): Transitions with a lower probability than this are pruned.
+        quantise (bool): If True store 16 bit integer weights, else float probabilities.
+
+    Returns:
+        dict: The report, per table and in total.
+    """
+    style_path = os.path.normpath(style_path)
+    if not compact_path:
+        compact_path = style_path + "_compact"
+    if os.path.normpath(compact_path) == style_path:
+        raise ValueError(f"compact style path must differ from the style path {style_path}")
+    os.makedirs(compact_path, exist_ok=True)
+
+    report = {"style": style_path, "compact_style": compact_path, "tables": {}}
+    size_before = 0
+    size_after = 0
+    for name in TRANSITION_TABLE_NAMES:
+        table = read_transition_probabilities_from_disk(style_path, f"{name}_probabilities")
+        if table is None:
+            raise FileNotFoundError(f"{name}_probabilities.pkl not found in {style_path}")
+        counts = None
+        if os.path.exists(os.path.join(style_path, f"{name}_counts.pkl")):
+            counts = read_transition_probabilities_from_disk(style_path, f"{name}_counts")
+
+        compact = compact_transition_table(table, counts, min_count, min_probability, quantise)
+        write_transition_probabilities_to_disk(compact, compact_path, f"{name}_probabilities")
+
+        table_size_before = os.path.getsize(os.path.join(style_path, f"{name}_probabilities.pkl"))
+        table_size_after = os.path.getsize(os.path.join(compact_path, f"{name}_probabilities.pkl"))
+        size_before += table_size_before
+        size_after += table_size_after
+        mean_kl, max_kl = transition_table_kl_divergence(table, compact)
+        report["tables"][name] = {
+            "transitions_before": sum(len(row) for row in table.values()),
+            "transitions_after": sum(len(row) for row in compact.values()),
+            "bytes_before": table_size_before,
+            "bytes_after": table_size_after,
+            "kl_mean_bits": mean_kl,
+            "kl_max_bits": max_kl,
+        }
+
+    report["bytes_before"] = size_before
+    report["bytes_after"] = size_after
+    report["load_seconds_before"] = get_style_load_time(style_path)
+    report["load_seconds_after"] = get_style_load_time(compact_path)
+    return report
+
+
+def print_compact_style_report(report):
+    """
+    prints the report returned by compact_style as a table
+    """
+    print(f"\nCompacted {report['style']} to {report['compact_style']}")
+    print(f"{'table':<22} {'transitions':>17} {'bytes':>15} {'KL mean bits':>13} {'KL max bits':>12}")
+    for name, table_report in report["tables"].items():
+        transitions = f"{table_report['transitions_before']} -> {table_report['transitions_after']}"
+        size = f"{table_report['bytes_before']} -> {table_report['bytes_after']}"
+        print(f"{name:<22} {transitions:>17} {size:>15} {table_report['kl_mean_bits']:>13.5f} {table_report['kl_max_bits']:>12.5f}")
+
+    size_saving = 100 * (1 - report["bytes_after"] / report["bytes_before"]) if report["bytes_before"] else 0
+    load_saving = 100 * (1 - report["load_seconds_after"] / report["load_seconds_before"]) if report["load_seconds_before"] else 0
+    print(f"size: {report['bytes_before']} -> {report['bytes_after']} bytes ({size_saving:.1f}% smaller)")
+    print(f"load time: {1000 * report['load_seconds_before']:.3f} -> {1000 * report['load_seconds_after']:.3f} ms ({load_saving:.1f}% faster)")
+    return
+
+
+def main():
+    """
+    parse command line arguments
+    compact a style, or map .mxl files to a map file, or reduce map files to a style
+    """
+    parser = argparse.ArgumentParser(description="MarkMelGen style tools")
+    parser.add_argument('-c', '--compact-style',
+                        help='style directory to compact e.g. input/style/classical_baroque_7 . '
+                             'Writes a pruned, quantised copy to <style>_compact, or the --output directory',
+                        default='',
+                        type=str)
+    parser.add_argument('-m', '--map',
+                        help='.mxl files or directories of .mxl files to count into the map file --output, '
+                             'e.g. input/music/essenFolksong --part 1/4 -o counts/essen_1.shard',
+                        nargs='+',
+                        default=[])
+    parser.add_argument('--part',
+                        help='with --map, count only part I of N of the sorted .mxl files, e.g. 1/4',
+                        default='',
+                        type=str)
+    parser.add_argument('-r', '--reduce',
+                        help='map files to merge, in order, into the style directory --output, '
+                             'e.g. counts/essen_*.shard -o input/style/essen',
+                        nargs='+',
+                        default=[])
+    parser.add_argument('--shard-files',
+                        help='with --map, count SHARD_FILES .mxl files at a time into shard files on disk, default 0, all in memory',
+                        default=0,
+                        type=int)
+    parser.add_argument('--shard-path',
+                        help='directory for the shard files, removed afterwards, default the system temporary directory',
+                        default='',
+                        type=str)
+    parser.add_argument('-o', '--output',
+                        help='compact style directory, default <style>_compact, or the --map file, or the --reduce style directory',
+                        default='',
+                        type=str)
+    parser.add_argument('--min-count',
+                        help='prune transitions seen fewer than MIN_COUNT times (counts are estimated for styles without *_counts.pkl), default 0',
+                        default=0,
+                        type=int)
+    parser.add_argument('--min-probability',
+                        help='prune transitions with a probability below MIN_PROBABILITY, default 0.0',
+                        default=0.0,
+                        type=float)
+    parser.add_argument('--no-quantise',
+                        help='keep float probabilities instead of 16 bit integer weights',
+                        action='store_true')
+    parser.add_argument('--profile',
+                        help='time the stages, writing a summary to log/, --profile cprofile also runs cProfile and writes its .pstats',
+                        nargs='?',
+                        const='spans',
+                        choices=['spans', 'cprofile'])
+
+    # print the help message only if no arguments are supplied on the command line
+    if len(sys.argv) == 1:
+        parser.print_help(sys.stderr)
+        sys.exit(1)
+
+    args = parser.parse_args()
+
+    if args.profile:
+        start_profile(args.profile == 'cprofile')
+
+    if args.compact_style:
+        if not os.path.isdir(args.compact_style):
+            print(f"exit: Error style directory not found at {args.compact_style}")
+            sys.exit(1)
+        report = compact_style(args.compact_style, args.output, args.min_count, args.min_probability, not args.no_quantise)
+        print_compact_style_report(report)
+
+    if (args.map or args.reduce) and not args.output:
+        print("exit: Error --map and --reduce need an --output")
+        sys.exit(1)
+
+    if args.map:
+        if args.part and not re.fullmatch(r"\d+/\d+", args.part):
+            print(f"exit: Error part {args.part} must be I/N e.g. 1/4")
+            sys.exit(1)
+        mxl_paths = get_mxl_paths(args.map, args.part)
+        if not mxl_paths:
+            print(f"exit: Error no .mxl files in {args.map} {args.part}")
+            sys.exit(1)
+        map_style(mxl_paths, args.output, False, args.shard_files, args.shard_path)
+
+    if args.reduce:
+        for map_filename in args.reduce:
+            if not os.path.isfile(map_filename):
+                print(f"exit: Error map file not found at {map_filename}")
+                sys.exit(1)
+            try:
+                read_shard_header(map_filename)
+            except ValueError as e:
+                print(f"exit: Error {e}")
+                sys.exit(1)
+        reduce_style(args.reduce, args.output, args.shard_path)
+
+    summary_filename = stop_profile(os.path.join('log', f'markmelgen_style_{get_iso_datetime_str()}'))
+    if summary_filename:
+        print(f"Profile summary written to {summary_filename}")
+    return
+
+
+if __name__ == '__main__':
+    main()
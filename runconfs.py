@@ -3,7 +3,7 @@
 # runconfs.py which runs MarkMelGen with the configuration files in the directory and passes on parameters and searches output for errors
 # free and open-source software, Paul Wardley Davies, see MarkMelGen/license.txt
 
-# usage: runconfs.py [-h] [-c CONFIG] [-g] [-s]
+# usage: runconfs.py [-h] [-c CONFIG] [-g] [-s] [--save-graphs {png,svg}] [-j JOBS] [-t TIMEOUT]
 #
 # optional arguments:
 #   -h, --help            show this help message and exit
@@ -11,6 +11,11 @@
 #                         config file path, relative to current working directory e.g. conf
 #   -g                    No graphs i.e. override DISPLAY_GRAPHS = False
 #   -s                    No score. i.e. override DISPLAY_SCORE = False
+#   --save-graphs {png,svg}
+#                         save the graphs of each config to files in the background rather than show them, see MarkMelGen.py --save-graphs
+#   -j JOBS, --jobs JOBS  run the configs in JOBS long-lived worker processes, without graphs or scores
+#   -t TIMEOUT, --timeout TIMEOUT
+#                         with --jobs, stop a config that runs longer than TIMEOUT seconds, default 600
 
 # usage examples:
 # 1. run top level
@@ -22,17 +27,183 @@
 #
 # 3. run conf/test without graphs or scores
 # python runconfs.py -c conf/test -g -s
+#
+# 4. run conf/test saving the graphs to .png files, without graph windows to close
+# python runconfs.py -c conf/test --save-graphs png -s
+#
+# 5. run conf/v2.0.0 in 4 worker processes, then show a summary table
+# python runconfs.py -c conf/v2.0.0 -j 4
 
 
 # standard libraries
 import argparse
+import contextlib
 import glob
+import multiprocessing
+import multiprocessing.connection
 import os
 import platform
 import subprocess
+import time
+import traceback
 from time import strftime
 # from datetime import datetime
 
+SEARCH_WORDS = ['Traceback', 'MarkMelGen.py', 'Error', 'Warning']
+
+
+def job_worker(conn):
+    """
+    a long-lived worker process: imports MarkMelGen once, then runs each (config path, log path) job received
+    in this process, keeping the loaded styles and parsed input music for later configs that use them
+    """
+    import MarkMelGen
+    import MarkMelGen_utilities
+    import markmelgen_style
+
+    MarkMelGen_utilities.PAUSE_ON_ERROR = False
+    markmelgen_style.CACHE_STYLES = True
+    MarkMelGen.CACHE_MUSIC = True
+    conn.send('ready')
+
+    while True:
+        job = conn.recv()
+        if job is None:
+            break
+        conf_path, log_path_file = job
+        start = time.perf_counter()
+        status = 'ok'
+        with open(log_path_file, 'w') as log_file, contextlib.redirect_stdout(log_file), contextlib.redirect_stderr(log_file):
+            try:
+                # the configs run in parallel, so each writes its outputs in turn
+                MarkMelGen.generate_song_buffers(conf_path, outputs=MarkMelGen_utilities.OUTPUT_TYPES,
+                                                 write_files=True, buffers=False, output_workers=0)
+            except SystemExit:
+                status = 'exit'
+            except Exception:
+                traceback.print_exc()
+                status = 'error'
+        conn.send((status, time.perf_counter() - start))
+    return
+
+
+def start_job_worker():
+    """
+    start a job_worker process, return the process and the connection to it
+    """
+    conn, worker_conn = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=job_worker, args=(worker_conn,))
+    process.start()
+    # only the worker holds its end, so the connection reads EOF if the worker dies
+    worker_conn.close()
+    return process, conn
+
+
+def search_log(log_path_file):
+    """
+    return the lines of a log with a search word, e.g. Traceback, Error
+    """
+    found = []
+    if not os.path.exists(log_path_file):
+        return found
+    with open(log_path_file) as logfile_list:
+        for line in logfile_list:
+            if any(word in line for word in SEARCH_WORDS):
+                found.append(line.rstrip())
+    return found
+
+
+def run_jobs(conf_paths, jobs, timeout):
+    """
+    run the configs in a pool of job_worker processes, stopping a config after timeout seconds,
+    then print a summary table of duration, status and error lines
+    """
+    start = time.perf_counter()
+    pending = list(conf_paths)
+    workers = [start_job_worker() for _ in range(min(jobs, len(pending)))]
+    ready = set()  # indexes of the workers that have imported MarkMelGen, so job time excludes start up
+    dead = set()  # indexes of the workers that died starting, e.g. MarkMelGen failed to import, so are not restarted
+    running = {}  # worker index -> (conf path, log path, deadline)
+    results = []
+
+    while pending or running:
+        for index in range(len(workers)):
+            if index in ready and index not in running and pending:
+                conf_path = pending.pop(0)
+                conf_file_no_extension = os.path.splitext(os.path.basename(conf_path))[0]
+                dt_string = strftime("%Y%m%d-%H_%M_%S")
+                log_path_file = 'output' + os.sep + conf_file_no_extension + '-' + dt_string + '.log'
+                print(dt_string, 'Running: ', conf_path, '>', log_path_file, '...')
+                workers[index][1].send((conf_path, log_path_file))
+                running[index] = (conf_path, log_path_file, time.monotonic() + timeout)
+
+        if pending and len(dead) == len(workers):
+            # no worker could start, so no config can run
+            for conf_path in pending:
+                results.append((conf_path, 'died', 0.0, []))
+            pending = []
+
+        conns = {workers[index][1]: index for index in range(len(workers))
+                 if index not in dead and (index in running or index not in ready)}
+        if not conns:
+            continue
+        wait_timeout = None
+        if running:
+            next_deadline = min(deadline for _, _, deadline in running.values())
+            wait_timeout = max(0.0, next_deadline - time.monotonic())
+        for conn in multiprocessing.connection.wait(list(conns), timeout=wait_timeout):
+            index = conns[conn]
+            if index not in ready:
+                try:
+                    conn.recv()
+                except (EOFError, OSError):
+                    workers[index][0].join()
+                    print('Worker', index, 'died starting, exit code', workers[index][0].exitcode)
+                    dead.add(index)
+                    continue
+                ready.add(index)
+                continue
+            conf_path, log_path_file, _ = running.pop(index)
+            try:
+                status, seconds = conn.recv()
+            except (EOFError, OSError):
+                # the worker died e.g. out of memory
+                status, seconds = 'died', 0.0
+                workers[index] = start_job_worker()
+                ready.discard(index)
+            results.append((conf_path, status, seconds, search_log(log_path_file)))
+
+        for index, (conf_path, log_path_file, deadline) in list(running.items()):
+            if time.monotonic() >= deadline:
+                running.pop(index)
+                workers[index][0].terminate()
+                workers[index][0].join()
+                workers[index] = start_job_worker()
+                ready.discard(index)
+                results.append((conf_path, 'timeout', timeout, search_log(log_path_file)))
+
+    for index, (process, conn) in enumerate(workers):
+        if index not in dead:
+            conn.send(None)
+        process.join()
+    wall_seconds = time.perf_counter() - start
+
+    print('\nSummary')
+    print(f"{'config':<60} {'status':<8} {'seconds':>8} {'errors':>6}")
+    for conf_path, status, seconds, lines in results:
+        errors = sum(1 for line in lines if 'Traceback' in line or 'Error' in line)
+        print(f"{conf_path:<60} {status:<8} {seconds:>8.2f} {errors:>6}")
+    job_seconds = sum(seconds for _, _, seconds, _ in results)
+    print(f"{len(results)} configs, {sum(1 for result in results if result[1] == 'ok')} ok, "
+          f"{job_seconds:.2f} seconds of jobs in {wall_seconds:.2f} seconds with {len(workers)} workers")
+
+    for conf_path, status, seconds, lines in results:
+        if lines:
+            print('\nSearch log of', conf_path, 'for', SEARCH_WORDS)
+            for line in lines:
+                print(line)
+    return results
+
 
 def main():
 
@@ -66,6 +237,18 @@ def main():
         help="No score. i.e. override DISPLAY_SCORE = False",
         action="store_true"
     )
+    parser.add_argument('--save-graphs',
+                        help='save the graphs of each config to .png or .svg files in the background, '
+                             'rather than show them, see MarkMelGen.py --save-graphs',
+                        choices=['png', 'svg'])
+    parser.add_argument('-j', '--jobs',
+                        help='run the configs in JOBS long-lived worker processes, without graphs or scores',
+                        default=0,
+                        type=int)
+    parser.add_argument('-t', '--timeout',
+                        help='with --jobs, stop a config that runs longer than TIMEOUT seconds, default 600',
+                        default=600,
+                        type=float)
 
     # Parse command line arguments.
     args = parser.parse_args()
@@ -75,6 +258,8 @@ def main():
     # print("args.config, args_config", args.config, args_config)
     args_g = args.g
     args_s = args.s
+    # saved graphs have no windows to close
+    no_graph_windows = args_g or args.save_graphs
 
     program_arguments = ' '
 
@@ -90,6 +275,9 @@ def main():
             # print('-s found so no score. i.e. override DISPLAY_SCORE = False')
             program_arguments = program_arguments + '-s '
 
+    if args.save_graphs:
+        program_arguments = program_arguments + '--save-graphs ' + args.save_graphs + ' '
+
     program_fully_qualified = "python3 MarkMelGen.py" + program_arguments
     if "Windows" in platform.system():        
         program_fully_qualified = "python MarkMelGen.py" + program_arguments
@@ -113,6 +301,10 @@ def main():
     os.chdir(cwd)
     # print("Current working directory: {0}".format(cwd))
 
+    if args.jobs > 0:
+        run_jobs([rel_config_path + os.sep + conf_file for conf_file in conf_files], args.jobs, args.timeout)
+        return
+
     # cases for graphs and score flags:
     # None  Pre close*2 pktc
     # -g        Pre close s pktc
@@ -136,11 +328,11 @@ def main():
         # print('Next Command line to run: ', call_str)
         # input('Press Enter to continue...')
 
-        if (not args_s) and (not args_g):
+        if (not args_s) and (not no_graph_windows):
             print('\nAfter MarkMelGen has run. 1. Close all graph windows. 2. Close score window to continue. (Discard as score already saved)')
             # input('Press Enter to continue...')
 
-        if (not args_s) and (args_g):
+        if (not args_s) and (no_graph_windows):
             print('\nAfter MarkMelGen has run. Close score window to continue. (Discard as score already saved)')
             # input('Press Enter to continue...')
 
@@ -157,7 +349,7 @@ def main():
                 print(line)
 
         # if no_score_with_graphs:
-        if (args_s) and (not args_g):
+        if (args_s) and (not no_graph_windows):
             input('\nClose all graph windows, then ... Press Enter to continue...')
 
 if __name__ == '__main__':
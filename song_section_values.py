@@ -20,6 +20,9 @@ import os
 import re
 import shutil
 import sys
+from MarkMelGen_utilities import (
+    get_iso_datetime_str, profile_span, save_histograms, start_profile, stop_profile, wait_for_histograms
+)
 
 class SongSectionValues:
     """
@@ -323,6 +326,7 @@ def truncate_section(name):
     return name  # Return the original name if no match is found
 
 
+@profile_span("show_histograms")
 def show_histograms(score, label):
     """
     function that shows histograms of the score with the supplied label
@@ -351,6 +355,7 @@ def show_histograms(score, label):
 
 # ...existing code...
 
+@profile_span("process_entire_song")
 def process_entire_song(a_song, song_key, config_file_path):
     """
     Process the entire song to get the values without sections
@@ -369,7 +374,8 @@ def process_entire_song(a_song, song_key, config_file_path):
     song_section_values.print()
 
 # def process_mxl_file(mxlfile, display_graphs):
-def process_mxl_file(mxlfile, display_graphs, config_file_path):
+@profile_span("process_mxl_file")
+def process_mxl_file(mxlfile, display_graphs, config_file_path, save_graphs=None):
     """
     Process a single mxl file
     """
@@ -377,7 +383,8 @@ def process_mxl_file(mxlfile, display_graphs, config_file_path):
     print("mxlfile fully qualified      :", mxlfile)
 
     # read mxl
-    a_song = music21.converter.parse(mxlfile)
+    with profile_span("parse"):
+        a_song = music21.converter.parse(mxlfile)
     # a_song.show('text')
 
     # normalise stream
@@ -476,7 +483,13 @@ def process_mxl_file(mxlfile, display_graphs, config_file_path):
     else:
         song_section_values.print_class_variable()
 
-    if display_graphs:
+    if save_graphs:
+        mxlfile_stem = os.path.splitext(os.path.basename(mxlfile))[0]
+        histograms_filename = os.path.join(
+            'log', f"song_section_values_{get_iso_datetime_str()}-{mxlfile_stem}-histograms.{save_graphs}"
+        )
+        save_histograms(a_song, 'Input ' + mxlfile, histograms_filename)
+    elif display_graphs:
         # label = 'Input ' + mxlfile_normalised_name
         label = 'Input ' + mxlfile
         show_histograms(a_song, label)
@@ -547,6 +560,15 @@ def main():
     parser.add_argument('--display-graphs', 
                         help='Display graphs (i.e. call show_histograms)', 
                         action='store_true')
+    parser.add_argument('--save-graphs',
+                        help='render the histograms headless to .png or .svg files in log/, in a background process, '
+                             'rather than display them',
+                        choices=['png', 'svg'])
+    parser.add_argument('--profile',
+                        help='time the stages, writing a summary to log/, --profile cprofile also runs cProfile and writes its .pstats',
+                        nargs='?',
+                        const='spans',
+                        choices=['spans', 'cprofile'])
 
     # print the help message only if no arguments are supplied on the command line
     if len(sys.argv) == 1:
@@ -556,6 +578,9 @@ def main():
     # Parse command line arguments.
     args = parser.parse_args()
 
+    if args.profile:
+        start_profile(args.profile == 'cprofile')
+
     
     base_dir = os.path.dirname(os.path.abspath(__file__))
     conf_dir = os.path.join(base_dir, "conf")
@@ -569,7 +594,7 @@ def main():
 
 
     if args.mxlfile:
-        process_mxl_file(args.mxlfile, args.display_graphs, new_conf_path)
+        process_mxl_file(args.mxlfile, args.display_graphs, new_conf_path, args.save_graphs)
     elif args.directory:
         mxl_files = glob.glob(os.path.join(args.directory, '*.mxl'))
         num_sections = len(section_order)
@@ -584,10 +609,17 @@ def main():
             mxl_files = (mxl_files * (num_sections // num_files + 1))[:num_sections]
 
         for mxlfile in mxl_files:
-            process_mxl_file(mxlfile, args.display_graphs, new_conf_path)
+            process_mxl_file(mxlfile, args.display_graphs, new_conf_path, args.save_graphs)
     else:
         print("Error: Please provide either a music file or a directory containing music files.")
         sys.exit(1)
 
+    for histograms_filename in wait_for_histograms():
+        print(f"Histograms written to {histograms_filename}")
+
+    summary_filename = stop_profile(os.path.join('log', f'song_section_values_{get_iso_datetime_str()}'))
+    if summary_filename:
+        print(f"Profile summary written to {summary_filename}")
+
 if __name__ == '__main__':
     main()
\ No newline at end of file